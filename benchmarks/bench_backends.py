@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the Ghostscript backends of pdfebc.core on the synthetic corpus of
+benchmarks.corpus. Compresses the corpus with pdfebc.core.compress_multiple_pdfs once per backend
+and job count, and reports files/s, the total CPU time of Ghostscript and the speedup of every
+backend over starting a Ghostscript process per file.
+
+The corpus is compressed once before the measurements, so that the files are in the page cache.
+The workers of a backend are started as part of its measurement, as they would be in a batch.
+Tiny files are left out by default, as they are copied without running Ghostscript.
+
+Run from the project root with ``python -m benchmarks.bench_backends``. Requires Ghostscript, and
+libgs for the libgs backend.
+
+Author: Simon Larsén
+"""
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+from .context import pdfebc
+from . import corpus
+import pdfebc.libgs
+
+JOBS_DEFAULT = [1, 4]
+BACKENDS_DEFAULT = list(pdfebc.core.BACKENDS)
+
+RESULT = "{:<12} {:>2} jobs {:>4} files {:>8.2f} s {:>8.2f} files/s {:>8.2f} s CPU {:>6.2f}x"
+
+def create_backend(backend, jobs, ghostscript_binary, library):
+    """
+    Returns:
+        pdfebc.core.WorkerPool: The workers of the backend, or None for the subprocess backend.
+    """
+    if backend == pdfebc.core.BACKEND_LIBGS:
+        return pdfebc.libgs.libgs_pool(jobs, library)
+    if backend == pdfebc.core.BACKEND_INTERPRETER:
+        return pdfebc.core.interpreter_pool(ghostscript_binary, jobs)
+    return None
+
+def measure(backend, jobs, corpus_directory, ghostscript_binary, library, tmpdir):
+    """Compress the corpus with a backend.
+
+    Returns:
+        dict: The measurement.
+    """
+    output_directory = tempfile.mkdtemp(dir=tmpdir)
+    start = time.perf_counter()
+    pool = create_backend(backend, jobs, ghostscript_binary, library)
+    try:
+        results = pdfebc.core.compress_multiple_pdfs(corpus_directory, output_directory,
+                                                     ghostscript_binary, jobs=jobs, min_savings=0,
+                                                     backend=pool)
+    finally:
+        if pool is not None:
+            pool.close()
+    seconds = time.perf_counter() - start
+    failed = [result for result in results if result.error is not None]
+    return dict(backend=backend, jobs=jobs, files=len(results), failed=len(failed),
+                seconds=seconds, files_per_second=len(results) / seconds,
+                cpu_seconds=sum(result.cpu_time or 0 for result in results))
+
+def run(corpus_directory, ghostscript_binary, library, backends, jobs_counts, tmpdir):
+    """Run all measurements on a corpus.
+
+    Returns:
+        list(dict): The measurements.
+    """
+    pdfebc.core.compress_multiple_pdfs(corpus_directory, tempfile.mkdtemp(dir=tmpdir),
+                                       ghostscript_binary)
+    measurements = []
+    for jobs in jobs_counts:
+        baseline = None
+        for backend in backends:
+            measurement = measure(backend, jobs, corpus_directory, ghostscript_binary, library,
+                                  tmpdir)
+            if baseline is None:
+                baseline = measurement['seconds']
+            measurement['speedup'] = baseline / measurement['seconds']
+            measurements.append(measurement)
+            print(RESULT.format(backend, jobs, measurement['files'], measurement['seconds'],
+                                measurement['files_per_second'], measurement['cpu_seconds'],
+                                measurement['speedup']))
+            if measurement['failed']:
+                print("  {} file(s) failed".format(measurement['failed']))
+    return measurements
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus",
+                        help="Directory of a corpus written by benchmarks.corpus. If not given, "
+                        "a corpus is generated in a temporary directory.")
+    parser.add_argument("--seed", type=int, default=corpus.SEED_DEFAULT,
+                        help="Seed of the generated corpus. Defaults to {}."
+                        .format(corpus.SEED_DEFAULT))
+    parser.add_argument("--scale", type=float, default=corpus.SCALE_DEFAULT,
+                        help="Scale of the generated corpus. Defaults to {}."
+                        .format(corpus.SCALE_DEFAULT))
+    parser.add_argument("--with-tiny", action='store_true',
+                        help="Keep the tiny files of the corpus, which are never compressed.")
+    parser.add_argument("-gs", "--ghostscript", default=pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT,
+                        help="The Ghostscript binary.")
+    parser.add_argument("--library", default=None,
+                        help="Name or path of libgs. Defaults to the one found by ctypes.")
+    parser.add_argument("--backends", nargs='+', choices=pdfebc.core.BACKENDS,
+                        default=BACKENDS_DEFAULT,
+                        help="Backends to benchmark, the first is the baseline of the speedup. "
+                        "Defaults to {}.".format(BACKENDS_DEFAULT))
+    parser.add_argument("--jobs", type=int, nargs='+', default=JOBS_DEFAULT,
+                        help="Job counts to benchmark. Defaults to {}.".format(JOBS_DEFAULT))
+    parser.add_argument("--json", help="Path to write the results to as JSON.")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        corpus_directory = args.corpus
+        if corpus_directory is None:
+            corpus_directory = os.path.join(tmpdir, 'corpus')
+            corpus.generate_corpus(corpus_directory, args.seed, args.scale)
+            if not args.with_tiny:
+                for entry in corpus.read_corpus(corpus_directory):
+                    if entry['kind'] == corpus.KIND_TINY:
+                        os.remove(os.path.join(corpus_directory, entry['filename']))
+        measurements = run(corpus_directory, args.ghostscript, args.library, args.backends,
+                           args.jobs, tmpdir)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(dict(python_version=platform.python_version(),
+                           ghostscript_version=pdfebc.core.ghostscript_version(args.ghostscript),
+                           platform=platform.platform(), cpu_count=os.cpu_count(),
+                           measurements=measurements), file, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the peak memory use of sending files as email attachments, comparing building
+the whole MIME message in memory with pdfebc.utils.attach_files against the streaming encoding
+of pdfebc.utils.send_with_attachments. Memory is measured with tracemalloc, and the emails are
+sent to the local SMTP stand-in server of the test suite, which only counts the received bytes.
+
+Run from the project root with ``python -m benchmarks.bench_email_memory``.
+
+Author: Simon Larsén
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from .context import pdfebc
+from tests.smtp_server import SMTPStandIn
+
+MEGABYTES_DEFAULT = 100
+FILES_DEFAULT = 4
+USER = "bench_user"
+PASSWORD = "bench_password"
+RECEIVER = "receiver@localhost"
+BYTES_PER_MEGABYTE = 1024**2
+
+RESULT = "{:<10} {:>8.3f} s {:>10.1f} MB peak {:>10.1f} MB sent"
+
+def create_files(directory, amount, size):
+    """Create PDF-named files filled with random bytes.
+
+    Args:
+        directory (str): Path to the directory to create the files in.
+        amount (int): Amount of files to create.
+        size (int): Size of each file in bytes.
+    Returns:
+        list(str): Paths to the created files.
+    """
+    paths = []
+    block = os.urandom(BYTES_PER_MEGABYTE)
+    for i in range(amount):
+        path = os.path.join(directory, 'attachment{}.pdf'.format(i))
+        with open(path, 'wb') as file:
+            for _ in range(size // len(block)):
+                file.write(block)
+            file.write(block[:size % len(block)])
+        paths.append(path)
+    return paths
+
+def send_in_memory(connection, filepaths):
+    """Send the files the way pdfebc used to, with the whole message built in memory."""
+    email_ = MIMEMultipart()
+    email_.attach(MIMEText(""))
+    email_["Subject"] = "pdfebc benchmark"
+    email_["From"] = USER
+    email_["To"] = RECEIVER
+    pdfebc.utils.attach_files(filepaths, email_)
+    connection.send_message(email_)
+
+def send_streaming(connection, filepaths):
+    """Send the files with the streaming encoding."""
+    connection.send_stream(USER, [RECEIVER], lambda: pdfebc.utils.iter_email_chunks(
+        "pdfebc benchmark", "", filepaths, USER, RECEIVER))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--megabytes", type=int, default=MEGABYTES_DEFAULT,
+                        help="Total size of the attachments. Defaults to {}.".format(
+                            MEGABYTES_DEFAULT))
+    parser.add_argument("--files", type=int, default=FILES_DEFAULT,
+                        help="Amount of attachments. Defaults to {}.".format(FILES_DEFAULT))
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filepaths = create_files(tmpdir, args.files,
+                                 args.megabytes * BYTES_PER_MEGABYTE // args.files)
+        for name, send in [("in-memory", send_in_memory), ("streaming", send_streaming)]:
+            server = SMTPStandIn(USER, PASSWORD, keep_messages=False).start()
+            connection = pdfebc.utils.SMTPConnection("127.0.0.1", server.port, USER, PASSWORD,
+                                                     use_tls=False)
+            try:
+                tracemalloc.start()
+                start = time.perf_counter()
+                send(connection, filepaths)
+                seconds = time.perf_counter() - start
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            finally:
+                connection.close()
+                server.stop()
+            print(RESULT.format(name, seconds, peak / BYTES_PER_MEGABYTE,
+                                server.messages[0][2] / BYTES_PER_MEGABYTE))
+
+if __name__ == '__main__':
+    main()
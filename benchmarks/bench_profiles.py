@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the compression profiles of pdfebc.profiles on a sample of the synthetic corpus of
+benchmarks.corpus. Every file of the sample is compressed with every profile, one at a time, and
+the seconds per MB of input and the compression ratio (total output size divided by total input
+size) are reported per profile and kind of file. Profiles defined in a configuration file are
+included with ``--config``.
+
+Run from the project root with ``python -m benchmarks.bench_profiles``. Requires Ghostscript.
+
+Author: Simon Larsén
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from .context import pdfebc
+from . import corpus
+
+SAMPLE_DEFAULT = 2
+
+RESULT = "{:<10} {:<8} {:>4} files {:>8.3f} s/MB {:>6.3f} ratio"
+
+def sample_corpus(entries, per_kind, seed):
+    """
+    Args:
+        entries (list(dict)): Manifest entries of a corpus.
+        per_kind (int): Amount of files to pick of every kind.
+        seed (int): Seed of the choice.
+    Returns:
+        list(dict): A sample of the entries, with at most per_kind entries of every kind.
+    """
+    rng = random.Random(seed)
+    sample = []
+    for kind in (spec.kind for spec in corpus.CORPUS_SPECS):
+        of_kind = [entry for entry in entries if entry['kind'] == kind]
+        sample.extend(rng.sample(of_kind, min(per_kind, len(of_kind))))
+    return sample
+
+def measure(profile, kind, filepaths, output_directory, ghostscript_binary):
+    """Compress files with a profile, one at a time.
+
+    Returns:
+        dict: The measurement.
+    """
+    start = time.perf_counter()
+    results = [pdfebc.core.compress_pdf(filepath,
+                                        os.path.join(output_directory, os.path.basename(filepath)),
+                                        ghostscript_binary, min_savings=0,
+                                        settings=profile.settings)
+               for filepath in filepaths]
+    seconds = time.perf_counter() - start
+    compressed = [result for result in results if result.action == pdfebc.core.ACTION_COMPRESSED]
+    input_bytes = sum(result.input_bytes for result in compressed)
+    output_bytes = sum(result.output_bytes for result in compressed)
+    megabytes = input_bytes / pdfebc.core.BYTES_PER_MEGABYTE
+    return dict(profile=profile.name, kind=kind, files=len(results), compressed=len(compressed),
+                seconds=seconds, seconds_per_megabyte=seconds / megabytes if megabytes else None,
+                input_bytes=input_bytes, output_bytes=output_bytes,
+                compression_ratio=output_bytes / input_bytes if input_bytes else None)
+
+def run(corpus_directory, entries, profiles, ghostscript_binary, tmpdir):
+    """Measure every profile on every kind of file of the sample.
+
+    Returns:
+        list(dict): The measurements.
+    """
+    measurements = []
+    for profile in profiles.values():
+        for kind in (spec.kind for spec in corpus.CORPUS_SPECS):
+            filepaths = [os.path.join(corpus_directory, entry['filename'])
+                         for entry in entries if entry['kind'] == kind]
+            if not filepaths:
+                continue
+            measurement = measure(profile, kind, filepaths, tempfile.mkdtemp(dir=tmpdir),
+                                  ghostscript_binary)
+            measurements.append(measurement)
+            print(RESULT.format(profile.name, kind, measurement['files'],
+                                measurement['seconds_per_megabyte'] or 0,
+                                measurement['compression_ratio'] or 0))
+    return measurements
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus",
+                        help="Directory of a corpus written by benchmarks.corpus. If not given, "
+                        "a corpus is generated in a temporary directory.")
+    parser.add_argument("--seed", type=int, default=corpus.SEED_DEFAULT,
+                        help="Seed of the generated corpus and of the sample. Defaults to {}."
+                        .format(corpus.SEED_DEFAULT))
+    parser.add_argument("--sample", type=int, default=SAMPLE_DEFAULT,
+                        help="Amount of files of every kind to compress. Defaults to {}."
+                        .format(SAMPLE_DEFAULT))
+    parser.add_argument("--config", help="A configuration file to read more profiles from.")
+    parser.add_argument("--profiles", nargs='+',
+                        help="Names of the profiles to benchmark. Defaults to all of them.")
+    parser.add_argument("-gs", "--ghostscript", default=pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT,
+                        help="The Ghostscript binary.")
+    parser.add_argument("--json", help="Path to write the results to as JSON.")
+    args = parser.parse_args()
+    config = pdfebc.utils.read_config(args.config) if args.config else {}
+    profiles = pdfebc.profiles.load_profiles(config)
+    if args.profiles:
+        unknown = set(args.profiles) - set(profiles)
+        if unknown:
+            parser.error("Unknown profiles: {}".format(", ".join(sorted(unknown))))
+        profiles = dict((name, profiles[name]) for name in args.profiles)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        corpus_directory = args.corpus
+        if corpus_directory is None:
+            corpus_directory = os.path.join(tmpdir, 'corpus')
+            corpus.generate_corpus(corpus_directory, args.seed)
+        entries = sample_corpus(corpus.read_corpus(corpus_directory), args.sample, args.seed)
+        measurements = run(corpus_directory, entries, profiles, args.ghostscript, tmpdir)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(dict(ghostscript_version=pdfebc.core.ghostscript_version(args.ghostscript),
+                           seed=args.seed, sample=args.sample,
+                           profiles=dict((name, list(profile.settings))
+                                         for name, profile in profiles.items()),
+                           measurements=measurements), file, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the pass-through path for files that are too small to compress. Compares
+spawning one ``cp`` process per file with the in-process copy and hardlink of
+pdfebc.core.copy_file.
+
+Run from the project root with ``python -m benchmarks.bench_small_copy``.
+
+Author: Simon Larsén
+"""
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+from .context import pdfebc
+
+FILES_DEFAULT = 5000
+FILE_SIZE_DEFAULT = 32 * 1024
+
+RESULT = "{:<10} {:>8.3f} s {:>10.0f} files/s"
+
+def create_small_files(directory, amount, size):
+    """Create small PDF-named files filled with random bytes.
+
+    Args:
+        directory (str): Path to the directory to create the files in.
+        amount (int): Amount of files to create.
+        size (int): Size of each file in bytes.
+    Returns:
+        list(str): Paths to the created files.
+    """
+    paths = []
+    for i in range(amount):
+        path = os.path.join(directory, 'small{}.pdf'.format(i))
+        with open(path, 'wb') as file:
+            file.write(os.urandom(size))
+        paths.append(path)
+    return paths
+
+def copy_with_cp(source, destination):
+    """Copy a file the way pdfebc used to, by spawning ``cp``."""
+    subprocess.Popen(['cp', source, destination]).communicate()
+
+def copy_in_process(source, destination):
+    """Copy a file with pdfebc.core.copy_file."""
+    pdfebc.core.copy_file(source, destination)
+
+def link_in_process(source, destination):
+    """Hardlink a file with pdfebc.core.copy_file."""
+    pdfebc.core.copy_file(source, destination, link=True)
+
+def time_copies(copy, sources, output_directory):
+    """Time copying all sources into a fresh output directory.
+
+    Args:
+        copy (function): Function that copies a source to a destination.
+        sources (list(str)): Paths to the files to copy.
+        output_directory (str): Path to an empty directory to copy the files to.
+    Returns:
+        float: Wall-clock time in seconds.
+    """
+    start = time.perf_counter()
+    for source in sources:
+        copy(source, os.path.join(output_directory, os.path.basename(source)))
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=FILES_DEFAULT,
+                        help="Amount of files. Defaults to {}.".format(FILES_DEFAULT))
+    parser.add_argument("--size", type=int, default=FILE_SIZE_DEFAULT,
+                        help="Size of each file in bytes. Defaults to {}.".format(FILE_SIZE_DEFAULT))
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source_directory = os.path.join(tmpdir, 'src')
+        os.makedirs(source_directory)
+        sources = create_small_files(source_directory, args.files, args.size)
+        for name, copy in [("cp", copy_with_cp), ("in-process", copy_in_process),
+                           ("link", link_in_process)]:
+            output_directory = tempfile.mkdtemp(dir=tmpdir)
+            seconds = time_copies(copy, sources, output_directory)
+            print(RESULT.format(name, seconds, args.files / seconds))
+
+if __name__ == '__main__':
+    main()
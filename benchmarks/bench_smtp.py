@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of sending several emails with one SMTP connection per email, versus over a
+single reused pdfebc.utils.SMTPConnection, against the local SMTP stand-in server of the test
+suite. The stand-in does not support STARTTLS, so the TLS handshake that a real server adds to
+every new connection is not included, and the measured difference is a lower bound.
+
+Run from the project root with ``python -m benchmarks.bench_smtp``.
+
+Author: Simon Larsén
+"""
+import argparse
+import time
+from email.mime.text import MIMEText
+from .context import pdfebc
+from tests.smtp_server import SMTPStandIn
+
+MESSAGES_DEFAULT = 500
+USER = "bench_user"
+PASSWORD = "bench_password"
+
+RESULT = "{:<12} {:>8.3f} s {:>10.0f} messages/s {:>6} connections"
+
+def create_email(number):
+    """
+    Args:
+        number (int): Number of the email.
+    Returns:
+        email.mime.text.MIMEText: A small email.
+    """
+    email_ = MIMEText("Message number {}".format(number))
+    email_["From"] = USER
+    email_["To"] = "receiver@localhost"
+    email_["Subject"] = "pdfebc benchmark {}".format(number)
+    return email_
+
+def send_with_new_connections(port, emails):
+    """Send every email over a connection of its own, as send_email does without a connection."""
+    for email_ in emails:
+        with pdfebc.utils.SMTPConnection("127.0.0.1", port, USER, PASSWORD,
+                                         use_tls=False) as connection:
+            connection.send_message(email_)
+
+def send_with_one_connection(port, emails):
+    """Send all emails over one connection."""
+    with pdfebc.utils.SMTPConnection("127.0.0.1", port, USER, PASSWORD,
+                                     use_tls=False) as connection:
+        connection.send_messages(emails)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=MESSAGES_DEFAULT,
+                        help="Amount of emails. Defaults to {}.".format(MESSAGES_DEFAULT))
+    args = parser.parse_args()
+    emails = [create_email(i) for i in range(args.messages)]
+    for name, send in [("per-message", send_with_new_connections),
+                       ("reused", send_with_one_connection)]:
+        server = SMTPStandIn(USER, PASSWORD).start()
+        try:
+            start = time.perf_counter()
+            send(server.port, emails)
+            seconds = time.perf_counter() - start
+        finally:
+            server.stop()
+        print(RESULT.format(name, seconds, args.messages / seconds, server.connections))
+
+if __name__ == '__main__':
+    main()
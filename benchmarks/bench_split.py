@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of splitting a single large PDF file into chunks of pages that are compressed in
+parallel. Compares the wall-clock time of a single-pass compression with split compressions
+for a range of chunk counts, and checks that every output has the same amount of pages.
+
+Run from the project root with ``python -m benchmarks.bench_split <file.pdf>``. Requires
+Ghostscript.
+
+Author: Simon Larsén
+"""
+import argparse
+import os
+import tempfile
+import time
+from .context import pdfebc
+
+CHUNKS_DEFAULT = [2, 4, 8]
+
+RESULT = "{:<12} {:>9.2f} s {:>8.2f}x {:>12} bytes {:>6} pages"
+
+def time_single_pass(filepath, output_path, ghostscript_binary):
+    """
+    Returns:
+        float: Wall-clock time of compressing the file in a single Ghostscript run.
+    """
+    start = time.perf_counter()
+    pdfebc.core.run_ghostscript(pdfebc.core.ghostscript_args(ghostscript_binary, filepath,
+                                                             output_path))
+    return time.perf_counter() - start
+
+def time_split(filepath, output_path, ghostscript_binary, chunks):
+    """
+    Returns:
+        float: Wall-clock time of compressing the file in chunks of pages.
+    """
+    start = time.perf_counter()
+    pdfebc.core.compress_pdf_split(filepath, output_path, ghostscript_binary, chunks)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pdf", help="The PDF file to compress.")
+    parser.add_argument("-gs", "--ghostscript", default=pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT,
+                        help="The Ghostscript binary.")
+    parser.add_argument("--chunks", type=int, nargs='+', default=CHUNKS_DEFAULT,
+                        help="Chunk counts to benchmark. Defaults to {}.".format(CHUNKS_DEFAULT))
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_path = os.path.join(tmpdir, 'single.pdf')
+        baseline = time_single_pass(args.pdf, output_path, args.ghostscript)
+        print(RESULT.format("single-pass", baseline, 1.0, os.stat(output_path).st_size,
+                            pdfebc.core.ghostscript_page_count(args.ghostscript, output_path)))
+        for chunks in args.chunks:
+            output_path = os.path.join(tmpdir, 'split{}.pdf'.format(chunks))
+            seconds = time_split(args.pdf, output_path, args.ghostscript, chunks)
+            print(RESULT.format("{} chunks".format(chunks), seconds, baseline / seconds,
+                                os.stat(output_path).st_size,
+                                pdfebc.core.ghostscript_page_count(args.ghostscript, output_path)))
+
+if __name__ == '__main__':
+    main()
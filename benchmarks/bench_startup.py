@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the startup time of pdfebc, for when it is called once per file from scripts.
+Measures, each in fresh Python processes:
+
+- The import time of pdfebc.main as reported by ``python -X importtime``, in total and for the
+  modules that take the longest to import on their own. Modules that should only be imported
+  when they are used, such as smtplib, are reported if they are imported at startup.
+- The wall time of ``pdfebc --help``, which does not read the configuration file.
+
+It also measures the time to read a configuration file by parsing it, versus from the snapshot
+that pdfebc.utils.load_config keeps of it.
+
+Run from the project root with ``python -m benchmarks.bench_startup``.
+
+Author: Simon Larsén
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from .context import pdfebc
+
+RUNS_DEFAULT = 10
+TOP_DEFAULT = 10
+CONFIG_READS = 200
+# modules that pdfebc must not import unless they are used
+LAZY_MODULES = ("smtplib", "email", "asyncio", "http.server", "ssl", "ctypes")
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+def parse_importtime(stderr):
+    """Parse the output of ``python -X importtime``.
+
+    Args:
+        stderr (str): The standard error of the Python process.
+    Returns:
+        dict: The self and cumulative import time of every module in microseconds, keyed by
+        module name.
+    """
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_time), int(cumulative))
+    return times
+
+def measure_imports(runs):
+    """Import pdfebc.main in fresh processes with ``-X importtime``.
+
+    Returns:
+        list(dict): The import times of every run, see parse_importtime.
+    """
+    measurements = []
+    for _ in range(runs):
+        process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import pdfebc.main"],
+                                 cwd=PROJECT_ROOT, stderr=subprocess.PIPE,
+                                 universal_newlines=True, check=True)
+        measurements.append(parse_importtime(process.stderr))
+    return measurements
+
+def measure_help(runs):
+    """
+    Returns:
+        list(float): The wall times of running ``pdfebc --help`` in fresh processes.
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "pdfebc.main", "--help"], cwd=PROJECT_ROOT,
+                       stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+def measure_config_reads(tmpdir):
+    """Read a configuration file repeatedly, by parsing it and from its snapshot.
+
+    Returns:
+        (float, float): The average seconds per read when parsing and with a snapshot.
+    """
+    config_path = os.path.join(tmpdir, 'config.cnf')
+    snapshot_path = os.path.join(tmpdir, 'snapshot.json')
+    sections = [pdfebc.utils.EMAIL_SECTION_KEY, pdfebc.utils.DEFAULT_SECTION_KEY, 'profile:scans']
+    contents = [dict((key, 'value') for key in pdfebc.utils.EMAIL_SECTION_KEYS),
+                dict((key, 'value') for key in pdfebc.utils.DEFAULT_SECTION_KEYS),
+                {'base': 'screen', 'color_image_resolution': '100', 'patterns': 'scans/*'}]
+    with open(config_path, 'w') as file:
+        pdfebc.utils.create_config(sections, contents).write(file)
+    start = time.perf_counter()
+    for _ in range(CONFIG_READS):
+        pdfebc.utils.read_config(config_path)
+    parsed = (time.perf_counter() - start) / CONFIG_READS
+    pdfebc.utils.load_config(config_path, snapshot_path)
+    start = time.perf_counter()
+    for _ in range(CONFIG_READS):
+        pdfebc.utils.load_config(config_path, snapshot_path)
+    snapshot = (time.perf_counter() - start) / CONFIG_READS
+    return parsed, snapshot
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=RUNS_DEFAULT,
+                        help="Amount of processes to start per measurement. Defaults to {}."
+                        .format(RUNS_DEFAULT))
+    parser.add_argument("--top", type=int, default=TOP_DEFAULT,
+                        help="Amount of the slowest modules to report. Defaults to {}."
+                        .format(TOP_DEFAULT))
+    parser.add_argument("--json", help="Path to write the results to as JSON.")
+    args = parser.parse_args()
+    imports = measure_imports(args.runs)
+    total = statistics.median(run['pdfebc.main'][1] for run in imports)
+    self_times = dict((name, statistics.median(run[name][0] for run in imports if name in run))
+                      for name in imports[0])
+    slowest = sorted(self_times.items(), key=lambda item: item[1], reverse=True)[:args.top]
+    eager = [name for name in LAZY_MODULES if name in imports[0]]
+    help_time = statistics.median(measure_help(args.runs))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        parsed, snapshot = measure_config_reads(tmpdir)
+    print("import pdfebc.main {:>8.1f} ms (median of {} runs)".format(total / 1000, args.runs))
+    for name, self_time in slowest:
+        print("  {:<30} {:>8.1f} ms".format(name, self_time / 1000))
+    print("imported at startup, but only needed when used: {}".format(", ".join(eager) or "none"))
+    print("pdfebc --help      {:>8.1f} ms".format(help_time * 1000))
+    print("config parsed      {:>8.3f} ms".format(parsed * 1000))
+    print("config snapshot    {:>8.3f} ms".format(snapshot * 1000))
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(dict(python_version=sys.version.split()[0], runs=args.runs,
+                           import_microseconds=total, slowest_modules=slowest,
+                           eager_lazy_modules=eager, help_seconds=help_time,
+                           config_parse_seconds=parsed, config_snapshot_seconds=snapshot),
+                      file, indent=2)
+
+if __name__ == '__main__':
+    main()
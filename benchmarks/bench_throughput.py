@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of compression throughput on the synthetic corpus of benchmarks.corpus. Times
+pdfebc.core.compress_pdf on the files of every kind one at a time, and
+pdfebc.core.compress_multiple_pdfs on the whole corpus for a range of job counts. Reports files/s,
+MB/s of input, the compression ratio (total output size divided by total input size) and peak
+memory use.
+
+Peak memory is reported both for the Python allocations of pdfebc itself, as measured by
+tracemalloc, and as the largest resident set size of any Ghostscript process that has finished so
+far. The latter never decreases between runs, as it is what the kernel reports for all children.
+
+With ``--json``, the results are also written as a JSON document together with a label, the
+Python and Ghostscript versions and the CPU count, so that results of different releases can be
+compared.
+
+Run from the project root with ``python -m benchmarks.bench_throughput``. Requires Ghostscript.
+
+Author: Simon Larsén
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import tempfile
+import time
+import tracemalloc
+from .context import pdfebc
+from . import corpus
+
+JOBS_DEFAULT = [1, 2, 4]
+
+RESULT = ("{:<10} {:>4} files {:>8.2f} s {:>8.2f} files/s {:>8.2f} MB/s {:>6.3f} ratio "
+          "{:>7.1f} MB python {:>7.1f} MB gs")
+
+def peak_child_rss():
+    """
+    Returns:
+        int: The largest resident set size of any finished child process, in bytes.
+    """
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+
+def measure(name, compress):
+    """Run a compression and measure its throughput and memory use.
+
+    Args:
+        name (str): Name of the measurement.
+        compress (function): A function without arguments that compresses some files and returns
+        their results.
+    Returns:
+        dict: The measurement.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    results = compress()
+    seconds = time.perf_counter() - start
+    _, python_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    input_bytes = sum(result.input_bytes or 0 for result in results)
+    output_bytes = sum(result.output_bytes or 0 for result in results)
+    actions = {}
+    for result in results:
+        actions[result.action] = actions.get(result.action, 0) + 1
+    return dict(name=name, files=len(results), seconds=seconds,
+                files_per_second=len(results) / seconds,
+                megabytes_per_second=input_bytes / pdfebc.core.BYTES_PER_MEGABYTE / seconds,
+                input_bytes=input_bytes, output_bytes=output_bytes,
+                compression_ratio=output_bytes / input_bytes if input_bytes else None,
+                python_peak_bytes=python_peak, ghostscript_peak_rss_bytes=peak_child_rss(),
+                actions=actions)
+
+def compress_one_at_a_time(filepaths, output_directory, ghostscript_binary):
+    """Compress files one after another with compress_pdf."""
+    return [pdfebc.core.compress_pdf(filepath, os.path.join(output_directory,
+                                                            os.path.basename(filepath)),
+                                     ghostscript_binary)
+            for filepath in filepaths]
+
+def print_measurement(measurement):
+    print(RESULT.format(measurement['name'], measurement['files'], measurement['seconds'],
+                        measurement['files_per_second'], measurement['megabytes_per_second'],
+                        measurement['compression_ratio'] or 0,
+                        measurement['python_peak_bytes'] / pdfebc.core.BYTES_PER_MEGABYTE,
+                        measurement['ghostscript_peak_rss_bytes'] /
+                        pdfebc.core.BYTES_PER_MEGABYTE))
+
+def run(corpus_directory, ghostscript_binary, jobs_counts, tmpdir):
+    """Run all measurements on a corpus.
+
+    Returns:
+        list(dict): The measurements.
+    """
+    entries = corpus.read_corpus(corpus_directory)
+    measurements = []
+    for kind in (spec.kind for spec in corpus.CORPUS_SPECS):
+        filepaths = [os.path.join(corpus_directory, entry['filename'])
+                     for entry in entries if entry['kind'] == kind]
+        output_directory = tempfile.mkdtemp(dir=tmpdir)
+        measurements.append(measure(kind, lambda: compress_one_at_a_time(
+            filepaths, output_directory, ghostscript_binary)))
+        print_measurement(measurements[-1])
+    for jobs in jobs_counts:
+        output_directory = tempfile.mkdtemp(dir=tmpdir)
+        measurements.append(measure("{} jobs".format(jobs),
+                                    lambda: pdfebc.core.compress_multiple_pdfs(
+                                        corpus_directory, output_directory, ghostscript_binary,
+                                        jobs=jobs)))
+        measurements[-1]['jobs'] = jobs
+        print_measurement(measurements[-1])
+    return measurements
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus",
+                        help="Directory of a corpus written by benchmarks.corpus. If not given, "
+                        "a corpus is generated in a temporary directory.")
+    parser.add_argument("--seed", type=int, default=corpus.SEED_DEFAULT,
+                        help="Seed of the generated corpus. Defaults to {}."
+                        .format(corpus.SEED_DEFAULT))
+    parser.add_argument("--scale", type=float, default=corpus.SCALE_DEFAULT,
+                        help="Scale of the generated corpus. Defaults to {}."
+                        .format(corpus.SCALE_DEFAULT))
+    parser.add_argument("-gs", "--ghostscript", default=pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT,
+                        help="The Ghostscript binary.")
+    parser.add_argument("--jobs", type=int, nargs='+', default=JOBS_DEFAULT,
+                        help="Job counts to benchmark. Defaults to {}.".format(JOBS_DEFAULT))
+    parser.add_argument("--json", help="Path to write the results to as JSON.")
+    parser.add_argument("--label", help="A label to store in the JSON results, e.g. a release.")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        corpus_directory = args.corpus
+        if corpus_directory is None:
+            corpus_directory = os.path.join(tmpdir, 'corpus')
+            corpus.generate_corpus(corpus_directory, args.seed, args.scale)
+        measurements = run(corpus_directory, args.ghostscript, args.jobs, tmpdir)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(dict(label=args.label, python_version=platform.python_version(),
+                           ghostscript_version=pdfebc.core.ghostscript_version(args.ghostscript),
+                           platform=platform.platform(), cpu_count=os.cpu_count(),
+                           timestamp=time.time(), corpus=corpus_directory if args.corpus else None,
+                           seed=args.seed, scale=args.scale, measurements=measurements),
+                      file, indent=2)
+
+if __name__ == '__main__':
+    main()
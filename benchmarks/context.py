@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pdfebc.core, pdfebc.cli, pdfebc.utils
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""Generator of a reproducible synthetic corpus of PDF files for the benchmarks. The files are
+written by a small pure-Python PDF writer, so no Ghostscript is needed to create them, and the
+same seed always gives byte-identical files. There are four kinds of files:
+
+- text: pages of Helvetica text in uncompressed content streams.
+- image: pages with a large, photo-like RGB image that is Flate compressed.
+- scanned: pages that are a single 300 DPI grayscale image of lines of "text" with speckles, like
+  the output of a document scanner.
+- tiny: single-page files below pdfebc.core.FILE_SIZE_LOWER_LIMIT, that are never compressed.
+
+A ``corpus.json`` manifest with the kind, size and SHA-256 of every file is written next to them,
+so that runs on different machines can check that they used the same corpus.
+
+Run from the project root with ``python -m benchmarks.corpus <directory>``.
+
+Author: Simon Larsén
+"""
+import argparse
+import collections
+import hashlib
+import json
+import os
+import random
+import zlib
+
+SEED_DEFAULT = 0
+SCALE_DEFAULT = 1.0
+MANIFEST_FILENAME = "corpus.json"
+
+PAGE_WIDTH = 612
+PAGE_HEIGHT = 792
+SCAN_DPI = 300
+FONT_SIZE = 10
+LINE_HEIGHT = 12
+
+KIND_TEXT = "text"
+KIND_IMAGE = "image"
+KIND_SCANNED = "scanned"
+KIND_TINY = "tiny"
+
+CorpusSpec = collections.namedtuple('CorpusSpec', ['kind', 'files', 'pages'])
+
+# The amount of files of every kind, and the amount of pages per file, at scale 1.0.
+CORPUS_SPECS = (
+    CorpusSpec(KIND_TEXT, 8, 20),
+    CorpusSpec(KIND_IMAGE, 4, 4),
+    CorpusSpec(KIND_SCANNED, 4, 3),
+    CorpusSpec(KIND_TINY, 20, 1),
+)
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+         "incididunt ut labore et dolore magna aliqua enim ad minim veniam quis nostrud "
+         "exercitation ullamco laboris nisi aliquip ex ea commodo consequat").split()
+
+class PDFWriter:
+    """A minimal writer of PDF files with text and image pages. Objects are numbered in the order
+    they are added, and the cross-reference table is written by ``to_bytes``.
+    """
+
+    CATALOG = 1
+    PAGES = 2
+    FONT = 3
+
+    def __init__(self):
+        self._objects = [None, None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+        self._pages = []
+
+    def _add(self, content):
+        self._objects.append(content)
+        return len(self._objects)
+
+    def _add_stream(self, dictionary, data):
+        length = b"/Length " + str(len(data)).encode()
+        return self._add(b"<< " + b" ".join(filter(None, [dictionary, length])) +
+                         b" >>\nstream\n" + data + b"\nendstream")
+
+    def add_page(self, content, images=()):
+        """Add a page.
+
+        Args:
+            content (bytes): The content stream of the page.
+            images (list(int)): Object numbers of image XObjects that the content stream refers
+            to as /Im0, /Im1 and so on.
+        """
+        xobjects = b" ".join(b"/Im" + str(i).encode() + b" " + str(number).encode() + b" 0 R"
+                             for i, number in enumerate(images))
+        contents = self._add_stream(b"", content)
+        resources = b"<< /Font << /F1 3 0 R >> /XObject << " + xobjects + b" >> >>"
+        self._pages.append(self._add(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {} {}] /Contents {} 0 R /Resources "
+            .format(PAGE_WIDTH, PAGE_HEIGHT, contents).encode() + resources + b" >>"))
+
+    def add_image(self, width, height, color_space, samples):
+        """Add a Flate compressed image with 8 bits per component.
+
+        Args:
+            width (int): Width in pixels.
+            height (int): Height in pixels.
+            color_space (str): DeviceRGB or DeviceGray.
+            samples (bytes): The uncompressed samples, row by row.
+        Returns:
+            int: The object number of the image.
+        """
+        dictionary = ("/Type /XObject /Subtype /Image /Width {} /Height {} /ColorSpace /{} "
+                      "/BitsPerComponent 8 /Filter /FlateDecode"
+                      .format(width, height, color_space)).encode()
+        return self._add_stream(dictionary, zlib.compress(samples, 6))
+
+    def to_bytes(self):
+        """
+        Returns:
+            bytes: The PDF file.
+        """
+        kids = " ".join("{} 0 R".format(number) for number in self._pages)
+        self._objects[self.CATALOG - 1] = b"<< /Type /Catalog /Pages 2 0 R >>"
+        self._objects[self.PAGES - 1] = "<< /Type /Pages /Kids [{}] /Count {} >>".format(
+            kids, len(self._pages)).encode()
+        output = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets = []
+        for number, content in enumerate(self._objects, start=1):
+            offsets.append(len(output))
+            output += str(number).encode() + b" 0 obj\n" + content + b"\nendobj\n"
+        xref_offset = len(output)
+        output += "xref\n0 {}\n0000000000 65535 f \n".format(len(self._objects) + 1).encode()
+        for offset in offsets:
+            output += "{:010d} 00000 n \n".format(offset).encode()
+        output += ("trailer\n<< /Size {} /Root 1 0 R >>\nstartxref\n{}\n%%EOF\n"
+                   .format(len(self._objects) + 1, xref_offset).encode())
+        return bytes(output)
+
+def random_bytes(rng, amount):
+    """
+    Returns:
+        bytes: ``amount`` bytes from the random number generator.
+    """
+    return rng.getrandbits(8 * amount).to_bytes(amount, 'little') if amount else b""
+
+def text_content(rng, lines):
+    """
+    Returns:
+        bytes: A content stream with ``lines`` lines of random words.
+    """
+    commands = ["BT /F1 {} Tf {} TL 72 {} Td".format(FONT_SIZE, LINE_HEIGHT, PAGE_HEIGHT - 72)]
+    for _ in range(lines):
+        line = " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 14)))
+        commands.append("({}) '".format(line))
+    commands.append("ET")
+    return "\n".join(commands).encode()
+
+def image_content(width, height):
+    """
+    Returns:
+        bytes: A content stream that draws /Im0 over the whole page.
+    """
+    return "q {} 0 0 {} 0 0 cm /Im0 Do Q".format(width, height).encode()
+
+def photo_samples(rng, width, height):
+    """Create the samples of a photo-like RGB image: diagonal color gradients with bands of noise.
+
+    Returns:
+        bytes: width * height RGB samples.
+    """
+    row_bytes = width * 3
+    red, green, blue = rng.randrange(256), rng.randrange(256), rng.randrange(256)
+    gradient = bytes(value for x in range(width + height)
+                     for value in ((red + x) % 256, (green + x // 2) % 256, (blue - x // 3) % 256))
+    rows = []
+    for y in range(height):
+        row = gradient[y * 3:y * 3 + row_bytes]
+        if y % 8 < 3:
+            start = rng.randrange(row_bytes // 2)
+            noise = random_bytes(rng, row_bytes // 4)
+            row = row[:start] + noise + row[start + len(noise):]
+        rows.append(row)
+    return b"".join(rows)
+
+def scanned_samples(rng, width, height):
+    """Create the samples of a scanned page: white paper with dark lines of text and speckles.
+
+    Returns:
+        bytes: width * height grayscale samples.
+    """
+    margin = width // 10
+    white = b"\xf8" * width
+    rows = []
+    for y in range(height):
+        row = bytearray(white)
+        if margin <= y <= height - margin and (y // 12) % 4 != 3:
+            x = margin
+            while x < width - margin:
+                word = rng.randint(20, 120)
+                end = min(x + word, width - margin)
+                row[x:end] = bytes([rng.randint(0, 60)]) * (end - x)
+                x = end + rng.randint(15, 30)
+        for _ in range(rng.randint(0, 4)):
+            row[rng.randrange(width)] = rng.randint(0, 255)
+        rows.append(bytes(row))
+    return b"".join(rows)
+
+def create_pdf(kind, pages, rng):
+    """Create a synthetic PDF file.
+
+    Args:
+        kind (str): One of KIND_TEXT, KIND_IMAGE, KIND_SCANNED and KIND_TINY.
+        pages (int): Amount of pages.
+        rng (random.Random): The random number generator to create the content with.
+    Returns:
+        bytes: The PDF file.
+    """
+    writer = PDFWriter()
+    for _ in range(pages):
+        if kind == KIND_TEXT:
+            writer.add_page(text_content(rng, (PAGE_HEIGHT - 144) // LINE_HEIGHT))
+        elif kind == KIND_TINY:
+            writer.add_page(text_content(rng, 3))
+        elif kind == KIND_IMAGE:
+            width, height = rng.randint(1000, 1400), rng.randint(1000, 1400)
+            image = writer.add_image(width, height, 'DeviceRGB', photo_samples(rng, width, height))
+            writer.add_page(image_content(PAGE_WIDTH, PAGE_HEIGHT), [image])
+        elif kind == KIND_SCANNED:
+            width, height = PAGE_WIDTH * SCAN_DPI // 72, PAGE_HEIGHT * SCAN_DPI // 72
+            image = writer.add_image(width, height, 'DeviceGray',
+                                     scanned_samples(rng, width, height))
+            writer.add_page(image_content(PAGE_WIDTH, PAGE_HEIGHT), [image])
+        else:
+            raise ValueError("Unknown kind of PDF file: '{}'".format(kind))
+    return writer.to_bytes()
+
+def generate_corpus(directory, seed=SEED_DEFAULT, scale=SCALE_DEFAULT):
+    """Write the synthetic corpus to a directory. Every file gets a random number generator of its
+    own that is seeded from the seed, kind and number of the file, so that scaling the corpus up
+    does not change the files that were already in it.
+
+    Args:
+        directory (str): Path to the directory to write the files to. It is created if needed.
+        seed (int): The seed of the corpus.
+        scale (float): Factor to multiply the amount of files of every kind by.
+    Returns:
+        list(dict): The manifest entries of the files, with their filename, kind, pages, size
+        and SHA-256.
+    """
+    os.makedirs(directory, exist_ok=True)
+    entries = []
+    for spec in CORPUS_SPECS:
+        for number in range(max(1, round(spec.files * scale))):
+            rng = random.Random("{}-{}-{}".format(seed, spec.kind, number))
+            content = create_pdf(spec.kind, spec.pages, rng)
+            filename = "{}{:03d}.pdf".format(spec.kind, number)
+            with open(os.path.join(directory, filename), 'wb') as file:
+                file.write(content)
+            entries.append(dict(filename=filename, kind=spec.kind, pages=spec.pages,
+                                size=len(content), sha256=hashlib.sha256(content).hexdigest()))
+    with open(os.path.join(directory, MANIFEST_FILENAME), 'w') as file:
+        json.dump(dict(seed=seed, scale=scale, files=entries), file, indent=2)
+    return entries
+
+def read_corpus(directory):
+    """Read the manifest of a corpus written by generate_corpus.
+
+    Returns:
+        list(dict): The manifest entries of the files.
+    """
+    with open(os.path.join(directory, MANIFEST_FILENAME)) as file:
+        return json.load(file)['files']
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", help="The directory to write the corpus to.")
+    parser.add_argument("--seed", type=int, default=SEED_DEFAULT,
+                        help="Seed of the corpus. Defaults to {}.".format(SEED_DEFAULT))
+    parser.add_argument("--scale", type=float, default=SCALE_DEFAULT,
+                        help="Factor to scale the amount of files by. Defaults to {}."
+                        .format(SCALE_DEFAULT))
+    args = parser.parse_args()
+    entries = generate_corpus(args.directory, args.seed, args.scale)
+    for kind in (spec.kind for spec in CORPUS_SPECS):
+        sizes = [entry['size'] for entry in entries if entry['kind'] == kind]
+        print("{:<8} {:>4} files {:>12} bytes".format(kind, len(sizes), sum(sizes)))
+
+if __name__ == '__main__':
+    main()
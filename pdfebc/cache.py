@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""This module contains the compression cache of the pdfebc program. The cache maps the content
+of an input PDF file, together with the exact Ghostscript settings and version used to compress
+it, to the compressed output. It lives in the user cache directory specified by appdirs, and is
+kept below a maximum size by evicting the least recently used entries.
+
+.. module:: cache
+    :platform: Unix
+    :synopsis: Persistent compression cache for pdfebc.
+
+.. moduleauthor:: Simon Larsén <slarse@kth.se>
+"""
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import namedtuple
+import appdirs
+
+BYTES_PER_MEGABYTE = 1024**2
+CACHE_DIR = appdirs.user_cache_dir('pdfebc')
+CACHE_SIZE_LIMIT_DEFAULT = 1024 * BYTES_PER_MEGABYTE
+OBJECTS_DIRNAME = "objects"
+STATS_FILENAME = "stats.json"
+ENTRY_EXTENSION = ".pdf"
+HASH_CHUNK_SIZE = BYTES_PER_MEGABYTE
+HITS_KEY = "hits"
+MISSES_KEY = "misses"
+
+CACHE_STATS = """
+#########################
+# COMPRESSION CACHE     #
+#########################
+Location: '{}'
+Entries: {}
+Size: {} bytes (limit {} bytes)
+Hits: {}
+Misses: {}
+"""
+
+CacheStats = namedtuple('CacheStats', ['location', 'entries', 'size', 'size_limit', 'hits', 'misses'])
+
+def hash_file(filepath):
+    """Compute the SHA-256 hex digest of the content of a file.
+
+    Args:
+        filepath (str): Path to the file.
+    Returns:
+        str: The hex digest.
+    """
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+class CompressionCache:
+    """A content-addressed cache of compressed PDF files.
+
+    Args:
+        cache_dir (str): Path to the directory in which to store the cache.
+        size_limit (int): Maximum total size of the cached files, in bytes.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, size_limit=CACHE_SIZE_LIMIT_DEFAULT):
+        self.cache_dir = cache_dir
+        self.size_limit = size_limit
+        self.objects_dir = os.path.join(cache_dir, OBJECTS_DIRNAME)
+        self.stats_path = os.path.join(cache_dir, STATS_FILENAME)
+        self.hits = 0
+        self.misses = 0
+        # total size of the entries, counted once on the first store and kept up to date after
+        self._size = None
+        self._lock = threading.Lock()
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+    def key(self, filepath, ghostscript_settings, ghostscript_version):
+        """Compute the cache key of a compression.
+
+        Args:
+            filepath (str): Path to the input PDF file.
+            ghostscript_settings (list(str)): The Ghostscript arguments, excluding the binary and
+            the input and output paths.
+            ghostscript_version (str): The version of the Ghostscript binary.
+        Returns:
+            str: The cache key.
+        """
+        sha = hashlib.sha256()
+        sha.update(hash_file(filepath).encode('utf-8'))
+        sha.update(json.dumps([ghostscript_version, list(ghostscript_settings)]).encode('utf-8'))
+        return sha.hexdigest()
+
+    def entry_path(self, key):
+        """
+        Args:
+            key (str): A cache key.
+        Returns:
+            str: Path to the cache entry of the key.
+        """
+        return os.path.join(self.objects_dir, key[:2], key + ENTRY_EXTENSION)
+
+    def fetch(self, key, output_path):
+        """Place the cached output of the key at the output path, if there is one. The output is
+        hardlinked to the cache entry if possible, and copied otherwise.
+
+        Args:
+            key (str): A cache key.
+            output_path (str): Where to put the cached output.
+        Returns:
+            bool: True if the cache had an entry for the key, False otherwise.
+        """
+        entry = self.entry_path(key)
+        try:
+            os.utime(entry)
+            if os.path.lexists(output_path):
+                os.remove(output_path)
+            try:
+                os.link(entry, output_path)
+            except OSError:
+                shutil.copyfile(entry, output_path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def store(self, key, output_path):
+        """Store a compressed output in the cache, and evict old entries if the cache grows
+        too large. The cache directory is only scanned on the first store, and when entries
+        must be evicted.
+
+        Args:
+            key (str): A cache key.
+            output_path (str): Path to the compressed output.
+        """
+        entry = self.entry_path(key)
+        entry_dir = os.path.dirname(entry)
+        os.makedirs(entry_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=entry_dir, suffix='.tmp')
+        try:
+            with open(output_path, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+                size = dst.tell()
+            try:
+                replaced_size = os.stat(entry).st_size
+            except FileNotFoundError:
+                replaced_size = 0
+            os.replace(tmp_path, entry)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entry_stats())
+            else:
+                self._size += size - replaced_size
+            too_large = self._size > self.size_limit
+        if too_large:
+            self.evict()
+
+    def entries(self):
+        """
+        Returns:
+            list(os.DirEntry): All entries of the cache.
+        """
+        entries = []
+        for subdir in os.scandir(self.objects_dir):
+            if subdir.is_dir():
+                entries.extend(entry for entry in os.scandir(subdir.path)
+                               if entry.name.endswith(ENTRY_EXTENSION))
+        return entries
+
+    def _entry_stats(self):
+        """
+        Returns:
+            list((int, int, str)): The mtime in nanoseconds, size and path of every entry.
+        """
+        stats = []
+        for entry in self.entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            stats.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        return stats
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is within its size limit."""
+        with self._lock:
+            entries = self._entry_stats()
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total_size <= self.size_limit:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total_size -= size
+            self._size = total_size
+
+    def persisted_stats(self):
+        """
+        Returns:
+            dict: The hit and miss counts stored in the cache directory.
+        """
+        try:
+            with open(self.stats_path, encoding='utf-8') as file:
+                return json.load(file)
+        except (IOError, ValueError):
+            return {HITS_KEY: 0, MISSES_KEY: 0}
+
+    def save_stats(self):
+        """Add the hits and misses of this session to the counts stored in the cache directory."""
+        with self._lock:
+            stats = self.persisted_stats()
+            stats[HITS_KEY] = stats.get(HITS_KEY, 0) + self.hits
+            stats[MISSES_KEY] = stats.get(MISSES_KEY, 0) + self.misses
+            self.hits = self.misses = 0
+            with open(self.stats_path, 'w', encoding='utf-8') as file:
+                json.dump(stats, file)
+
+    def stats(self):
+        """
+        Returns:
+            CacheStats: Statistics for the cache, including the hits and misses of this session.
+        """
+        entries = self.entries()
+        persisted = self.persisted_stats()
+        return CacheStats(self.cache_dir, len(entries), sum(entry.stat().st_size for entry in entries),
+                          self.size_limit, persisted.get(HITS_KEY, 0) + self.hits,
+                          persisted.get(MISSES_KEY, 0) + self.misses)
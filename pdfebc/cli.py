@@ -10,11 +10,21 @@
 import argparse
 import sys
 import os
-from . import utils
+from . import core, profiles, scheduling, utils
 
 OUT_DIR_DEFAULT = "pdfebc_out"
 SRC_DIR_DEFAULT = "."
 GHOSTSCRIPT_BINARY_DEFAULT = "gs"
+JOBS_DEFAULT = 1
+CACHE_SIZE_DEFAULT = 1024
+# the defaults of the estimate, watch and server modules, which are only imported when used
+ESTIMATE_PAGES_DEFAULT = 3
+SETTLE_TIME_DEFAULT = 2.0
+POLL_INTERVAL_DEFAULT = 1.0
+HOST_DEFAULT = "127.0.0.1"
+PORT_DEFAULT = 8470
+QUEUE_SIZE_DEFAULT = 64
+MAX_UPLOAD_DEFAULT = 512
 
 DESCRIPTION = "CLI tool for compressing PDF files, and sending the output via e-mail."
 OUT_DIR_SHORT = "-o"
@@ -31,6 +41,9 @@ GS_HELP = "Specify the name of the Ghostscript binary. Defaults to '{}'.".format
 SEND_SHORT = "-e"
 SEND_LONG = "--email"
 SEND_HELP = "Attempt to send the compressed PDF files with the settings in config.ini."
+STREAM_LONG = "--stream"
+STREAM_HELP = """Together with {}, send compressed files while the rest of the files are still being
+compressed, as soon as there are enough files to fill an email.""".format(SEND_LONG)
 CLEAN_SHORT = "-c"
 CLEAN_LONG = "--clean"
 CLEAN_HELP = """Automatically remove output directory after finishing the program.
@@ -38,6 +51,135 @@ Most useful in conjuction with {}.""".format(SEND_LONG)
 STATUS_SHORT = "-cs"
 STATUS_LONG = "--configstatus"
 STATUS_HELP = "Show the location and health of the configuration file."
+JOBS_SHORT = "-j"
+JOBS_LONG = "--jobs"
+JOBS_HELP = """Amount of Ghostscript processes to run in parallel. Defaults to the '{}' option of
+the configuration file, or {} if it is not set.""".format(utils.JOBS_KEY, JOBS_DEFAULT)
+NO_CACHE_LONG = "--no-cache"
+NO_CACHE_HELP = """Do not look up or store compressed files in the compression cache. The size of
+the cache in megabytes is set by the '{}' option of the configuration file, and defaults to {}.
+""".format(utils.CACHE_SIZE_KEY, CACHE_SIZE_DEFAULT)
+CACHE_STATS_LONG = "--cache-stats"
+CACHE_STATS_HELP = "Show the location, size and hit rate of the compression cache."
+RECURSIVE_SHORT = "-r"
+RECURSIVE_LONG = "--recursive"
+RECURSIVE_HELP = """Also look for PDF files in subdirectories of the source directory. The directory
+structure is mirrored in the output directory."""
+INCLUDE_LONG = "--include"
+INCLUDE_HELP = """Only compress files whose path relative to the source directory matches this glob
+pattern. May be given multiple times."""
+EXCLUDE_LONG = "--exclude"
+EXCLUDE_HELP = """Do not compress files whose path relative to the source directory matches this
+glob pattern. May be given multiple times."""
+FILES_FROM_LONG = "--files-from"
+FILES_FROM_HELP = """Compress the PDF files listed in this file instead of the files in the source
+directory. Use '-' to read the list from stdin. Paths are separated by newlines, or by NUL characters
+as written by 'find -print0'. A path may be followed by a tab and the path to write its output to.
+Other outputs are placed in the output directory, mirroring the directory structure of the source
+directory for files inside it. The list is read while files are compressed, so there is no limit on
+its length."""
+SCHEDULE_LONG = "--schedule"
+SCHEDULE_HELP = """The order in which to compress files. '{}' compresses files in the order they are
+found, '{}' starts with the largest files and '{}' starts with the files that are predicted to
+take the longest, based on previous runs. Defaults to '{}'.""".format(
+    scheduling.SCHEDULE_FIFO, scheduling.SCHEDULE_LARGEST_FIRST, scheduling.SCHEDULE_LEARNED,
+    scheduling.SCHEDULE_FIFO)
+LINK_SMALL_LONG = "--link-small"
+LINK_SMALL_HELP = """Hardlink files that are too small to compress into the output directory instead
+of copying them, if the source and output directories are on the same file system."""
+SPLIT_ABOVE_LONG = "--split-above"
+SPLIT_ABOVE_HELP = """Compress files of at least this many megabytes in chunks of pages in parallel,
+and merge the chunks afterwards. By default, files are never split."""
+SPLIT_CHUNKS_LONG = "--split-chunks"
+SPLIT_CHUNKS_HELP = "Amount of chunks to split large files into. Defaults to {}.".format(
+    core.SPLIT_CHUNKS_DEFAULT)
+MIN_SAVINGS_LONG = "--min-savings"
+MIN_SAVINGS_HELP = """Keep the original file if compression does not make it at least this many
+percent smaller. Defaults to {:g}.""".format(core.MIN_SAVINGS_DEFAULT * 100)
+NO_HISTORY_LONG = "--no-history"
+NO_HISTORY_HELP = """Do not skip files that have not gotten smaller from compression in previous runs,
+and do not record the outcome of this run."""
+PROFILE_SHORT = "-p"
+PROFILE_LONG = "--profile"
+PROFILE_HELP = """The compression profile to use. '{}' gives the smallest files, '{}' the highest
+throughput and '{}' the best quality. More profiles can be defined in the configuration file.
+Defaults to the '{}' option of the configuration file, or '{}' if it is not set.""".format(
+    profiles.PROFILE_SCREEN, profiles.PROFILE_FAST, profiles.PROFILE_PRINTER, utils.PROFILE_KEY,
+    profiles.PROFILE_DEFAULT)
+PROFILE_RULE_LONG = "--profile-rule"
+PROFILE_RULE_HELP = """A rule of the form GLOB=PROFILE, that compresses files whose path relative to
+the source directory matches the glob pattern with the profile. May be given multiple times, the
+first matching rule wins. Takes precedence over the patterns of profiles in the configuration
+file."""
+TIMEOUT_LONG = "--timeout"
+TIMEOUT_HELP = """Kill Ghostscript if it takes longer than this many seconds to compress a file. By
+default, there is no timeout."""
+CPU_LIMIT_LONG = "--cpu-limit"
+CPU_LIMIT_HELP = """Kill Ghostscript if it uses more than this many seconds of CPU time on a file. By
+default, there is no limit."""
+MEMORY_LIMIT_LONG = "--memory-limit"
+MEMORY_LIMIT_HELP = """Limit the memory of every Ghostscript process to this many megabytes. By
+default, there is no limit."""
+RETRY_LONG = "--retry"
+RETRY_HELP = """Compress files that fail or exceed a limit again with lower resolution settings that
+are cheaper to render."""
+COPY_ON_FAILURE_LONG = "--copy-on-failure"
+COPY_ON_FAILURE_HELP = """Copy files that cannot be compressed to the output directory, instead of
+leaving them out."""
+BACKEND_LONG = "--backend"
+BACKEND_HELP = """How to run Ghostscript. '{}' starts Ghostscript for every file. '{}' runs Ghostscript
+as a library in worker processes that start up while the previous file is compressed, which hides
+its startup time, and falls back to '{}' if libgs cannot be found. '{}' does the same with
+Ghostscript interpreters that are fed their file over stdin. Defaults to '{}'.""".format(
+    core.BACKEND_SUBPROCESS, core.BACKEND_LIBGS, core.BACKEND_SUBPROCESS, core.BACKEND_INTERPRETER,
+    core.BACKEND_SUBPROCESS)
+JSON_RESULTS_LONG = "--json-results"
+JSON_RESULTS_HELP = """Write the result of every file, including sizes, compression ratio and timings,
+as JSON Lines to this file. Use '-' for stdout."""
+DRY_RUN_LONG = "--dry-run"
+ESTIMATE_LONG = "--estimate"
+DRY_RUN_HELP = """Do not compress anything, but project the output size, CPU time and wall-clock time
+of the batch from the compression history. Files that have not been compressed before are counted
+as unknown, unless {} is given. With {}, the projection of every file is written instead of its
+result.""".format(ESTIMATE_LONG, JSON_RESULTS_LONG)
+ESTIMATE_HELP = """With {}, project files that have not been compressed before by compressing a few
+of their pages each, and give a confidence range for the projection.""".format(DRY_RUN_LONG)
+ESTIMATE_PAGES_LONG = "--estimate-pages"
+ESTIMATE_PAGES_HELP = "Amount of pages to sample per file with {}. Defaults to {}.".format(
+    ESTIMATE_LONG, ESTIMATE_PAGES_DEFAULT)
+COMMANDS_HELP = """Without a command, pdfebc compresses the PDF files in the source directory once. The
+options above, such as the source and output directories, go before the command."""
+WATCH_COMMAND = "watch"
+WATCH_HELP = "Keep compressing PDF files as they land in the source directory, until interrupted."
+SETTLE_LONG = "--settle"
+SETTLE_HELP = """Seconds a file's size and modification time must stay the same before it is
+considered completely written and is compressed. Defaults to {}.""".format(
+    SETTLE_TIME_DEFAULT)
+POLL_INTERVAL_LONG = "--poll-interval"
+POLL_INTERVAL_HELP = """Seconds between scans of the source directory when inotify is not used.
+Defaults to {}.""".format(POLL_INTERVAL_DEFAULT)
+NO_INOTIFY_LONG = "--no-inotify"
+NO_INOTIFY_HELP = "Poll the source directory instead of using inotify, e.g. for network shares."
+LATENCY_LOG_LONG = "--latency-log"
+LATENCY_LOG_HELP = """Append the result of every file, including the latency from detecting the file
+to writing its output, as JSON Lines to this file."""
+SERVE_COMMAND = "serve"
+SERVE_HELP = """Serve a local HTTP API for compressing PDF files, until interrupted. The '{}' option
+sets the amount of files compressed in parallel.""".format(JOBS_LONG)
+HOST_LONG = "--host"
+HOST_HELP = "The host to listen on. Defaults to '{}'.".format(HOST_DEFAULT)
+PORT_LONG = "--port"
+PORT_HELP = "The port to listen on. Defaults to {}.".format(PORT_DEFAULT)
+QUEUE_SIZE_LONG = "--queue-size"
+QUEUE_SIZE_HELP = """Maximum amount of jobs waiting to be compressed, further jobs are rejected until
+there is room. Defaults to {}.""".format(QUEUE_SIZE_DEFAULT)
+MAX_UPLOAD_LONG = "--max-upload"
+MAX_UPLOAD_HELP = "Maximum size of a submitted file in megabytes. Defaults to {}.".format(
+    MAX_UPLOAD_DEFAULT)
+INCREMENTAL_SHORT = "-i"
+INCREMENTAL_LONG = "--incremental"
+INCREMENTAL_HELP = """Only compress files that have changed since the last run with the same output
+directory, and remove outputs of files that have been removed from the source directory."""
 
 CONFIG_STATUS = """
 #############################
@@ -72,21 +214,54 @@ MALFORMED_ENTRIES = """The following sections contain entries that missing or ma
 -----------------------------------------------------------------
 """
 
+# arguments that make pdfebc exit before it uses any option that defaults to the configuration
+HELP_ARGS = ("-h", "--help")
+NO_CONFIG_ARGS = HELP_ARGS + (STATUS_SHORT, STATUS_LONG)
+
 START_CONFIG = "START-CONFIG".center(50).replace(" ", "-")
 END_CONFIG = "END-CONFIG".center(50).replace(" ", "-")
 
-def create_argparser():
+def config_needed(args):
+    """
+    Args:
+        args (list(str)): The command line arguments.
+    Returns:
+        bool: False if the arguments only ask for help or for the status of the configuration
+        file, so that the configuration file need not be read before parsing them.
+    """
+    return not any(arg in NO_CONFIG_ARGS for arg in args)
+
+def create_argparser(config=None):
     """
+    Args:
+        config (defaultdict): The configuration to take defaults from, as read by
+        pdfebc.utils.load_config. If None, the built-in defaults are used, and only the built-in
+        profiles are available.
     Returns:
         argparse.ArgumentParser: The argument parser for pdfebc.
+    Raises:
+        pdfebc.utils.ConfigurationError
     """
-    config = utils.read_config()
-    out_dir_default = utils.try_get_conf(config, utils.DEFAULT_SECTION_KEY,
-                                         utils.OUT_DEFAULT_DIR_KEY)
-    src_dir_default = utils.try_get_conf(config, utils.DEFAULT_SECTION_KEY,
-                                         utils.SRC_DEFAULT_DIR_KEY)
-    gs_default_binary = utils.try_get_conf(config, utils.DEFAULT_SECTION_KEY,
-                                           utils.GS_DEFAULT_BINARY_KEY)
+    if config is None:
+        config = {}
+        out_dir_default, src_dir_default = OUT_DIR_DEFAULT, SRC_DIR_DEFAULT
+        gs_default_binary = GHOSTSCRIPT_BINARY_DEFAULT
+    else:
+        out_dir_default = utils.try_get_conf(config, utils.DEFAULT_SECTION_KEY,
+                                             utils.OUT_DEFAULT_DIR_KEY)
+        src_dir_default = utils.try_get_conf(config, utils.DEFAULT_SECTION_KEY,
+                                             utils.SRC_DEFAULT_DIR_KEY)
+        gs_default_binary = utils.try_get_conf(config, utils.DEFAULT_SECTION_KEY,
+                                               utils.GS_DEFAULT_BINARY_KEY)
+    jobs_default = utils.try_get_conf_or_default(config, utils.DEFAULT_SECTION_KEY,
+                                                 utils.JOBS_KEY, str(JOBS_DEFAULT))
+    cache_size_default = utils.try_get_conf_or_default(config, utils.DEFAULT_SECTION_KEY,
+                                                       utils.CACHE_SIZE_KEY, str(CACHE_SIZE_DEFAULT))
+    profile_default = utils.try_get_conf_or_default(config, utils.DEFAULT_SECTION_KEY,
+                                                    utils.PROFILE_KEY, profiles.PROFILE_DEFAULT)
+    compression_profiles = profiles.load_profiles(config)
+    if profile_default not in compression_profiles:
+        raise utils.ConfigurationError("Unknown default profile '{}'".format(profile_default))
     parser = argparse.ArgumentParser(
         description=DESCRIPTION)
     parser.add_argument(
@@ -97,12 +272,183 @@ def create_argparser():
         GS_SHORT, GS_LONG, help=GS_HELP, type=str, default=gs_default_binary)
     parser.add_argument(
         SEND_SHORT, SEND_LONG, help=SEND_HELP, action='store_true')
+    parser.add_argument(
+        STREAM_LONG, help=STREAM_HELP, action='store_true')
     parser.add_argument(
         CLEAN_SHORT, CLEAN_LONG, help=CLEAN_HELP, action='store_true')
     parser.add_argument(
         STATUS_SHORT, STATUS_LONG, help=STATUS_HELP, action='store_true')
+    parser.add_argument(
+        JOBS_SHORT, JOBS_LONG, help=JOBS_HELP, type=positive_int, default=jobs_default)
+    parser.add_argument(
+        NO_CACHE_LONG, help=NO_CACHE_HELP, action='store_true')
+    parser.add_argument(
+        CACHE_STATS_LONG, help=CACHE_STATS_HELP, action='store_true')
+    parser.add_argument(
+        INCREMENTAL_SHORT, INCREMENTAL_LONG, help=INCREMENTAL_HELP, action='store_true')
+    parser.add_argument(
+        RECURSIVE_SHORT, RECURSIVE_LONG, help=RECURSIVE_HELP, action='store_true')
+    parser.add_argument(
+        INCLUDE_LONG, help=INCLUDE_HELP, type=str, action='append', default=[])
+    parser.add_argument(
+        EXCLUDE_LONG, help=EXCLUDE_HELP, type=str, action='append', default=[])
+    parser.add_argument(
+        FILES_FROM_LONG, help=FILES_FROM_HELP, type=str, default=None)
+    parser.add_argument(
+        SCHEDULE_LONG, help=SCHEDULE_HELP, choices=scheduling.SCHEDULES,
+        default=scheduling.SCHEDULE_FIFO)
+    parser.add_argument(
+        LINK_SMALL_LONG, help=LINK_SMALL_HELP, action='store_true')
+    parser.add_argument(
+        SPLIT_ABOVE_LONG, help=SPLIT_ABOVE_HELP, type=positive_int, default=None)
+    parser.add_argument(
+        SPLIT_CHUNKS_LONG, help=SPLIT_CHUNKS_HELP, type=positive_int,
+        default=core.SPLIT_CHUNKS_DEFAULT)
+    parser.add_argument(
+        MIN_SAVINGS_LONG, help=MIN_SAVINGS_HELP, type=percentage,
+        default=core.MIN_SAVINGS_DEFAULT * 100)
+    parser.add_argument(
+        NO_HISTORY_LONG, help=NO_HISTORY_HELP, action='store_true')
+    parser.add_argument(
+        PROFILE_SHORT, PROFILE_LONG, help=PROFILE_HELP, choices=list(compression_profiles),
+        default=profile_default)
+    parser.add_argument(
+        PROFILE_RULE_LONG, help=PROFILE_RULE_HELP, type=profile_rule, action='append', default=[])
+    parser.add_argument(
+        TIMEOUT_LONG, help=TIMEOUT_HELP, type=positive_float, default=None)
+    parser.add_argument(
+        CPU_LIMIT_LONG, help=CPU_LIMIT_HELP, type=positive_float, default=None)
+    parser.add_argument(
+        MEMORY_LIMIT_LONG, help=MEMORY_LIMIT_HELP, type=positive_int, default=None)
+    parser.add_argument(
+        RETRY_LONG, help=RETRY_HELP, action='store_true')
+    parser.add_argument(
+        COPY_ON_FAILURE_LONG, help=COPY_ON_FAILURE_HELP, action='store_true')
+    parser.add_argument(
+        BACKEND_LONG, help=BACKEND_HELP, choices=core.BACKENDS, default=core.BACKEND_SUBPROCESS)
+    parser.add_argument(
+        JSON_RESULTS_LONG, help=JSON_RESULTS_HELP, type=str, default=None)
+    parser.add_argument(
+        DRY_RUN_LONG, help=DRY_RUN_HELP, action='store_true')
+    parser.add_argument(
+        ESTIMATE_LONG, help=ESTIMATE_HELP, action='store_true')
+    parser.add_argument(
+        ESTIMATE_PAGES_LONG, help=ESTIMATE_PAGES_HELP, type=positive_int,
+        default=ESTIMATE_PAGES_DEFAULT)
+    parser.set_defaults(cache_size=positive_int(cache_size_default), profiles=compression_profiles)
+    subparsers = parser.add_subparsers(dest='command', title='commands',
+                                       description=COMMANDS_HELP)
+    watch_parser = subparsers.add_parser(WATCH_COMMAND, help=WATCH_HELP, description=WATCH_HELP)
+    watch_parser.add_argument(
+        SETTLE_LONG, help=SETTLE_HELP, type=non_negative_float, default=SETTLE_TIME_DEFAULT)
+    watch_parser.add_argument(
+        POLL_INTERVAL_LONG, help=POLL_INTERVAL_HELP, type=non_negative_float,
+        default=POLL_INTERVAL_DEFAULT)
+    watch_parser.add_argument(
+        NO_INOTIFY_LONG, help=NO_INOTIFY_HELP, action='store_true')
+    watch_parser.add_argument(
+        LATENCY_LOG_LONG, help=LATENCY_LOG_HELP, type=str, default=None)
+    serve_parser = subparsers.add_parser(SERVE_COMMAND, help=SERVE_HELP, description=SERVE_HELP)
+    serve_parser.add_argument(
+        HOST_LONG, help=HOST_HELP, type=str, default=HOST_DEFAULT)
+    serve_parser.add_argument(
+        PORT_LONG, help=PORT_HELP, type=positive_int, default=PORT_DEFAULT)
+    serve_parser.add_argument(
+        QUEUE_SIZE_LONG, help=QUEUE_SIZE_HELP, type=positive_int,
+        default=QUEUE_SIZE_DEFAULT)
+    serve_parser.add_argument(
+        MAX_UPLOAD_LONG, help=MAX_UPLOAD_HELP, type=positive_int,
+        default=MAX_UPLOAD_DEFAULT)
     return parser
 
+def positive_int(value):
+    """Argument type for options that only accept positive integers.
+
+    Args:
+        value (str): The raw value of the option.
+    Returns:
+        int: The value as an integer.
+    Raises:
+        argparse.ArgumentTypeError
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError("'{}' is not a positive integer".format(value))
+    return number
+
+def profile_rule(value):
+    """Argument type for rules that select a compression profile for files matching a glob
+    pattern.
+
+    Args:
+        value (str): The raw value of the option, of the form GLOB=PROFILE.
+    Returns:
+        (str, str): The glob pattern and the name of the profile.
+    Raises:
+        argparse.ArgumentTypeError
+    """
+    pattern, _, name = value.rpartition("=")
+    if not pattern or not name:
+        raise argparse.ArgumentTypeError("'{}' is not of the form GLOB=PROFILE".format(value))
+    return pattern, name
+
+def positive_float(value):
+    """Argument type for options that accept a positive amount of seconds.
+
+    Args:
+        value (str): The raw value of the option.
+    Returns:
+        float: The value as a float.
+    Raises:
+        argparse.ArgumentTypeError
+    """
+    try:
+        number = float(value)
+    except ValueError:
+        number = 0
+    if not number > 0:
+        raise argparse.ArgumentTypeError("'{}' is not a positive number".format(value))
+    return number
+
+def non_negative_float(value):
+    """Argument type for options that accept a non-negative amount of seconds.
+
+    Args:
+        value (str): The raw value of the option.
+    Returns:
+        float: The value as a float.
+    Raises:
+        argparse.ArgumentTypeError
+    """
+    try:
+        number = float(value)
+    except ValueError:
+        number = -1
+    if number < 0:
+        raise argparse.ArgumentTypeError("'{}' is not a non-negative number".format(value))
+    return number
+
+def percentage(value):
+    """Argument type for options that accept a percentage between 0 and 100.
+
+    Args:
+        value (str): The raw value of the option.
+    Returns:
+        float: The value as a float.
+    Raises:
+        argparse.ArgumentTypeError
+    """
+    try:
+        number = float(value)
+    except ValueError:
+        number = -1
+    if not 0 <= number <= 100:
+        raise argparse.ArgumentTypeError("'{}' is not a percentage between 0 and 100".format(value))
+    return number
+
 def prompt_for_config_values():
     """Prompt the user for the user, password and receiver values for the config.
 
@@ -9,27 +9,341 @@ of functions that manipulate PDF files and the file system.
 .. moduleauthor:: Simon Larsén <slarse@kth.se>
 """
 import os
-import sys
+import math
+import time
+import signal
+import resource
+import shutil
+import tempfile
 import subprocess
-from . import utils
+import json
+import fnmatch
+import hashlib
+import functools
+import threading
+import collections
+from concurrent import futures
+from . import profiles, scheduling, utils
 
 BYTES_PER_MEGABYTE = 1024**2
-FILE_SIZE_LOWER_LIMIT = BYTES_PER_MEGABYTE
+# files this small are never worth a Ghostscript process, larger ones are left to the history
+FILE_SIZE_LOWER_LIMIT = 64 * 1024
+# outputs must be at least this fraction smaller than the input to be kept
+MIN_SAVINGS_DEFAULT = 0.05
 PDF_EXTENSION = ".pdf"
+GHOSTSCRIPT_SETTINGS = profiles.builtin_profiles()[profiles.PROFILE_DEFAULT].settings
+# lower resolution settings that are cheaper to render, for retrying files that fail or time out
+FALLBACK_SETTINGS = profiles.builtin_profiles()[profiles.PROFILE_FAST].settings
+MANIFEST_FILENAME = ".pdfebc_manifest.json"
+PENDING_FILES_PER_JOB = 4
+# seconds between reads of the CPU time of a child process that asyncio waits for
+CPU_SAMPLE_INTERVAL = 0.1
+FILE_LIST_CHUNK_SIZE = 64 * 1024
+FILE_LIST_OUTPUT_SEPARATOR = "\t"
+COPY_CHUNK_SIZE = 8 * BYTES_PER_MEGABYTE
+COPY_LINK = "link"
+COPY_FILE_RANGE = "copy_file_range"
+COPY_SENDFILE = "sendfile"
+COPY_BUFFERED = "buffered"
+SPLIT_CHUNKS_DEFAULT = 4
+BACKEND_SUBPROCESS = "subprocess"
+BACKEND_LIBGS = "libgs"
+BACKEND_INTERPRETER = "interpreter"
+BACKENDS = (BACKEND_SUBPROCESS, BACKEND_LIBGS, BACKEND_INTERPRETER)
+ACTION_COMPRESSED = "compressed"
+ACTION_COPIED = "copied"
+ACTION_CACHED = "cached"
+ACTION_KEPT_ORIGINAL = "kept_original"
+ACTION_FALLBACK = "fallback"
+ACTION_COPIED_AFTER_FAILURE = "copied_after_failure"
+ACTION_SKIPPED = "skipped"
+ACTION_FAILED = "failed"
+# settings for stitching compressed chunks together, images are already downsampled
+MERGE_SETTINGS = ("-sDEVICE=pdfwrite", "-dNOPAUSE", "-dQUIET", "-dBATCH",
+                  "-dDownsampleColorImages=false", "-dDownsampleGrayImages=false",
+                  "-dDownsampleMonoImages=false", "-dAutoFilterColorImages=false",
+                  "-dAutoFilterGrayImages=false", "-dColorImageFilter=/FlateEncode",
+                  "-dGrayImageFilter=/FlateEncode")
 
 COMPRESSING_MULTIPLE = """Source directory: '{}'
 Output directory: '{}'
-Found '{}' PDF files. Starting compression ..."""
-ALL_FILES_DONE = """All files done!
+Looking for PDF files and compressing them with {} parallel job(s) ..."""
+ALL_FILES_DONE = """All files done! Found '{}' PDF files.
 Results saved to '{}'"""
 COMPRESSING = "Compressing '{}' ..."
+COMPRESSING_SPLIT = "Compressing '{}' in {} chunks of pages ..."
 FILE_DONE = "File done! Result saved to '{}'"
+CACHE_HIT = "Found '{}' in the compression cache, not compressing."
+NOT_SMALLER = """Compressing '{}' saved less than {:.0%}, kept the original.
+Original size: {} bytes, compressed size: {} bytes"""
+NEVER_SHRINKS = "'{}' has not gotten smaller from compression before, not compressing."
+FILE_UNCHANGED = "'{}' is unchanged since the last run, not compressing."
+OUTPUT_REMOVED = "Source of '{}' is gone, removed the output."
+FILE_FAILED = """Failed to compress '{}'
+Reason: {}"""
 NOT_COMPRESSING = """Not compressing '{}'
 Reason: Actual file size is {} bytes,
 lower limit for compression is {} bytes"""
+FILE_TIMED_OUT = "Compressing '{}' took longer than {} seconds, killed Ghostscript."
+RETRYING = "Compressing '{}' failed: {}. Retrying with fallback settings ..."
+COPIED_AFTER_FAILURE = "Could not compress '{}', copied the original instead."
+GS_EXIT_CODE = "Ghostscript exited with code {}"
+GS_TIMED_OUT = "Ghostscript took longer than {} seconds and was killed"
+GS_CPU_LIMIT = "Ghostscript used more than {} seconds of CPU time and was killed"
+GS_JOB_FAILED = "Ghostscript failed with {}"
 GS_NOT_INSTALLED = """Ghostscript not installed or not aliased to '{}'.
 Exiting ..."""
 
+class CompressionError(Exception):
+    """Raised when Ghostscript fails to compress a file."""
+
+class GhostscriptTimeoutError(CompressionError):
+    """Raised when Ghostscript is killed for running longer than its timeout.
+
+    Attributes:
+        timeout (float): The timeout in seconds.
+        cpu_time (float): The user and system CPU seconds Ghostscript used before it was killed.
+    """
+
+    def __init__(self, timeout, cpu_time):
+        super().__init__(GS_TIMED_OUT.format(timeout))
+        self.timeout = timeout
+        self.cpu_time = cpu_time
+
+class GhostscriptLimits(collections.namedtuple('GhostscriptLimits',
+                                               ['timeout', 'cpu_time', 'memory'])):
+    """Limits of the resources a single Ghostscript process may use. A limit that is None is not
+    enforced.
+
+    Attributes:
+        timeout (float): Wall-clock seconds after which Ghostscript is killed.
+        cpu_time (float): User and system CPU seconds after which Ghostscript is killed.
+        memory (int): Maximum size of the address space of Ghostscript in bytes. Ghostscript fails
+        when it cannot allocate more memory.
+    """
+    __slots__ = ()
+
+class CompressionResult(collections.namedtuple('CompressionResult', [
+        'source_path', 'output_path', 'action', 'input_bytes', 'output_bytes', 'wall_time',
+        'cpu_time', 'exit_code', 'error', 'failed_attempts'])):
+    """The outcome of compressing a single file.
+
+    Attributes:
+        source_path (str): Path to the PDF file.
+        output_path (str): Output path.
+        action (str): What was done with the file, one of ACTION_COMPRESSED, ACTION_COPIED,
+        ACTION_CACHED, ACTION_KEPT_ORIGINAL, ACTION_FALLBACK, ACTION_COPIED_AFTER_FAILURE,
+        ACTION_SKIPPED and ACTION_FAILED.
+        input_bytes (int): Size of the PDF file.
+        output_bytes (int): Size of the output, or None if there is no output.
+        wall_time (float): Wall-clock seconds spent on the file.
+        cpu_time (float): User and system CPU seconds used by Ghostscript, or None if Ghostscript
+        was not run or its usage could not be measured.
+        exit_code (int): Exit code of Ghostscript, or None if Ghostscript was not run.
+        error (str): A description of what went wrong, or None if nothing did.
+        failed_attempts (tuple(str)): Descriptions of the Ghostscript runs that failed before the
+        file was compressed with fallback settings or copied. Empty if there were none.
+    """
+    __slots__ = ()
+
+    def __new__(cls, source_path, output_path, action, input_bytes, output_bytes, wall_time,
+                cpu_time, exit_code, error, failed_attempts=()):
+        return super().__new__(cls, source_path, output_path, action, input_bytes, output_bytes,
+                               wall_time, cpu_time, exit_code, error, tuple(failed_attempts))
+
+    @property
+    def compression_ratio(self):
+        """float: Output size divided by input size, or None if either is unknown or zero."""
+        if not self.input_bytes or self.output_bytes is None:
+            return None
+        return self.output_bytes / self.input_bytes
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: The fields of the result, and its compression ratio.
+        """
+        result = dict(self._asdict())
+        result['failed_attempts'] = list(self.failed_attempts)
+        result['compression_ratio'] = self.compression_ratio
+        return result
+
+def write_results_json_lines(results, file):
+    """Write compression results as JSON Lines, one object per result.
+
+    Args:
+        results (Iterable[CompressionResult]): The results to write.
+        file: A writable text file.
+    """
+    for result in results:
+        file.write(json.dumps(result.to_dict()) + "\n")
+
+def output_size(output_path):
+    """
+    Args:
+        output_path (str): Path to an output file.
+    Returns:
+        int: The size of the file, or None if it does not exist.
+    """
+    try:
+        return os.stat(output_path).st_size
+    except OSError:
+        return None
+
+def is_pdf_filename(filename):
+    """
+    Args:
+        filename (str): A filename or filepath.
+    Returns:
+        bool: True if the filename has a PDF extension, regardless of case.
+    """
+    return filename.lower().endswith(PDF_EXTENSION)
+
+def is_included(relative_path, include=(), exclude=()):
+    """
+    Args:
+        relative_path (str): Path to a file, relative to the source directory.
+        include (Iterable[str]): Glob patterns of which at least one must match the path. If
+        empty, all paths are included.
+        exclude (Iterable[str]): Glob patterns matching paths to leave out.
+    Returns:
+        bool: True if the path is included and not excluded.
+    """
+    if include and not any(fnmatch.fnmatch(relative_path, pattern) for pattern in include):
+        return False
+    return not any(fnmatch.fnmatch(relative_path, pattern) for pattern in exclude)
+
+def iter_pdf_entries(source_directory, recursive=False, include=(), exclude=(),
+                     skip_directories=()):
+    """Lazily find PDF files in the specified directory. Files are yielded as they are found,
+    so the caller can start working before the whole directory tree has been walked. The yielded
+    entries cache their stat results, so calling ``entry.stat()`` does not cost an extra
+    system call for every use.
+
+    Args:
+        source_directory (str): The source directory.
+        recursive (bool): Whether or not to also look in subdirectories.
+        include (Iterable[str]): Glob patterns of which at least one must match the path of a file,
+        relative to the source directory. If empty, all files are included.
+        exclude (Iterable[str]): Glob patterns matching relative paths of files to leave out.
+        skip_directories (Iterable[str]): Directories not to descend into, such as the output
+        directory.
+
+    Returns:
+        generator(os.DirEntry): Directory entries of the PDF files.
+
+    Raises:
+        ValueError
+    """
+    if not os.path.isdir(source_directory):
+        raise ValueError("%s is not a directory!" % source_directory)
+    skip_directories = {os.path.realpath(directory) for directory in skip_directories}
+    directories = [source_directory]
+    while directories:
+        directory = directories.pop()
+        subdirectories = []
+        with os.scandir(directory) as dir_entries:
+            for entry in dir_entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive and os.path.realpath(entry.path) not in skip_directories:
+                        subdirectories.append(entry.path)
+                    continue
+                if not is_pdf_filename(entry.name) or not entry.is_file():
+                    continue
+                relative_path = os.path.relpath(entry.path, source_directory)
+                if is_included(relative_path, include, exclude):
+                    yield entry
+        directories.extend(reversed(subdirectories))
+
+class SourceFile:
+    """A file to compress that was given explicitly instead of found in a directory. It has
+    the ``path`` and ``stat`` members of the os.DirEntry objects of iter_pdf_entries, so that
+    both can be fed to the batch engine, and may carry an output path of its own.
+
+    Args:
+        path (str): Path to the PDF file.
+        output_path (str): Path to write the output to, or None to place it in the output
+        directory of the batch.
+    """
+    __slots__ = ('path', 'output_path', '_stat')
+
+    def __init__(self, path, output_path=None):
+        self.path = path
+        self.output_path = output_path
+        self._stat = None
+
+    def stat(self):
+        """
+        Returns:
+            os.stat_result: The stat result of the file, which is cached after the first call.
+        Raises:
+            OSError
+        """
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+def iter_file_list(file):
+    """Lazily read a list of files to compress. Paths are separated by NUL characters if there
+    is one before the first newline, as written by ``find -print0``, and by newlines otherwise.
+    A path may be followed by a tab and the path to write its output to. Empty entries are
+    skipped. Only one chunk of the list is held in memory at a time, so lists of any length can be
+    processed, even while they are still being written to a pipe.
+
+    Args:
+        file: A readable binary file, such as ``sys.stdin.buffer``.
+
+    Returns:
+        generator(SourceFile): The files of the list, in order.
+    """
+    read = getattr(file, 'read1', file.read)
+    separator = None
+    remainder = b""
+    while True:
+        chunk = read(FILE_LIST_CHUNK_SIZE)
+        data = remainder + chunk
+        if separator is None:
+            # a pipe may hand out less than the first path, so wait for the first separator
+            nul, newline = data.find(b"\0"), data.find(b"\n")
+            if nul != -1 and (newline == -1 or nul < newline):
+                separator = b"\0"
+            elif newline != -1 or not chunk:
+                separator = b"\n"
+            else:
+                remainder = data
+                continue
+        records = data.split(separator)
+        remainder = records.pop() if chunk else b""
+        for record in records:
+            if separator == b"\n":
+                record = record.rstrip(b"\r")
+            if not record:
+                continue
+            path, _, output_path = os.fsdecode(record).partition(FILE_LIST_OUTPUT_SEPARATOR)
+            yield SourceFile(path, output_path or None)
+        if not chunk:
+            return
+
+def source_output_path(entry, source_directory, output_directory):
+    """
+    Args:
+        entry (os.DirEntry): A file found by iter_pdf_entries, or a SourceFile.
+        source_directory (str): Filepath to the source directory.
+        output_directory (str): Filepath to the output directory.
+    Returns:
+        (str, str): The path of the file relative to the source directory, and its output path.
+        Outputs mirror the directory structure of the source directory, except for files outside
+        of it, whose outputs are placed directly in the output directory. An output path of a
+        SourceFile takes precedence.
+    """
+    relative_path = os.path.relpath(entry.path, source_directory)
+    if relative_path == os.pardir or relative_path.startswith(os.pardir + os.sep):
+        relative_path = os.path.basename(entry.path)
+    output = getattr(entry, 'output_path', None)
+    if output is None:
+        output = os.path.join(output_directory, relative_path)
+    return relative_path, output
+
 def get_pdf_filenames_at(source_directory):
     """Find all PDF files in the specified directory.
 
@@ -42,66 +356,1258 @@ def get_pdf_filenames_at(source_directory):
     Raises:
         ValueError
     """
-    if not os.path.isdir(source_directory):
-        raise ValueError("%s is not a directory!" % source_directory)
-    return [os.path.join(source_directory, filename)
-            for filename in os.listdir(source_directory)
-            if filename.endswith(PDF_EXTENSION)]
+    return [entry.path for entry in iter_pdf_entries(source_directory)]
+
+def copy_file(source, destination, link=False):
+    """Copy a file without spawning a process. If ``link`` is True, the destination is hardlinked
+    to the source when they are on the same file system. Otherwise, the data is copied in the kernel
+    with ``os.copy_file_range`` or ``os.sendfile`` when available, and with a buffered copy as a
+    last resort.
+
+    Args:
+        source (str): Path to the file to copy.
+        destination (str): Path to copy the file to. Must not exist if ``link`` is True.
+        link (bool): Whether or not to try to hardlink the destination to the source.
+
+    Returns:
+        str: The method that was used, one of COPY_LINK, COPY_FILE_RANGE, COPY_SENDFILE and
+        COPY_BUFFERED.
+    """
+    if link:
+        try:
+            os.link(source, destination)
+            return COPY_LINK
+        except OSError:
+            pass
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        size = os.fstat(src.fileno()).st_size
+        for method, copy_chunk in ((COPY_FILE_RANGE, getattr(os, 'copy_file_range', None)),
+                                   (COPY_SENDFILE, getattr(os, 'sendfile', None))):
+            if copy_chunk is None:
+                continue
+            offset = 0
+            try:
+                while offset < size:
+                    if method == COPY_FILE_RANGE:
+                        copied = copy_chunk(src.fileno(), dst.fileno(),
+                                            min(COPY_CHUNK_SIZE, size - offset), offset, offset)
+                    else:
+                        copied = copy_chunk(dst.fileno(), src.fileno(), offset,
+                                            min(COPY_CHUNK_SIZE, size - offset))
+                    if copied == 0:
+                        break
+                    offset += copied
+            except OSError:
+                # not supported for these files, start over with the next method
+                dst.seek(0)
+                dst.truncate()
+                continue
+            if offset >= size:
+                return method
+            dst.seek(0)
+            dst.truncate()
+        src.seek(0)
+        shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+        return COPY_BUFFERED
+
+def ghostscript_args(ghostscript_binary, filepath, output_path, first_page=None, last_page=None,
+                     settings=GHOSTSCRIPT_SETTINGS):
+    """
+    Args:
+        ghostscript_binary (str): Name/alias of the Ghostscript binary.
+        filepath (str): Path to the PDF file.
+        output_path (str): Output path.
+        first_page (int): The first page to compress, or None to start at the first page.
+        last_page (int): The last page to compress, or None to stop at the last page.
+        settings (tuple(str)): The Ghostscript settings to compress with.
+    Returns:
+        list(str): The argument vector for compressing the PDF file with Ghostscript.
+    """
+    page_range = []
+    if first_page is not None:
+        page_range.append("-dFirstPage=%d" % first_page)
+    if last_page is not None:
+        page_range.append("-dLastPage=%d" % last_page)
+    return [ghostscript_binary, *settings, *page_range,
+            "-sOutputFile=%s" % output_path, filepath]
+
+def postscript_string(string):
+    """
+    Args:
+        string (str): Any string.
+    Returns:
+        str: The string as a PostScript string literal.
+    """
+    escaped = string.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return "(%s)" % escaped
+
+def postscript_job(filepath):
+    """A job for a Ghostscript interpreter that was started with the arguments of
+    interpreter_args. The job runs the PDF file through the pdfwrite device. Its output file is
+    set when the interpreter starts, as Ghostscript does not let a program change the output file
+    of a device in SAFER mode.
+
+    Args:
+        filepath (str): Path to the PDF file.
+    Returns:
+        str: The job as a PostScript program.
+    """
+    return "{} (r) file runpdf\n".format(postscript_string(filepath))
+
+def interpreter_args(settings, directories, output_path):
+    """
+    Args:
+        settings (tuple(str)): The Ghostscript settings to compress with.
+        directories (Iterable[str]): Absolute paths of the directories that the interpreter may
+        read files in, including their subdirectories.
+        output_path (str): Path to write the output of the interpreter to.
+    Returns:
+        list(str): The arguments, without the binary, of a Ghostscript interpreter that compresses
+        the file of a postscript_job to the output path. The interpreter runs in SAFER mode, so it
+        can only read files in the given directories, and only write the output path.
+    """
+    permits = ["--permit-file-read=%s" % os.path.join(directory, "*")
+               for directory in sorted(directories)]
+    return [*(arg for arg in settings if arg != "-dBATCH"), "-dSAFER", *permits,
+            "--permit-file-write=%s" % output_path, "-sOutputFile=%s" % output_path]
+
+def covers(directories, needed):
+    """
+    Args:
+        directories (Iterable[str]): Absolute paths of directories.
+        needed (Iterable[str]): Absolute paths of directories.
+    Returns:
+        bool: True if every needed directory is one of the directories or below one of them.
+    """
+    return all(any(directory == permitted or directory.startswith(os.path.join(permitted, ""))
+                   for permitted in directories) for directory in needed)
+
+class WorkerPool:
+    """A pool of Ghostscript interpreters that compress files with postscript_job, and that are
+    started before they are needed. Ghostscript starts up and loads its fonts and resources while
+    the previous file is compressed, instead of after a file has been given to it, which is a
+    large part of the time it takes to compress a small file.
+
+    Every interpreter compresses a single file, as Ghostscript does not let a program change the
+    output file of a device in SAFER mode. An interpreter is started with a scratch file as its
+    output, which is moved to the output path when the interpreter is done. When an interpreter
+    is given a file, a spare interpreter with the same settings, memory limit and directories is
+    started for the next file. A file is only given to a spare that has its settings and memory
+    limit and can read its directory, other files start an interpreter of their own. The oldest
+    spares are stopped when there are more than ``size`` of them. A crash of an interpreter only
+    affects the file that it was compressing.
+
+    Args:
+        start_worker (function): A function that starts a worker, called with the arguments of
+        interpreter_args and a memory limit in bytes, or None. It may raise CompressionError, and
+        should not wait for the worker to start up. The worker must have a method
+        ``run(job, limits)`` that runs a job of postscript_job within the time and CPU limits of a
+        GhostscriptLimits, or None, waits for the worker to exit, and returns the exit code, CPU
+        seconds and error like run_ghostscript_attempt, and a method ``close()`` that stops the
+        worker if it is still running.
+        size (int): The maximum amount of files to compress at the same time.
+        version (str): The Ghostscript version of the workers, for the compression cache.
+    """
+
+    def __init__(self, start_worker, size, version):
+        self.start_worker = start_worker
+        self.size = size
+        self.version = version
+        self.scratch_directory = tempfile.mkdtemp(prefix="pdfebc-")
+        self._spares = []
+        self._busy = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def _start(self, key, directories):
+        fd, scratch_path = tempfile.mkstemp(suffix=PDF_EXTENSION, dir=self.scratch_directory)
+        os.close(fd)
+        try:
+            return scratch_path, self.start_worker(
+                interpreter_args(key[0], directories, scratch_path), key[1])
+        except BaseException:
+            os.remove(scratch_path)
+            raise
+
+    def _acquire(self, key, directories):
+        with self._condition:
+            while self._busy >= self.size:
+                self._condition.wait()
+            self._busy += 1
+            for i, (spare_key, spare_directories, _, _) in enumerate(self._spares):
+                if spare_key == key and covers(spare_directories, directories):
+                    return self._spares.pop(i)
+            # files are often found in a few directories, which later interpreters may all read
+            for spare_key, spare_directories, _, _ in self._spares:
+                if spare_key == key:
+                    directories = directories | spare_directories
+        try:
+            return (key, directories, *self._start(key, directories))
+        except BaseException:
+            self._release()
+            raise
+
+    def _release(self):
+        with self._condition:
+            self._busy -= 1
+            self._condition.notify()
+            remove_scratch = self._closed and self._busy == 0
+        if remove_scratch:
+            shutil.rmtree(self.scratch_directory, ignore_errors=True)
+
+    def _add_spare(self, key, directories):
+        try:
+            spare = (key, directories, *self._start(key, directories))
+        except CompressionError:
+            return
+        with self._condition:
+            self._spares.append(spare)
+            stopped = self._spares if self._closed else self._spares[:-self.size]
+            self._spares = self._spares[len(stopped):]
+        self._stop(stopped)
+
+    @staticmethod
+    def _stop(spares):
+        for _, _, scratch_path, worker in spares:
+            worker.close()
+            os.remove(scratch_path)
+
+    def compress(self, filepath, output_path, settings, limits=None):
+        """Compress a PDF file with one of the workers, and wait for it to finish.
+
+        Args:
+            filepath (str): Path to the PDF file.
+            output_path (str): Output path.
+            settings (tuple(str)): The Ghostscript settings to compress with.
+            limits (GhostscriptLimits): Resource limits of the job, or None for no limits.
+        Returns:
+            int, float, str: The exit code, the CPU seconds used by the worker, and a description
+            of why compression failed, or None if it succeeded.
+        Raises:
+            FileNotFoundError
+        """
+        filepath = os.path.abspath(filepath)
+        key = (tuple(settings), limits.memory if limits is not None else None)
+        try:
+            key, directories, scratch_path, worker = self._acquire(
+                key, frozenset([os.path.dirname(filepath)]))
+        except CompressionError as e:
+            return None, 0.0, str(e)
+        try:
+            try:
+                # the spare starts up while this file is compressed
+                self._add_spare(key, directories)
+                exit_code, cpu_time, error = worker.run(postscript_job(filepath), limits)
+            finally:
+                worker.close()
+            if error is None:
+                shutil.move(scratch_path, output_path)
+            return exit_code, cpu_time, error
+        finally:
+            if os.path.lexists(scratch_path):
+                os.remove(scratch_path)
+            self._release()
+
+    def close(self):
+        """Stop all spare workers. The scratch directory is removed when the files that are being
+        compressed are done."""
+        with self._condition:
+            self._closed = True
+            spares, self._spares = self._spares, []
+            remove_scratch = self._busy == 0
+        self._stop(spares)
+        if remove_scratch:
+            shutil.rmtree(self.scratch_directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def ghostscript_page_count(ghostscript_binary, filepath):
+    """Count the pages of a PDF file with Ghostscript.
+
+    Args:
+        ghostscript_binary (str): Name/alias of the Ghostscript binary.
+        filepath (str): Path to the PDF file.
+    Returns:
+        int: The amount of pages.
+    Raises:
+        CompressionError, FileNotFoundError
+    """
+    process = subprocess.run(
+        [ghostscript_binary, "-q", "-dNODISPLAY", "--permit-file-read=%s" % filepath, "-c",
+         "%s (r) file runpdfbegin pdfpagecount = quit" % postscript_string(filepath)],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+    try:
+        return int(process.stdout.strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        raise CompressionError("Could not count the pages of '{}'".format(filepath))
+
+def page_ranges(page_count, chunks):
+    """Split pages into contiguous ranges of as equal length as possible.
+
+    Args:
+        page_count (int): The amount of pages.
+        chunks (int): The maximum amount of ranges.
+    Returns:
+        list((int, int)): The first and last page of each range, 1-indexed and inclusive.
+    """
+    chunks = max(1, min(chunks, page_count))
+    base, extra = divmod(page_count, chunks)
+    ranges = []
+    first = 1
+    for i in range(chunks):
+        last = first + base - 1 + (1 if i < extra else 0)
+        ranges.append((first, last))
+        first = last + 1
+    return ranges
+
+def wait_for_process(process, timeout=None):
+    """Wait for a child process to exit, and measure how much CPU time it used. With a timeout,
+    the process is killed by a timer if it is still running at the timeout, so its exit is
+    noticed as soon as it happens.
+
+    Args:
+        process (subprocess.Popen): The child process.
+        timeout (float): Maximum amount of seconds to wait, or None to wait until the process exits.
+    Returns:
+        int, float: The exit code, and the user and system CPU seconds of the process.
+    Raises:
+        GhostscriptTimeoutError
+    """
+    killed = False
+    if timeout is not None:
+        lock = threading.Lock()
+        exited = False
+
+        def kill():
+            nonlocal killed
+            with lock:
+                # the process is not reaped before exited is set, so its pid cannot be reused
+                if not exited:
+                    process.kill()
+                    killed = True
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+        try:
+            os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        finally:
+            with lock:
+                exited = True
+            timer.cancel()
+    _, status, rusage = os.wait4(process.pid, 0)
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    # the process is already reaped, this only cleans up after it
+    process.communicate()
+    if killed and process.returncode == -signal.SIGKILL:
+        raise GhostscriptTimeoutError(timeout, rusage.ru_utime + rusage.ru_stime)
+    return process.returncode, rusage.ru_utime + rusage.ru_stime
+
+def limit_process(pid, cpu_time=None, memory=None):
+    """Limit the total CPU time and the address space of a running child process. Exceeding the
+    CPU time limit sends SIGXCPU, and SIGKILL one second later. The limits are capped by the hard
+    limits of this process, as they cannot be raised. They are set with ``resource.prlimit`` once
+    the child has started, as setting them in the child before it runs Ghostscript is not safe
+    when this process has threads, so they are not set on systems without ``resource.prlimit``.
+
+    Args:
+        pid (int): The process id of the child process.
+        cpu_time (float): The CPU time limit in seconds, or None.
+        memory (int): Maximum size of the address space in bytes, or None.
+    """
+    if not hasattr(resource, 'prlimit'):
+        return
+    rlimits = []
+    if cpu_time is not None:
+        seconds = max(1, math.ceil(cpu_time))
+        rlimits.append((resource.RLIMIT_CPU, seconds, seconds + 1))
+    if memory is not None:
+        rlimits.append((resource.RLIMIT_AS, memory, memory))
+    for rlimit, soft, hard in rlimits:
+        _, max_hard = resource.getrlimit(rlimit)
+        if max_hard != resource.RLIM_INFINITY:
+            soft, hard = min(soft, max_hard), min(hard, max_hard)
+        try:
+            resource.prlimit(pid, rlimit, (soft, hard))
+        except ProcessLookupError:
+            # the child has already exited
+            return
+
+def start_ghostscript(args, limits=None):
+    """
+    Args:
+        args (list(str)): The argument vector.
+        limits (GhostscriptLimits): Resource limits of the process, or None for no limits.
+    Returns:
+        subprocess.Popen: The Ghostscript process.
+    Raises:
+        FileNotFoundError
+    """
+    process = subprocess.Popen(args)
+    if limits is not None:
+        limit_process(process.pid, limits.cpu_time, limits.memory)
+    return process
+
+def run_ghostscript_attempt(args, limits=None):
+    """Run Ghostscript to completion, or until it is killed for exceeding its limits.
+
+    Args:
+        args (list(str)): The argument vector.
+        limits (GhostscriptLimits): Resource limits of the process, or None for no limits.
+    Returns:
+        int, float, str: The exit code, the user and system CPU seconds used by Ghostscript, and a
+        description of why it failed, or None if it succeeded.
+    Raises:
+        FileNotFoundError
+    """
+    process = start_ghostscript(args, limits)
+    try:
+        exit_code, cpu_time = wait_for_process(process,
+                                               limits.timeout if limits is not None else None)
+    except GhostscriptTimeoutError as e:
+        return process.returncode, e.cpu_time, str(e)
+    if exit_code == 0:
+        return exit_code, cpu_time, None
+    if limits is not None and limits.cpu_time is not None and (
+            exit_code == -signal.SIGXCPU
+            or (exit_code == -signal.SIGKILL and cpu_time >= limits.cpu_time)):
+        return exit_code, cpu_time, GS_CPU_LIMIT.format(limits.cpu_time)
+    return exit_code, cpu_time, GS_EXIT_CODE.format(exit_code)
 
-def compress_pdf(filepath, output_path, ghostscript_binary, status_callback=None):
-    """Compress a single PDF file.
+def run_ghostscript(args, limits=None):
+    """Run Ghostscript to completion.
+
+    Args:
+        args (list(str)): The argument vector.
+        limits (GhostscriptLimits): Resource limits of the process, or None for no limits.
+    Returns:
+        float: The user and system CPU seconds used by Ghostscript.
+    Raises:
+        CompressionError, FileNotFoundError
+    """
+    exit_code, cpu_time, error = run_ghostscript_attempt(args, limits)
+    if error is not None:
+        raise CompressionError("'{}' failed: {}".format(" ".join(args), error))
+    return cpu_time
+
+def compress_pdf_split(filepath, output_path, ghostscript_binary, chunks=SPLIT_CHUNKS_DEFAULT,
+                       status_callback=None, limits=None, settings=GHOSTSCRIPT_SETTINGS):
+    """Compress a single PDF file by compressing ranges of its pages in parallel, and then merging
+    the compressed ranges into one output.
 
     Args:
         filepath (str): Path to the PDF file.
         output_path (str): Output path.
         ghostscript_binary (str): Name/alias of the Ghostscript binary.
+        chunks (int): The amount of page ranges to compress in parallel.
         status_callback (function): A callback function for passing status messages to a view.
+        limits (GhostscriptLimits): Resource limits of each Ghostscript process, or None for no
+        limits.
+        settings (tuple(str)): The Ghostscript settings to compress the chunks with.
+
+    Returns:
+        float: The user and system CPU seconds used by Ghostscript to compress and merge the chunks.
 
     Raises:
-        ValueError
+        CompressionError, FileNotFoundError
+    """
+    page_count = ghostscript_page_count(ghostscript_binary, filepath)
+    ranges = page_ranges(page_count, chunks)
+    utils.if_callable_call_with_formatted_string(status_callback, COMPRESSING_SPLIT, filepath,
+                                                 len(ranges))
+    output_directory = os.path.dirname(os.path.abspath(output_path))
+    with tempfile.TemporaryDirectory(dir=output_directory, prefix='.pdfebc-chunks-') as tmpdir:
+        chunk_paths = [os.path.join(tmpdir, "chunk{}.pdf".format(i)) for i in range(len(ranges))]
+        with futures.ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            chunk_futures = [executor.submit(run_ghostscript,
+                                             ghostscript_args(ghostscript_binary, filepath,
+                                                              chunk_path, first, last, settings),
+                                             limits)
+                             for chunk_path, (first, last) in zip(chunk_paths, ranges)]
+            cpu_time = sum(future.result() for future in chunk_futures)
+        cpu_time += run_ghostscript([ghostscript_binary, *MERGE_SETTINGS,
+                                     "-sOutputFile=%s" % output_path, *chunk_paths], limits)
+    merged_page_count = ghostscript_page_count(ghostscript_binary, output_path)
+    if merged_page_count != page_count:
+        raise CompressionError("'{}' has {} pages, but the merged output has {}"
+                               .format(filepath, page_count, merged_page_count))
+    return cpu_time
+
+@functools.lru_cache(maxsize=None)
+def ghostscript_version(ghostscript_binary):
+    """Get the version of a Ghostscript binary. The result is memoized, so the binary is only
+    run once.
+
+    Args:
+        ghostscript_binary (str): Name/alias of the Ghostscript binary.
+    Returns:
+        str: The version string reported by the binary.
+    Raises:
+        FileNotFoundError
+    """
+    process = subprocess.run([ghostscript_binary, "--version"], stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL, universal_newlines=True)
+    return process.stdout.strip()
+
+def process_cpu_time(pid):
+    """
+    Args:
+        pid (int): The process id of a running child process.
+    Returns:
+        float: The user and system CPU seconds the process has used so far, or None if it
+        cannot be read, as on systems without /proc.
+    """
+    try:
+        with open("/proc/%d/stat" % pid, 'rb') as file:
+            stat = file.read()
+    except OSError:
+        return None
+    # the fields after the executable name, which is in parentheses and may contain spaces
+    fields = stat[stat.rindex(b")") + 2:].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+class InterpreterWorker:
+    """A Ghostscript interpreter process for a WorkerPool, that starts up as soon as it is
+    created, and then waits for its job on stdin. The job is wrapped so that the interpreter
+    prints a sentinel line to stdout when it is done, telling whether the job succeeded or which
+    error stopped it. The sentinel contains a random token, so that it cannot be mistaken for
+    other output of Ghostscript. When stdin is closed after the job, the interpreter exits, which
+    completes its output file.
+
+    Args:
+        ghostscript_binary (str): Name/alias of the Ghostscript binary.
+        args (list(str)): The arguments of the interpreter, without the binary, as returned by
+        interpreter_args.
+        memory (int): Maximum size of the address space of the interpreter in bytes, or None.
+    Raises:
+        FileNotFoundError
     """
-    if not filepath.endswith(PDF_EXTENSION):
+
+    def __init__(self, ghostscript_binary, args, memory=None):
+        # read when the interpreter has exited, so Ghostscript's messages cannot fill up a pipe
+        self.output = tempfile.TemporaryFile()
+        try:
+            self.process = subprocess.Popen([ghostscript_binary, *args, "-"],
+                                            stdin=subprocess.PIPE, stdout=self.output)
+        except BaseException:
+            self.output.close()
+            raise
+        limit_process(self.process.pid, memory=memory)
+        self.token = os.urandom(8).hex()
+
+    def _wrap(self, job):
+        done = "pdfebc-%s" % self.token
+        return ("{{ {} }} stopped {{ {} print $error /errorname get == "
+                "$error /newerror false put }} {{ {} = }} ifelse flush\n").format(
+                    job.strip(), postscript_string(done + " failed "),
+                    postscript_string(done + " ok"))
+
+    def _read_status(self):
+        """
+        Returns:
+            str: What the sentinel of the job tells, "ok" or "failed" followed by the error, or
+            None if the interpreter did not print the sentinel.
+        """
+        done = ("pdfebc-%s " % self.token).encode()
+        self.output.seek(0)
+        for line in self.output:
+            if line.startswith(done):
+                return line[len(done):].rstrip(b"\r\n").decode(errors='replace')
+        return None
+
+    def run(self, job, limits=None):
+        """Run the job, and wait for the interpreter to exit. The interpreter is killed if it
+        exceeds the limits.
+
+        Args:
+            job (str): A job of postscript_job.
+            limits (GhostscriptLimits): Time and CPU time limits of the job, or None.
+        Returns:
+            int, float, str: The exit code, the CPU seconds used by the job, and a description of
+            why it failed, or None if it succeeded.
+        """
+        timeout = limits.timeout if limits is not None else None
+        cpu_limit = limits.cpu_time if limits is not None else None
+        # the CPU time of starting up is not counted as part of the job
+        startup_cpu_time = process_cpu_time(self.process.pid) or 0.0
+        if cpu_limit is not None:
+            limit_process(self.process.pid, cpu_time=startup_cpu_time + cpu_limit)
+        try:
+            self.process.stdin.write(os.fsencode(self._wrap(job)))
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        try:
+            exit_code, cpu_time = wait_for_process(self.process, timeout)
+        except GhostscriptTimeoutError as e:
+            return self.process.returncode, max(0.0, e.cpu_time - startup_cpu_time), str(e)
+        cpu_time = max(0.0, cpu_time - startup_cpu_time)
+        status = self._read_status()
+        if exit_code != 0 or status is None:
+            if cpu_limit is not None and (exit_code == -signal.SIGXCPU or (
+                    exit_code == -signal.SIGKILL and cpu_time >= cpu_limit)):
+                return exit_code, cpu_time, GS_CPU_LIMIT.format(cpu_limit)
+            return exit_code, cpu_time, GS_EXIT_CODE.format(exit_code)
+        if status == "ok":
+            return 0, cpu_time, None
+        return 1, cpu_time, GS_JOB_FAILED.format(status.split(" ", 1)[-1])
+
+    def close(self):
+        """Stop the interpreter if it is still running, such as a spare that was never given a
+        job."""
+        if self.process.returncode is None:
+            self.process.kill()
+            self.process.wait()
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.output.close()
+
+def interpreter_pool(ghostscript_binary, size):
+    """Create a pool of Ghostscript interpreters that are fed jobs over stdin.
+
+    Args:
+        ghostscript_binary (str): Name/alias of the Ghostscript binary.
+        size (int): The maximum amount of files to compress at the same time.
+    Returns:
+        WorkerPool: The pool, whose interpreters are started when files are compressed.
+    Raises:
+        FileNotFoundError
+    """
+    return WorkerPool(lambda args, memory: InterpreterWorker(ghostscript_binary, args, memory),
+                      size, ghostscript_version(ghostscript_binary))
+
+def keep_original_if_not_smaller(filepath, output_path, file_size, min_savings, link_small=False):
+    """Replace an output with a copy of its source if it is not sufficiently smaller than it.
+
+    Args:
+        filepath (str): Path to the PDF file.
+        output_path (str): Path to the compressed output.
+        file_size (int): Size of the PDF file in bytes.
+        min_savings (float): The fraction of the size that must be saved, e.g. 0.05 for 5%.
+        link_small (bool): Whether or not to hardlink the source to the output path, instead of
+        copying it.
+    Returns:
+        (int, bool): The size of the compressed output, or None if there is none, and whether or
+        not the output was kept.
+    """
+    compressed_size = output_size(output_path)
+    if compressed_size is None or compressed_size <= file_size * (1 - min_savings):
+        return compressed_size, True
+    os.remove(output_path)
+    copy_file(filepath, output_path, link_small)
+    return compressed_size, False
+
+def compress_pdf(filepath, output_path, ghostscript_binary, status_callback=None, cache=None,
+                 file_size=None, link_small=False, split_threshold=None,
+                 split_chunks=SPLIT_CHUNKS_DEFAULT, min_savings=MIN_SAVINGS_DEFAULT, history=None,
+                 limits=None, fallback_settings=(), copy_on_failure=False,
+                 settings=GHOSTSCRIPT_SETTINGS, backend=None):
+    """Compress a single PDF file. If the output is not at least ``min_savings`` smaller than the
+    PDF file, the PDF file is copied to the output path instead.
+
+    If Ghostscript fails, or is killed for exceeding its limits, it is run again with each of the
+    fallback settings in turn until one succeeds. If all of them fail, the PDF file is copied to
+    the output path if ``copy_on_failure`` is set, and otherwise the result is a failure. So at
+    worst, a file takes as long as the timeout times the amount of attempts.
+
+    Args:
+        filepath (str): Path to the PDF file.
+        output_path (str): Output path.
+        ghostscript_binary (str): Name/alias of the Ghostscript binary.
+        status_callback (function): A callback function for passing status messages to a view.
+        cache (pdfebc.cache.CompressionCache): A compression cache to look up and store
+        compressed files in. If None, Ghostscript is always run.
+        file_size (int): The size of the PDF file in bytes, if already known.
+        link_small (bool): Whether or not to hardlink files that are not compressed to the
+        output path, instead of copying them.
+        split_threshold (int): Files of at least this many bytes are compressed in chunks of pages
+        in parallel, see compress_pdf_split. If None, files are never split.
+        split_chunks (int): The amount of chunks to split large files into.
+        min_savings (float): The fraction of the size that compression must save for the output to
+        be kept, e.g. 0.05 for 5%.
+        history (pdfebc.history.CompressionHistory): A compression history. Files that have not
+        gotten at least ``min_savings`` smaller from compression with the same Ghostscript
+        version before are copied without running Ghostscript, and the outcome of every
+        compression is recorded. If None, Ghostscript is always run.
+        limits (GhostscriptLimits): Resource limits of each Ghostscript process, or None for no
+        limits.
+        fallback_settings (Iterable[tuple(str)]): Ghostscript settings to retry with, in order,
+        e.g. (FALLBACK_SETTINGS,).
+        copy_on_failure (bool): Whether or not to copy the PDF file to the output path if every
+        attempt to compress it fails.
+        settings (tuple(str)): The Ghostscript settings to compress with, such as the settings of
+        a pdfebc.profiles.Profile. Cache entries and history are kept apart per settings.
+        backend (WorkerPool): Ghostscript interpreters that are started ahead of time to compress
+        with, instead of starting a Ghostscript process. Files that are split still use
+        Ghostscript processes. If None, a Ghostscript process is started for every attempt.
+
+    Returns:
+        CompressionResult: The outcome of the compression. If every attempt fails and the file is
+        not copied, the action is ACTION_FAILED.
+
+    Raises:
+        ValueError, CompressionError, FileNotFoundError: FileNotFoundError if the PDF file or the
+        Ghostscript binary does not exist.
+    """
+    if not is_pdf_filename(filepath):
         raise ValueError("Filename must end with .pdf!\n%s does not." % filepath)
+    start = time.monotonic()
+    cache_key = None
+    fingerprint = None
+    version = None
+    cpu_time = None
+    exit_code = None
+    error = None
+    failed_attempts = []
+    if file_size is None:
+        file_size = os.stat(filepath).st_size
+    # the output may be hardlinked to a cache entry, which must not be overwritten
+    if os.path.lexists(output_path):
+        os.remove(output_path)
+    if (history is not None or cache is not None) and file_size >= FILE_SIZE_LOWER_LIMIT:
+        version = (backend.version if backend is not None
+                   else ghostscript_version(ghostscript_binary))
+    if history is not None and file_size >= FILE_SIZE_LOWER_LIMIT:
+        fingerprint = history.fingerprint(filepath, file_size, settings)
+    if file_size < FILE_SIZE_LOWER_LIMIT:
+        utils.if_callable_call_with_formatted_string(status_callback, NOT_COMPRESSING,
+                                                     filepath, file_size, FILE_SIZE_LOWER_LIMIT)
+        copy_file(filepath, output_path, link_small)
+        action = ACTION_COPIED
+    elif fingerprint is not None and history.never_shrinks(fingerprint, min_savings, version):
+        history.skip(fingerprint)
+        utils.if_callable_call_with_formatted_string(status_callback, NEVER_SHRINKS, filepath)
+        copy_file(filepath, output_path, link_small)
+        action = ACTION_COPIED
+    else:
+        if cache is not None:
+            cache_key = cache.key(filepath, settings, version)
+        if cache_key is not None and cache.fetch(cache_key, output_path):
+            utils.if_callable_call_with_formatted_string(status_callback, CACHE_HIT, filepath)
+            action = ACTION_CACHED
+        elif split_threshold is not None and file_size >= split_threshold:
+            try:
+                cpu_time = compress_pdf_split(filepath, output_path, ghostscript_binary,
+                                              split_chunks, status_callback, limits,
+                                              settings)
+                exit_code = 0
+            except CompressionError as e:
+                error = str(e)
+            action = ACTION_COMPRESSED
+        else:
+            utils.if_callable_call_with_formatted_string(status_callback, COMPRESSING,
+                                                         filepath)
+            cpu_time = 0.0
+            for attempt_settings in (settings, *fallback_settings):
+                if error is not None:
+                    utils.if_callable_call_with_formatted_string(status_callback, RETRYING,
+                                                                 filepath, error)
+                    failed_attempts.append(error)
+                    if os.path.lexists(output_path):
+                        os.remove(output_path)
+                if backend is not None:
+                    exit_code, attempt_cpu_time, error = backend.compress(
+                        filepath, output_path, attempt_settings, limits)
+                else:
+                    exit_code, attempt_cpu_time, error = run_ghostscript_attempt(
+                        ghostscript_args(ghostscript_binary, filepath, output_path,
+                                         settings=attempt_settings), limits)
+                cpu_time += attempt_cpu_time
+                if error is None:
+                    break
+            action = ACTION_FALLBACK if failed_attempts else ACTION_COMPRESSED
+    if error is not None:
+        if os.path.lexists(output_path):
+            os.remove(output_path)
+        if not copy_on_failure:
+            utils.if_callable_call_with_formatted_string(status_callback, FILE_FAILED, filepath,
+                                                         error)
+            return CompressionResult(filepath, output_path, ACTION_FAILED, file_size, None,
+                                     time.monotonic() - start, cpu_time, exit_code, error,
+                                     failed_attempts)
+        failed_attempts.append(error)
+        error = None
+        copy_file(filepath, output_path, link_small)
+        utils.if_callable_call_with_formatted_string(status_callback, COPIED_AFTER_FAILURE,
+                                                     filepath)
+        action = ACTION_COPIED_AFTER_FAILURE
+    if action in (ACTION_COMPRESSED, ACTION_FALLBACK, ACTION_CACHED):
+        ran_ghostscript = action == ACTION_COMPRESSED
+        if cache_key is not None and ran_ghostscript:
+            cache.store(cache_key, output_path)
+        compressed_size, kept = keep_original_if_not_smaller(filepath, output_path, file_size,
+                                                             min_savings, link_small)
+        if not kept:
+            utils.if_callable_call_with_formatted_string(status_callback, NOT_SMALLER, filepath,
+                                                         min_savings, file_size, compressed_size)
+            action = ACTION_KEPT_ORIGINAL
+        if ran_ghostscript and fingerprint is not None and compressed_size is not None \
+                and file_size > 0:
+            history.record(fingerprint, compressed_size / file_size, cpu_time,
+                           time.monotonic() - start, version)
+    utils.if_callable_call_with_formatted_string(status_callback, FILE_DONE, output_path)
+    return CompressionResult(filepath, output_path, action, file_size, output_size(output_path),
+                             time.monotonic() - start, cpu_time, exit_code, error, failed_attempts)
+
+def settings_digest(settings):
+    """
+    Args:
+        settings (Iterable[str]): Ghostscript settings.
+    Returns:
+        str: A short digest of the settings, for telling apart outputs compressed with different
+        settings.
+    """
+    return hashlib.sha256(json.dumps(list(settings)).encode('utf-8')).hexdigest()[:16]
+
+def read_manifest(output_directory):
+    """Read the manifest of a previous run from the output directory.
+
+    Args:
+        output_directory (str): Filepath to the output directory.
+    Returns:
+        dict: A dict mapping absolute source paths to
+        [mtime_ns, size, inode, settings digest, output filename] records. Empty if there is no
+        readable manifest.
+    """
+    try:
+        with open(os.path.join(output_directory, MANIFEST_FILENAME), encoding='utf-8') as file:
+            manifest = json.load(file)
+    except (IOError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+def write_manifest(output_directory, manifest):
+    """Write a manifest to the output directory, replacing any previous manifest.
+
+    Args:
+        output_directory (str): Filepath to the output directory.
+        manifest (dict): A dict mapping absolute source paths to
+        [mtime_ns, size, inode, settings digest, output filename] records.
+    """
+    manifest_path = os.path.join(output_directory, MANIFEST_FILENAME)
+    # a unique temporary file, as other runs may write a manifest to the same directory
+    fd, tmp_path = tempfile.mkstemp(dir=output_directory, prefix=MANIFEST_FILENAME,
+                                    suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            json.dump(manifest, file, separators=(',', ':'))
+        os.replace(tmp_path, manifest_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def remove_orphaned_outputs(previous_manifest, output_directory, status_callback=None):
+    """Remove the outputs of all sources in a manifest that no longer exist.
+
+    Args:
+        previous_manifest (dict): The manifest of a previous run.
+        output_directory (str): Filepath to the output directory.
+        status_callback (function): A callback function for passing status messages to a view.
+    """
+    for source_path, record in previous_manifest.items():
+        if os.path.exists(source_path):
+            continue
+        output = os.path.join(output_directory, record[-1])
+        if os.path.isfile(output):
+            os.remove(output)
+            utils.if_callable_call_with_formatted_string(status_callback, OUTPUT_REMOVED, output)
+
+def compress_multiple_pdfs(source_directory, output_directory, ghostscript_binary,
+                           status_callback=None, jobs=1, cache=None, incremental=False,
+                           recursive=False, include=(), exclude=(),
+                           schedule=scheduling.SCHEDULE_FIFO, cost_model=None, link_small=False,
+                           split_threshold=None, split_chunks=SPLIT_CHUNKS_DEFAULT,
+                           min_savings=MIN_SAVINGS_DEFAULT, history=None, result_callback=None,
+                           limits=None, fallback_settings=(), copy_on_failure=False,
+                           settings=GHOSTSCRIPT_SETTINGS, settings_rules=(), sources=None,
+                           keep_results=True, backend=None):
+    """Compress all PDF files in the current directory and place the output in the given output
+    directory.
+
+    With the FIFO schedule, files are compressed as they are found. Other schedules first find all
+    files, and then order them so that the most expensive ones start first. Up to ``jobs`` files
+    are compressed at the same time. A file that fails to compress is reported through the status
+    callback and in its result, the rest of the batch carries on. A manifest of the mtime, size,
+    inode and settings of every source is written to the output directory. In incremental mode,
+    sources that match the manifest of the previous run and still have their output are not
+    compressed again, and outputs of sources that are gone are removed.
+
+    Instead of the files in the source directory, an explicit list of files can be compressed by
+    passing them as ``sources``. They are consumed lazily, like the files found in the source
+    directory, so together with ``keep_results=False`` and the FIFO schedule, memory use does not
+    grow with the amount of files, except for their records in the manifest.
+
+    Args:
+        source_directory (str): Filepath to the source directory.
+        output_directory (str): Filepath to the output directory.
+        ghostscript_binary (str): Name of the Ghostscript binary.
+        status_callback (function): A callback function for passing status messages to a view.
+        jobs (int): The maximum amount of files to compress in parallel.
+        cache (pdfebc.cache.CompressionCache): A compression cache, or None to not use one.
+        incremental (bool): Whether or not to skip sources that are unchanged since the last run,
+        and that would be compressed with the same settings as in that run.
+        recursive (bool): Whether or not to also compress PDF files in subdirectories. The
+        directory structure is mirrored in the output directory.
+        include (Iterable[str]): Glob patterns of which at least one must match a file's path
+        relative to the source directory for it to be compressed.
+        exclude (Iterable[str]): Glob patterns matching relative paths of files to leave out.
+        schedule (str): The scheduling policy, one of pdfebc.scheduling.SCHEDULES.
+        cost_model (pdfebc.scheduling.CostModel): A cost model that is used by the learned
+        schedule, and that is updated with the compression time of every compressed file.
+        link_small (bool): Whether or not to hardlink files that are too small to compress to their
+        outputs, instead of copying them.
+        split_threshold (int): Files of at least this many bytes are compressed in chunks of pages
+        in parallel. If None, files are never split.
+        split_chunks (int): The amount of chunks to split large files into. Note that each of the
+        ``jobs`` workers may run this many Ghostscript processes.
+        min_savings (float): The fraction of the size that compression must save for an output to
+        be kept, otherwise the source is copied to the output directory.
+        history (pdfebc.history.CompressionHistory): A compression history that is used to skip
+        files that do not get smaller from compression, and that is updated with the outcome of
+        every compressed file. If None, no history is used.
+        result_callback (function): A callback function that is called with the result of every
+        file as soon as it has finished, for processing outputs while the batch goes on. Files may
+        finish in another order than they were found in.
+        limits (GhostscriptLimits): Resource limits of each Ghostscript process, or None for no
+        limits.
+        fallback_settings (Iterable[tuple(str)]): Ghostscript settings to retry failed files with.
+        copy_on_failure (bool): Whether or not to copy files that fail to compress to the output
+        directory.
+        settings (tuple(str)): The Ghostscript settings to compress files with.
+        settings_rules (Iterable[(str, tuple(str))]): Glob patterns matching relative paths of
+        files, and the Ghostscript settings to compress those files with instead. The first
+        matching pattern wins, see pdfebc.profiles.settings_rules.
+        sources (Iterable[SourceFile]): Files to compress instead of the files in the source
+        directory, such as the files of iter_file_list. Their paths relative to the source
+        directory decide their output paths, unless they have output paths of their own. If None,
+        the source directory is searched.
+        keep_results (bool): Whether or not to return the results. If False, results are only
+        passed to the result callback, and are not kept in memory.
+        backend (WorkerPool): Ghostscript interpreters that are started ahead of time, or None
+        to start a Ghostscript process for every file. Its size should be at least ``jobs``.
+
+    Returns:
+        list(CompressionResult): The result of every file, in the same order as the source files
+        were found. Empty if ``keep_results`` is False.
+
+    Raises:
+        ValueError
+    """
+    if jobs < 1:
+        raise ValueError("jobs must be a positive integer, was %s" % jobs)
+    entries = sources
+    if entries is None:
+        entries = iter_pdf_entries(source_directory, recursive, include, exclude,
+                                   skip_directories=[output_directory])
+    elif include or exclude:
+        entries = (entry for entry in sources if is_included(
+            source_output_path(entry, source_directory, output_directory)[0], include, exclude))
+    indexed_entries = scheduling.order_entries(enumerate(entries), schedule, cost_model)
+    indexed_results = list()
+    previous_manifest = read_manifest(output_directory) if incremental else {}
+    manifest = dict()
+    found = 0
+    utils.if_callable_call_with_formatted_string(status_callback, COMPRESSING_MULTIPLE,
+                                                 source_directory, output_directory, jobs)
+
+    def collect(index, source_path, output, manifest_key, record, future):
+        if future is None:
+            result = CompressionResult(source_path, output, ACTION_SKIPPED, record[1],
+                                       output_size(output), 0.0, None, None, None)
+        else:
+            try:
+                result = future.result()
+            except Exception as e:
+                utils.if_callable_call_with_formatted_string(status_callback, FILE_FAILED,
+                                                             source_path, repr(e))
+                result = CompressionResult(source_path, output, ACTION_FAILED, record[1], None,
+                                           None, None, None, repr(e))
+            if cost_model is not None and result.error is None:
+                cost_model.record(source_path, record[1], result.wall_time)
+        if result.error is None:
+            manifest[manifest_key] = record
+        report(index, result)
+
+    def report(index, result):
+        if keep_results:
+            indexed_results.append((index, result))
+        if callable(result_callback):
+            result_callback(result)
+
+    with futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        running = dict()
+        for index, entry in indexed_entries:
+            found += 1
+            relative_path, output = source_output_path(entry, source_directory, output_directory)
+            explicit_output = getattr(entry, 'output_path', None) is not None
+            try:
+                file_stat = entry.stat()
+                if os.path.dirname(relative_path) or explicit_output:
+                    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+            except OSError as e:
+                utils.if_callable_call_with_formatted_string(status_callback, FILE_FAILED,
+                                                             entry.path, repr(e))
+                report(index, CompressionResult(entry.path, output, ACTION_FAILED, None, None,
+                                                None, None, None, repr(e)))
+                continue
+            manifest_key = os.path.abspath(entry.path)
+            file_settings = profiles.select_settings(relative_path, settings, settings_rules)
+            # outputs outside of the output directory are recorded with their absolute path
+            record = [file_stat.st_mtime_ns, file_stat.st_size, file_stat.st_ino,
+                      settings_digest(file_settings),
+                      os.path.abspath(output) if explicit_output else relative_path]
+            if previous_manifest.get(manifest_key) == record and os.path.isfile(output):
+                utils.if_callable_call_with_formatted_string(status_callback, FILE_UNCHANGED,
+                                                             entry.path)
+                collect(index, entry.path, output, manifest_key, record, None)
+                continue
+            future = executor.submit(compress_pdf, entry.path, output, ghostscript_binary,
+                                     status_callback, cache, file_stat.st_size, link_small,
+                                     split_threshold, split_chunks, min_savings, history,
+                                     limits, fallback_settings, copy_on_failure, file_settings,
+                                     backend)
+            running[future] = (index, entry.path, output, manifest_key, record)
+            # discovery is kept from running too far ahead of the files that have finished, but a
+            # slow file does not hold back the files behind it
+            if len(running) >= jobs * PENDING_FILES_PER_JOB:
+                done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    collect(*running.pop(future), future)
+        for future in futures.as_completed(running):
+            collect(*running[future], future)
+    if incremental:
+        remove_orphaned_outputs(previous_manifest, output_directory, status_callback)
+    write_manifest(output_directory, manifest)
+    utils.if_callable_call_with_formatted_string(status_callback, ALL_FILES_DONE, found,
+                                                 output_directory)
+    return [result for _, result in sorted(indexed_results, key=lambda pair: pair[0])]
+
+async def wait_for_process_async(process, sample_cpu_time=False):
+    """Wait for a child process of asyncio to exit. Its CPU time cannot be read once it has been
+    reaped, so it is read every CPU_SAMPLE_INTERVAL seconds while it runs.
+
+    Args:
+        process (asyncio.subprocess.Process): The process.
+        sample_cpu_time (bool): Whether to read the CPU time of the process.
+    Returns:
+        int, float: The exit code, and the user and system CPU seconds the process had used
+        when its CPU time was last read, or None if it was not read.
+    """
+    import asyncio
+    if not sample_cpu_time:
+        return await process.wait(), None
+    cpu_time = None
+    waiter = asyncio.ensure_future(process.wait())
     try:
+        while not waiter.done():
+            cpu_time = process_cpu_time(process.pid) or cpu_time
+            await asyncio.wait([waiter], timeout=CPU_SAMPLE_INTERVAL)
+        return waiter.result(), cpu_time
+    finally:
+        waiter.cancel()
+
+async def compress_pdf_async(filepath, output_path, ghostscript_binary, status_callback=None,
+                             timeout=None, semaphore=None, link_small=False,
+                             min_savings=MIN_SAVINGS_DEFAULT, cache=None, history=None,
+                             limits=None, settings=GHOSTSCRIPT_SETTINGS):
+    """Compress a single PDF file without blocking the event loop. If the coroutine times out
+    or is cancelled, the child process is killed and the partial output is removed.
+
+    The cache, history, minimum savings, limits and settings work as for compress_pdf. Splitting
+    large files, fallback settings, copying on failure and backends are only supported by
+    compress_pdf.
+
+    Args:
+        filepath (str): Path to the PDF file.
+        output_path (str): Output path.
+        ghostscript_binary (str): Name/alias of the Ghostscript binary.
+        status_callback (function): A callback function for passing status messages to a view.
+        timeout (float): Maximum amount of seconds to let the child process run, or None for the
+        timeout of the limits.
+        semaphore (asyncio.Semaphore): A semaphore that must be held while the child process runs,
+        for limiting the amount of concurrent processes. If None, no limit is imposed.
+        link_small (bool): Whether or not to hardlink files that are too small to compress to the
+        output path, instead of copying them.
+        min_savings (float): The fraction of the size that compression must save for the output to
+        be kept, e.g. 0.05 for 5%.
+        cache (pdfebc.cache.CompressionCache): A compression cache, or None.
+        history (pdfebc.history.CompressionHistory): A compression history, or None.
+        limits (GhostscriptLimits): Resource limits of the child process, or None for no limits.
+        settings (tuple(str)): The Ghostscript settings to compress with.
+
+    Returns:
+        CompressionResult: The outcome of the compression. The CPU time of the child process is
+        not measured. If Ghostscript exits with a non-zero exit code, the action is ACTION_FAILED.
+
+    Raises:
+        ValueError, FileNotFoundError, asyncio.TimeoutError
+    """
+    # asyncio is imported here, as it takes longer to import than the rest of pdfebc together
+    import asyncio
+    if not is_pdf_filename(filepath):
+        raise ValueError("Filename must end with .pdf!\n%s does not." % filepath)
+    start = time.monotonic()
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(1)
+    if timeout is None and limits is not None:
+        timeout = limits.timeout
+    # file operations that may block, such as hashing and copying, run in the default executor
+    run_blocking = functools.partial(asyncio.get_event_loop().run_in_executor, None)
+    cache_key = None
+    fingerprint = None
+    version = None
+    returncode = None
+    async with semaphore:
         file_size = os.stat(filepath).st_size
+        if os.path.lexists(output_path):
+            os.remove(output_path)
         if file_size < FILE_SIZE_LOWER_LIMIT:
             utils.if_callable_call_with_formatted_string(status_callback, NOT_COMPRESSING,
                                                          filepath, file_size, FILE_SIZE_LOWER_LIMIT)
-            process = subprocess.Popen(['cp', filepath, output_path])
+            await run_blocking(copy_file, filepath, output_path, link_small)
+            utils.if_callable_call_with_formatted_string(status_callback, FILE_DONE, output_path)
+            return CompressionResult(filepath, output_path, ACTION_COPIED, file_size,
+                                     output_size(output_path), time.monotonic() - start, None,
+                                     None, None)
+        if cache is not None or history is not None:
+            version = await run_blocking(ghostscript_version, ghostscript_binary)
+        if history is not None:
+            fingerprint = await run_blocking(history.fingerprint, filepath, file_size, settings)
+            if history.never_shrinks(fingerprint, min_savings, version):
+                history.skip(fingerprint)
+                utils.if_callable_call_with_formatted_string(status_callback, NEVER_SHRINKS,
+                                                             filepath)
+                await run_blocking(copy_file, filepath, output_path, link_small)
+                utils.if_callable_call_with_formatted_string(status_callback, FILE_DONE,
+                                                             output_path)
+                return CompressionResult(filepath, output_path, ACTION_COPIED, file_size,
+                                         output_size(output_path), time.monotonic() - start,
+                                         None, None, None)
+        if cache is not None:
+            cache_key = await run_blocking(cache.key, filepath, settings, version)
+        if cache_key is not None and await run_blocking(cache.fetch, cache_key, output_path):
+            utils.if_callable_call_with_formatted_string(status_callback, CACHE_HIT, filepath)
+            action = ACTION_CACHED
         else:
             utils.if_callable_call_with_formatted_string(status_callback, COMPRESSING, filepath)
-            process = subprocess.Popen(
-                [ghostscript_binary, "-sDEVICE=pdfwrite",
-                 "-dCompatabilityLevel=1.4", "-dPDFSETTINGS=/ebook",
-                 "-dNOPAUSE", "-dQUIET", "-dBATCH",
-                 "-sOutputFile=%s" % output_path, filepath]
-                )
-    except FileNotFoundError:
-        utils.if_callable_call_with_formatted_string(status_callback, GS_NOT_INSTALLED,
-                                                     ghostscript_binary)
-        sys.exit(1)
-    process.communicate()
+            args = ghostscript_args(ghostscript_binary, filepath, output_path, settings=settings)
+            process = await asyncio.create_subprocess_exec(*args)
+            if limits is not None:
+                limit_process(process.pid, limits.cpu_time, limits.memory)
+            try:
+                returncode, cpu_time = await asyncio.wait_for(
+                    wait_for_process_async(process, limits is not None
+                                           and limits.cpu_time is not None), timeout)
+            except BaseException as e:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                if os.path.lexists(output_path):
+                    os.remove(output_path)
+                if isinstance(e, asyncio.TimeoutError):
+                    utils.if_callable_call_with_formatted_string(status_callback, FILE_TIMED_OUT,
+                                                                 filepath, timeout)
+                raise
+            action = ACTION_COMPRESSED
+    if returncode:
+        error = GS_EXIT_CODE.format(returncode)
+        if limits is not None and limits.cpu_time is not None and (
+                returncode == -signal.SIGXCPU or (returncode == -signal.SIGKILL
+                                                  and cpu_time is not None
+                                                  and cpu_time >= limits.cpu_time)):
+            error = GS_CPU_LIMIT.format(limits.cpu_time)
+        if os.path.lexists(output_path):
+            os.remove(output_path)
+        utils.if_callable_call_with_formatted_string(status_callback, FILE_FAILED, filepath, error)
+        return CompressionResult(filepath, output_path, ACTION_FAILED, file_size, None,
+                                 time.monotonic() - start, None, returncode, error)
+    ran_ghostscript = action == ACTION_COMPRESSED
+    if cache_key is not None and ran_ghostscript:
+        await run_blocking(cache.store, cache_key, output_path)
+    compressed_size, kept = await run_blocking(keep_original_if_not_smaller, filepath,
+                                               output_path, file_size, min_savings, link_small)
+    if not kept:
+        utils.if_callable_call_with_formatted_string(status_callback, NOT_SMALLER, filepath,
+                                                     min_savings, file_size, compressed_size)
+        action = ACTION_KEPT_ORIGINAL
+    if ran_ghostscript and fingerprint is not None and compressed_size is not None:
+        history.record(fingerprint, compressed_size / file_size, None, time.monotonic() - start,
+                       version)
     utils.if_callable_call_with_formatted_string(status_callback, FILE_DONE, output_path)
+    return CompressionResult(filepath, output_path, action, file_size, output_size(output_path),
+                             time.monotonic() - start, None, returncode, None)
 
-def compress_multiple_pdfs(source_directory, output_directory, ghostscript_binary, status_callback=None):
-    """Compress all PDF files in the current directory and place the output in the given output directory.
+async def compress_many_async(paths, ghostscript_binary, status_callback=None, concurrency=1,
+                              timeout=None, link_small=False, min_savings=MIN_SAVINGS_DEFAULT,
+                              cache=None, history=None, limits=None,
+                              settings=GHOSTSCRIPT_SETTINGS):
+    """Compress many PDF files concurrently, yielding each result as soon as its file is done.
+    Results therefore come in completion order, not in the order of the input. A file that fails
+    does not stop the others. If the consumer stops iterating, or is cancelled, all running child
+    processes are killed.
 
     Args:
-        source_directory (str): Filepath to the source directory.
-        output_directory (str): Filepath to the output directory.
-        ghostscript_binary (str): Name of the Ghostscript binary.
+        paths (Iterable[(str, str)]): Pairs of PDF file paths and output paths.
+        ghostscript_binary (str): Name/alias of the Ghostscript binary.
         status_callback (function): A callback function for passing status messages to a view.
+        concurrency (int): The maximum amount of child processes to run at the same time.
+        timeout (float): Maximum amount of seconds to spend on each file, or None for no limit.
+        link_small (bool): Whether or not to hardlink files that are too small to compress.
+        min_savings (float): The fraction of the size that compression must save for the output to
+        be kept, e.g. 0.05 for 5%.
+        cache (pdfebc.cache.CompressionCache): A compression cache, or None.
+        history (pdfebc.history.CompressionHistory): A compression history, or None.
+        limits (GhostscriptLimits): Resource limits of each child process, or None for no limits.
+        settings (tuple(str)): The Ghostscript settings to compress with.
 
     Returns:
-        list(str): paths to outputs.
+        async_generator(CompressionResult): The result of each file. Files that raised an error,
+        such as a timeout, get a result with the action ACTION_FAILED.
+
+    Raises:
+        ValueError
     """
-    source_paths = get_pdf_filenames_at(source_directory)
-    out_paths = list()
-    utils.if_callable_call_with_formatted_string(status_callback, COMPRESSING_MULTIPLE,
-                                                 source_directory, output_directory, len(source_paths))
-    for source_path in source_paths:
-        output = os.path.join(output_directory, os.path.basename(source_path))
-        out_paths.append(output)
-        compress_pdf(source_path, output, ghostscript_binary, status_callback)
-    utils.if_callable_call_with_formatted_string(status_callback, ALL_FILES_DONE, output_directory)
-    return out_paths
+    import asyncio
+    if concurrency < 1:
+        raise ValueError("concurrency must be a positive integer, was %s" % concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    paths = iter(paths)
+    running = {}
+
+    def start_next():
+        for filepath, output_path in paths:
+            task = asyncio.ensure_future(compress_pdf_async(
+                filepath, output_path, ghostscript_binary, status_callback, timeout, semaphore,
+                link_small, min_savings, cache, history, limits, settings))
+            running[task] = (filepath, output_path)
+            return True
+        return False
+
+    try:
+        # keep a few more tasks than processes around, so the semaphore is never starved
+        while len(running) < concurrency * PENDING_FILES_PER_JOB and start_next():
+            pass
+        while running:
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                filepath, output_path = running.pop(task)
+                start_next()
+                error = task.exception()
+                if error is None:
+                    yield task.result()
+                else:
+                    yield CompressionResult(filepath, output_path, ACTION_FAILED,
+                                            output_size(filepath), None, None, None, None,
+                                            repr(error))
+    finally:
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.wait(list(running))
@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+"""This module contains the size and time projections of the pdfebc program, for planning a batch
+before running it. No document is compressed in full. Instead, every file is projected in one of
+these ways:
+
+- Files below the size limit for compression are copied, and cost nothing.
+- Files in the compression history have the ratio, CPU time and wall-clock time of their last
+  compression. Files that did not get smaller then are copied.
+- Other files have a few pages, spread evenly over the document, compressed one at a time. The
+  CPU time, wall-clock time and output size of a page are averaged over the samples and
+  multiplied by the amount of pages. The fixed cost of starting Ghostscript, which is measured
+  once per batch, is subtracted from every sample and added back once per file.
+
+Sampled files get a standard error from the variation between their sampled pages, so the
+projection of a batch comes with a confidence range. The range assumes that files vary
+independently of each other, and that the sampled pages are representative of the rest. Single
+page outputs repeat resources that pages share, such as fonts, so projected output sizes of
+text documents tend to be on the high side.
+
+.. module:: estimate
+    :platform: Unix
+    :synopsis: Projections of batch cost and savings for pdfebc.
+
+.. moduleauthor:: Simon Larsén <slarse@kth.se>
+"""
+import os
+import math
+import time
+import heapq
+import tempfile
+import collections
+from concurrent import futures
+from . import core, profiles, scheduling, utils
+
+SAMPLE_PAGES_DEFAULT = 3
+# the confidence ranges are this many standard errors wide on each side, about 95%
+CONFIDENCE_Z = 1.96
+
+METHOD_COPY = "copy"
+METHOD_HISTORY = "history"
+METHOD_SAMPLE = "sample"
+METHOD_UNKNOWN = "unknown"
+
+ESTIMATING = "Estimating '{}' from {} of {} page(s) ..."
+ESTIMATE_FAILED = "Could not estimate '{}': {}"
+ESTIMATE_SUMMARY = """Projection for {} file(s), {} bytes, with {} parallel job(s):
+Output size:     {} bytes ({} to {}), saving {} bytes
+CPU time:        {:.1f} s ({:.1f} to {:.1f})
+Wall-clock time: {:.1f} s ({:.1f} to {:.1f})
+Estimated from:  {} sampled, {} from history, {} copied, {} unknown"""
+
+class Range(collections.namedtuple('Range', ['value', 'low', 'high'])):
+    """A projected quantity and its confidence range.
+
+    Attributes:
+        value (float): The projection.
+        low (float): The lower end of the confidence range.
+        high (float): The upper end of the confidence range.
+    """
+    __slots__ = ()
+
+class Sample(collections.namedtuple('Sample', ['output_bytes', 'cpu_time', 'wall_time'])):
+    """The cost of compressing a single page, or of starting Ghostscript.
+
+    Attributes:
+        output_bytes (int): Size of the output.
+        cpu_time (float): User and system CPU seconds used by Ghostscript.
+        wall_time (float): Wall-clock seconds the compression took.
+    """
+    __slots__ = ()
+
+class FileEstimate(collections.namedtuple('FileEstimate', [
+        'source_path', 'method', 'input_bytes', 'pages', 'output_bytes', 'output_error',
+        'cpu_time', 'cpu_error', 'wall_time', 'wall_error', 'error'])):
+    """The projected cost and outcome of compressing a single file.
+
+    Attributes:
+        source_path (str): Path to the PDF file.
+        method (str): How the file was projected, one of METHOD_COPY, METHOD_HISTORY,
+        METHOD_SAMPLE and METHOD_UNKNOWN.
+        input_bytes (int): Size of the PDF file, or None if it could not be read.
+        pages (int): The amount of pages, or None if they were not counted.
+        output_bytes (float): Projected size of the output. If the output is not projected to be
+        small enough to keep, this is the size of the PDF file.
+        output_error (float): Standard error of the output size.
+        cpu_time (float): Projected CPU seconds Ghostscript uses on the file.
+        cpu_error (float): Standard error of the CPU time.
+        wall_time (float): Projected wall-clock seconds spent on the file.
+        wall_error (float): Standard error of the wall-clock time.
+        error (str): Why the file could not be projected, or None.
+    """
+    __slots__ = ()
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: The fields of the estimate.
+        """
+        return dict(self._asdict())
+
+class BatchEstimate(collections.namedtuple('BatchEstimate', [
+        'files', 'jobs', 'input_bytes', 'output_bytes', 'cpu_time', 'wall_time'])):
+    """The projected cost and outcome of compressing a batch of files.
+
+    Attributes:
+        files (list(FileEstimate)): The estimates of the files, in the order they were found.
+        jobs (int): The amount of files compressed in parallel.
+        input_bytes (int): Total size of the files.
+        output_bytes (Range): Total size of the outputs.
+        cpu_time (Range): Total CPU seconds used by Ghostscript.
+        wall_time (Range): Wall-clock seconds the batch takes with ``jobs`` parallel jobs.
+    """
+    __slots__ = ()
+
+    def methods(self):
+        """
+        Returns:
+            collections.Counter: The amount of files projected with each method.
+        """
+        return collections.Counter(estimate.method for estimate in self.files)
+
+def sample_page_numbers(page_count, samples):
+    """Spread sampled pages evenly over a document, taking the middle page of as many equally
+    long ranges of pages as there are samples.
+
+    Args:
+        page_count (int): The amount of pages of the document.
+        samples (int): The maximum amount of pages to sample.
+    Returns:
+        list(int): The 1-indexed page numbers to sample, in ascending order.
+    """
+    return [(first + last) // 2 for first, last in core.page_ranges(page_count, samples)]
+
+def project(values, page_count, fixed=0.0):
+    """Project the total of a per-page quantity of a document from samples of some of its pages.
+
+    Args:
+        values (list(float)): The quantity for each sampled page, including the fixed cost.
+        page_count (int): The amount of pages of the document.
+        fixed (float): The part of every sample that is paid once per document, not per page.
+    Returns:
+        (float, float): The projected total and its standard error. With a single sample, the
+        pages are assumed to vary as much as the sampled page is large.
+    """
+    per_page = [max(0.0, value - fixed) for value in values]
+    count = len(per_page)
+    mean = sum(per_page) / count
+    total = fixed + page_count * mean
+    if count >= page_count:
+        return total, 0.0
+    if count == 1:
+        variance = mean ** 2
+    else:
+        variance = sum((value - mean) ** 2 for value in per_page) / (count - 1)
+    # finite population correction, sampling every page leaves no uncertainty
+    correction = (page_count - count) / (page_count - 1)
+    return total, page_count * math.sqrt(variance / count * correction)
+
+def measure_startup(ghostscript_binary):
+    """Measure the fixed cost of starting Ghostscript.
+
+    Args:
+        ghostscript_binary (str): Name/alias of the Ghostscript binary.
+    Returns:
+        Sample: The CPU and wall-clock time of starting and stopping Ghostscript.
+    Raises:
+        FileNotFoundError
+    """
+    start = time.monotonic()
+    process = core.start_ghostscript([ghostscript_binary, "-q", "-dNODISPLAY", "-dNOPAUSE",
+                                      "-dBATCH", "-c", "quit"])
+    _, cpu_time = core.wait_for_process(process)
+    return Sample(0, cpu_time, time.monotonic() - start)
+
+def sample_page(filepath, page, ghostscript_binary, output_directory, settings, limits=None):
+    """Compress a single page of a PDF file.
+
+    Args:
+        filepath (str): Path to the PDF file.
+        page (int): The 1-indexed page number.
+        ghostscript_binary (str): Name/alias of the Ghostscript binary.
+        output_directory (str): A directory to write the output to. The output is removed.
+        settings (tuple(str)): The Ghostscript settings to compress with.
+        limits (pdfebc.core.GhostscriptLimits): Resource limits of Ghostscript, or None.
+    Returns:
+        Sample: The cost and output size of the page.
+    Raises:
+        CompressionError, FileNotFoundError
+    """
+    fd, output_path = tempfile.mkstemp(dir=output_directory, suffix=core.PDF_EXTENSION)
+    os.close(fd)
+    try:
+        start = time.monotonic()
+        _, cpu_time, error = core.run_ghostscript_attempt(
+            core.ghostscript_args(ghostscript_binary, filepath, output_path, page, page,
+                                  settings), limits)
+        wall_time = time.monotonic() - start
+        if error is not None:
+            raise core.CompressionError(error)
+        return Sample(os.stat(output_path).st_size, cpu_time, wall_time)
+    finally:
+        os.remove(output_path)
+
+def kept_size(output_bytes, file_size, min_savings):
+    """
+    Returns:
+        float: The projected output size, or the size of the file if the output is not projected
+        to save at least ``min_savings`` of it, as then the original is kept.
+    """
+    return file_size if output_bytes > file_size * (1 - min_savings) else output_bytes
+
+def estimate_pdf(filepath, ghostscript_binary, startup, status_callback=None, history=None,
+                 sample_pages=SAMPLE_PAGES_DEFAULT, min_savings=core.MIN_SAVINGS_DEFAULT,
+                 limits=None, settings=core.GHOSTSCRIPT_SETTINGS, file_size=None):
+    """Project the cost and outcome of compressing a single PDF file, without compressing it.
+
+    Args:
+        filepath (str): Path to the PDF file.
+        ghostscript_binary (str): Name/alias of the Ghostscript binary.
+        startup (Sample): The fixed cost of starting Ghostscript, see measure_startup.
+        status_callback (function): A callback function for passing status messages to a view.
+        history (pdfebc.history.CompressionHistory): A compression history to take the outcome
+        of files that have been compressed before from. If None, all files are sampled.
+        sample_pages (int): The maximum amount of pages to sample. If 0, files that are not in
+        the history are not sampled, and are projected as unknown.
+        min_savings (float): The fraction of the size that compression must save for an output to
+        be kept.
+        limits (pdfebc.core.GhostscriptLimits): Resource limits of Ghostscript, or None.
+        settings (tuple(str)): The Ghostscript settings the file would be compressed with.
+        file_size (int): The size of the PDF file in bytes, if already known.
+    Returns:
+        FileEstimate: The projection. A file that cannot be read or sampled is projected as
+        unknown, with its original size as the output size and no cost.
+    """
+    unknown = lambda size, pages, error: FileEstimate(filepath, METHOD_UNKNOWN, size, pages,
+                                                      size, 0.0, 0.0, 0.0, 0.0, 0.0, error)
+    copy = lambda size: FileEstimate(filepath, METHOD_COPY, size, None, size, 0.0, 0.0, 0.0,
+                                     0.0, 0.0, None)
+    try:
+        if file_size is None:
+            file_size = os.stat(filepath).st_size
+        if file_size < core.FILE_SIZE_LOWER_LIMIT:
+            return copy(file_size)
+        if history is not None:
+            fingerprint = history.fingerprint(filepath, file_size, settings)
+            entry = history.get(fingerprint)
+            if history.never_shrinks(fingerprint, min_savings):
+                return copy(file_size)
+            if entry is not None:
+                cpu_time = entry.cpu_time if entry.cpu_time is not None else entry.wall_time
+                return FileEstimate(filepath, METHOD_HISTORY, file_size, None,
+                                    kept_size(entry.ratio * file_size, file_size, min_savings),
+                                    0.0, cpu_time, 0.0, entry.wall_time, 0.0, None)
+        if sample_pages < 1:
+            return unknown(file_size, None, None)
+        page_count = core.ghostscript_page_count(ghostscript_binary, filepath)
+        if page_count < 1:
+            raise core.CompressionError("'{}' has no pages".format(filepath))
+        pages = sample_page_numbers(page_count, sample_pages)
+        utils.if_callable_call_with_formatted_string(status_callback, ESTIMATING, filepath,
+                                                     len(pages), page_count)
+        with tempfile.TemporaryDirectory() as output_directory:
+            samples = [sample_page(filepath, page, ghostscript_binary, output_directory,
+                                   settings, limits) for page in pages]
+    except (IOError, core.CompressionError) as e:
+        error = str(e) if isinstance(e, core.CompressionError) else repr(e)
+        utils.if_callable_call_with_formatted_string(status_callback, ESTIMATE_FAILED, filepath,
+                                                     error)
+        return unknown(file_size, None, error)
+    output_bytes, output_error = project([sample.output_bytes for sample in samples], page_count)
+    cpu_time, cpu_error = project([sample.cpu_time for sample in samples], page_count,
+                                  startup.cpu_time)
+    wall_time, wall_error = project([sample.wall_time for sample in samples], page_count,
+                                    startup.wall_time)
+    if kept_size(output_bytes, file_size, min_savings) == file_size:
+        output_bytes, output_error = file_size, 0.0
+    return FileEstimate(filepath, METHOD_SAMPLE, file_size, page_count, output_bytes,
+                        output_error, cpu_time, cpu_error, wall_time, wall_error, None)
+
+def total_range(values, errors, low=0.0, high=math.inf):
+    """
+    Args:
+        values (list(float)): Projected quantities.
+        errors (list(float)): Their standard errors.
+        low (float): The lowest possible total.
+        high (float): The highest possible total.
+    Returns:
+        Range: The projected total and its confidence range, assuming independent errors.
+    """
+    total = sum(values)
+    spread = CONFIDENCE_Z * math.sqrt(sum(error ** 2 for error in errors))
+    return Range(total, max(low, total - spread), min(high, total + spread))
+
+def makespan(durations, jobs):
+    """Simulate a pool of workers that each take the next file as soon as they are free.
+
+    Args:
+        durations (Iterable[float]): Wall-clock seconds of each file, in the order they are
+        handed out.
+        jobs (int): The amount of workers.
+    Returns:
+        float: The wall-clock seconds until the last file is done.
+    """
+    workers = [0.0] * jobs
+    for duration in durations:
+        heapq.heapreplace(workers, workers[0] + duration)
+    return max(workers)
+
+def wall_time_range(estimates, jobs, schedule=scheduling.SCHEDULE_FIFO):
+    """
+    Args:
+        estimates (list(FileEstimate)): Estimates of the files, in the order they were found.
+        jobs (int): The amount of files compressed in parallel.
+        schedule (str): The scheduling policy, one of pdfebc.scheduling.SCHEDULES. The learned
+        policy is simulated as largest-first.
+    Returns:
+        Range: The wall-clock time of the batch. The ends of the range are the times when every
+        file takes as short or as long as its own range allows.
+    """
+    if schedule != scheduling.SCHEDULE_FIFO:
+        estimates = sorted(estimates, key=lambda estimate: estimate.input_bytes or 0,
+                           reverse=True)
+    bound = lambda sign: makespan((max(0.0, estimate.wall_time +
+                                       sign * CONFIDENCE_Z * estimate.wall_error)
+                                   for estimate in estimates), jobs)
+    return Range(makespan((estimate.wall_time for estimate in estimates), jobs), bound(-1),
+                 bound(1))
+
+def estimate_multiple_pdfs(source_directory, ghostscript_binary, status_callback=None, jobs=1,
+                           recursive=False, include=(), exclude=(),
+                           schedule=scheduling.SCHEDULE_FIFO, history=None,
+                           sample_pages=SAMPLE_PAGES_DEFAULT,
+                           min_savings=core.MIN_SAVINGS_DEFAULT, limits=None,
+                           settings=core.GHOSTSCRIPT_SETTINGS, settings_rules=(), sources=None,
+                           output_directory=None):
+    """Project the cost and outcome of compressing a batch of PDF files, without compressing
+    them. Files are sampled ``jobs`` at a time. The arguments are those of
+    pdfebc.core.compress_multiple_pdfs.
+
+    Args:
+        source_directory (str): Filepath to the source directory.
+        ghostscript_binary (str): Name/alias of the Ghostscript binary.
+        status_callback (function): A callback function for passing status messages to a view.
+        jobs (int): The amount of files that would be compressed in parallel.
+        recursive (bool): Whether or not to also project PDF files in subdirectories.
+        include (Iterable[str]): Glob patterns of which at least one must match a file's path
+        relative to the source directory for it to be projected.
+        exclude (Iterable[str]): Glob patterns matching relative paths of files to leave out.
+        schedule (str): The scheduling policy the batch would be run with.
+        history (pdfebc.history.CompressionHistory): A compression history, or None.
+        sample_pages (int): The maximum amount of pages to sample per file.
+        min_savings (float): The fraction of the size that compression must save for an output to
+        be kept.
+        limits (pdfebc.core.GhostscriptLimits): Resource limits of Ghostscript, or None.
+        settings (tuple(str)): The Ghostscript settings to compress files with.
+        settings_rules (Iterable[(str, tuple(str))]): Glob patterns and the settings they select.
+        sources (Iterable[pdfebc.core.SourceFile]): Files to project instead of the files in the
+        source directory.
+        output_directory (str): The output directory of the batch, which is not searched for
+        files. If None, all subdirectories are searched.
+
+    Returns:
+        BatchEstimate: The projection.
+
+    Raises:
+        ValueError, FileNotFoundError
+    """
+    if jobs < 1:
+        raise ValueError("jobs must be a positive integer, was %s" % jobs)
+    entries = sources
+    if entries is None:
+        entries = core.iter_pdf_entries(source_directory, recursive, include, exclude,
+                                        skip_directories=[output_directory or source_directory])
+    needs_ghostscript = sample_pages > 0
+    startup = measure_startup(ghostscript_binary) if needs_ghostscript else Sample(0, 0.0, 0.0)
+    indexed_estimates = []
+    with futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        running = dict()
+        for index, entry in enumerate(entries):
+            relative_path, _ = core.source_output_path(entry, source_directory,
+                                                       output_directory or source_directory)
+            if sources is not None and not core.is_included(relative_path, include, exclude):
+                continue
+            try:
+                file_size = entry.stat().st_size
+            except OSError:
+                # estimate_pdf reports the file as unreadable
+                file_size = None
+            future = executor.submit(
+                estimate_pdf, entry.path, ghostscript_binary, startup, status_callback, history,
+                sample_pages, min_savings, limits,
+                profiles.select_settings(relative_path, settings, settings_rules), file_size)
+            running[future] = index
+            # as in pdfebc.core.compress_multiple_pdfs, discovery is kept from running too far
+            # ahead of the files that have been estimated
+            if len(running) >= jobs * core.PENDING_FILES_PER_JOB:
+                done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    indexed_estimates.append((running.pop(future), future.result()))
+        for future in futures.as_completed(running):
+            indexed_estimates.append((running[future], future.result()))
+    estimates = [estimate for _, estimate in sorted(indexed_estimates, key=lambda pair: pair[0])]
+    input_bytes = sum(estimate.input_bytes or 0 for estimate in estimates)
+    return BatchEstimate(
+        estimates, jobs, input_bytes,
+        total_range([estimate.output_bytes or 0 for estimate in estimates],
+                    [estimate.output_error for estimate in estimates], high=input_bytes),
+        total_range([estimate.cpu_time for estimate in estimates],
+                    [estimate.cpu_error for estimate in estimates]),
+        wall_time_range(estimates, jobs, schedule))
+
+def format_estimate(estimate):
+    """
+    Args:
+        estimate (BatchEstimate): A projection of a batch.
+    Returns:
+        str: A summary of the projection for the user.
+    """
+    methods = estimate.methods()
+    output = estimate.output_bytes
+    return ESTIMATE_SUMMARY.format(
+        len(estimate.files), estimate.input_bytes, estimate.jobs, round(output.value),
+        round(output.low), round(output.high), round(estimate.input_bytes - output.value),
+        *estimate.cpu_time, *estimate.wall_time, methods[METHOD_SAMPLE], methods[METHOD_HISTORY],
+        methods[METHOD_COPY], methods[METHOD_UNKNOWN])
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""This module contains the compression history of the pdfebc program. The history remembers,
+for every document that has been compressed, how much Ghostscript managed to shrink it and how
+much CPU time that took. Documents that Ghostscript could not make sufficiently smaller, such as
+already optimized or pure text PDF files, are passed through without running Ghostscript on later
+runs. Whether a document shrinks sufficiently is decided by the minimum savings of the current
+run, and documents are compressed again after they have been passed through a number of times,
+or when the Ghostscript version changes.
+
+Documents are identified by a fingerprint of their size, the first and last blocks of their
+content and the Ghostscript settings, so that the history survives files being moved or renamed
+without having to hash entire files.
+
+.. module:: history
+    :platform: Unix
+    :synopsis: Persistent compression history for pdfebc.
+
+.. moduleauthor:: Simon Larsén <slarse@kth.se>
+"""
+import os
+import json
+import hashlib
+import threading
+from collections import namedtuple
+import appdirs
+
+HISTORY_FILENAME = "history.json"
+HISTORY_PATH = os.path.join(appdirs.user_data_dir('pdfebc'), HISTORY_FILENAME)
+FINGERPRINT_BLOCK_SIZE = 64 * 1024
+# a document that did not shrink is compressed again after it has been skipped this many times
+RETRY_AFTER_SKIPS = 10
+
+HistoryEntry = namedtuple('HistoryEntry', ['ratio', 'cpu_time', 'wall_time', 'skips', 'version'])
+
+class CompressionHistory:
+    """The compression history of documents, keyed by fingerprint.
+
+    Args:
+        path (str): Path to the file the history is stored in.
+    """
+
+    def __init__(self, path=HISTORY_PATH):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path=HISTORY_PATH):
+        """Load a history from disk. A missing or unreadable file gives an empty history.
+
+        Args:
+            path (str): Path to the file the history is stored in.
+        Returns:
+            CompressionHistory: The history.
+        """
+        history = cls(path)
+        try:
+            with open(path, encoding='utf-8') as file:
+                history.entries = {fingerprint: HistoryEntry(*entry)
+                                   if len(entry) == len(HistoryEntry._fields)
+                                   # entries of older versions have no skips or version
+                                   else HistoryEntry(*entry[:3], 0, None)
+                                   for fingerprint, entry in json.load(file).items()}
+        except (IOError, ValueError, TypeError, AttributeError):
+            history.entries = {}
+        return history
+
+    def save(self):
+        """Write the history to disk."""
+        with self._lock:
+            data = {fingerprint: list(entry) for fingerprint, entry in self.entries.items()}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(data, file, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def fingerprint(filepath, file_size, ghostscript_settings):
+        """Compute the fingerprint of a document. Only the first and last blocks of the file are
+        read.
+
+        Args:
+            filepath (str): Path to the PDF file.
+            file_size (int): Size of the PDF file in bytes.
+            ghostscript_settings (Iterable[str]): The Ghostscript settings the document is
+            compressed with.
+        Returns:
+            str: The fingerprint.
+        """
+        sha = hashlib.sha256()
+        sha.update(json.dumps([file_size, list(ghostscript_settings)]).encode('utf-8'))
+        with open(filepath, 'rb') as file:
+            sha.update(file.read(FINGERPRINT_BLOCK_SIZE))
+            if file_size > 2 * FINGERPRINT_BLOCK_SIZE:
+                file.seek(-FINGERPRINT_BLOCK_SIZE, os.SEEK_END)
+                sha.update(file.read(FINGERPRINT_BLOCK_SIZE))
+        return sha.hexdigest()
+
+    def get(self, fingerprint):
+        """
+        Args:
+            fingerprint (str): A document fingerprint.
+        Returns:
+            HistoryEntry: The history of the document, or None if it has never been compressed.
+        """
+        with self._lock:
+            return self.entries.get(fingerprint)
+
+    def never_shrinks(self, fingerprint, min_savings, version=None):
+        """
+        Args:
+            fingerprint (str): A document fingerprint.
+            min_savings (float): The fraction of the size that compression must save, e.g. 0.05
+            for 5%.
+            version (str): The version of Ghostscript, or None to accept any version.
+        Returns:
+            bool: True if compressing the document with this version of Ghostscript has not made
+            it at least ``min_savings`` smaller before, and it has been skipped fewer than
+            RETRY_AFTER_SKIPS times since.
+        """
+        entry = self.get(fingerprint)
+        return (entry is not None and entry.ratio > 1 - min_savings
+                and entry.skips < RETRY_AFTER_SKIPS
+                and (version is None or entry.version == version))
+
+    def skip(self, fingerprint):
+        """Count that a document was passed through without being compressed.
+
+        Args:
+            fingerprint (str): A document fingerprint that is in the history.
+        """
+        with self._lock:
+            entry = self.entries[fingerprint]
+            self.entries[fingerprint] = entry._replace(skips=entry.skips + 1)
+
+    def record(self, fingerprint, ratio, cpu_time, wall_time, version=None):
+        """Record the outcome of compressing a document.
+
+        Args:
+            fingerprint (str): A document fingerprint.
+            ratio (float): Output size divided by input size.
+            cpu_time (float): CPU seconds Ghostscript used, or None if unknown.
+            wall_time (float): Wall-clock seconds the compression took.
+            version (str): The version of Ghostscript, or None if unknown.
+        """
+        with self._lock:
+            self.entries[fingerprint] = HistoryEntry(ratio, cpu_time, wall_time, 0, version)
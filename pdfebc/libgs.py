@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""This module contains a backend that runs Ghostscript as a library, instead of starting the
+Ghostscript binary for every file. libgs is loaded with ctypes in worker processes, each of which
+initializes a Ghostscript instance with the gsapi_new_instance and gsapi_init_with_args
+functions, and then compresses a file with it by running a job of pdfebc.core.postscript_job with
+gsapi_run_string. The workers are managed by a pdfebc.core.WorkerPool, which starts them before
+they are needed, so that loading libgs and initializing Ghostscript is done while other files are
+compressed.
+
+The workers are separate processes, so that a crash of Ghostscript does not take pdfebc with it,
+and so that the CPU time and memory of every worker can be measured and limited like those of a
+Ghostscript process. A worker is started with ``python -m pdfebc.libgs``, reads its job as a JSON
+line from stdin, and writes a JSON line to stdout when Ghostscript is initialized and when the
+job is done. Ghostscript's own output goes to stderr.
+
+libgs is optional. If it cannot be found, pdfebc compresses files with the Ghostscript binary.
+
+.. module:: libgs
+    :platform: Unix
+    :synopsis: Ghostscript library backend for pdfebc.
+
+.. moduleauthor:: Simon Larsén <slarse@kth.se>
+"""
+import os
+import sys
+import json
+import math
+import signal
+import select
+import resource
+import subprocess
+import ctypes
+import ctypes.util
+from . import core
+
+LIBRARY_NAME = "gs"
+ARG_ENCODING_UTF8 = 1
+# seconds to wait for a worker to initialize Ghostscript
+STARTUP_TIMEOUT = 60
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LIBGS_NOT_FOUND = "libgs could not be found"
+LIBGS_ERROR = "Ghostscript failed with error code {}"
+WORKER_NOT_STARTED = "The libgs worker could not start Ghostscript: {}"
+
+class Revision(ctypes.Structure):
+    """The gsapi_revision_t structure of libgs."""
+    _fields_ = [("product", ctypes.c_char_p), ("copyright", ctypes.c_char_p),
+                ("revision", ctypes.c_long), ("revisiondate", ctypes.c_long)]
+
+def find_libgs():
+    """
+    Returns:
+        str: The name of libgs to load with ctypes, or None if it is not installed.
+    """
+    return ctypes.util.find_library(LIBRARY_NAME)
+
+def format_revision(revision):
+    """
+    Args:
+        revision (int): A revision number of libgs, such as 952 or 10021.
+    Returns:
+        str: The version, formatted like ``gs --version`` does, such as "9.52" or "10.02.1".
+    """
+    if revision >= 1000:
+        return "%d.%02d.%d" % (revision // 1000, revision // 10 % 100, revision % 10)
+    return "%d.%02d" % (revision // 100, revision % 100)
+
+def libgs_version(library):
+    """
+    Args:
+        library (str): Name or path of libgs.
+    Returns:
+        str: The version of libgs.
+    Raises:
+        OSError
+    """
+    revision = Revision()
+    ctypes.CDLL(library).gsapi_revision(ctypes.byref(revision), ctypes.sizeof(revision))
+    return format_revision(revision.revision)
+
+class GhostscriptInstance:
+    """A Ghostscript interpreter in the current process. Only one instance can be created per
+    process by most builds of libgs.
+
+    Args:
+        library (str): Name or path of libgs.
+        args (list(str)): The arguments to initialize the interpreter with, without the binary.
+    Raises:
+        OSError, pdfebc.core.CompressionError
+    """
+
+    def __init__(self, library, args):
+        self.library = library = ctypes.CDLL(library)
+        library.gsapi_new_instance.argtypes = [ctypes.POINTER(ctypes.c_void_p), ctypes.c_void_p]
+        library.gsapi_set_arg_encoding.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        library.gsapi_init_with_args.argtypes = [ctypes.c_void_p, ctypes.c_int,
+                                                 ctypes.POINTER(ctypes.c_char_p)]
+        library.gsapi_run_string.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int,
+                                             ctypes.POINTER(ctypes.c_int)]
+        library.gsapi_exit.argtypes = [ctypes.c_void_p]
+        library.gsapi_delete_instance.argtypes = [ctypes.c_void_p]
+        self.instance = ctypes.c_void_p()
+        code = library.gsapi_new_instance(ctypes.byref(self.instance), None)
+        if code < 0:
+            self.instance = None
+            raise core.CompressionError("gsapi_new_instance failed with code {}".format(code))
+        library.gsapi_set_arg_encoding(self.instance, ARG_ENCODING_UTF8)
+        argv = (ctypes.c_char_p * (len(args) + 1))(b"gs", *(os.fsencode(arg) for arg in args))
+        code = library.gsapi_init_with_args(self.instance, len(argv), argv)
+        if code < 0:
+            self.close()
+            raise core.CompressionError("gsapi_init_with_args failed with code {}".format(code))
+
+    def run_string(self, program):
+        """
+        Args:
+            program (str): A PostScript program.
+        Returns:
+            int: The return code of gsapi_run_string, which is negative if the program failed.
+        """
+        exit_code = ctypes.c_int()
+        return self.library.gsapi_run_string(self.instance, os.fsencode(program), 0,
+                                             ctypes.byref(exit_code))
+
+    def close(self):
+        """Exit and delete the interpreter."""
+        if self.instance is not None:
+            self.library.gsapi_exit(self.instance)
+            self.library.gsapi_delete_instance(self.instance)
+            self.instance = None
+
+def process_cpu_time():
+    """
+    Returns:
+        float: The user and system CPU seconds used by the current process.
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def set_cpu_limit(seconds):
+    """Limit the CPU time of the current process to this many more seconds. Exceeding the limit
+    sends SIGXCPU, which kills the process.
+
+    Args:
+        seconds (float): The limit, or None to remove it.
+    """
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = resource.RLIM_INFINITY
+    if seconds is not None:
+        soft = max(1, math.ceil(process_cpu_time() + seconds))
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+def worker_main(args):
+    """Run a worker process. Ghostscript is initialized with the arguments, and then the worker
+    runs a job, unless stdin is closed first. A job is a JSON object with the PostScript
+    ``program`` to run and a ``cpu_limit`` in seconds, or null. The response to initializing
+    Ghostscript and to the job is a JSON object with the ``code`` of libgs and the total
+    ``cpu_time`` of the worker. The job is responded to when Ghostscript has exited, which
+    completes its output file.
+
+    Args:
+        args (list(str)): The name or path of libgs, followed by the arguments of Ghostscript.
+    Returns:
+        int: The exit code of the worker.
+    """
+    # Ghostscript writes its messages to stdout, which carries the responses
+    responses = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    def respond(code, error=None):
+        responses.write(json.dumps(dict(code=code, cpu_time=process_cpu_time(), error=error)) +
+                        "\n")
+        responses.flush()
+    try:
+        instance = GhostscriptInstance(args[0], args[1:])
+    except (OSError, core.CompressionError) as e:
+        respond(-1, str(e))
+        return 1
+    respond(0)
+    line = sys.stdin.readline()
+    if not line:
+        instance.close()
+        return 0
+    job = json.loads(line)
+    set_cpu_limit(job['cpu_limit'])
+    code = instance.run_string(job['program'])
+    instance.close()
+    respond(code)
+    return 0 if code >= 0 else 1
+
+class LibgsWorker:
+    """A worker process that compresses a file with libgs, for a pdfebc.core.WorkerPool. The
+    worker starts to initialize Ghostscript as soon as it is created.
+
+    Args:
+        library (str): Name or path of libgs.
+        args (list(str)): The arguments to initialize Ghostscript with, without the binary.
+        memory (int): Maximum size of the address space of the worker in bytes, or None.
+    """
+
+    def __init__(self, library, args, memory=None):
+        environment = dict(os.environ)
+        environment['PYTHONPATH'] = os.pathsep.join(
+            filter(None, [PACKAGE_ROOT, environment.get('PYTHONPATH')]))
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "pdfebc.libgs", library, *args], stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, universal_newlines=True, env=environment)
+        core.limit_process(self.process.pid, memory=memory)
+
+    def _read_response(self, timeout=None):
+        """
+        Returns:
+            dict: The next response of the worker, or None if it exited without responding.
+        Raises:
+            pdfebc.core.GhostscriptTimeoutError
+        """
+        ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+        if not ready:
+            self.process.kill()
+            _, cpu_time = core.wait_for_process(self.process)
+            raise core.GhostscriptTimeoutError(timeout, cpu_time)
+        line = self.process.stdout.readline()
+        return json.loads(line) if line else None
+
+    def run(self, job, limits=None):
+        """Run the job, and wait for the worker to exit. The worker is killed if it exceeds the
+        limits.
+
+        Args:
+            job (str): A job of pdfebc.core.postscript_job.
+            limits (pdfebc.core.GhostscriptLimits): Time and CPU time limits of the job, or None.
+        Returns:
+            int, float, str: The exit code, the CPU seconds used by the job, and a description of
+            why it failed, or None if it succeeded.
+        """
+        timeout = limits.timeout if limits is not None else None
+        cpu_limit = limits.cpu_time if limits is not None else None
+        startup_cpu_time = 0.0
+        try:
+            response = self._read_response(STARTUP_TIMEOUT)
+            if response is not None and response['code'] < 0:
+                core.wait_for_process(self.process)
+                return response['code'], 0.0, WORKER_NOT_STARTED.format(response['error'])
+            if response is not None:
+                startup_cpu_time = response['cpu_time']
+                self.process.stdin.write(json.dumps(dict(program=job, cpu_limit=cpu_limit)) +
+                                         "\n")
+                self.process.stdin.flush()
+                response = self._read_response(timeout)
+        except BrokenPipeError:
+            response = None
+        except core.GhostscriptTimeoutError as e:
+            return (self.process.returncode, max(0.0, e.cpu_time - startup_cpu_time),
+                    str(e))
+        exit_code, cpu_time = core.wait_for_process(self.process)
+        cpu_time = max(0.0, cpu_time - startup_cpu_time)
+        if response is None:
+            if cpu_limit is not None and (exit_code == -signal.SIGXCPU or (
+                    exit_code == -signal.SIGKILL and cpu_time >= cpu_limit)):
+                return exit_code, cpu_time, core.GS_CPU_LIMIT.format(cpu_limit)
+            return exit_code, cpu_time, core.GS_EXIT_CODE.format(exit_code)
+        if response['code'] < 0:
+            return response['code'], cpu_time, LIBGS_ERROR.format(response['code'])
+        return 0, cpu_time, None
+
+    def close(self):
+        """Stop the worker if it is still running, such as a spare that was never given a
+        job."""
+        if self.process.returncode is None:
+            self.process.kill()
+            self.process.wait()
+        for stream in (self.process.stdin, self.process.stdout):
+            try:
+                stream.close()
+            except BrokenPipeError:
+                pass
+
+def libgs_pool(size, library=None):
+    """Create a pool of workers that compress files with libgs.
+
+    Args:
+        size (int): The maximum amount of files to compress at the same time.
+        library (str): Name or path of libgs. If None, it is searched for with find_libgs.
+    Returns:
+        pdfebc.core.WorkerPool: The pool, whose workers are started when files are compressed.
+    Raises:
+        OSError
+    """
+    library = library if library is not None else find_libgs()
+    if library is None:
+        raise OSError(LIBGS_NOT_FOUND)
+    return core.WorkerPool(lambda args, memory: LibgsWorker(library, args, memory), size,
+                           libgs_version(library))
+
+if __name__ == '__main__':
+    sys.exit(worker_main(sys.argv[1:]))
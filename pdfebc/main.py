@@ -5,9 +5,9 @@ Author: Simon Larsén
 """
 import os
 import shutil
-import smtplib
+import signal
 import sys
-from . import cli, core, utils
+from . import cache, cli, core, history, profiles, scheduling, utils
 
 AUTH_ERROR = """An authentication error has occured!
 Status code: {}
@@ -26,31 +26,296 @@ Please open an issue about this error at 'https://github.com/slarse/pdfebc/issue
 OUT_DIR_IS_FILE = """The specified output directory ({}) is a file!
 Please specify a path to either an existing directory, or to where you wish to create one."""
 
+EMAIL_CONFIG_ERROR = """Cannot send e-mail: {}
+Run pdfebc with {} to check the configuration file."""
+
+BACKEND_UNAVAILABLE = "Cannot use libgs: {}. Compressing with '{}' instead."
+
+
+def write_json_results(results, path):
+    """Write compression results as JSON Lines.
+
+    Args:
+        results (list(pdfebc.core.CompressionResult)): The results to write.
+        path (str): Path to the file to write to, or '-' for stdout.
+    """
+    if path == "-":
+        core.write_results_json_lines(results, sys.stdout)
+        return
+    with open(path, 'w', encoding='utf-8') as file:
+        core.write_results_json_lines(results, file)
+
+def open_file_list(path):
+    """
+    Args:
+        path (str): Path to a list of files to compress, or '-' for stdin.
+    Returns:
+        A readable binary file of the list.
+    """
+    if path == "-":
+        return sys.stdin.buffer
+    return open(path, 'rb')
+
+def create_backend(args):
+    """
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+    Returns:
+        pdfebc.core.WorkerPool: The workers of the selected backend, or None to start a
+        Ghostscript process for every file.
+    """
+    if args.backend == core.BACKEND_LIBGS:
+        # only imported when needed, as ctypes is not needed otherwise
+        from . import libgs
+        try:
+            return libgs.libgs_pool(args.jobs)
+        except OSError as e:
+            cli.status_callback(BACKEND_UNAVAILABLE.format(e, args.ghostscript))
+    elif args.backend == core.BACKEND_INTERPRETER:
+        try:
+            return core.interpreter_pool(args.ghostscript, args.jobs)
+        except FileNotFoundError:
+            cli.status_callback(core.GS_NOT_INSTALLED.format(args.ghostscript))
+            sys.exit(1)
+    return None
+
+def compress_options(args, compression_cache, compression_history, backend=None):
+    """
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+        compression_cache (pdfebc.cache.CompressionCache): A compression cache, or None.
+        compression_history (pdfebc.history.CompressionHistory): A compression history, or None.
+        backend (pdfebc.core.WorkerPool): The workers to compress with, or None.
+    Returns:
+        dict: The keyword arguments for pdfebc.core.compress_pdf that the batch, watch and serve
+        modes share.
+    """
+    split_threshold = None
+    if args.split_above is not None:
+        split_threshold = args.split_above * core.BYTES_PER_MEGABYTE
+    limits = None
+    if (args.timeout, args.cpu_limit, args.memory_limit) != (None, None, None):
+        memory = None
+        if args.memory_limit is not None:
+            memory = args.memory_limit * core.BYTES_PER_MEGABYTE
+        limits = core.GhostscriptLimits(args.timeout, args.cpu_limit, memory)
+    return dict(cache=compression_cache, history=compression_history, link_small=args.link_small,
+                split_threshold=split_threshold, split_chunks=args.split_chunks,
+                min_savings=args.min_savings / 100, limits=limits,
+                fallback_settings=(core.FALLBACK_SETTINGS,) if args.retry else (),
+                copy_on_failure=args.copy_on_failure,
+                settings=args.profiles[args.profile].settings, backend=backend)
+
+def run_watch(args, options):
+    """Compress PDF files as they land in the source directory, until interrupted or terminated.
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+        options (dict): Keyword arguments for pdfebc.core.compress_pdf.
+    """
+    # only imported when needed, as it takes long to import
+    from . import watch
+    latency_log = None
+    if args.latency_log is not None:
+        latency_log = open(args.latency_log, 'a', encoding='utf-8')
+    try:
+        file_watch = watch.Watch(args.srcdir, args.outdir, args.ghostscript, cli.status_callback,
+                                 jobs=args.jobs, settle_time=args.settle,
+                                 poll_interval=args.poll_interval,
+                                 use_inotify=not args.no_inotify, latency_log=latency_log,
+                                 **options)
+        signal.signal(signal.SIGTERM, lambda signum, frame: file_watch.stop())
+        file_watch.run()
+    finally:
+        if latency_log is not None:
+            latency_log.close()
+
+def run_server(args, options):
+    """Serve the HTTP API until interrupted or terminated.
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+        options (dict): Keyword arguments for pdfebc.core.compress_pdf.
+    """
+    # only imported when needed, as http.server takes long to import
+    from . import server
+    service = server.CompressionService(args.ghostscript, cli.status_callback, workers=args.jobs,
+                                        queue_size=args.queue_size, **options)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    server.serve(service, args.host, args.port, args.max_upload * core.BYTES_PER_MEGABYTE,
+                 cli.status_callback)
+
+def run_estimate(args, options, settings_rules, sources):
+    """Project the cost and outcome of compressing the batch, without compressing anything.
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+        options (dict): Keyword arguments for pdfebc.core.compress_pdf.
+        settings_rules (list((str, tuple(str)))): Glob patterns and the settings they select.
+        sources (Iterable[pdfebc.core.SourceFile]): Files to project instead of the files in the
+        source directory, or None.
+    """
+    from . import estimate
+    batch_estimate = estimate.estimate_multiple_pdfs(
+        args.srcdir, args.ghostscript, cli.status_callback, jobs=args.jobs,
+        recursive=args.recursive, include=args.include, exclude=args.exclude,
+        schedule=args.schedule, history=options['history'],
+        sample_pages=args.estimate_pages if args.estimate else 0,
+        min_savings=options['min_savings'], limits=options['limits'],
+        settings=options['settings'], settings_rules=settings_rules, sources=sources,
+        output_directory=args.outdir)
+    if args.json_results is not None:
+        write_json_results(batch_estimate.files, args.json_results)
+    cli.status_callback(estimate.format_estimate(batch_estimate))
 
 def main():
     """Run PDFEBC."""
+    config = None
     try:
-        parser = cli.create_argparser()
+        if cli.config_needed(sys.argv[1:]):
+            config = utils.load_config()
+        parser = cli.create_argparser(config)
     except (utils.ConfigurationError, IOError):
         cli.diagnose_config()
         sys.exit(1)
     args = parser.parse_args()
+    try:
+        settings_rules = profiles.settings_rules(args.profiles, args.profile_rule)
+    except ValueError as e:
+        parser.error(str(e))
     if args.configstatus:
         cli.diagnose_config()
         sys.exit(0)
-    if os.path.isfile(args.outdir):
-        cli.status_callback(OUT_DIR_IS_FILE.format(args.outdir))
+    compression_cache = None
+    if args.cache_stats or not args.no_cache:
+        compression_cache = cache.CompressionCache(
+            size_limit=args.cache_size * cache.BYTES_PER_MEGABYTE)
+    if args.cache_stats:
+        cli.status_callback(cache.CACHE_STATS.format(*compression_cache.stats()))
+        sys.exit(0)
+    if args.estimate and not args.dry_run:
+        parser.error("{} requires {}".format(cli.ESTIMATE_LONG, cli.DRY_RUN_LONG))
+    if args.dry_run:
+        if args.command is not None:
+            parser.error("{} cannot be used with the {} command".format(cli.DRY_RUN_LONG,
+                                                                         args.command))
+        compression_history = None if args.no_history else history.CompressionHistory.load()
+        file_list = None
+        if args.files_from is not None:
+            try:
+                file_list = open_file_list(args.files_from)
+            except OSError as e:
+                parser.error("cannot read {}: {}".format(args.files_from, e.strerror))
+        try:
+            run_estimate(args, compress_options(args, None, compression_history), settings_rules,
+                         None if file_list is None else core.iter_file_list(file_list))
+        except FileNotFoundError:
+            cli.status_callback(core.GS_NOT_INSTALLED.format(args.ghostscript))
+            sys.exit(1)
+        finally:
+            if file_list not in (None, sys.stdin.buffer):
+                file_list.close()
+        sys.exit(0)
+    if args.command != cli.SERVE_COMMAND:
+        if os.path.isfile(args.outdir):
+            cli.status_callback(OUT_DIR_IS_FILE.format(args.outdir))
+            sys.exit(1)
+        if not os.path.isdir(args.outdir):
+            os.makedirs(args.outdir)
+    cost_model = scheduling.CostModel.load()
+    compression_history = None if args.no_history else history.CompressionHistory.load()
+    backend = create_backend(args)
+    if backend is None and shutil.which(args.ghostscript) is None:
+        cli.status_callback(core.GS_NOT_INSTALLED.format(args.ghostscript))
         sys.exit(1)
-    if not os.path.isdir(args.outdir):
-        os.makedirs(args.outdir)
-    filepaths = core.compress_multiple_pdfs(args.srcdir, args.outdir,
-                                            args.ghostscript, cli.status_callback)
+    options = compress_options(args, compression_cache, compression_history, backend)
+    if args.command in (cli.WATCH_COMMAND, cli.SERVE_COMMAND):
+        try:
+            if args.command == cli.WATCH_COMMAND:
+                run_watch(args, options)
+            else:
+                run_server(args, options)
+        finally:
+            if backend is not None:
+                backend.close()
+        if compression_history is not None:
+            compression_history.save()
+        if compression_cache is not None:
+            compression_cache.save_stats()
+        sys.exit(0)
+    # results of a file list are not kept in memory, but handled as they come
+    file_list = None
+    if args.files_from is not None:
+        try:
+            file_list = open_file_list(args.files_from)
+        except OSError as e:
+            parser.error("cannot read {}: {}".format(args.files_from, e.strerror))
+    email_pipeline = None
+    if args.email and args.stream:
+        try:
+            email_pipeline = utils.EmailPipeline(config, cli.status_callback).start()
+        except (utils.ConfigurationError, ValueError) as e:
+            cli.status_callback(EMAIL_CONFIG_ERROR.format(e, cli.STATUS_LONG))
+            if backend is not None:
+                backend.close()
+            sys.exit(1)
+    sources = None if file_list is None else core.iter_file_list(file_list)
+    json_file = None
+    if file_list is not None and args.json_results is not None:
+        json_file = sys.stdout if args.json_results == "-" else open(args.json_results, 'w',
+                                                                      encoding='utf-8')
+    filepaths = []
+
+    def result_callback(result):
+        if result.error is None and email_pipeline is not None:
+            email_pipeline.put(result.output_path)
+        elif result.error is None and file_list is not None and args.email:
+            filepaths.append(result.output_path)
+        if json_file is not None:
+            core.write_results_json_lines([result], json_file)
+    try:
+        results = core.compress_multiple_pdfs(args.srcdir, args.outdir,
+                                              args.ghostscript, cli.status_callback,
+                                              jobs=args.jobs,
+                                              incremental=args.incremental,
+                                              recursive=args.recursive,
+                                              include=args.include,
+                                              exclude=args.exclude,
+                                              schedule=args.schedule,
+                                              cost_model=cost_model,
+                                              result_callback=result_callback,
+                                              settings_rules=settings_rules,
+                                              sources=sources,
+                                              keep_results=file_list is None,
+                                              **options)
+    finally:
+        if backend is not None:
+            backend.close()
+    if file_list is not None:
+        if file_list is not sys.stdin.buffer:
+            file_list.close()
+        if json_file not in (None, sys.stdout):
+            json_file.close()
+    else:
+        if args.json_results is not None:
+            write_json_results(results, args.json_results)
+        filepaths = [result.output_path for result in results if result.error is None]
+    cost_model.save()
+    if compression_history is not None:
+        compression_history.save()
+    if compression_cache is not None:
+        compression_cache.save_stats()
     if args.email:
+        # only imported when needed, as it takes long to import
+        import smtplib
         if not utils.valid_config_exists():
             # TODO Add step-by-step config creation here.
             pass
         try:
-            utils.send_files_preconf(filepaths, status_callback=cli.status_callback)
+            if email_pipeline is not None:
+                email_pipeline.close()
+            else:
+                utils.send_files_preconf(filepaths, status_callback=cli.status_callback)
         except smtplib.SMTPAuthenticationError as e:
             cli.status_callback(AUTH_ERROR.format(e.smtp_code, e.smtp_error))
         except Exception as e:
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""This module contains the compression profiles of the pdfebc program. A profile is a named set
+of Ghostscript settings that trades compression time against output size. The built-in profiles
+are:
+
+- ebook: Ghostscript's /ebook settings, 150 DPI images. The default.
+- screen: Ghostscript's /screen settings, 72 DPI images.
+- printer: Ghostscript's /printer settings, 300 DPI images.
+- fast: /screen settings with low resolution images and without embedding fonts that are not
+  already embedded, for the highest throughput.
+
+Profiles are defined or changed in sections of the configuration file that are named
+``profile:<name>``, for example:
+
+    |[profile:scans]
+    |base = screen
+    |color_image_resolution = 100
+    |gray_image_resolution = 100
+    |mono_image_resolution = 300
+    |embed_fonts = no
+    |extra = -dDetectDuplicateImages=true
+    |patterns = scans/*.pdf *_scan.pdf
+
+All options are optional. 'base' is the profile to start from, and defaults to the built-in
+profile of the same name, or to the default profile. 'pdfsettings' is one of Ghostscript's
+predefined settings, such as ebook. 'extra' is a list of additional Ghostscript arguments. Files
+whose path relative to the source directory matches one of the 'patterns' are compressed with
+the profile. The profile to use for all other files is set by the optional 'profile' option of
+the DEFAULTS section.
+
+.. module:: profiles
+    :platform: Unix
+    :synopsis: Compression profiles for pdfebc.
+
+.. moduleauthor:: Simon Larsén <slarse@kth.se>
+"""
+import shlex
+import fnmatch
+import collections
+from . import utils
+
+PROFILE_SECTION_PREFIX = "profile:"
+BASE_KEY = "base"
+PDFSETTINGS_KEY = "pdfsettings"
+COLOR_IMAGE_RESOLUTION_KEY = "color_image_resolution"
+GRAY_IMAGE_RESOLUTION_KEY = "gray_image_resolution"
+MONO_IMAGE_RESOLUTION_KEY = "mono_image_resolution"
+EMBED_FONTS_KEY = "embed_fonts"
+EXTRA_KEY = "extra"
+PATTERNS_KEY = "patterns"
+PDFSETTINGS = ("screen", "ebook", "printer", "prepress", "default")
+BOOLEANS = {"yes": True, "true": True, "on": True, "1": True,
+            "no": False, "false": False, "off": False, "0": False}
+
+PROFILE_EBOOK = "ebook"
+PROFILE_SCREEN = "screen"
+PROFILE_PRINTER = "printer"
+PROFILE_FAST = "fast"
+PROFILE_DEFAULT = PROFILE_EBOOK
+
+BASE_SETTINGS = ("-sDEVICE=pdfwrite", "-dCompatibilityLevel=1.4", "-dNOPAUSE", "-dQUIET",
+                 "-dBATCH")
+BUILTIN_OPTIONS = collections.OrderedDict([
+    (PROFILE_EBOOK, ("-dPDFSETTINGS=/ebook",)),
+    (PROFILE_SCREEN, ("-dPDFSETTINGS=/screen",)),
+    (PROFILE_PRINTER, ("-dPDFSETTINGS=/printer",)),
+    (PROFILE_FAST, ("-dPDFSETTINGS=/screen", "-dDownsampleColorImages=true",
+                    "-dColorImageResolution=72", "-dDownsampleGrayImages=true",
+                    "-dGrayImageResolution=72", "-dDownsampleMonoImages=true",
+                    "-dMonoImageResolution=150", "-dEmbedAllFonts=false",
+                    "-dDetectDuplicateImages=false")),
+])
+RESOLUTION_OPTIONS = ((COLOR_IMAGE_RESOLUTION_KEY, "Color"), (GRAY_IMAGE_RESOLUTION_KEY, "Gray"),
+                      (MONO_IMAGE_RESOLUTION_KEY, "Mono"))
+
+class Profile(collections.namedtuple('Profile', ['name', 'settings', 'patterns'])):
+    """A compression profile.
+
+    Attributes:
+        name (str): Name of the profile.
+        settings (tuple(str)): The Ghostscript settings of the profile.
+        patterns (tuple(str)): Glob patterns of relative paths of files to compress with the
+        profile.
+    """
+    __slots__ = ()
+
+    @property
+    def options(self):
+        """tuple(str): The settings that are not part of BASE_SETTINGS."""
+        return self.settings[len(BASE_SETTINGS):]
+
+def builtin_profiles():
+    """
+    Returns:
+        collections.OrderedDict: The built-in profiles, keyed by name.
+    """
+    return collections.OrderedDict(
+        (name, Profile(name, BASE_SETTINGS + options, ()))
+        for name, options in BUILTIN_OPTIONS.items())
+
+def set_option(options, name, value):
+    """Set a Ghostscript option, replacing an earlier value of the same option.
+
+    Args:
+        options (list(str)): Ghostscript options of the form ``-dName=value``.
+        name (str): The name of the option, e.g. ``-dPDFSETTINGS``.
+        value (str): The new value.
+    """
+    option = "{}={}".format(name, value)
+    for i, existing in enumerate(options):
+        if existing.split("=", 1)[0] == name:
+            options[i] = option
+            return
+    options.append(option)
+
+def parse_boolean(name, key, value):
+    """
+    Returns:
+        bool: The value of a yes or no option of a profile.
+    Raises:
+        pdfebc.utils.ConfigurationError
+    """
+    try:
+        return BOOLEANS[value.lower()]
+    except KeyError:
+        raise utils.ConfigurationError("Option '{}' of profile '{}' must be yes or no, was '{}'"
+                                       .format(key, name, value))
+
+def parse_resolution(name, key, value):
+    """
+    Returns:
+        int: The value of an image resolution option of a profile.
+    Raises:
+        pdfebc.utils.ConfigurationError
+    """
+    try:
+        resolution = int(value)
+    except ValueError:
+        resolution = 0
+    if resolution < 1:
+        raise utils.ConfigurationError("Option '{}' of profile '{}' must be a positive integer, "
+                                       "was '{}'".format(key, name, value))
+    return resolution
+
+def profile_from_section(name, section, profiles):
+    """Create a profile from a section of the configuration file.
+
+    Args:
+        name (str): Name of the profile.
+        section (dict): The options of the section.
+        profiles (dict): The profiles defined so far, that the profile can be based on.
+    Returns:
+        Profile: The profile.
+    Raises:
+        pdfebc.utils.ConfigurationError
+    """
+    base_name = section.get(BASE_KEY) or (name if name in profiles else PROFILE_DEFAULT)
+    if base_name not in profiles:
+        raise utils.ConfigurationError("Profile '{}' is based on unknown profile '{}'"
+                                       .format(name, base_name))
+    options = list(profiles[base_name].options)
+    pdfsettings = section.get(PDFSETTINGS_KEY)
+    if pdfsettings:
+        if pdfsettings.lstrip("/") not in PDFSETTINGS:
+            raise utils.ConfigurationError("Option '{}' of profile '{}' must be one of {}"
+                                           .format(PDFSETTINGS_KEY, name, PDFSETTINGS))
+        set_option(options, "-dPDFSETTINGS", "/" + pdfsettings.lstrip("/"))
+    for key, image_type in RESOLUTION_OPTIONS:
+        if section.get(key):
+            resolution = parse_resolution(name, key, section[key])
+            set_option(options, "-dDownsample{}Images".format(image_type), "true")
+            set_option(options, "-d{}ImageResolution".format(image_type), str(resolution))
+    if section.get(EMBED_FONTS_KEY):
+        embed_fonts = parse_boolean(name, EMBED_FONTS_KEY, section[EMBED_FONTS_KEY])
+        set_option(options, "-dEmbedAllFonts", str(embed_fonts).lower())
+    for option in shlex.split(section.get(EXTRA_KEY) or ""):
+        if "=" in option:
+            set_option(options, *option.split("=", 1))
+        else:
+            options.append(option)
+    patterns = tuple((section.get(PATTERNS_KEY) or "").split())
+    return Profile(name, BASE_SETTINGS + tuple(options), patterns)
+
+def load_profiles(config):
+    """Load the built-in profiles, and the profiles defined in the configuration file.
+
+    Args:
+        config (defaultdict): The configuration, as read by pdfebc.utils.read_config.
+    Returns:
+        collections.OrderedDict: The profiles, keyed by name. Profiles of the configuration file
+        come in the order they are defined, after the built-in profiles.
+    Raises:
+        pdfebc.utils.ConfigurationError
+    """
+    profiles = builtin_profiles()
+    for section_name, section in config.items():
+        if section_name.startswith(PROFILE_SECTION_PREFIX):
+            name = section_name[len(PROFILE_SECTION_PREFIX):].strip()
+            if not name:
+                raise utils.ConfigurationError("Section '{}' does not name a profile"
+                                               .format(section_name))
+            profiles[name] = profile_from_section(name, section, profiles)
+    return profiles
+
+def settings_rules(profiles, rules=()):
+    """Collect the glob patterns that select profiles for files.
+
+    Args:
+        profiles (dict): Profiles keyed by name.
+        rules (Iterable[(str, str)]): Glob patterns and the names of the profiles they select,
+        that take precedence over the patterns of the profiles.
+    Returns:
+        list((str, tuple(str))): Glob patterns and the Ghostscript settings they select, in order
+        of precedence.
+    Raises:
+        ValueError
+    """
+    selected = []
+    for pattern, name in rules:
+        if name not in profiles:
+            raise ValueError("Unknown profile '{}'".format(name))
+        selected.append((pattern, profiles[name].settings))
+    for profile in profiles.values():
+        selected.extend((pattern, profile.settings) for pattern in profile.patterns)
+    return selected
+
+def select_settings(relative_path, settings, rules):
+    """
+    Args:
+        relative_path (str): Path to a file, relative to the source directory.
+        settings (tuple(str)): The Ghostscript settings to use if no rule matches.
+        rules (Iterable[(str, tuple(str))]): Glob patterns and the settings they select, in order
+        of precedence.
+    Returns:
+        tuple(str): The settings of the first rule whose pattern matches the path, or the default
+        settings.
+    """
+    for pattern, rule_settings in rules:
+        if fnmatch.fnmatch(relative_path, pattern):
+            return rule_settings
+    return settings
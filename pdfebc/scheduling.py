@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""This module contains the batch scheduling policies of the pdfebc program. A policy decides in
+which order the files of a batch are handed to the worker pool. When files are compressed in
+parallel, starting the most expensive files first keeps a single large file from finishing long
+after all the others.
+
+The learned policy uses a cost model that is stored next to the configuration file, and which is
+updated with the measured compression time of every file after each run.
+
+.. module:: scheduling
+    :platform: Unix
+    :synopsis: Batch scheduling policies for pdfebc.
+
+.. moduleauthor:: Simon Larsén <slarse@kth.se>
+"""
+import os
+import json
+import threading
+from . import utils
+
+SCHEDULE_FIFO = "fifo"
+SCHEDULE_LARGEST_FIRST = "largest-first"
+SCHEDULE_LEARNED = "learned"
+SCHEDULES = (SCHEDULE_FIFO, SCHEDULE_LARGEST_FIRST, SCHEDULE_LEARNED)
+COST_MODEL_FILENAME = "costs.json"
+COST_MODEL_PATH = os.path.join(os.path.dirname(utils.CONFIG_PATH), COST_MODEL_FILENAME)
+# weight of the newest observation in the running seconds-per-byte average
+SMOOTHING_FACTOR = 0.2
+SECONDS_PER_BYTE_KEY = "seconds_per_byte"
+FILES_KEY = "files"
+
+class CostModel:
+    """A model of how long files take to compress. Files that have been compressed before, and
+    have not changed size since, are predicted to take as long as they did then. Other files are
+    predicted from their size and a running average of seconds per byte.
+
+    Args:
+        path (str): Path to the file the model is stored in.
+    """
+
+    def __init__(self, path=COST_MODEL_PATH):
+        self.path = path
+        self.seconds_per_byte = None
+        self.files = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path=COST_MODEL_PATH):
+        """Load a cost model from disk. A missing or unreadable file gives an empty model.
+
+        Args:
+            path (str): Path to the file the model is stored in.
+        Returns:
+            CostModel: The cost model.
+        """
+        model = cls(path)
+        try:
+            with open(path, encoding='utf-8') as file:
+                data = json.load(file)
+            model.seconds_per_byte = data.get(SECONDS_PER_BYTE_KEY)
+            model.files = data.get(FILES_KEY, {})
+        except (IOError, ValueError, AttributeError):
+            pass
+        return model
+
+    def save(self):
+        """Write the cost model to disk."""
+        with self._lock:
+            data = {SECONDS_PER_BYTE_KEY: self.seconds_per_byte, FILES_KEY: self.files}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(data, file, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+    def record(self, filepath, size, seconds):
+        """Record how long a file took to compress.
+
+        Args:
+            filepath (str): Path to the file.
+            size (int): Size of the file in bytes.
+            seconds (float): Wall-clock time it took to compress the file.
+        """
+        with self._lock:
+            self.files[os.path.abspath(filepath)] = [size, seconds]
+            if size > 0:
+                observed = seconds / size
+                if self.seconds_per_byte is None:
+                    self.seconds_per_byte = observed
+                else:
+                    self.seconds_per_byte += SMOOTHING_FACTOR * (observed - self.seconds_per_byte)
+
+    def predict(self, filepath, size):
+        """Predict how long a file will take to compress.
+
+        Args:
+            filepath (str): Path to the file.
+            size (int): Size of the file in bytes.
+        Returns:
+            float: The predicted cost. If nothing has been learned yet, this is the size itself,
+            which gives the same order as the largest-first policy.
+        """
+        with self._lock:
+            previous = self.files.get(os.path.abspath(filepath))
+            if previous is not None and previous[0] == size:
+                return previous[1]
+            if self.seconds_per_byte is None:
+                return size
+            return size * self.seconds_per_byte
+
+def entry_size(entry):
+    """
+    Args:
+        entry (os.DirEntry): A directory entry, or an object with the same path and stat members.
+    Returns:
+        int: The size of the file, or 0 if it cannot be read. Such files fail when they are
+        compressed, so it does not matter when they are scheduled.
+    """
+    try:
+        return entry.stat().st_size
+    except OSError:
+        return 0
+
+def order_entries(indexed_entries, schedule, cost_model=None):
+    """Order directory entries according to a scheduling policy. All policies except
+    FIFO need to see every entry before they can hand out the first one.
+
+    Args:
+        indexed_entries (Iterable[(int, os.DirEntry)]): Directory entries, paired with the
+        index in which they were found.
+        schedule (str): One of SCHEDULES.
+        cost_model (CostModel): The cost model to use for the learned policy.
+    Returns:
+        Iterable[(int, os.DirEntry)]: The entries in the order they should be compressed.
+    Raises:
+        ValueError
+    """
+    if schedule == SCHEDULE_FIFO:
+        return indexed_entries
+    if schedule == SCHEDULE_LARGEST_FIRST:
+        cost = entry_size
+    elif schedule == SCHEDULE_LEARNED:
+        model = cost_model if cost_model is not None else CostModel()
+        cost = lambda entry: model.predict(entry.path, entry_size(entry))
+    else:
+        raise ValueError("Unknown schedule '{}', must be one of {}".format(schedule, SCHEDULES))
+    return sorted(indexed_entries, key=lambda indexed_entry: cost(indexed_entry[1]), reverse=True)
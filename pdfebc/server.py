@@ -0,0 +1,455 @@
+# -*- coding: utf-8 -*-
+"""This module contains the HTTP service of the pdfebc program, which lets other programs
+compress PDF files without starting pdfebc for every file. The service only uses the standard
+library and listens on localhost by default. Its API is:
+
+    |POST   /jobs              Submit the request body as a PDF file. Answers 202 with the job,
+    |                          or 503 if the job queue is full.
+    |GET    /jobs/<id>         Get the status of a job, and its result once it is done.
+    |GET    /jobs/<id>/result  Fetch the compressed file of a job that is done.
+    |DELETE /jobs/<id>         Remove a job that is not running, and its files.
+    |GET    /metrics           Get the queue depth, throughput and other metrics.
+
+Jobs are put in a bounded queue and compressed by a fixed pool of worker threads that share the
+compression cache. Finished jobs are kept until they are deleted or expire.
+
+.. module:: server
+    :platform: Unix
+    :synopsis: HTTP compression service for pdfebc.
+
+.. moduleauthor:: Simon Larsén <slarse@kth.se>
+"""
+import os
+import re
+import json
+import time
+import uuid
+import queue
+import shutil
+import tempfile
+import threading
+import collections
+import socketserver
+import urllib.parse
+from http import server as http_server
+from . import core, utils
+
+HOST_DEFAULT = "127.0.0.1"
+PORT_DEFAULT = 8470
+QUEUE_SIZE_DEFAULT = 64
+MAX_UPLOAD_BYTES_DEFAULT = 512 * core.BYTES_PER_MEGABYTE
+JOB_TTL_SECONDS = 60 * 60
+THROUGHPUT_WINDOW_SECONDS = 60
+RETRY_AFTER_SECONDS = 5
+COPY_BUFFER_SIZE = 1024 * 1024
+DEFAULT_JOB_FILENAME = "document.pdf"
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+JOB_PATH = re.compile(r"^/jobs/([0-9a-f]{32})(/result)?$")
+
+SERVING = """Serving on http://{}:{}/ with {} worker(s) and room for {} queued job(s).
+Press Ctrl-C to stop."""
+SERVER_STOPPED = "Stopped serving. Completed {} job(s), {} failed."
+JOB_NOT_RUN = "The service stopped before the job was run"
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the job queue is full."""
+
+class Job:
+    """A compression job.
+
+    Args:
+        directory (str): Path to a directory of the job's own, which holds its files.
+        filename (str): Name of the submitted file.
+    """
+
+    def __init__(self, directory, filename):
+        self.id = os.path.basename(directory)
+        self.filename = filename
+        self.input_path = os.path.join(directory, "input", filename)
+        self.output_path = os.path.join(directory, "output", filename)
+        self.directory = directory
+        self.status = STATUS_QUEUED
+        self.result = None
+        self.submitted = time.time()
+        self.finished = None
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: The status of the job, and its result once it is done.
+        """
+        return {'id': self.id, 'filename': self.filename, 'status': self.status,
+                'submitted': self.submitted, 'finished': self.finished,
+                'result': self.result.to_dict() if self.result is not None else None}
+
+class CompressionService:
+    """A queue of compression jobs and a pool of worker threads that compress them.
+
+    Args:
+        ghostscript_binary (str): Name of the Ghostscript binary.
+        status_callback (function): A callback function for passing status messages to a view.
+        workers (int): Amount of jobs to compress in parallel.
+        queue_size (int): Maximum amount of jobs that may wait in the queue.
+        work_directory (str): Path to the directory to keep job files in. If None, a temporary
+        directory is created and removed when the service stops.
+        job_ttl (float): Amount of seconds to keep finished jobs for.
+        compress_options (dict): Keyword arguments for pdfebc.core.compress_pdf, such as cache
+        and history.
+    """
+
+    def __init__(self, ghostscript_binary, status_callback=None, workers=1,
+                 queue_size=QUEUE_SIZE_DEFAULT, work_directory=None, job_ttl=JOB_TTL_SECONDS,
+                 **compress_options):
+        self.ghostscript_binary = ghostscript_binary
+        self.status_callback = status_callback
+        self.workers = workers
+        self.queue_size = queue_size
+        self.job_ttl = job_ttl
+        self.compress_options = compress_options
+        self._owns_work_directory = work_directory is None
+        self.work_directory = work_directory or tempfile.mkdtemp(prefix="pdfebc-serve-")
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._started = time.monotonic()
+        self._finish_times = collections.deque()
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._bytes_in = 0
+        self._bytes_out = 0
+
+    def start(self):
+        """Start the worker threads.
+
+        Returns:
+            CompressionService: The service itself.
+        """
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        """Let the workers finish their current jobs and stop them. Queued jobs are marked as
+        failed without being run.
+        """
+        self._fail_queued_jobs()
+        remaining = len(self._threads)
+        while remaining:
+            try:
+                self._queue.put_nowait(None)
+                remaining -= 1
+            except queue.Full:
+                # jobs were submitted while stopping
+                remaining += self._fail_queued_jobs()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._owns_work_directory:
+            shutil.rmtree(self.work_directory, ignore_errors=True)
+
+    def create_job(self, filename):
+        """Create a job with a directory of its own, without queueing it.
+
+        Args:
+            filename (str): Name of the file to compress. Anything but the base name is ignored,
+            and names that do not end with .pdf are replaced.
+        Returns:
+            Job: The job.
+        """
+        filename = os.path.basename(filename or "")
+        if not core.is_pdf_filename(filename) or filename.startswith("."):
+            filename = DEFAULT_JOB_FILENAME
+        job = Job(os.path.join(self.work_directory, uuid.uuid4().hex), filename)
+        os.makedirs(os.path.dirname(job.input_path))
+        os.makedirs(os.path.dirname(job.output_path))
+        return job
+
+    def submit(self, job):
+        """Queue a job whose input file has been written.
+
+        Args:
+            job (Job): The job.
+        Raises:
+            QueueFullError
+        """
+        self.remove_expired_jobs()
+        with self._lock:
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self._rejected += 1
+                raise QueueFullError("The job queue is full")
+            self._jobs[job.id] = job
+            self._bytes_in += os.stat(job.input_path).st_size
+
+    def discard(self, job):
+        """Remove the files of a job that was never queued.
+
+        Args:
+            job (Job): The job.
+        """
+        shutil.rmtree(job.directory, ignore_errors=True)
+
+    def get(self, job_id):
+        """
+        Args:
+            job_id (str): The id of a job.
+        Returns:
+            Job: The job, or None if there is no such job.
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def delete(self, job_id):
+        """Remove a job that is not running, and its files. Queued jobs are skipped by the
+        workers.
+
+        Args:
+            job_id (str): The id of a job.
+        Returns:
+            bool: True if the job was removed, False if there is no such job or it is running.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status == STATUS_RUNNING:
+                return False
+            del self._jobs[job_id]
+        shutil.rmtree(job.directory, ignore_errors=True)
+        return True
+
+    def remove_expired_jobs(self):
+        """Remove finished jobs that are older than the time to live."""
+        deadline = time.time() - self.job_ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished is not None and job.finished < deadline]
+        for job_id in expired:
+            self.delete(job_id)
+
+    def metrics(self):
+        """
+        Returns:
+            dict: The queue depth, the amount of running, completed, failed and rejected jobs,
+            the throughput in jobs per second over the last minute and since the start, and the
+            amount of bytes submitted and produced.
+        """
+        now = time.monotonic()
+        with self._lock:
+            while self._finish_times and self._finish_times[0] < now - THROUGHPUT_WINDOW_SECONDS:
+                self._finish_times.popleft()
+            uptime = now - self._started
+            return {'queue_depth': self._queue.qsize(), 'queue_size': self.queue_size,
+                    'workers': self.workers, 'running': self._running,
+                    'completed': self._completed, 'failed': self._failed,
+                    'rejected': self._rejected, 'jobs': len(self._jobs),
+                    'throughput_last_minute': len(self._finish_times) / min(
+                        uptime, THROUGHPUT_WINDOW_SECONDS) if uptime > 0 else 0.0,
+                    'throughput_total': (self._completed + self._failed) / uptime
+                                        if uptime > 0 else 0.0,
+                    'bytes_in': self._bytes_in, 'bytes_out': self._bytes_out,
+                    'uptime': uptime}
+
+    def _fail_queued_jobs(self):
+        """Take every job out of the queue and mark it as failed.
+
+        Returns:
+            int: The amount of stop sentinels that were taken out of the queue.
+        """
+        sentinels = 0
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                return sentinels
+            if job is None:
+                sentinels += 1
+                continue
+            with self._lock:
+                if self._jobs.get(job.id) is not job:
+                    # deleted while queued
+                    continue
+                job.result = core.CompressionResult(job.input_path, job.output_path,
+                                                    core.ACTION_FAILED, None, None, None, None,
+                                                    None, JOB_NOT_RUN)
+                job.status = STATUS_FAILED
+                job.finished = time.time()
+                self._failed += 1
+
+    def _work(self):
+        for job in iter(self._queue.get, None):
+            with self._lock:
+                if self._jobs.get(job.id) is not job:
+                    # deleted while queued
+                    continue
+                job.status = STATUS_RUNNING
+                self._running += 1
+            try:
+                result = core.compress_pdf(job.input_path, job.output_path,
+                                           self.ghostscript_binary, self.status_callback,
+                                           **self.compress_options)
+            except Exception as e:
+                result = core.CompressionResult(job.input_path, job.output_path,
+                                                core.ACTION_FAILED, None, None, None, None, None,
+                                                repr(e))
+            with self._lock:
+                self._running -= 1
+                job.result = result
+                job.finished = time.time()
+                self._finish_times.append(time.monotonic())
+                if result.error is None:
+                    job.status = STATUS_DONE
+                    self._completed += 1
+                    self._bytes_out += result.output_bytes or 0
+                else:
+                    job.status = STATUS_FAILED
+                    self._failed += 1
+
+class RequestHandler(http_server.BaseHTTPRequestHandler):
+    """Handles the requests of the HTTP API."""
+    server_version = "pdfebc"
+
+    def log_message(self, format, *args):
+        """Requests are not logged."""
+
+    def send_json(self, status, body, headers=()):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, status, message, headers=()):
+        self.send_json(status, {'error': message}, headers)
+
+    def do_POST(self):
+        service = self.server.service
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != "/jobs":
+            self.send_error_json(404, "Not found")
+            return
+        try:
+            length = int(self.headers.get("Content-Length"))
+        except (TypeError, ValueError):
+            self.send_error_json(411, "Content-Length is required")
+            return
+        if length > self.server.max_upload_bytes:
+            self.send_error_json(413, "Files may be at most {} bytes".format(
+                self.server.max_upload_bytes))
+            return
+        name = urllib.parse.parse_qs(url.query).get("name", [None])[0]
+        job = service.create_job(name)
+        try:
+            with open(job.input_path, 'wb') as file:
+                remaining = length
+                while remaining > 0:
+                    chunk = self.rfile.read(min(COPY_BUFFER_SIZE, remaining))
+                    if not chunk:
+                        raise ConnectionError("Request body ended early")
+                    file.write(chunk)
+                    remaining -= len(chunk)
+            service.submit(job)
+        except QueueFullError as e:
+            service.discard(job)
+            self.send_error_json(503, str(e), [("Retry-After", str(RETRY_AFTER_SECONDS))])
+            return
+        except ConnectionError:
+            service.discard(job)
+            return
+        self.send_json(202, job.to_dict(), [("Location", "/jobs/" + job.id)])
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == "/metrics":
+            self.send_json(200, service.metrics())
+            return
+        match = JOB_PATH.match(self.path)
+        job = service.get(match.group(1)) if match else None
+        if job is None:
+            self.send_error_json(404, "Not found")
+        elif not match.group(2):
+            self.send_json(200, job.to_dict())
+        elif job.status != STATUS_DONE:
+            self.send_error_json(409, "Job is {}".format(job.status))
+        else:
+            self.send_file(job.output_path, job.filename)
+
+    def do_DELETE(self):
+        match = JOB_PATH.match(self.path)
+        if not match or match.group(2):
+            self.send_error_json(404, "Not found")
+        elif self.server.service.delete(match.group(1)):
+            self.send_json(200, {'id': match.group(1), 'deleted': True})
+        elif self.server.service.get(match.group(1)) is None:
+            self.send_error_json(404, "Not found")
+        else:
+            self.send_error_json(409, "Job is running")
+
+    def send_file(self, path, filename):
+        try:
+            file = open(path, 'rb')
+        except OSError:
+            self.send_error_json(410, "The result is gone")
+            return
+        with file:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/pdf")
+            self.send_header("Content-Length", str(os.fstat(file.fileno()).st_size))
+            self.send_header("Content-Disposition", 'attachment; filename="%s"' % filename)
+            self.end_headers()
+            shutil.copyfileobj(file, self.wfile, COPY_BUFFER_SIZE)
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http_server.HTTPServer):
+    """An HTTP server that handles each request in a thread of its own, and that holds the
+    compression service.
+
+    Args:
+        server_address ((str, int)): The host and port to listen on. Port 0 picks a free port.
+        service (CompressionService): The compression service.
+        max_upload_bytes (int): Maximum size of a submitted file.
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, service, max_upload_bytes=MAX_UPLOAD_BYTES_DEFAULT):
+        super().__init__(server_address, RequestHandler)
+        self.service = service
+        self.max_upload_bytes = max_upload_bytes
+
+def serve(service, host=HOST_DEFAULT, port=PORT_DEFAULT,
+          max_upload_bytes=MAX_UPLOAD_BYTES_DEFAULT, status_callback=None):
+    """Serve the HTTP API until interrupted.
+
+    Args:
+        service (CompressionService): A compression service that has not been started.
+        host (str): The host to listen on.
+        port (int): The port to listen on.
+        max_upload_bytes (int): Maximum size of a submitted file.
+        status_callback (function): A callback function for passing status messages to a view.
+    """
+    httpd = ThreadingHTTPServer((host, port), service, max_upload_bytes)
+    service.start()
+    utils.if_callable_call_with_formatted_string(status_callback, SERVING,
+                                                 *httpd.server_address[:2], service.workers,
+                                                 service.queue_size)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        service.stop()
+    metrics = service.metrics()
+    utils.if_callable_call_with_formatted_string(status_callback, SERVER_STOPPED,
+                                                 metrics['completed'], metrics['failed'])
@@ -13,11 +13,24 @@ The config file should have the following format:
     |receiver = <receiver_email>
     |smtp_server = <smtp_server>
     |smtp_port = <smtp_port>
+    |max_message_bytes = <max_message_size_in_bytes>
     |
     |[DEFAULTS]
     |gs_binary = <ghostscript_binary>
     |src = <source_dir>
     |out = <out_dir>
+    |jobs = <parallel_jobs>
+    |cache_size = <cache_size_in_megabytes>
+    |profile = <compression_profile>
+
+The 'max_message_bytes', 'jobs', 'cache_size' and 'profile' options are optional, all other
+options are mandatory. Compression profiles are defined in sections of their own, see
+pdfebc.profiles. Files are sent in as many emails as needed to keep each email below
+'max_message_bytes', which defaults to 25 MB.
+
+smtplib and the email package are only imported when an email is sent, as they make up a large
+part of the startup time of pdfebc. For the same reason, load_config keeps a snapshot of the
+parsed configuration file, that is used for as long as the file does not change.
 
 .. module:: utils
     :platform: Unix
@@ -25,17 +38,23 @@ The config file should have the following format:
 
 .. moduleauthor:: Simon Larsén <slarse@kth.se>
 """
-import smtplib
 import os
+import re
+import time
+import uuid
+import queue
+import threading
+import base64
+import json
+import tempfile
 import configparser
-from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
-from email.mime.multipart import MIMEMultipart
 from collections import defaultdict
 import appdirs
 
 CONFIG_FILENAME = 'config.cnf'
 CONFIG_PATH = os.path.join(appdirs.user_config_dir('pdfebc'), CONFIG_FILENAME)
+CONFIG_SNAPSHOT_FILENAME = 'config_snapshot.json'
+CONFIG_SNAPSHOT_PATH = os.path.join(appdirs.user_cache_dir('pdfebc'), CONFIG_SNAPSHOT_FILENAME)
 EMAIL_SECTION_KEY = "EMAIL"
 PASSWORD_KEY = "pass"
 USER_KEY = "user"
@@ -44,14 +63,31 @@ DEFAULT_SMTP_SERVER = "smtp.gmail.com"
 DEFAULT_SMTP_PORT = 587
 SMTP_SERVER_KEY = "smtp_server"
 SMTP_PORT_KEY = "smtp_port"
+MAX_MESSAGE_BYTES_KEY = "max_message_bytes"
+DEFAULT_MAX_MESSAGE_BYTES = 25 * 1024**2
 EMAIL_SECTION_KEYS = {USER_KEY, PASSWORD_KEY, RECEIVER_KEY, SMTP_SERVER_KEY, SMTP_PORT_KEY}
+EMAIL_SECTION_OPTIONAL_KEYS = {MAX_MESSAGE_BYTES_KEY}
 DEFAULT_SECTION_KEY = "DEFAULTS"
 GS_DEFAULT_BINARY_KEY = "gs_binary"
 SRC_DEFAULT_DIR_KEY = "src"
 OUT_DEFAULT_DIR_KEY = "out"
+JOBS_KEY = "jobs"
+CACHE_SIZE_KEY = "cache_size"
+PROFILE_KEY = "profile"
 DEFAULT_SECTION_KEYS = {GS_DEFAULT_BINARY_KEY, SRC_DEFAULT_DIR_KEY, OUT_DEFAULT_DIR_KEY}
+DEFAULT_SECTION_OPTIONAL_KEYS = {JOBS_KEY, CACHE_SIZE_KEY, PROFILE_KEY}
 SECTION_KEYS = {EMAIL_SECTION_KEY: EMAIL_SECTION_KEYS,
                 DEFAULT_SECTION_KEY: DEFAULT_SECTION_KEYS}
+OPTIONAL_SECTION_KEYS = {EMAIL_SECTION_KEY: EMAIL_SECTION_OPTIONAL_KEYS,
+                         DEFAULT_SECTION_KEY: DEFAULT_SECTION_OPTIONAL_KEYS}
+# estimated size of the headers of an email and its text part, and of each attachment's headers
+MESSAGE_OVERHEAD_BYTES = 4096
+ATTACHMENT_OVERHEAD_BYTES = 512
+# base64 line length, excluding the CRLF line break
+BASE64_LINE_LENGTH = 76
+# attachments are read and encoded this many bytes at a time, a whole number of base64 lines
+ATTACHMENT_CHUNK_SIZE = (BASE64_LINE_LENGTH // 4 * 3) * 16 * 1024
+CRLF = b"\r\n"
 
 SENDING_PRECONF = """Sending files ...
 From: {}
@@ -62,6 +98,22 @@ SMTP Port: {}
 Files:
 {}"""
 FILES_SENT = "Files successfully sent!"""
+SENDING_MESSAGE = "Sending email {} of {} with {} file(s), about {} bytes ..."
+MESSAGE_SENT = "Email {} of {} sent!"
+ATTACHMENT_TOO_LARGE = """'{}' is about {} bytes when attached, which is more than the limit of {} bytes.
+Sending it in an email of its own, the server may reject it."""
+MULTIPART_SUBJECT = "{} ({} of {})"
+STREAMED_SUBJECT = "{} (part {})"
+PRECONF_SUBJECT = "PDF files from pdfebc"
+SENDING_STREAMED = """Sending files as they are compressed ...
+From: {}
+To: {}
+SMTP Server: {}
+SMTP Port: {}"""
+SENDING_STREAMED_MESSAGE = "Sending email {} with {} file(s), about {} bytes ..."
+STREAMED_MESSAGE_SENT = "Email {} sent!"
+# an idle connection is checked with NOOP before it is used again
+SMTP_NOOP_AFTER_IDLE_SECONDS = 30
 
 class ConfigurationError(configparser.ParsingError):
     pass
@@ -119,6 +171,85 @@ def read_config(config_path=CONFIG_PATH):
     config = config_parser_to_defaultdict(config_parser)
     return config
 
+def config_fingerprint(config_path):
+    """
+    Args:
+        config_path (str): Path to the config file.
+    Returns:
+        list: The absolute path, modification time in nanoseconds and size of the config file,
+        which change whenever the file does.
+    Raises:
+        IOError
+    """
+    stat = os.stat(config_path)
+    return [os.path.abspath(config_path), stat.st_mtime_ns, stat.st_size]
+
+def read_config_snapshot(fingerprint, snapshot_path):
+    """
+    Args:
+        fingerprint (list): The fingerprint of the config file, see config_fingerprint.
+        snapshot_path (str): Path to the snapshot.
+    Returns:
+        defaultdict: The config of the snapshot, or None if there is no snapshot of the config
+        file with this fingerprint.
+    """
+    try:
+        with open(snapshot_path, encoding='utf-8') as file:
+            snapshot = json.load(file)
+        if snapshot['fingerprint'] != fingerprint:
+            return None
+        config = defaultdict(defaultdict)
+        for section, section_content in snapshot['config'].items():
+            config[section].update(section_content)
+        return config
+    except (IOError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+def write_config_snapshot(config, fingerprint, snapshot_path):
+    """Write a snapshot of a parsed config. The snapshot is replaced atomically, so concurrent
+    invocations never read half of one. Failing to write it is not an error, it only means that
+    the next invocation parses the config file again.
+
+    Args:
+        config (defaultdict): The parsed config.
+        fingerprint (list): The fingerprint of the config file, see config_fingerprint.
+        snapshot_path (str): Path to the snapshot.
+    """
+    directory = os.path.dirname(snapshot_path)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with open(fd, 'w', encoding='utf-8') as file:
+                json.dump(dict(fingerprint=fingerprint, config=config), file)
+            os.replace(temp_path, snapshot_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+    except OSError:
+        pass
+
+def load_config(config_path=CONFIG_PATH, snapshot_path=CONFIG_SNAPSHOT_PATH):
+    """Read the config information from the config file, or from the snapshot of it that was
+    taken the last time it was read, if the file has not changed since.
+
+    Args:
+        config_path (str): Path to the config file.
+        snapshot_path (str): Path to the snapshot of the config file.
+    Returns:
+        defaultdict: A defaultdict with the config information.
+    Raises:
+        IOError
+    """
+    if not os.path.isfile(config_path):
+        raise IOError("No config file found at %s" % config_path)
+    fingerprint = config_fingerprint(config_path)
+    config = read_config_snapshot(fingerprint, snapshot_path)
+    if config is None:
+        config = read_config(config_path)
+        write_config_snapshot(config, fingerprint, snapshot_path)
+    return config
+
 def config_parser_to_defaultdict(config_parser):
     """Convert a ConfigParser to a defaultdict.
 
@@ -132,16 +263,19 @@ def config_parser_to_defaultdict(config_parser):
                 config[section][option] = option_value
     return config
 
-def section_is_healthy(section, expected_keys):
-    """Check that the section contains all keys it should.
+def section_is_healthy(section, expected_keys, optional_keys=()):
+    """Check that the section contains all keys it should, and no keys it shouldn't.
 
     Args:
         section (defaultdict): A defaultdict.
         expected_keys (Iterable): A Set of keys that should be contained in the section.
+        optional_keys (Iterable): A Set of keys that may be contained in the section.
     Returns:
         boolean: True if the section is healthy, false if not.
     """
-    return set(section.keys()) == set(expected_keys)
+    keys = set(section.keys())
+    expected_keys = set(expected_keys)
+    return expected_keys <= keys <= expected_keys | set(optional_keys)
 
 def check_config(config):
     """Check that all sections of the config contain the keys that they should.
@@ -156,7 +290,8 @@ def check_config(config):
         if not section_content:
             raise ConfigurationError("Config file badly formed! Section {} is missing."
                                      .format(section))
-        elif not section_is_healthy(section_content, expected_section_keys):
+        elif not section_is_healthy(section_content, expected_section_keys,
+                                    OPTIONAL_SECTION_KEYS.get(section, ())):
             raise ConfigurationError("The {} section of the configuration file is badly formed!"
                                      .format(section))
 
@@ -204,22 +339,300 @@ def try_get_conf(config, section, attribute):
                              "Failed to get attribute '{}' from section '{}'!"
                              .format(attribute, section))
 
-def send_with_attachments(subject, message, filepaths, config):
-    """Send an email from the user (a gmail) to the receiver.
+def try_get_conf_or_default(config, section, attribute, default):
+    """Try to parse an optional attribute of the config file, falling back to a default
+    value if it is not there.
+
+    Args:
+        config (defaultdict): A defaultdict.
+        section (str): The section of the config file to get information from.
+        attribute (str): The attribute of the section to fetch.
+        default: The value to return if the attribute is missing or empty.
+    Returns:
+        str: The string corresponding to the section and attribute, or the default value.
+    """
+    try:
+        return try_get_conf(config, section, attribute)
+    except ConfigurationError:
+        return default
+
+class SMTPConnection:
+    """A reusable, authenticated connection to an SMTP server, for sending several emails
+    without a new handshake and login for each of them. The connection is opened when the first
+    email is sent, is checked with NOOP if it has been idle for a while, and is reopened if the
+    server has dropped it. Closes the connection on exit when used as a context manager.
+
+    Args:
+        server (str): Hostname of the SMTP server.
+        port (int): Port of the SMTP server.
+        user (str): User to log in as.
+        password (str): Password of the user.
+        use_tls (bool): Whether or not to upgrade the connection with STARTTLS before logging in.
+        noop_after_idle (float): Amount of seconds the connection may be idle before it is checked
+        with NOOP.
+    """
+
+    def __init__(self, server, port, user, password, use_tls=True,
+                 noop_after_idle=SMTP_NOOP_AFTER_IDLE_SECONDS):
+        self.server = server
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_tls = use_tls
+        self.noop_after_idle = noop_after_idle
+        self._smtp = None
+        self._last_used = None
+
+    @classmethod
+    def from_config(cls, config):
+        """Create a connection with the settings of the EMAIL section of the config.
+
+        Args:
+            config (defaultdict): A defaultdict.
+        Returns:
+            SMTPConnection: An unopened connection.
+        Raises:
+            ConfigurationError
+        """
+        return cls(try_get_conf(config, EMAIL_SECTION_KEY, SMTP_SERVER_KEY),
+                   int(try_get_conf(config, EMAIL_SECTION_KEY, SMTP_PORT_KEY)),
+                   try_get_conf(config, EMAIL_SECTION_KEY, USER_KEY),
+                   try_get_conf(config, EMAIL_SECTION_KEY, PASSWORD_KEY))
+
+    def connect(self):
+        """Open and log in on a new connection, closing the current one if there is one.
+
+        Raises:
+            smtplib.SMTPException, OSError
+        """
+        import smtplib
+        self.close()
+        smtp = smtplib.SMTP(self.server, self.port)
+        try:
+            if self.use_tls:
+                smtp.starttls()
+            smtp.login(self.user, self.password)
+        except:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        self._last_used = time.monotonic()
+
+    def is_alive(self):
+        """
+        Returns:
+            bool: True if the connection is open and the server answers NOOP.
+        """
+        import smtplib
+        if self._smtp is None:
+            return False
+        try:
+            return self._smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def ensure_connected(self):
+        """Open the connection if it is not open, or reopen it if it has been idle and does not
+        answer NOOP.
+
+        Raises:
+            smtplib.SMTPException, OSError
+        """
+        if self._smtp is None:
+            self.connect()
+        elif time.monotonic() - self._last_used >= self.noop_after_idle and not self.is_alive():
+            self.connect()
+
+    def send_message(self, email_):
+        """Send an email. If the server has dropped the connection, it is reopened and the
+        email is sent again.
+
+        Args:
+            email_ (email.message.Message): The email to send.
+        Raises:
+            smtplib.SMTPException, OSError
+        """
+        import smtplib
+        self.ensure_connected()
+        try:
+            self._smtp.send_message(email_)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            self.connect()
+            self._smtp.send_message(email_)
+        self._last_used = time.monotonic()
+
+    def send_stream(self, sender, receivers, chunk_source):
+        """Send an email whose content is produced in chunks, writing each chunk to the DATA
+        stream as it is produced, so the email is never held in memory in full. If the server has
+        dropped the connection, it is reopened and the email is sent again.
+
+        Args:
+            sender (str): Address of the sender.
+            receivers (list(str)): Addresses of the receivers.
+            chunk_source (function): A function without arguments that returns an iterable of
+            the bytes of the email, with CRLF line breaks and with every chunk ending in a line
+            break. It is called again if the email has to be resent.
+        Raises:
+            smtplib.SMTPException, OSError
+        """
+        import smtplib
+        self.ensure_connected()
+        try:
+            self._send_stream(sender, receivers, chunk_source())
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            self.connect()
+            self._send_stream(sender, receivers, chunk_source())
+        self._last_used = time.monotonic()
+
+    def _send_stream(self, sender, receivers, chunks):
+        import smtplib
+        smtp = self._smtp
+        smtp.ehlo_or_helo_if_needed()
+        code, response = smtp.mail(sender)
+        if code != 250:
+            smtp.rset()
+            raise smtplib.SMTPSenderRefused(code, response, sender)
+        refused = {}
+        for receiver in receivers:
+            code, response = smtp.rcpt(receiver)
+            if code not in (250, 251):
+                refused[receiver] = (code, response)
+        if len(refused) == len(receivers):
+            smtp.rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        smtp.putcmd("data")
+        code, response = smtp.getreply()
+        if code != 354:
+            raise smtplib.SMTPDataError(code, response)
+        try:
+            for chunk in chunks:
+                smtp.send(re.sub(rb"(?m)^\.", b"..", chunk))
+        except BaseException:
+            # the server is still reading the data, so the connection cannot be used again
+            self._smtp = None
+            smtp.close()
+            raise
+        smtp.send(b"." + CRLF)
+        code, response = smtp.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, response)
+
+    def send_messages(self, emails):
+        """Send a sequence of emails over the connection.
+
+        Args:
+            emails (Iterable[email.message.Message]): The emails to send.
+        Raises:
+            smtplib.SMTPException, OSError
+        """
+        for email_ in emails:
+            self.send_message(email_)
+
+    def close(self):
+        """Close the connection, if it is open."""
+        import smtplib
+        if self._smtp is None:
+            return
+        smtp, self._smtp = self._smtp, None
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def header_block(message):
+    """
+    Args:
+        message (email.message.EmailMessage): A message with the SMTP policy.
+    Returns:
+        bytes: The headers of the message and the blank line that ends them, with CRLF line
+        breaks. Non-ASCII headers are encoded as the policy prescribes.
+    """
+    import io
+    import email.policy
+    from email.generator import BytesGenerator
+    buffer = io.BytesIO()
+    BytesGenerator(buffer, policy=email.policy.SMTP).flatten(message)
+    headers, separator, _ = buffer.getvalue().partition(CRLF + CRLF)
+    return headers + separator
+
+def iter_attachment_chunks(filepath):
+    """Read a file in chunks and encode it with base64 one chunk at a time.
+
+    Args:
+        filepath (str): Path to the file.
+    Returns:
+        Iterable[bytes]: Base64 lines with CRLF line breaks.
+    """
+    with open(filepath, "rb") as file:
+        for chunk in iter(lambda: file.read(ATTACHMENT_CHUNK_SIZE), b""):
+            yield base64.encodebytes(chunk).replace(b"\n", CRLF)
+
+def iter_email_chunks(subject, message, filepaths, sender, receiver):
+    """Produce an email with attachments in chunks, reading and encoding one chunk of an
+    attachment at a time.
 
     Args:
         subject (str): Subject of the email.
         message (str): A message.
         filepaths (list(str)): Filepaths to files to be attached.
-        config (defaultdict): A defaultdict.
+        sender (str): Address of the sender.
+        receiver (str): Address of the receiver.
+    Returns:
+        Iterable[bytes]: The email, with CRLF line breaks.
     """
-    email_ = MIMEMultipart()
-    email_.attach(MIMEText(message))
+    import email.policy
+    from email.message import EmailMessage
+    from email.mime.text import MIMEText
+    # base64 never contains '-', so the boundary cannot occur in an attachment
+    boundary = "=" * 15 + uuid.uuid4().hex + "=="
+    delimiter = b"--" + boundary.encode("ascii")
+    email_ = EmailMessage(policy=email.policy.SMTP)
     email_["Subject"] = subject
-    email_["From"] = try_get_conf(config, EMAIL_SECTION_KEY, USER_KEY)
-    email_["To"] = try_get_conf(config, EMAIL_SECTION_KEY, RECEIVER_KEY)
-    attach_files(filepaths, email_)
-    send_email(email_, config)
+    email_["From"] = sender
+    email_["To"] = receiver
+    email_["MIME-Version"] = "1.0"
+    email_["Content-Type"] = "multipart/mixed"
+    email_.set_boundary(boundary)
+    yield header_block(email_)
+    text = MIMEText(message, policy=email.policy.SMTP).as_bytes()
+    yield delimiter + CRLF + text + CRLF
+    for filepath in filepaths:
+        # only the headers are generated, the body is encoded by iter_attachment_chunks
+        part = EmailMessage(policy=email.policy.SMTP)
+        part["Content-Type"] = "application/octet-stream"
+        part["Content-Transfer-Encoding"] = "base64"
+        part.add_header("Content-Disposition", "attachment",
+                        filename=os.path.basename(filepath))
+        yield delimiter + CRLF + header_block(part)
+        yield from iter_attachment_chunks(filepath)
+    yield delimiter + b"--" + CRLF
+
+def send_with_attachments(subject, message, filepaths, config, connection=None):
+    """Send an email from the user (a gmail) to the receiver. The attachments are encoded and
+    sent in chunks, so they are never read into memory in full.
+
+    Args:
+        subject (str): Subject of the email.
+        message (str): A message.
+        filepaths (list(str)): Filepaths to files to be attached.
+        config (defaultdict): A defaultdict.
+        connection (SMTPConnection): An open connection to send the email over. If None, a
+        connection is opened for this email only.
+    """
+    sender = try_get_conf(config, EMAIL_SECTION_KEY, USER_KEY)
+    receiver = try_get_conf(config, EMAIL_SECTION_KEY, RECEIVER_KEY)
+    chunk_source = lambda: iter_email_chunks(subject, message, filepaths, sender, receiver)
+    if connection is not None:
+        connection.send_stream(sender, [receiver], chunk_source)
+        return
+    with SMTPConnection.from_config(config) as connection:
+        connection.send_stream(sender, [receiver], chunk_source)
 
 
 def attach_files(filepaths, email_):
@@ -229,6 +642,7 @@ def attach_files(filepaths, email_):
         filepaths (list(str)): A list of filepaths.
         email_ (email.MIMEMultipart): A MIMEMultipart email_.
     """
+    from email.mime.application import MIMEApplication
     for filepath in filepaths:
         base = os.path.basename(filepath)
         with open(filepath, "rb") as file:
@@ -236,41 +650,197 @@ def attach_files(filepaths, email_):
             part["Content-Disposition"] = 'attachment; filename="%s"' % base
             email_.attach(part)
 
-def send_email(email_, config):
+def send_email(email_, config, connection=None):
     """Send an email.
 
     Args:
         email_ (email.MIMEMultipart): The email to send.
         config (defaultdict): A defaultdict.
+        connection (SMTPConnection): An open connection to send the email over. If None, a
+        connection is opened for this email only.
+    """
+    if connection is not None:
+        connection.send_message(email_)
+        return
+    with SMTPConnection.from_config(config) as connection:
+        connection.send_message(email_)
+
+def encoded_attachment_size(file_size, filename):
+    """Estimate how many bytes a file takes up in an email when attached with base64 encoding.
+
+    Args:
+        file_size (int): Size of the file in bytes.
+        filename (str): Name of the file.
+    Returns:
+        int: The estimated size of the attachment.
+    """
+    encoded_size = 4 * ((file_size + 2) // 3)
+    line_breaks = 2 * ((encoded_size + BASE64_LINE_LENGTH - 1) // BASE64_LINE_LENGTH)
+    return encoded_size + line_breaks + ATTACHMENT_OVERHEAD_BYTES + 2 * len(filename)
+
+def pack_attachments(filepaths, max_message_bytes):
+    """Pack files into as few emails as possible, with each email below a size limit, using the
+    first-fit decreasing strategy. Files that are too large to fit in any email get one of their
+    own.
+
+    Args:
+        filepaths (list(str)): A list of filepaths.
+        max_message_bytes (int): The maximum size of an email, including encoding overhead.
+    Returns:
+        list((list(str), int)): The filepaths of each email, in the same order as in the given
+        list, paired with the estimated size of the email.
     """
-    smtp_server = try_get_conf(config, EMAIL_SECTION_KEY, SMTP_SERVER_KEY)
-    smtp_port = int(try_get_conf(config, EMAIL_SECTION_KEY, SMTP_PORT_KEY))
-    user = try_get_conf(config, EMAIL_SECTION_KEY, USER_KEY)
-    password = try_get_conf(config, EMAIL_SECTION_KEY, PASSWORD_KEY)
-    server = smtplib.SMTP(smtp_server, smtp_port)
-    server.starttls()
-    server.login(user, password)
-    server.send_message(email_)
-    server.quit()
+    sizes = {filepath: encoded_attachment_size(os.stat(filepath).st_size,
+                                               os.path.basename(filepath))
+             for filepath in filepaths}
+    order = {filepath: index for index, filepath in enumerate(filepaths)}
+    bins = []
+    for filepath in sorted(filepaths, key=lambda path: sizes[path], reverse=True):
+        for bin_ in bins:
+            if bin_[1] + sizes[filepath] <= max_message_bytes:
+                bin_[0].append(filepath)
+                bin_[1] += sizes[filepath]
+                break
+        else:
+            bins.append([[filepath], MESSAGE_OVERHEAD_BYTES + sizes[filepath]])
+    return [(sorted(bin_filepaths, key=order.get), size) for bin_filepaths, size in bins]
 
 def send_files_preconf(filepaths, config_path=CONFIG_PATH, status_callback=None):
-    """Send files using the config.ini settings.
+    """Send files using the config.ini settings. The files are packed into as few emails as
+    possible without any email exceeding the 'max_message_bytes' option of the configuration,
+    and all emails are sent over the same connection.
 
     Args:
         filepaths (list(str)): A list of filepaths.
     """
     config = read_config(config_path)
-    subject = "PDF files from pdfebc"
+    subject = PRECONF_SUBJECT
     message = ""
+    max_message_bytes = int(try_get_conf_or_default(config, EMAIL_SECTION_KEY,
+                                                    MAX_MESSAGE_BYTES_KEY,
+                                                    DEFAULT_MAX_MESSAGE_BYTES))
     args = (try_get_conf(config, EMAIL_SECTION_KEY, USER_KEY),
             try_get_conf(config, EMAIL_SECTION_KEY, RECEIVER_KEY),
             try_get_conf(config, EMAIL_SECTION_KEY, SMTP_SERVER_KEY),
             try_get_conf(config, EMAIL_SECTION_KEY, SMTP_PORT_KEY),
             '\n'.join(filepaths))
     if_callable_call_with_formatted_string(status_callback, SENDING_PRECONF, *args)
-    send_with_attachments(subject, message, filepaths, config)
+    packed = pack_attachments(filepaths, max_message_bytes) or [([], MESSAGE_OVERHEAD_BYTES)]
+    with SMTPConnection.from_config(config) as connection:
+        for number, (message_filepaths, size) in enumerate(packed, start=1):
+            if size > max_message_bytes:
+                if_callable_call_with_formatted_string(status_callback, ATTACHMENT_TOO_LARGE,
+                                                       message_filepaths[0], size,
+                                                       max_message_bytes)
+            message_subject = subject
+            if len(packed) > 1:
+                message_subject = MULTIPART_SUBJECT.format(subject, number, len(packed))
+            if_callable_call_with_formatted_string(status_callback, SENDING_MESSAGE, number,
+                                                   len(packed), len(message_filepaths), size)
+            send_with_attachments(message_subject, message, message_filepaths, config, connection)
+            if_callable_call_with_formatted_string(status_callback, MESSAGE_SENT, number,
+                                                   len(packed))
     if_callable_call_with_formatted_string(status_callback, FILES_SENT)
 
+class EmailPipeline:
+    """Sends files in the background as they are added, for overlapping the sending of
+    compressed files with the compression of others. As soon as the added files make up a full
+    email, the files that fill an email best are sent, and the rest wait for more files. When the
+    pipeline is closed, the remaining files are sent in as few emails as possible. All emails
+    are sent over the same connection.
+
+    Args:
+        config (defaultdict): A defaultdict.
+        status_callback (function): A callback function for passing status messages to a view.
+    """
+
+    def __init__(self, config, status_callback=None):
+        self.config = config
+        self.status_callback = status_callback
+        self.max_message_bytes = int(try_get_conf_or_default(config, EMAIL_SECTION_KEY,
+                                                             MAX_MESSAGE_BYTES_KEY,
+                                                             DEFAULT_MAX_MESSAGE_BYTES))
+        self.messages_sent = 0
+        self._queue = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """Start sending in the background.
+
+        Returns:
+            EmailPipeline: The pipeline itself.
+        """
+        if_callable_call_with_formatted_string(
+            self.status_callback, SENDING_STREAMED,
+            try_get_conf(self.config, EMAIL_SECTION_KEY, USER_KEY),
+            try_get_conf(self.config, EMAIL_SECTION_KEY, RECEIVER_KEY),
+            try_get_conf(self.config, EMAIL_SECTION_KEY, SMTP_SERVER_KEY),
+            try_get_conf(self.config, EMAIL_SECTION_KEY, SMTP_PORT_KEY))
+        self._thread.start()
+        return self
+
+    def put(self, filepath):
+        """Add a file to be sent.
+
+        Args:
+            filepath (str): Path to the file.
+        """
+        self._queue.put(filepath)
+
+    def close(self):
+        """Send the remaining files and wait for all emails to be sent.
+
+        Raises:
+            smtplib.SMTPException, OSError: If sending any email failed.
+        """
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        if_callable_call_with_formatted_string(self.status_callback, FILES_SENT)
+
+    def _send(self, connection, filepaths, size):
+        self.messages_sent += 1
+        if size > self.max_message_bytes:
+            if_callable_call_with_formatted_string(self.status_callback, ATTACHMENT_TOO_LARGE,
+                                                   filepaths[0], size, self.max_message_bytes)
+        if_callable_call_with_formatted_string(self.status_callback, SENDING_STREAMED_MESSAGE,
+                                               self.messages_sent, len(filepaths), size)
+        send_with_attachments(STREAMED_SUBJECT.format(PRECONF_SUBJECT, self.messages_sent), "",
+                              filepaths, self.config, connection)
+        if_callable_call_with_formatted_string(self.status_callback, STREAMED_MESSAGE_SENT,
+                                               self.messages_sent)
+
+    def _run(self):
+        pending = []
+        pending_size = MESSAGE_OVERHEAD_BYTES
+        closed = False
+        try:
+            with SMTPConnection.from_config(self.config) as connection:
+                while True:
+                    filepath = self._queue.get()
+                    if filepath is None:
+                        closed = True
+                        break
+                    pending.append(filepath)
+                    pending_size += encoded_attachment_size(os.stat(filepath).st_size,
+                                                            os.path.basename(filepath))
+                    if pending_size < self.max_message_bytes:
+                        continue
+                    filepaths, size = pack_attachments(pending, self.max_message_bytes)[0]
+                    self._send(connection, filepaths, size)
+                    sent = set(filepaths)
+                    pending = [path for path in pending if path not in sent]
+                    pending_size -= size - MESSAGE_OVERHEAD_BYTES
+                for filepaths, size in pack_attachments(pending, self.max_message_bytes):
+                    self._send(connection, filepaths, size)
+        except Exception as e:
+            self._error = e
+            # keep consuming until closed, so that adding files never blocks
+            while not closed:
+                closed = self._queue.get() is None
+
 def valid_config_exists(config_path=CONFIG_PATH):
     """Verify that a valid config file exists.
 
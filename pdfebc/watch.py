@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+"""This module contains the watch mode of the pdfebc program, which compresses PDF files as soon
+as they land in the source directory. New and changed files are detected with inotify where it
+is available, and by polling the directory otherwise. Files that are still being written are left
+alone until their size and mtime have stopped changing, and are then compressed by a worker pool
+that lives for as long as the watch.
+
+The latency from a file being detected to its output being written is measured for every file,
+and summarized when the watch stops.
+
+.. module:: watch
+    :platform: Unix
+    :synopsis: Watch mode for pdfebc.
+
+.. moduleauthor:: Simon Larsén <slarse@kth.se>
+"""
+import os
+import json
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import functools
+import threading
+import collections
+from concurrent import futures
+from . import core, utils
+
+POLL_INTERVAL_DEFAULT = 1.0
+SETTLE_TIME_DEFAULT = 2.0
+LATENCY_WINDOW = 1000
+# seconds between checks for compressed files that have been removed from the source directory
+FORGET_INTERVAL = 60.0
+INOTIFY_EVENT = struct.Struct("iIII")
+INOTIFY_READ_SIZE = 64 * 1024
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+INOTIFY_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+WATCHING = """Watching '{}' for PDF files with {}.
+Output directory: '{}'
+Compressing with {} parallel job(s). Press Ctrl-C to stop."""
+WATCH_FILE_DONE = "'{}' was compressed {:.2f} seconds after it was detected."
+WATCH_SUMMARY = """Stopped watching. Compressed {} file(s).
+Latency from detection to output: mean {:.2f} s, median {:.2f} s, 95th percentile {:.2f} s, max {:.2f} s"""
+WATCH_NOTHING_DONE = "Stopped watching. No files were compressed."
+
+LatencySummary = collections.namedtuple('LatencySummary', ['count', 'mean', 'median',
+                                                           'percentile_95', 'max'])
+
+class LatencyStats:
+    """Thread-safe statistics of per-file latencies. Percentiles are computed over the most
+    recent latencies only.
+
+    Args:
+        window (int): Amount of recent latencies to compute percentiles over.
+    """
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._recent = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        """Record a latency.
+
+        Args:
+            seconds (float): The latency in seconds.
+        """
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+            self._recent.append(seconds)
+
+    def summary(self):
+        """
+        Returns:
+            LatencySummary: A summary of the recorded latencies, or None if there are none.
+        """
+        with self._lock:
+            if not self.count:
+                return None
+            recent = sorted(self._recent)
+            percentile = lambda fraction: recent[min(len(recent) - 1, int(fraction * len(recent)))]
+            return LatencySummary(self.count, self.total / self.count, percentile(0.5),
+                                  percentile(0.95), self.max)
+
+class InotifyWatcher:
+    """Detects changes to the files of a directory with inotify, through ctypes.
+
+    Args:
+        directory (str): Path to the directory to watch.
+    Raises:
+        OSError: If inotify is not available.
+    """
+    name = "inotify"
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        try:
+            inotify_init1 = libc.inotify_init1
+            self._add_watch = libc.inotify_add_watch
+        except AttributeError:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.directory = directory
+        self._fd = inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if self._add_watch(self._fd, os.fsencode(directory), INOTIFY_MASK) < 0:
+            error = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(error, "inotify_add_watch failed for '{}'".format(directory))
+
+    def changes(self, timeout):
+        """Wait for changes.
+
+        Args:
+            timeout (float): Maximum amount of seconds to wait.
+        Returns:
+            set(str): Paths to the files that have changed.
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            data = os.read(self._fd, INOTIFY_READ_SIZE)
+        except BlockingIOError:
+            return set()
+        paths = set()
+        offset = 0
+        while offset < len(data):
+            _, _, _, name_length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + name_length].rstrip(b"\0")
+            offset += name_length
+            if name:
+                paths.add(os.path.join(self.directory, os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        os.close(self._fd)
+
+class PollingWatcher:
+    """Detects changes to the files of a directory by comparing the size and mtime of its files
+    between scans.
+
+    Args:
+        directory (str): Path to the directory to watch.
+        interval (float): Amount of seconds between scans.
+    """
+    name = "polling"
+
+    def __init__(self, directory, interval=POLL_INTERVAL_DEFAULT):
+        self.directory = directory
+        self.interval = interval
+        self._signatures = self._scan()
+
+    def _scan(self):
+        signatures = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        file_stat = entry.stat()
+                        signatures[entry.path] = (file_stat.st_size, file_stat.st_mtime_ns)
+                except OSError:
+                    pass
+        return signatures
+
+    def changes(self, timeout):
+        """Wait for changes.
+
+        Args:
+            timeout (float): Maximum amount of seconds to wait.
+        Returns:
+            set(str): Paths to the files that have changed.
+        """
+        time.sleep(min(timeout, self.interval))
+        signatures = self._scan()
+        changed = {path for path, signature in signatures.items()
+                   if self._signatures.get(path) != signature}
+        self._signatures = signatures
+        return changed
+
+    def close(self):
+        pass
+
+def create_watcher(directory, poll_interval=POLL_INTERVAL_DEFAULT, use_inotify=True):
+    """Create an inotify watcher if possible, and a polling watcher otherwise.
+
+    Args:
+        directory (str): Path to the directory to watch.
+        poll_interval (float): Amount of seconds between scans of a polling watcher.
+        use_inotify (bool): Whether or not to try inotify at all.
+    Returns:
+        InotifyWatcher or PollingWatcher: The watcher.
+    """
+    if use_inotify:
+        try:
+            return InotifyWatcher(directory)
+        except OSError:
+            pass
+    return PollingWatcher(directory, poll_interval)
+
+class Debouncer:
+    """Holds back files until their size and mtime have not changed for a while, so that files
+    that are still being written are not compressed.
+
+    Args:
+        settle_time (float): Amount of seconds a file's size and mtime must stay the same.
+    """
+
+    def __init__(self, settle_time=SETTLE_TIME_DEFAULT):
+        self.settle_time = settle_time
+        # path -> [signature, time the signature was first seen, time the file was detected]
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, path, now=None):
+        """Start tracking a file, if it is not tracked already.
+
+        Args:
+            path (str): Path to the file.
+            now (float): The current time.monotonic().
+        """
+        now = time.monotonic() if now is None else now
+        if path not in self._pending:
+            self._pending[path] = [None, now, now]
+
+    def ready(self, now=None):
+        """Find the tracked files that have settled, and stop tracking them.
+
+        Args:
+            now (float): The current time.monotonic().
+        Returns:
+            list((str, (int, int), float)): The path, size and mtime, and detection time of every
+            settled file.
+        """
+        now = time.monotonic() if now is None else now
+        settled = []
+        for path, pending in list(self._pending.items()):
+            try:
+                file_stat = os.stat(path)
+            except OSError:
+                del self._pending[path]
+                continue
+            signature = (file_stat.st_size, file_stat.st_mtime_ns)
+            if signature != pending[0]:
+                pending[0], pending[1] = signature, now
+            elif now - pending[1] >= self.settle_time:
+                settled.append((path, signature, pending[2]))
+                del self._pending[path]
+        return settled
+
+class Watch:
+    """Compresses PDF files that land in a directory, until stopped.
+
+    Args:
+        source_directory (str): Path to the directory to watch.
+        output_directory (str): Path to the output directory.
+        ghostscript_binary (str): Name of the Ghostscript binary.
+        status_callback (function): A callback function for passing status messages to a view.
+        jobs (int): The amount of files to compress in parallel.
+        settle_time (float): Amount of seconds a file's size and mtime must stay the same before
+        it is compressed.
+        poll_interval (float): Amount of seconds between scans if inotify is not available.
+        use_inotify (bool): Whether or not to use inotify if it is available.
+        latency_log (file): A writable text file to write the result of every file to as JSON
+        Lines, with its latency added. If None, results are not logged.
+        compress_options (dict): Keyword arguments for pdfebc.core.compress_pdf, such as cache
+        and history.
+    """
+
+    def __init__(self, source_directory, output_directory, ghostscript_binary,
+                 status_callback=None, jobs=1, settle_time=SETTLE_TIME_DEFAULT,
+                 poll_interval=POLL_INTERVAL_DEFAULT, use_inotify=True, latency_log=None,
+                 **compress_options):
+        self.source_directory = source_directory
+        self.output_directory = output_directory
+        self.ghostscript_binary = ghostscript_binary
+        self.status_callback = status_callback
+        self.jobs = jobs
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.latency_log = latency_log
+        self.compress_options = compress_options
+        self.debouncer = Debouncer(settle_time)
+        self.latency = LatencyStats()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        # path -> (size, mtime) of the version that was last compressed
+        self._compressed = {}
+
+    def stop(self):
+        """Make a running watch stop. Files that are being compressed are finished first."""
+        self._stop.set()
+
+    def _initial_paths(self):
+        """The PDF files that are in the source directory when the watch starts and have no
+        output yet."""
+        return [entry.path for entry in core.iter_pdf_entries(self.source_directory)
+                if not os.path.exists(os.path.join(self.output_directory, entry.name))]
+
+    def _compress(self, path, detected):
+        output_path = os.path.join(self.output_directory, os.path.basename(path))
+        try:
+            result = core.compress_pdf(path, output_path, self.ghostscript_binary,
+                                       self.status_callback, **self.compress_options)
+        except Exception as e:
+            utils.if_callable_call_with_formatted_string(self.status_callback, core.FILE_FAILED,
+                                                         path, repr(e))
+            result = core.CompressionResult(path, output_path, core.ACTION_FAILED, None, None,
+                                            None, None, None, repr(e))
+        latency = time.monotonic() - detected
+        if result.error is None:
+            self.latency.record(latency)
+            utils.if_callable_call_with_formatted_string(self.status_callback, WATCH_FILE_DONE,
+                                                         path, latency)
+        with self._lock:
+            if result.error is not None:
+                # compressed again if the same file lands again
+                self._compressed.pop(path, None)
+            if self.latency_log is not None:
+                record = result.to_dict()
+                record['latency'] = latency
+                self.latency_log.write(json.dumps(record) + "\n")
+                self.latency_log.flush()
+        return result
+
+    def _forget_removed_files(self):
+        """Stop remembering the compressed versions of files that are no longer in the source
+        directory, so that a long watch does not remember every file it has seen."""
+        with self._lock:
+            paths = list(self._compressed)
+        removed = [path for path in paths if not os.path.exists(path)]
+        with self._lock:
+            for path in removed:
+                self._compressed.pop(path, None)
+
+    def _check(self, path, future):
+        """Report a compression that failed without producing a result."""
+        error = future.exception()
+        if error is not None:
+            utils.if_callable_call_with_formatted_string(self.status_callback, core.FILE_FAILED,
+                                                         path, repr(error))
+
+    def run(self):
+        """Watch the source directory until stop is called or the process is interrupted.
+
+        Returns:
+            LatencySummary: A summary of the latencies of the compressed files, or None if no
+            files were compressed.
+        """
+        os.makedirs(self.output_directory, exist_ok=True)
+        watcher = create_watcher(self.source_directory, self.poll_interval, self.use_inotify)
+        utils.if_callable_call_with_formatted_string(self.status_callback, WATCHING,
+                                                     self.source_directory, watcher.name,
+                                                     self.output_directory, self.jobs)
+        for path in self._initial_paths():
+            self.debouncer.add(path)
+        next_forget = time.monotonic() + FORGET_INTERVAL
+        try:
+            with futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                while not self._stop.is_set():
+                    if time.monotonic() >= next_forget:
+                        self._forget_removed_files()
+                        next_forget = time.monotonic() + FORGET_INTERVAL
+                    # poll quickly while files are settling, and wait for events otherwise
+                    timeout = self.debouncer.settle_time / 4 if len(self.debouncer) else 0.5
+                    for path in watcher.changes(timeout):
+                        if core.is_pdf_filename(path) and os.path.isfile(path):
+                            self.debouncer.add(path)
+                    for path, signature, detected in self.debouncer.ready():
+                        with self._lock:
+                            if self._compressed.get(path) == signature:
+                                continue
+                            self._compressed[path] = signature
+                        future = executor.submit(self._compress, path, detected)
+                        future.add_done_callback(functools.partial(self._check, path))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+        summary = self.latency.summary()
+        if summary is None:
+            utils.if_callable_call_with_formatted_string(self.status_callback, WATCH_NOTHING_DONE)
+        else:
+            utils.if_callable_call_with_formatted_string(self.status_callback, WATCH_SUMMARY,
+                                                         summary.count, summary.mean,
+                                                         summary.median, summary.percentile_95,
+                                                         summary.max)
+        return summary
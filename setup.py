@@ -20,7 +20,7 @@ setup(
     url='https://github.com/slarse/pdfebc',
     download_url='https://github.com/slarse/pdfebc/archive/v0.2.0.tar.gz',
     license=license,
-    packages=find_packages(exclude=('tests', 'docs')),
+    packages=find_packages(exclude=('tests', 'docs', 'benchmarks')),
     scripts=['bin/pdfebc'],
     tests_require=test_requirements,
     install_requires=required
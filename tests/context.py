@@ -2,4 +2,4 @@
 import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-import pdfebc.core, pdfebc.cli, pdfebc.utils
+import pdfebc.core, pdfebc.cli, pdfebc.utils, pdfebc.cache, pdfebc.scheduling, pdfebc.history, pdfebc.watch, pdfebc.server, pdfebc.profiles, pdfebc.estimate, pdfebc.libgs
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Stand-in for Ghostscript that takes a predictable amount of time and writes a predictable
+output, for testing the batch engine without real PDF rendering. It can be passed to pdfebc with
+``--ghostscript tests/fake_ghostscript.py``, and understands the invocations that pdfebc makes:
+
+- ``--version`` prints PDFEBC_FAKE_GS_VERSION.
+- ``-dNODISPLAY`` page counting prints the amount of ``/Type /Page`` objects in the file. Without
+  a file, as when only starting and quitting Ghostscript, it prints nothing.
+- Anything else "compresses" its input files to the ``-sOutputFile`` path, by writing the first
+  PDFEBC_FAKE_GS_RATIO of their concatenated bytes. With ``-dFirstPage`` or ``-dLastPage``, only
+  the share of the bytes that belongs to those pages is used, as if all pages were the same size.
+- With ``-`` as the last argument, it runs the job of pdfebc.core.InterpreterWorker from stdin,
+  and exits when stdin is closed. The first PostScript string of the job is its input path, and
+  the last two are the sentinels it prints when it fails or succeeds. The input is compressed to
+  the ``-sOutputFile`` path.
+
+A file that starts with ``%crash`` makes the fake Ghostscript abort when it compresses it.
+
+How long a compression takes, and how it ends, is controlled with environment variables:
+
+- PDFEBC_FAKE_GS_SECONDS: Seconds to sleep for every file. Defaults to 0.
+- PDFEBC_FAKE_GS_SECONDS_PER_MB: Seconds to sleep per megabyte of input. Defaults to 0.
+- PDFEBC_FAKE_GS_CPU_SECONDS_PER_MB: CPU seconds to burn per megabyte of input. Defaults to 0.
+- PDFEBC_FAKE_GS_RATIO: Output size divided by input size. Defaults to 0.5.
+- PDFEBC_FAKE_GS_EXIT_CODE: Exit code of a compression, nothing is written if it is non-zero.
+  Defaults to 0.
+- PDFEBC_FAKE_GS_EASY_ARG: An argument, such as ``-dPDFSETTINGS=/screen``, that makes a
+  compression neither sleep, burn CPU nor fail, for testing retries with fallback settings. Not
+  used if unset.
+- PDFEBC_FAKE_GS_VERSION: The version to report. Defaults to "fake".
+- PDFEBC_FAKE_GS_LOG: Path to a file that a JSON line with the arguments, inputs, output, pid,
+  start and end time of every compression is appended to. Not used if unset.
+
+Author: Simon Larsén
+"""
+import json
+import os
+import re
+import shlex
+import stat
+import sys
+import time
+
+SECONDS_VARIABLE = "PDFEBC_FAKE_GS_SECONDS"
+SECONDS_PER_MB_VARIABLE = "PDFEBC_FAKE_GS_SECONDS_PER_MB"
+CPU_SECONDS_PER_MB_VARIABLE = "PDFEBC_FAKE_GS_CPU_SECONDS_PER_MB"
+RATIO_VARIABLE = "PDFEBC_FAKE_GS_RATIO"
+EXIT_CODE_VARIABLE = "PDFEBC_FAKE_GS_EXIT_CODE"
+EASY_ARG_VARIABLE = "PDFEBC_FAKE_GS_EASY_ARG"
+VERSION_VARIABLE = "PDFEBC_FAKE_GS_VERSION"
+LOG_VARIABLE = "PDFEBC_FAKE_GS_LOG"
+
+VERSION_DEFAULT = "fake"
+RATIO_DEFAULT = 0.5
+BYTES_PER_MEGABYTE = 1024**2
+PAGE_MARKER = b"/Type /Page "
+CRASH_MARKER = b"%crash"
+POSTSCRIPT_STRING = re.compile(rb"\(((?:\\.|[^\\)])*)\)")
+
+WRAPPER = """#!/bin/sh
+{variables}
+exec {python} {script} "$@"
+"""
+
+def create_fake_ghostscript(directory, seconds=0, seconds_per_megabyte=0,
+                            cpu_seconds_per_megabyte=0, ratio=RATIO_DEFAULT, exit_code=0,
+                            easy_arg=None, version=VERSION_DEFAULT, log=None):
+    """Create an executable that runs the fake Ghostscript with the given settings, so that tests
+    do not need to change the environment of the test process.
+
+    Args:
+        directory (str): Path to the directory to create the executable in.
+        seconds (float): Seconds to sleep for every file.
+        seconds_per_megabyte (float): Seconds to sleep per megabyte of input.
+        cpu_seconds_per_megabyte (float): CPU seconds to burn per megabyte of input.
+        ratio (float): Output size divided by input size.
+        exit_code (int): Exit code of compressions.
+        easy_arg (str): An argument that makes compressions instant and successful, or None.
+        version (str): The version to report.
+        log (str): Path to the invocation log, or None to not log invocations.
+
+    Returns:
+        str: Path to the executable.
+    """
+    settings = {SECONDS_VARIABLE: seconds, SECONDS_PER_MB_VARIABLE: seconds_per_megabyte,
+                CPU_SECONDS_PER_MB_VARIABLE: cpu_seconds_per_megabyte, RATIO_VARIABLE: ratio,
+                EXIT_CODE_VARIABLE: exit_code, VERSION_VARIABLE: version}
+    if easy_arg is not None:
+        settings[EASY_ARG_VARIABLE] = easy_arg
+    if log is not None:
+        settings[LOG_VARIABLE] = log
+    variables = "\n".join("export {}={}".format(name, shlex.quote(str(value)))
+                          for name, value in sorted(settings.items()))
+    path = os.path.join(directory, 'fake_gs')
+    with open(path, 'w') as file:
+        file.write(WRAPPER.format(variables=variables, python=shlex.quote(sys.executable),
+                                  script=shlex.quote(os.path.abspath(__file__))))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    return path
+
+def read_log(path):
+    """Read the invocation log of the fake Ghostscript.
+
+    Args:
+        path (str): Path to the log.
+
+    Returns:
+        list(dict): The logged compressions, in the order they started.
+    """
+    if not os.path.isfile(path):
+        return []
+    with open(path) as file:
+        return sorted((json.loads(line) for line in file), key=lambda entry: entry['start'])
+
+def burn_cpu(seconds):
+    """Keep the CPU busy until this process has used ``seconds`` more CPU time."""
+    deadline = time.process_time() + seconds
+    while time.process_time() < deadline:
+        pass
+
+def count_pages(args):
+    for arg in args:
+        if arg.startswith("--permit-file-read="):
+            with open(arg.split("=", 1)[1], 'rb') as file:
+                return file.read().count(PAGE_MARKER)
+    return None
+
+def page_range(args, content):
+    """
+    Returns:
+        bytes: The share of the content that belongs to the pages of -dFirstPage and -dLastPage.
+    """
+    options = dict(arg.split("=", 1) for arg in args if arg.startswith(("-dFirstPage=",
+                                                                         "-dLastPage=")))
+    if not options:
+        return content
+    pages = max(1, content.count(PAGE_MARKER))
+    first = max(1, int(options.get("-dFirstPage", 1)))
+    last = min(pages, int(options.get("-dLastPage", pages)))
+    return content[len(content) * (first - 1) // pages:len(content) * last // pages]
+
+def compress(args, inputs, output_path):
+    content = b""
+    for path in inputs:
+        with open(path, 'rb') as file:
+            content += file.read()
+    if content.startswith(CRASH_MARKER):
+        os.abort()
+    content = page_range(args, content)
+    megabytes = len(content) / BYTES_PER_MEGABYTE
+    start = time.time()
+    exit_code = 0
+    if os.environ.get(EASY_ARG_VARIABLE) not in args:
+        time.sleep(float(os.environ.get(SECONDS_VARIABLE, 0)) +
+                   float(os.environ.get(SECONDS_PER_MB_VARIABLE, 0)) * megabytes)
+        burn_cpu(float(os.environ.get(CPU_SECONDS_PER_MB_VARIABLE, 0)) * megabytes)
+        exit_code = int(os.environ.get(EXIT_CODE_VARIABLE, 0))
+    if exit_code == 0:
+        ratio = float(os.environ.get(RATIO_VARIABLE, RATIO_DEFAULT))
+        with open(output_path, 'wb') as file:
+            file.write(content[:int(len(content) * ratio)])
+    log = os.environ.get(LOG_VARIABLE)
+    if log:
+        entry = dict(args=args, inputs=inputs, output=output_path, pid=os.getpid(), start=start,
+                     end=time.time(), exit_code=exit_code)
+        with open(log, 'a') as file:
+            file.write(json.dumps(entry) + "\n")
+    return exit_code
+
+def postscript_strings(line):
+    """
+    Returns:
+        list(str): The PostScript string literals of a line, unescaped.
+    """
+    return [os.fsdecode(re.sub(rb"\\(.)", rb"\1", string))
+            for string in POSTSCRIPT_STRING.findall(line)]
+
+def output_file(args):
+    return next(arg.split("=", 1)[1] for arg in args if arg.startswith("-sOutputFile="))
+
+def interpret(args):
+    for line in sys.stdin.buffer:
+        strings = postscript_strings(line)
+        input_path, (failed, ok) = strings[0], strings[-2:]
+        exit_code = compress(args, [input_path], output_file(args))
+        print(failed + "/ioerror" if exit_code else ok, flush=True)
+    return 0
+
+def main(args):
+    if "--version" in args:
+        print(os.environ.get(VERSION_VARIABLE, VERSION_DEFAULT))
+        return 0
+    if "-dNODISPLAY" in args:
+        pages = count_pages(args)
+        if pages is not None:
+            print(pages)
+        return 0
+    if args and args[-1] == "-":
+        return interpret(args)
+    return compress(args, [arg for arg in args if not arg.startswith("-")], output_file(args))
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,159 @@
+/* Stand-in for libgs, for testing pdfebc.libgs without Ghostscript. It implements the part of the
+ * gsapi that pdfebc uses, and runs the jobs of pdfebc.core.postscript_job like the fake
+ * Ghostscript of fake_ghostscript.py: the input is "compressed" to the -sOutputFile path of the
+ * instance by writing the first PDFEBC_FAKE_GS_RATIO of its bytes. Inputs that start with one of
+ * these lines behave differently:
+ *
+ * - "%crash" makes the job abort the process.
+ * - "%hang" makes the job sleep forever.
+ * - "%spin" makes the job burn CPU forever.
+ * - "%fail" makes the job fail with error code -1.
+ *
+ * If PDFEBC_FAKE_GS_LOG is set, a JSON line with the event ("init" or "run"), the pid and the
+ * arguments or the output path is appended to it.
+ *
+ * Build with: cc -shared -fPIC -o libgs.so fake_libgs.c
+ *
+ * Author: Simon Larsén
+ */
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+
+#define FAKE_REVISION 10021
+#define MAX_PATH 4096
+
+typedef struct {
+    const char *product;
+    const char *copyright;
+    long revision;
+    long revisiondate;
+} gsapi_revision_t;
+
+static void log_event(const char *event, const char *detail) {
+    const char *path = getenv("PDFEBC_FAKE_GS_LOG");
+    if (path == NULL) {
+        return;
+    }
+    FILE *log = fopen(path, "a");
+    if (log == NULL) {
+        return;
+    }
+    fprintf(log, "{\"event\": \"%s\", \"pid\": %d, \"detail\": \"", event, (int) getpid());
+    for (; *detail; detail++) {
+        if (*detail == '"' || *detail == '\\') {
+            fputc('\\', log);
+        }
+        fputc(*detail, log);
+    }
+    fputs("\"}\n", log);
+    fclose(log);
+}
+
+/* The -sOutputFile path of the instance. */
+static char output_path[MAX_PATH];
+
+int gsapi_revision(gsapi_revision_t *revision, int length) {
+    if (length < (int) sizeof(gsapi_revision_t)) {
+        return sizeof(gsapi_revision_t);
+    }
+    revision->product = "Fake Ghostscript";
+    revision->copyright = "";
+    revision->revision = FAKE_REVISION;
+    revision->revisiondate = 20231101;
+    return 0;
+}
+
+int gsapi_new_instance(void **instance, void *caller_handle) {
+    *instance = malloc(1);
+    return *instance == NULL ? -1 : 0;
+}
+
+int gsapi_set_arg_encoding(void *instance, int encoding) {
+    return 0;
+}
+
+int gsapi_init_with_args(void *instance, int argc, char **argv) {
+    char args[MAX_PATH * 4] = "";
+    for (int i = 1; i < argc; i++) {
+        strncat(args, argv[i], sizeof(args) - strlen(args) - 2);
+        strcat(args, " ");
+        if (strncmp(argv[i], "-sOutputFile=", 13) == 0) {
+            strncpy(output_path, argv[i] + 13, MAX_PATH - 1);
+        }
+    }
+    log_event("init", args);
+    return 0;
+}
+
+/* Read the PostScript string that starts at the first '(' of the text into out, and return a
+ * pointer to the character after it, or NULL if there is none. */
+static const char *read_string(const char *text, char *out) {
+    text = strchr(text, '(');
+    if (text == NULL) {
+        return NULL;
+    }
+    size_t length = 0;
+    for (text++; *text && *text != ')' && length < MAX_PATH - 1; text++) {
+        if (*text == '\\') {
+            text++;
+        }
+        out[length++] = *text;
+    }
+    out[length] = '\0';
+    return *text ? text + 1 : NULL;
+}
+
+int gsapi_run_string(void *instance, const char *program, int user_errors, int *exit_code) {
+    char input_path[MAX_PATH];
+    if (read_string(program, input_path) == NULL) {
+        return -1;
+    }
+    log_event("run", output_path);
+    FILE *input = fopen(input_path, "rb");
+    if (input == NULL) {
+        return -1;
+    }
+    fseek(input, 0, SEEK_END);
+    long size = ftell(input);
+    rewind(input);
+    char *content = malloc(size + 1);
+    size_t read = fread(content, 1, size, input);
+    content[read] = '\0';
+    fclose(input);
+    if (strncmp(content, "%crash", 6) == 0) {
+        abort();
+    }
+    if (strncmp(content, "%hang", 5) == 0) {
+        for (;;) {
+            sleep(1);
+        }
+    }
+    if (strncmp(content, "%spin", 5) == 0) {
+        for (volatile unsigned long i = 0;; i++) {
+        }
+    }
+    if (strncmp(content, "%fail", 5) == 0) {
+        free(content);
+        return -1;
+    }
+    const char *ratio = getenv("PDFEBC_FAKE_GS_RATIO");
+    FILE *output = fopen(output_path, "wb");
+    if (output == NULL) {
+        free(content);
+        return -1;
+    }
+    fwrite(content, 1, (size_t) (read * (ratio ? atof(ratio) : 0.5)), output);
+    fclose(output);
+    free(content);
+    return 0;
+}
+
+int gsapi_exit(void *instance) {
+    return 0;
+}
+
+void gsapi_delete_instance(void *instance) {
+    free(instance);
+}
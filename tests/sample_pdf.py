@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""Writes small but valid PDF files, for the tests that run real Ghostscript.
+
+Author: Simon Larsén
+"""
+
+def write_sample_pdf(path, pages=1):
+    """Write a PDF file with a line of text on every page.
+
+    Args:
+        path (str): Path to write the file to.
+        pages (int): The amount of pages.
+    """
+    page_ids = [4 + 2 * i for i in range(pages)]
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [{}] /Count {} >>".format(
+            " ".join("%d 0 R" % page_id for page_id in page_ids), pages).encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, page_id in enumerate(page_ids):
+        content = "BT /F1 24 Tf 72 720 Td (Page {}) Tj ET".format(i + 1).encode()
+        objects.append("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {} 0 R "
+                       "/Resources << /Font << /F1 3 0 R >> >> >>".format(page_id + 1).encode())
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, xref)
+    with open(path, 'wb') as file:
+        file.write(data)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""A minimal SMTP server for testing and benchmarking the email functions of pdfebc against a
+real socket. It supports EHLO, AUTH PLAIN, MAIL, RCPT, DATA, NOOP, RSET and QUIT, but not
+STARTTLS, so clients must be created with ``use_tls=False``.
+
+Author: Simon Larsén
+"""
+import base64
+import socketserver
+import threading
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Handles a single SMTP session."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b"\r\n")
+
+    def read_line(self):
+        return self.rfile.readline()
+
+    def read_data(self):
+        """Read message data up to the terminating dot, undoing dot-stuffing. If the server does
+        not keep messages, only the size of the data is returned."""
+        lines = []
+        size = 0
+        while True:
+            line = self.read_line()
+            if not line or line == b".\r\n":
+                return b"".join(lines) if self.server.keep_messages else size
+            line = line[1:] if line.startswith(b".") else line
+            size += len(line)
+            if self.server.keep_messages:
+                lines.append(line)
+
+    def authenticate(self, argument):
+        if not argument:
+            self.reply("334 ")
+            argument = self.read_line().strip().decode('ascii')
+        _, user, password = base64.b64decode(argument).decode('utf-8').split("\0")
+        if (user, password) == (self.server.user, self.server.password):
+            self.server.logins += 1
+            self.reply("235 Authentication successful")
+        else:
+            self.reply("535 Authentication failed")
+
+    def handle(self):
+        self.server.register(self.connection)
+        self.server.connections += 1
+        self.reply("220 localhost ESMTP pdfebc test server")
+        mail_from, recipients = None, []
+        while True:
+            line = self.read_line()
+            if not line:
+                break
+            command, _, argument = line.decode('ascii').strip().partition(" ")
+            command = command.upper()
+            if command == "EHLO":
+                self.reply("250-localhost")
+                self.reply("250 AUTH PLAIN")
+            elif command == "HELO":
+                self.reply("250 localhost")
+            elif command == "AUTH":
+                mechanism, _, initial_response = argument.partition(" ")
+                if mechanism.upper() != "PLAIN":
+                    self.reply("504 Unrecognized authentication type")
+                else:
+                    self.authenticate(initial_response)
+            elif command == "MAIL":
+                mail_from, recipients = argument, []
+                self.reply("250 OK")
+            elif command == "RCPT":
+                recipients.append(argument)
+                self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                self.server.messages.append((mail_from, recipients, self.read_data()))
+                self.reply("250 OK")
+            elif command in ("NOOP", "RSET"):
+                self.server.noops += command == "NOOP"
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                break
+            else:
+                self.reply("500 Unrecognized command")
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """An SMTP server on a free port of localhost that records the messages it receives.
+
+    Args:
+        user (str): The only user that may log in.
+        password (str): Password of the user.
+        keep_messages (bool): Whether or not to keep the data of received messages. If False,
+        only their size is kept.
+
+    Attributes:
+        messages (list((str, list(str), bytes))): The sender, recipients and data, or size of the
+        data, of every received message.
+        connections (int): Amount of connections that have been opened.
+        logins (int): Amount of successful logins.
+        noops (int): Amount of NOOP commands.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, user, password, keep_messages=True):
+        super().__init__(("127.0.0.1", 0), SMTPHandler)
+        self.user = user
+        self.password = password
+        self.keep_messages = keep_messages
+        self.messages = []
+        self.connections = 0
+        self.logins = 0
+        self.noops = 0
+        self._sockets = []
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def register(self, sock):
+        self._sockets.append(sock)
+
+    def drop_connections(self):
+        """Close all open client connections, as a server that times out idle clients would."""
+        for sock in self._sockets:
+            try:
+                sock.shutdown(2)
+            except OSError:
+                pass
+        self._sockets = []
+
+    def start(self):
+        """Serve in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close all connections."""
+        self.shutdown()
+        self.drop_connections()
+        self.server_close()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the cache module.
+
+Author: Simon Larsén
+"""
+import unittest
+import tempfile
+import os
+from unittest.mock import Mock, patch
+from .context import pdfebc
+
+SETTINGS = ("-sDEVICE=pdfwrite", "-dPDFSETTINGS=/ebook")
+VERSION = "9.22"
+
+def write_file(path, content):
+    """Write bytes to a file.
+
+    Args:
+        path (str): Path to the file.
+        content (bytes): The content of the file.
+    """
+    with open(path, 'wb') as file:
+        file.write(content)
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmpdir.name, 'cache')
+        self.cache = pdfebc.cache.CompressionCache(self.cache_dir)
+        self.source = os.path.join(self.tmpdir.name, 'source.pdf')
+        self.output = os.path.join(self.tmpdir.name, 'output.pdf')
+        write_file(self.source, b'source content')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_key_depends_on_content_settings_and_version(self):
+        key = self.cache.key(self.source, SETTINGS, VERSION)
+        self.assertEqual(key, self.cache.key(self.source, SETTINGS, VERSION))
+        self.assertNotEqual(key, self.cache.key(self.source, SETTINGS[:1], VERSION))
+        self.assertNotEqual(key, self.cache.key(self.source, SETTINGS, "9.50"))
+        write_file(self.source, b'other content')
+        self.assertNotEqual(key, self.cache.key(self.source, SETTINGS, VERSION))
+
+    def test_fetch_missing_entry(self):
+        key = self.cache.key(self.source, SETTINGS, VERSION)
+        self.assertFalse(self.cache.fetch(key, self.output))
+        self.assertFalse(os.path.exists(self.output))
+        self.assertEqual(1, self.cache.misses)
+
+    def test_store_then_fetch(self):
+        key = self.cache.key(self.source, SETTINGS, VERSION)
+        write_file(self.output, b'compressed')
+        self.cache.store(key, self.output)
+        os.remove(self.output)
+        self.assertTrue(self.cache.fetch(key, self.output))
+        with open(self.output, 'rb') as file:
+            self.assertEqual(b'compressed', file.read())
+        self.assertEqual(1, self.cache.hits)
+
+    def test_evict_least_recently_used(self):
+        self.cache.size_limit = 10
+        keys = []
+        for i in range(3):
+            key = str(i) * 64
+            write_file(self.output, b'x' * 5)
+            self.cache.store(key, self.output)
+            os.utime(self.cache.entry_path(key), ns=(i, i))
+            keys.append(key)
+        self.cache.evict()
+        self.assertFalse(os.path.exists(self.cache.entry_path(keys[0])))
+        self.assertTrue(os.path.exists(self.cache.entry_path(keys[1])))
+        self.assertTrue(os.path.exists(self.cache.entry_path(keys[2])))
+
+    def test_store_scans_only_when_evicting(self):
+        self.cache.size_limit = 12
+        write_file(self.output, b'x' * 5)
+        self.cache.store('0' * 64, self.output)
+        with patch.object(self.cache, 'entries', wraps=self.cache.entries) as mock_entries:
+            self.cache.store('1' * 64, self.output)
+            mock_entries.assert_not_called()
+            self.cache.store('2' * 64, self.output)
+            mock_entries.assert_called_once_with()
+        self.assertEqual(10, self.cache._size)
+        self.assertEqual(2, self.cache.stats().entries)
+
+    def test_save_stats_accumulates(self):
+        self.cache.hits, self.cache.misses = 2, 3
+        self.cache.save_stats()
+        other_cache = pdfebc.cache.CompressionCache(self.cache_dir)
+        other_cache.hits = 1
+        stats = other_cache.stats()
+        self.assertEqual(3, stats.hits)
+        self.assertEqual(3, stats.misses)
+        self.assertEqual(0, stats.entries)
+
+    @patch('pdfebc.core.ghostscript_version', return_value=VERSION)
+    @patch('subprocess.Popen', autospec=True)
+    def test_compress_pdf_cache_hit_does_not_run_ghostscript(self, mock_popen, mock_version):
+        key = self.cache.key(self.source, pdfebc.core.GHOSTSCRIPT_SETTINGS, VERSION)
+        write_file(self.output, b'compressed')
+        self.cache.store(key, self.output)
+        mock_status_callback = Mock(return_value=None)
+        with patch('pdfebc.core.FILE_SIZE_LOWER_LIMIT', 0):
+            pdfebc.core.compress_pdf(self.source, self.output,
+                                     pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT,
+                                     mock_status_callback, self.cache)
+        mock_popen.assert_not_called()
+        mock_status_callback.assert_any_call(pdfebc.core.CACHE_HIT.format(self.source))
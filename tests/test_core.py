@@ -5,9 +5,23 @@ Author: Simon Larsén
 """
 import unittest
 import tempfile
+import json
+import io
+import asyncio
+import time
+import stat
+import sys
+import subprocess
 import os
+import threading
+import signal
+import resource
+import shutil
+from concurrent import futures
 from unittest.mock import Mock, patch
 from .context import pdfebc
+from .fake_ghostscript import create_fake_ghostscript, read_log
+from .sample_pdf import write_sample_pdf
 
 PDF_FILE_EXTENSION = '.pdf'
 OTHER_FILE_EXTENSIONS = ['.png', '.bmp', '.txt', '.sh', '.py']
@@ -29,6 +43,69 @@ def create_temporary_files_with_suffixes(directory, suffixes=[PDF_FILE_EXTENSION
                  for i in range(files_per_suffix) for suffix in suffixes]
     return filepaths
 
+SLEEPING_GHOSTSCRIPT = """#!/bin/sh
+# Stand-in for Ghostscript that sleeps for as many seconds as the input file says, and then
+# copies the input to the output.
+for arg; do
+    case "$arg" in -sOutputFile=*) out="${arg#-sOutputFile=}";; esac
+    last="$arg"
+done
+sleep "$(cat "$last")"
+cp "$last" "$out"
+"""
+
+def create_sleeping_ghostscript(directory):
+    """Create an executable Ghostscript stand-in that sleeps for as long as its input file says.
+
+    Args:
+        directory (str): Path to the directory to create the executable in.
+
+    Returns:
+        str: Path to the executable.
+    """
+    path = os.path.join(directory, 'sleeping_gs')
+    with open(path, 'w') as file:
+        file.write(SLEEPING_GHOSTSCRIPT)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    return path
+
+RUSAGE = Mock(ru_utime=0.5, ru_stime=0.25)
+
+def fake_compress_pdf(filepath, output_path, *args, **kwargs):
+    """Stand-in for pdfebc.core.compress_pdf that creates an empty output.
+
+    Returns:
+        pdfebc.core.CompressionResult: A successful result.
+    """
+    open(output_path, 'w').close()
+    return pdfebc.core.CompressionResult(filepath, output_path, pdfebc.core.ACTION_COMPRESSED,
+                                         0, 0, 0.0, 0.0, 0, None)
+
+def output_paths(results):
+    """
+    Args:
+        results (list(pdfebc.core.CompressionResult)): Compression results.
+
+    Returns:
+        list(str): The output paths of the successful results.
+    """
+    return [result.output_path for result in results if result.error is None]
+
+def run_coroutine(coroutine):
+    """Run a coroutine to completion in a fresh event loop.
+
+    Args:
+        coroutine: The coroutine to run.
+
+    Returns:
+        The result of the coroutine.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
 class CoreTest(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -105,8 +182,10 @@ class CoreTest(unittest.TestCase):
             mock_status_callback.assert_any_call(expected_not_compressing_message)
             mock_status_callback.assert_any_call(expected_done_message)
 
+    @patch('os.wait4', return_value=(1, 0, RUSAGE))
     @patch('subprocess.Popen', autospec=True)
-    def test_compress_adequately_sized_pdf(self, mock_popen):
+    def test_compress_adequately_sized_pdf(self, mock_popen, mock_wait4):
+        mock_popen.return_value.pid = 1
         # change the lower limit for file size, is reset in the setUp method
         pdfebc.core.FILE_SIZE_LOWER_LIMIT = 0
         with tempfile.TemporaryDirectory(dir=self.trash_can.name) as tmpoutdir:
@@ -114,9 +193,13 @@ class CoreTest(unittest.TestCase):
             pdf_file = create_temporary_files_with_suffixes(self.trash_can.name, files_per_suffix=1)[0]
             pdf_file.close()
             output_path = os.path.join(tmpoutdir, os.path.basename(pdf_file.name))
-            pdfebc.core.compress_pdf(pdf_file.name, output_path,
-                                     pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT, mock_status_callback)
+            result = pdfebc.core.compress_pdf(pdf_file.name, output_path,
+                                              pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT,
+                                              mock_status_callback)
             mock_popen.assert_called_once()
+            self.assertEqual(pdfebc.core.ACTION_COMPRESSED, result.action)
+            self.assertEqual(0, result.exit_code)
+            self.assertEqual(0.75, result.cpu_time)
             mock_popen_instance = mock_popen([])
             mock_popen_instance.communicate.assert_called_once()
             mock_status_callback.assert_called()
@@ -125,7 +208,487 @@ class CoreTest(unittest.TestCase):
             mock_status_callback.assert_any_call(expected_compressing_message)
             mock_status_callback.assert_any_call(expected_done_message)
 
+    @patch('pdfebc.core.compress_pdf', autospec=True)
+    def test_compress_multiple_pdfs_in_parallel_keeps_order(self, mock_compress_pdf):
+        mock_compress_pdf.side_effect = fake_compress_pdf
+        with tempfile.TemporaryDirectory() as tmpdir, tempfile.TemporaryDirectory() as tmpoutdir:
+            create_temporary_files_with_suffixes(tmpdir, files_per_suffix=10)
+            source_paths = pdfebc.core.get_pdf_filenames_at(tmpdir)
+            expected_out_paths = [os.path.join(tmpoutdir, os.path.basename(path))
+                                  for path in source_paths]
+            results = pdfebc.core.compress_multiple_pdfs(tmpdir, tmpoutdir,
+                                                         pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT,
+                                                         jobs=4)
+            self.assertEqual(expected_out_paths, output_paths(results))
+            self.assertEqual(len(source_paths), mock_compress_pdf.call_count)
+
+    @patch('pdfebc.core.compress_pdf', autospec=True)
+    def test_compress_multiple_pdfs_failure_does_not_abort_batch(self, mock_compress_pdf):
+        with tempfile.TemporaryDirectory() as tmpdir, tempfile.TemporaryDirectory() as tmpoutdir:
+            create_temporary_files_with_suffixes(tmpdir, files_per_suffix=5)
+            source_paths = pdfebc.core.get_pdf_filenames_at(tmpdir)
+            failing_path = source_paths[2]
+            error = OSError("disk full")
+            def compress(filepath, *args, **kwargs):
+                if filepath == failing_path:
+                    raise error
+                return fake_compress_pdf(filepath, *args, **kwargs)
+            mock_compress_pdf.side_effect = compress
+            mock_status_callback = Mock(return_value=None)
+            results = pdfebc.core.compress_multiple_pdfs(tmpdir, tmpoutdir,
+                                                         pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT,
+                                                         mock_status_callback, jobs=2)
+            expected_out_paths = [os.path.join(tmpoutdir, os.path.basename(path))
+                                  for path in source_paths if path != failing_path]
+            self.assertEqual(expected_out_paths, output_paths(results))
+            self.assertEqual(pdfebc.core.ACTION_FAILED, results[2].action)
+            self.assertEqual(repr(error), results[2].error)
+            mock_status_callback.assert_any_call(
+                pdfebc.core.FILE_FAILED.format(failing_path, repr(error)))
+
+    @patch('pdfebc.core.compress_pdf', autospec=True)
+    def test_compress_multiple_pdfs_passes_results_to_callback(self, mock_compress_pdf):
+        mock_compress_pdf.side_effect = fake_compress_pdf
+        with tempfile.TemporaryDirectory() as tmpdir, tempfile.TemporaryDirectory() as tmpoutdir:
+            create_temporary_files_with_suffixes(tmpdir, files_per_suffix=6)
+            mock_result_callback = Mock(return_value=None)
+            results = pdfebc.core.compress_multiple_pdfs(tmpdir, tmpoutdir,
+                                                         pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT,
+                                                         jobs=2,
+                                                         result_callback=mock_result_callback)
+            self.assertCountEqual(results, [call[0][0] for call in
+                                            mock_result_callback.call_args_list])
+
+    def test_compress_multiple_pdfs_with_non_positive_jobs(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with self.assertRaises(ValueError):
+                pdfebc.core.compress_multiple_pdfs(tmpdir, tmpdir,
+                                                   pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT, jobs=0)
+
+    @patch('pdfebc.core.compress_pdf', autospec=True)
+    def test_compress_multiple_pdfs_writes_manifest(self, mock_compress_pdf):
+        mock_compress_pdf.side_effect = fake_compress_pdf
+        with tempfile.TemporaryDirectory() as tmpdir, tempfile.TemporaryDirectory() as tmpoutdir:
+            create_temporary_files_with_suffixes(tmpdir, files_per_suffix=3)
+            source_paths = pdfebc.core.get_pdf_filenames_at(tmpdir)
+            pdfebc.core.compress_multiple_pdfs(tmpdir, tmpoutdir,
+                                               pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT)
+            manifest = pdfebc.core.read_manifest(tmpoutdir)
+            self.assertEqual({os.path.abspath(path) for path in source_paths}, set(manifest))
+            for source_path in source_paths:
+                file_stat = os.stat(source_path)
+                self.assertEqual([file_stat.st_mtime_ns, file_stat.st_size, file_stat.st_ino,
+                                  pdfebc.core.settings_digest(pdfebc.core.GHOSTSCRIPT_SETTINGS),
+                                  os.path.basename(source_path)],
+                                 manifest[os.path.abspath(source_path)])
+            self.assertEqual([pdfebc.core.MANIFEST_FILENAME],
+                             [name for name in os.listdir(tmpoutdir)
+                              if name.startswith(pdfebc.core.MANIFEST_FILENAME)])
+
+    @patch('pdfebc.core.compress_pdf', autospec=True)
+    def test_compress_multiple_pdfs_incremental_recompresses_with_other_settings(
+            self, mock_compress_pdf):
+        mock_compress_pdf.side_effect = fake_compress_pdf
+        with tempfile.TemporaryDirectory() as tmpdir, tempfile.TemporaryDirectory() as tmpoutdir:
+            create_temporary_files_with_suffixes(tmpdir, files_per_suffix=3)
+            source_paths = pdfebc.core.get_pdf_filenames_at(tmpdir)
+            pdfebc.core.compress_multiple_pdfs(tmpdir, tmpoutdir,
+                                               pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT,
+                                               incremental=True)
+            mock_compress_pdf.reset_mock()
+            rules = [(os.path.basename(source_paths[0]), pdfebc.core.FALLBACK_SETTINGS)]
+            results = pdfebc.core.compress_multiple_pdfs(tmpdir, tmpoutdir,
+                                                         pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT,
+                                                         incremental=True, settings_rules=rules)
+            mock_compress_pdf.assert_called_once()
+            self.assertEqual(source_paths[0], mock_compress_pdf.call_args[0][0])
+            self.assertEqual([pdfebc.core.ACTION_COMPRESSED, pdfebc.core.ACTION_SKIPPED,
+                              pdfebc.core.ACTION_SKIPPED],
+                             [result.action for result in results])
+
+    @patch('pdfebc.core.compress_pdf', autospec=True)
+    def test_compress_multiple_pdfs_incremental_skips_unchanged(self, mock_compress_pdf):
+        mock_compress_pdf.side_effect = fake_compress_pdf
+        with tempfile.TemporaryDirectory() as tmpdir, tempfile.TemporaryDirectory() as tmpoutdir:
+            create_temporary_files_with_suffixes(tmpdir, files_per_suffix=3)
+            source_paths = pdfebc.core.get_pdf_filenames_at(tmpdir)
+            first_results = pdfebc.core.compress_multiple_pdfs(
+                tmpdir, tmpoutdir, pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT, incremental=True)
+            mock_compress_pdf.reset_mock()
+            with open(source_paths[0], 'w') as file:
+                file.write("changed")
+            second_results = pdfebc.core.compress_multiple_pdfs(
+                tmpdir, tmpoutdir, pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT, incremental=True)
+            mock_compress_pdf.assert_called_once()
+            self.assertEqual(source_paths[0], mock_compress_pdf.call_args[0][0])
+            self.assertEqual(output_paths(first_results), output_paths(second_results))
+            self.assertEqual([pdfebc.core.ACTION_COMPRESSED, pdfebc.core.ACTION_SKIPPED,
+                              pdfebc.core.ACTION_SKIPPED],
+                             [result.action for result in second_results])
+
+    @patch('pdfebc.core.compress_pdf', autospec=True)
+    def test_compress_multiple_pdfs_incremental_removes_orphaned_outputs(self, mock_compress_pdf):
+        mock_compress_pdf.side_effect = fake_compress_pdf
+        with tempfile.TemporaryDirectory() as tmpdir, tempfile.TemporaryDirectory() as tmpoutdir:
+            create_temporary_files_with_suffixes(tmpdir, files_per_suffix=3)
+            out_paths = output_paths(pdfebc.core.compress_multiple_pdfs(
+                tmpdir, tmpoutdir, pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT, incremental=True))
+            removed_source = pdfebc.core.get_pdf_filenames_at(tmpdir)[1]
+            os.remove(removed_source)
+            remaining_out_paths = output_paths(pdfebc.core.compress_multiple_pdfs(
+                tmpdir, tmpoutdir, pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT, incremental=True))
+            removed_output = os.path.join(tmpoutdir, os.path.basename(removed_source))
+            self.assertFalse(os.path.exists(removed_output))
+            self.assertEqual([path for path in out_paths if path != removed_output],
+                             remaining_out_paths)
+
+    def test_iter_pdf_entries_matches_extension_case_insensitively(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = create_temporary_files_with_suffixes(tmpdir, suffixes=['.pdf', '.PDF', '.Pdf'],
+                                                         files_per_suffix=2)
+            filepaths = [entry.path for entry in pdfebc.core.iter_pdf_entries(tmpdir)]
+            self.assert_filepaths_match_file_names(filepaths, files)
+
+    def test_iter_pdf_entries_recursive(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            subdir = os.path.join(tmpdir, 'sub', 'subsub')
+            os.makedirs(subdir)
+            files = (create_temporary_files_with_suffixes(tmpdir, files_per_suffix=2)
+                     + create_temporary_files_with_suffixes(subdir, files_per_suffix=2))
+            flat_filepaths = [entry.path for entry in pdfebc.core.iter_pdf_entries(tmpdir)]
+            recursive_filepaths = [entry.path for entry in
+                                   pdfebc.core.iter_pdf_entries(tmpdir, recursive=True)]
+            self.assertEqual(2, len(flat_filepaths))
+            self.assert_filepaths_match_file_names(recursive_filepaths, files)
+
+    def test_iter_pdf_entries_skips_directories(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            outdir = os.path.join(tmpdir, 'out')
+            os.makedirs(outdir)
+            files = create_temporary_files_with_suffixes(tmpdir, files_per_suffix=2)
+            create_temporary_files_with_suffixes(outdir, files_per_suffix=2)
+            filepaths = [entry.path for entry in
+                         pdfebc.core.iter_pdf_entries(tmpdir, recursive=True,
+                                                      skip_directories=[outdir])]
+            self.assert_filepaths_match_file_names(filepaths, files)
+
+    def test_iter_pdf_entries_include_and_exclude(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            subdir = os.path.join(tmpdir, 'lectures')
+            os.makedirs(subdir)
+            for path in [os.path.join(subdir, 'l1.pdf'), os.path.join(subdir, 'l2-draft.pdf'),
+                         os.path.join(tmpdir, 'notes.pdf')]:
+                open(path, 'w').close()
+            filepaths = [entry.path for entry in
+                         pdfebc.core.iter_pdf_entries(tmpdir, recursive=True,
+                                                      include=['lectures/*'],
+                                                      exclude=['*-draft.pdf'])]
+            self.assertEqual([os.path.join(subdir, 'l1.pdf')], filepaths)
 
+    @patch('pdfebc.core.compress_pdf', autospec=True)
+    def test_compress_multiple_pdfs_recursive_mirrors_directories(self, mock_compress_pdf):
+        mock_compress_pdf.side_effect = fake_compress_pdf
+        with tempfile.TemporaryDirectory() as tmpdir, tempfile.TemporaryDirectory() as tmpoutdir:
+            subdir = os.path.join(tmpdir, 'sub')
+            os.makedirs(subdir)
+            source_path = os.path.join(subdir, 'file.pdf')
+            open(source_path, 'w').close()
+            results = pdfebc.core.compress_multiple_pdfs(tmpdir, tmpoutdir,
+                                                         pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT,
+                                                         recursive=True)
+            expected_output = os.path.join(tmpoutdir, 'sub', 'file.pdf')
+            self.assertEqual([expected_output], output_paths(results))
+            self.assertTrue(os.path.isdir(os.path.dirname(expected_output)))
+            self.assertEqual(expected_output, mock_compress_pdf.call_args[0][1])
+
+    def test_copy_file_link(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source = os.path.join(tmpdir, 'source.pdf')
+            destination = os.path.join(tmpdir, 'destination.pdf')
+            with open(source, 'wb') as file:
+                file.write(b'content')
+            method = pdfebc.core.copy_file(source, destination, link=True)
+            self.assertEqual(pdfebc.core.COPY_LINK, method)
+            self.assertTrue(os.path.samefile(source, destination))
+
+    @unittest.skipUnless(hasattr(os, 'copy_file_range'), "requires os.copy_file_range")
+    def test_copy_file_with_copy_file_range(self):
+        self.assert_copy_file_method(pdfebc.core.COPY_FILE_RANGE)
+
+    @patch('os.copy_file_range', create=True, side_effect=OSError("not supported"))
+    def test_copy_file_falls_back_to_sendfile(self, mock_copy_file_range):
+        self.assert_copy_file_method(pdfebc.core.COPY_SENDFILE)
+
+    @patch('os.sendfile', create=True, side_effect=OSError("not supported"))
+    @patch('os.copy_file_range', create=True, side_effect=OSError("not supported"))
+    def test_copy_file_falls_back_to_buffered_copy(self, mock_copy_file_range, mock_sendfile):
+        self.assert_copy_file_method(pdfebc.core.COPY_BUFFERED)
+
+    @patch('subprocess.Popen', autospec=True)
+    def test_compress_too_small_pdf_does_not_spawn_process(self, mock_popen):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source = os.path.join(tmpdir, 'source.pdf')
+            output = os.path.join(tmpdir, 'output.pdf')
+            with open(source, 'wb') as file:
+                file.write(b'small')
+            pdfebc.core.compress_pdf(source, output, pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT,
+                                     link_small=True)
+            mock_popen.assert_not_called()
+            self.assertTrue(os.path.samefile(source, output))
+
+    def test_page_ranges(self):
+        self.assertEqual([(1, 3), (4, 6), (7, 8), (9, 10)], pdfebc.core.page_ranges(10, 4))
+        self.assertEqual([(1, 1), (2, 2)], pdfebc.core.page_ranges(2, 4))
+        self.assertEqual([(1, 7)], pdfebc.core.page_ranges(7, 1))
+
+    @patch('pdfebc.core.ghostscript_page_count', return_value=10)
+    @patch('pdfebc.core.run_ghostscript')
+    def test_compress_pdf_split(self, mock_run_ghostscript, mock_page_count):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source = os.path.join(tmpdir, 'source.pdf')
+            output = os.path.join(tmpdir, 'output.pdf')
+            open(source, 'w').close()
+            pdfebc.core.compress_pdf_split(source, output, pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT,
+                                           chunks=3)
+            *chunk_calls, merge_call = [call[0][0] for call in mock_run_ghostscript.call_args_list]
+            page_args = sorted((args[-4], args[-3]) for args in chunk_calls)
+            self.assertEqual([("-dFirstPage=1", "-dLastPage=4"), ("-dFirstPage=5", "-dLastPage=7"),
+                              ("-dFirstPage=8", "-dLastPage=10")], page_args)
+            chunk_outputs = sorted(args[-2][len("-sOutputFile="):] for args in chunk_calls)
+            self.assertEqual(chunk_outputs, merge_call[-3:])
+            self.assertIn("-sOutputFile=%s" % output, merge_call)
+            self.assertEqual(['source.pdf'], os.listdir(tmpdir))
+
+    @patch('pdfebc.core.ghostscript_page_count', side_effect=[10, 9])
+    @patch('pdfebc.core.run_ghostscript')
+    def test_compress_pdf_split_page_count_mismatch(self, mock_run_ghostscript, mock_page_count):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source = os.path.join(tmpdir, 'source.pdf')
+            open(source, 'w').close()
+            with self.assertRaises(pdfebc.core.CompressionError):
+                pdfebc.core.compress_pdf_split(source, os.path.join(tmpdir, 'output.pdf'),
+                                               pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT)
+
+    @patch('os.wait4', return_value=(1, 0, RUSAGE))
+    @patch('pdfebc.core.compress_pdf_split', return_value=1.0)
+    @patch('subprocess.Popen', autospec=True)
+    def test_compress_pdf_splits_files_above_threshold(self, mock_popen, mock_split, mock_wait4):
+        mock_popen.return_value.pid = 1
+        pdfebc.core.FILE_SIZE_LOWER_LIMIT = 0
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source = os.path.join(tmpdir, 'source.pdf')
+            output = os.path.join(tmpdir, 'output.pdf')
+            with open(source, 'wb') as file:
+                file.write(b'x' * 100)
+            pdfebc.core.compress_pdf(source, output, pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT,
+                                     split_threshold=101)
+            mock_split.assert_not_called()
+            pdfebc.core.compress_pdf(source, output, pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT,
+                                     split_threshold=100, split_chunks=8)
+            mock_split.assert_called_once_with(source, output,
+                                               pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT, 8, None,
+                                               None, pdfebc.core.GHOSTSCRIPT_SETTINGS)
+            mock_popen.assert_called_once()
+
+    def test_compression_result_to_dict(self):
+        result = pdfebc.core.CompressionResult('in.pdf', 'out.pdf', pdfebc.core.ACTION_COMPRESSED,
+                                               200, 50, 1.5, 1.25, 0, None)
+        result_dict = result.to_dict()
+        self.assertEqual(0.25, result_dict['compression_ratio'])
+        self.assertEqual(200, result_dict['input_bytes'])
+        self.assertEqual(pdfebc.core.ACTION_COMPRESSED, result_dict['action'])
+
+    def test_write_results_json_lines(self):
+        results = [pdfebc.core.CompressionResult('{}.pdf'.format(i), 'out{}.pdf'.format(i),
+                                                 pdfebc.core.ACTION_COPIED, 10, 10, 0.1, None,
+                                                 None, None)
+                   for i in range(3)]
+        file = io.StringIO()
+        pdfebc.core.write_results_json_lines(results, file)
+        lines = file.getvalue().splitlines()
+        self.assertEqual([result.to_dict() for result in results],
+                         [json.loads(line) for line in lines])
+
+    @patch('os.wait4', return_value=(1, 1 << 8, RUSAGE))
+    @patch('subprocess.Popen', autospec=True)
+    def test_compress_pdf_ghostscript_failure(self, mock_popen, mock_wait4):
+        mock_popen.return_value.pid = 1
+        pdfebc.core.FILE_SIZE_LOWER_LIMIT = 0
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source = os.path.join(tmpdir, 'source.pdf')
+            open(source, 'w').close()
+            result = pdfebc.core.compress_pdf(source, os.path.join(tmpdir, 'output.pdf'),
+                                              pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT)
+            self.assertEqual(pdfebc.core.ACTION_FAILED, result.action)
+            self.assertEqual(1, result.exit_code)
+            self.assertEqual(pdfebc.core.GS_EXIT_CODE.format(1), result.error)
+
+    def create_sleeping_pdfs(self, directory, sleep_times):
+        """Create PDF files for the sleeping Ghostscript stand-in.
+
+        Args:
+            directory (str): Path to the directory to create the files in.
+            sleep_times (list(float)): The amount of seconds each file should take to "compress".
+
+        Returns:
+            list((str, str)): Pairs of source paths and output paths.
+        """
+        paths = []
+        for i, sleep_time in enumerate(sleep_times):
+            source = os.path.join(directory, '{}.pdf'.format(i))
+            with open(source, 'w') as file:
+                file.write(str(sleep_time))
+            paths.append((source, os.path.join(directory, 'out{}.pdf'.format(i))))
+        return paths
+
+    def test_compress_many_async_yields_in_completion_order(self):
+        pdfebc.core.FILE_SIZE_LOWER_LIMIT = 0
+        with tempfile.TemporaryDirectory() as tmpdir:
+            gs = create_sleeping_ghostscript(tmpdir)
+            paths = self.create_sleeping_pdfs(tmpdir, [0.6, 0.1, 0.3])
+            async def collect():
+                return [result async for result in
+                        pdfebc.core.compress_many_async(paths, gs, concurrency=3)]
+            start = time.monotonic()
+            results = run_coroutine(collect())
+            elapsed = time.monotonic() - start
+            self.assertEqual([paths[1][0], paths[2][0], paths[0][0]],
+                             [result.source_path for result in results])
+            self.assertTrue(all(result.error is None for result in results))
+            self.assertTrue(all(os.path.isfile(output) for _, output in paths))
+            self.assertLess(elapsed, 0.9)
+
+    def test_compress_many_async_respects_concurrency(self):
+        pdfebc.core.FILE_SIZE_LOWER_LIMIT = 0
+        with tempfile.TemporaryDirectory() as tmpdir:
+            gs = create_sleeping_ghostscript(tmpdir)
+            paths = self.create_sleeping_pdfs(tmpdir, [0.2] * 4)
+            async def collect():
+                return [result async for result in
+                        pdfebc.core.compress_many_async(paths, gs, concurrency=2)]
+            start = time.monotonic()
+            run_coroutine(collect())
+            self.assertGreaterEqual(time.monotonic() - start, 0.4)
+
+    def test_compress_many_async_timeout_kills_child(self):
+        pdfebc.core.FILE_SIZE_LOWER_LIMIT = 0
+        with tempfile.TemporaryDirectory() as tmpdir:
+            gs = create_sleeping_ghostscript(tmpdir)
+            paths = self.create_sleeping_pdfs(tmpdir, [5, 0.1])
+            async def collect():
+                return [result async for result in
+                        pdfebc.core.compress_many_async(paths, gs, concurrency=2, timeout=0.5,
+                                                        min_savings=0)]
+            start = time.monotonic()
+            results = dict((result.source_path, result) for result in run_coroutine(collect()))
+            self.assertLess(time.monotonic() - start, 2)
+            self.assertEqual(pdfebc.core.ACTION_FAILED, results[paths[0][0]].action)
+            self.assertIn('TimeoutError', results[paths[0][0]].error)
+            self.assertEqual(pdfebc.core.ACTION_COMPRESSED, results[paths[1][0]].action)
+            self.assertFalse(os.path.exists(paths[0][1]))
+
+    def test_compress_pdf_async_cancellation_kills_child(self):
+        pdfebc.core.FILE_SIZE_LOWER_LIMIT = 0
+        with tempfile.TemporaryDirectory() as tmpdir:
+            gs = create_sleeping_ghostscript(tmpdir)
+            (source, output), = self.create_sleeping_pdfs(tmpdir, [5])
+            async def cancel_soon():
+                task = asyncio.ensure_future(pdfebc.core.compress_pdf_async(source, output, gs))
+                await asyncio.sleep(0.2)
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+            start = time.monotonic()
+            run_coroutine(cancel_soon())
+            self.assertLess(time.monotonic() - start, 2)
+            self.assertFalse(os.path.exists(output))
+
+    def test_compress_pdf_async_matches_compress_pdf(self):
+        pdfebc.core.FILE_SIZE_LOWER_LIMIT = 0
+        with tempfile.TemporaryDirectory() as tmpdir:
+            gs = create_sleeping_ghostscript(tmpdir)
+            (source, output), = self.create_sleeping_pdfs(tmpdir, [0])
+            compression_cache = pdfebc.cache.CompressionCache(os.path.join(tmpdir, 'cache'))
+            history = pdfebc.history.CompressionHistory(os.path.join(tmpdir, 'history.json'))
+            expected = pdfebc.core.compress_pdf(source, output, gs)
+            actions = [run_coroutine(pdfebc.core.compress_pdf_async(
+                source, output, gs, cache=compression_cache, history=history)).action
+                       for _ in range(2)]
+            self.assertEqual(pdfebc.core.ACTION_KEPT_ORIGINAL, expected.action)
+            self.assertEqual([pdfebc.core.ACTION_KEPT_ORIGINAL, pdfebc.core.ACTION_COPIED],
+                             actions)
+            result = run_coroutine(pdfebc.core.compress_pdf_async(
+                source, output, gs, cache=compression_cache, min_savings=0))
+            self.assertEqual(pdfebc.core.ACTION_CACHED, result.action)
+
+    def test_compress_pdf_keeps_original_when_not_smaller(self):
+        pdfebc.core.FILE_SIZE_LOWER_LIMIT = 0
+        with tempfile.TemporaryDirectory() as tmpdir:
+            gs = create_sleeping_ghostscript(tmpdir)
+            (source, output), = self.create_sleeping_pdfs(tmpdir, [0])
+            mock_status_callback = Mock(return_value=None)
+            result = pdfebc.core.compress_pdf(source, output, gs, mock_status_callback)
+            self.assertEqual(pdfebc.core.ACTION_KEPT_ORIGINAL, result.action)
+            self.assertIsNone(result.error)
+            with open(source, 'rb') as source_file, open(output, 'rb') as output_file:
+                self.assertEqual(source_file.read(), output_file.read())
+            mock_status_callback.assert_any_call(pdfebc.core.NOT_SMALLER.format(
+                source, pdfebc.core.MIN_SAVINGS_DEFAULT, result.input_bytes, result.input_bytes))
+
+    def test_compress_pdf_keeps_output_that_is_small_enough(self):
+        pdfebc.core.FILE_SIZE_LOWER_LIMIT = 0
+        with tempfile.TemporaryDirectory() as tmpdir:
+            gs = create_sleeping_ghostscript(tmpdir)
+            (source, output), = self.create_sleeping_pdfs(tmpdir, [0])
+            result = pdfebc.core.compress_pdf(source, output, gs, min_savings=0)
+            self.assertEqual(pdfebc.core.ACTION_COMPRESSED, result.action)
+
+    def test_compress_pdf_skips_files_that_never_shrink(self):
+        pdfebc.core.FILE_SIZE_LOWER_LIMIT = 0
+        with tempfile.TemporaryDirectory() as tmpdir:
+            gs = create_sleeping_ghostscript(tmpdir)
+            (source, output), = self.create_sleeping_pdfs(tmpdir, [0])
+            history = pdfebc.history.CompressionHistory(os.path.join(tmpdir, 'history.json'))
+            first = pdfebc.core.compress_pdf(source, output, gs, history=history)
+            mock_status_callback = Mock(return_value=None)
+            with patch('subprocess.Popen', autospec=True) as mock_popen:
+                second = pdfebc.core.compress_pdf(source, output, gs, mock_status_callback,
+                                                  history=history)
+                mock_popen.assert_not_called()
+            self.assertEqual(pdfebc.core.ACTION_KEPT_ORIGINAL, first.action)
+            self.assertEqual(pdfebc.core.ACTION_COPIED, second.action)
+            self.assertTrue(os.path.isfile(output))
+            mock_status_callback.assert_any_call(pdfebc.core.NEVER_SHRINKS.format(source))
+
+    def test_compress_pdf_retries_files_with_lower_min_savings(self):
+        pdfebc.core.FILE_SIZE_LOWER_LIMIT = 0
+        with tempfile.TemporaryDirectory() as tmpdir:
+            gs = create_sleeping_ghostscript(tmpdir)
+            (source, output), = self.create_sleeping_pdfs(tmpdir, [0])
+            history = pdfebc.history.CompressionHistory(os.path.join(tmpdir, 'history.json'))
+            first = pdfebc.core.compress_pdf(source, output, gs, history=history,
+                                             min_savings=0.99)
+            second = pdfebc.core.compress_pdf(source, output, gs, history=history, min_savings=0)
+            self.assertEqual(pdfebc.core.ACTION_KEPT_ORIGINAL, first.action)
+            self.assertEqual(pdfebc.core.ACTION_COMPRESSED, second.action)
+
+    def assert_copy_file_method(self, expected_method):
+        """Assert that copy_file copies a file correctly with the expected method.
+
+        Args:
+            expected_method (str): The copy method copy_file is expected to use.
+        """
+        content = os.urandom(3 * 1024)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source = os.path.join(tmpdir, 'source.pdf')
+            destination = os.path.join(tmpdir, 'destination.pdf')
+            with open(source, 'wb') as file:
+                file.write(content)
+            method = pdfebc.core.copy_file(source, destination)
+            self.assertEqual(expected_method, method)
+            self.assertFalse(os.path.samefile(source, destination))
+            with open(destination, 'rb') as file:
+                self.assertEqual(content, file.read())
 
     def assert_filepaths_match_file_names(self, filepaths, temporary_files):
         """Assert that a list of filepaths match a list of temporary files.
@@ -140,3 +703,578 @@ class CoreTest(unittest.TestCase):
         for filepath, tmpfile in zip(sorted_filepaths, sorted_temporary_files):
             self.assertEqual(filepath, tmpfile.name)
 
+
+class BatchTest(unittest.TestCase):
+    """Tests of the batch engine and of Ghostscript limits with the fake Ghostscript, that takes a
+    predictable amount of time and writes half of its input.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source_directory = os.path.join(self.tmpdir.name, 'src')
+        self.output_directory = os.path.join(self.tmpdir.name, 'out')
+        self.log = os.path.join(self.tmpdir.name, 'gs.log')
+        os.makedirs(self.source_directory)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def create_pdfs(self, sizes):
+        """Create PDF files of the given sizes in the source directory.
+
+        Args:
+            sizes (list(int)): The size of each file in bytes.
+
+        Returns:
+            list(str): Paths to the files.
+        """
+        paths = []
+        for i, size in enumerate(sizes):
+            path = os.path.join(self.source_directory, '{}.pdf'.format(i))
+            with open(path, 'wb') as file:
+                file.write(os.urandom(size))
+            paths.append(path)
+        return paths
+
+    def time_batch(self, gs, jobs, **kwargs):
+        """
+        Returns:
+            float, list(pdfebc.core.CompressionResult): The wall-clock time of compressing the
+            source directory, and the results.
+        """
+        os.makedirs(self.output_directory, exist_ok=True)
+        start = time.monotonic()
+        results = pdfebc.core.compress_multiple_pdfs(self.source_directory, self.output_directory,
+                                                     gs, jobs=jobs, **kwargs)
+        return time.monotonic() - start, results
+
+    def test_parallel_speedup(self):
+        gs = create_fake_ghostscript(self.tmpdir.name, seconds=0.25)
+        self.create_pdfs([128 * 1024] * 4)
+        sequential, _ = self.time_batch(gs, jobs=1)
+        parallel, results = self.time_batch(gs, jobs=4)
+        self.assertGreaterEqual(sequential, 1.0)
+        self.assertLess(parallel, sequential / 2)
+        self.assertEqual([pdfebc.core.ACTION_COMPRESSED] * 4,
+                         [result.action for result in results])
+        self.assertTrue(all(result.compression_ratio == 0.5 for result in results))
+
+    def test_slow_file_does_not_hold_back_the_batch(self):
+        gs = create_fake_ghostscript(self.tmpdir.name, seconds_per_megabyte=1)
+        paths = self.create_pdfs([3 * 1024 * 1024] + [100 * 1024] * 18)
+        finished = []
+        elapsed, results = self.time_batch(gs, jobs=2,
+                                           schedule=pdfebc.scheduling.SCHEDULE_LARGEST_FIRST,
+                                           result_callback=lambda result: finished.append(
+                                               result.source_path))
+        # the small files take less time on one worker than the large file on the other, so the
+        # batch takes about as long as the large file when they do not wait for it
+        self.assertEqual(paths[0], finished[-1])
+        self.assertLess(elapsed, 3.45)
+        self.assertCountEqual(paths, [result.source_path for result in results])
+
+    def test_largest_first_schedule_order(self):
+        gs = create_fake_ghostscript(self.tmpdir.name, log=self.log)
+        paths = self.create_pdfs([100 * 1024, 300 * 1024, 200 * 1024, 400 * 1024])
+        _, results = self.time_batch(gs, jobs=1, schedule=pdfebc.scheduling.SCHEDULE_LARGEST_FIRST)
+        started = [entry['inputs'][0] for entry in read_log(self.log)]
+        self.assertEqual([paths[3], paths[1], paths[2], paths[0]], started)
+        self.assertEqual(sorted(paths), sorted(result.source_path for result in results))
+
+    def test_learned_schedule_records_costs(self):
+        gs = create_fake_ghostscript(self.tmpdir.name, seconds_per_megabyte=0.5)
+        paths = self.create_pdfs([128 * 1024, 256 * 1024])
+        cost_model = pdfebc.scheduling.CostModel(os.path.join(self.tmpdir.name, 'costs.json'))
+        self.time_batch(gs, jobs=2, schedule=pdfebc.scheduling.SCHEDULE_LEARNED,
+                        cost_model=cost_model)
+        small, large = (cost_model.predict(path, os.stat(path).st_size) for path in paths)
+        self.assertGreater(small, 0)
+        self.assertGreater(large, small)
+
+    def test_cpu_time_is_measured(self):
+        gs = create_fake_ghostscript(self.tmpdir.name, cpu_seconds_per_megabyte=1)
+        self.create_pdfs([256 * 1024])
+        _, (result,) = self.time_batch(gs, jobs=1)
+        self.assertGreaterEqual(result.cpu_time, 0.2)
+
+    def test_cache_hits_do_not_run_ghostscript(self):
+        gs = create_fake_ghostscript(self.tmpdir.name, seconds=0.1, log=self.log)
+        self.create_pdfs([128 * 1024] * 3)
+        cache = pdfebc.cache.CompressionCache(os.path.join(self.tmpdir.name, 'cache'))
+        _, first = self.time_batch(gs, jobs=3, cache=cache)
+        self.output_directory = os.path.join(self.tmpdir.name, 'out2')
+        _, second = self.time_batch(gs, jobs=3, cache=cache)
+        self.assertEqual([pdfebc.core.ACTION_COMPRESSED] * 3, [result.action for result in first])
+        self.assertEqual([pdfebc.core.ACTION_CACHED] * 3, [result.action for result in second])
+        self.assertEqual(3, len(read_log(self.log)))
+        for result in second:
+            self.assertEqual(64 * 1024, os.stat(result.output_path).st_size)
+
+    def test_failures_do_not_stop_the_batch(self):
+        gs = create_fake_ghostscript(self.tmpdir.name, exit_code=1, log=self.log)
+        self.create_pdfs([128 * 1024] * 3)
+        _, results = self.time_batch(gs, jobs=2)
+        self.assertEqual([pdfebc.core.ACTION_FAILED] * 3, [result.action for result in results])
+        self.assertEqual([1] * 3, [result.exit_code for result in results])
+        self.assertEqual(3, len(read_log(self.log)))
+
+    def test_concurrent_processes_never_exceed_jobs(self):
+        gs = create_fake_ghostscript(self.tmpdir.name, seconds=0.1, log=self.log)
+        self.create_pdfs([128 * 1024] * 6)
+        self.time_batch(gs, jobs=2)
+        entries = read_log(self.log)
+        for entry in entries:
+            running = [other for other in entries
+                       if other['start'] <= entry['start'] < other['end']]
+            self.assertLessEqual(len(running), 2)
+
+    def test_timeout_costs_at_most_the_timeout(self):
+        gs = create_fake_ghostscript(self.tmpdir.name, seconds_per_megabyte=10)
+        paths = self.create_pdfs([1024 * 1024, 80 * 1024, 80 * 1024])
+        limits = pdfebc.core.GhostscriptLimits(1.5, None, None)
+        elapsed, results = self.time_batch(gs, jobs=3, limits=limits)
+        self.assertLess(elapsed, 3)
+        results = dict((result.source_path, result) for result in results)
+        slow = results[paths[0]]
+        self.assertEqual(pdfebc.core.ACTION_FAILED, slow.action)
+        self.assertEqual(pdfebc.core.GS_TIMED_OUT.format(1.5), slow.error)
+        self.assertFalse(os.path.exists(slow.output_path))
+        for path in paths[1:]:
+            self.assertEqual(pdfebc.core.ACTION_COMPRESSED, results[path].action)
+
+    def test_retry_with_fallback_settings_after_timeout(self):
+        gs = create_fake_ghostscript(self.tmpdir.name, seconds=5, log=self.log,
+                                     easy_arg="-dPDFSETTINGS=/screen")
+        source, = self.create_pdfs([128 * 1024])
+        output = os.path.join(self.tmpdir.name, 'out.pdf')
+        mock_status_callback = Mock(return_value=None)
+        result = pdfebc.core.compress_pdf(source, output, gs, mock_status_callback,
+                                          limits=pdfebc.core.GhostscriptLimits(0.3, None, None),
+                                          fallback_settings=(pdfebc.core.FALLBACK_SETTINGS,))
+        timed_out = pdfebc.core.GS_TIMED_OUT.format(0.3)
+        self.assertEqual(pdfebc.core.ACTION_FALLBACK, result.action)
+        self.assertIsNone(result.error)
+        self.assertEqual((timed_out,), result.failed_attempts)
+        self.assertEqual(64 * 1024, result.output_bytes)
+        self.assertEqual(1, len(read_log(self.log)))
+        mock_status_callback.assert_any_call(pdfebc.core.RETRYING.format(source, timed_out))
+
+    def test_copy_on_failure_after_all_attempts_fail(self):
+        gs = create_fake_ghostscript(self.tmpdir.name, exit_code=1, log=self.log)
+        source, = self.create_pdfs([128 * 1024])
+        output = os.path.join(self.tmpdir.name, 'out.pdf')
+        result = pdfebc.core.compress_pdf(source, output, gs,
+                                          fallback_settings=(pdfebc.core.FALLBACK_SETTINGS,),
+                                          copy_on_failure=True)
+        self.assertEqual(pdfebc.core.ACTION_COPIED_AFTER_FAILURE, result.action)
+        self.assertIsNone(result.error)
+        self.assertEqual((pdfebc.core.GS_EXIT_CODE.format(1),) * 2, result.failed_attempts)
+        self.assertEqual(2, len(read_log(self.log)))
+        with open(source, 'rb') as source_file, open(output, 'rb') as output_file:
+            self.assertEqual(source_file.read(), output_file.read())
+
+    def test_cpu_limit_kills_ghostscript(self):
+        gs = create_fake_ghostscript(self.tmpdir.name, cpu_seconds_per_megabyte=40)
+        source, = self.create_pdfs([128 * 1024])
+        result = pdfebc.core.compress_pdf(source, os.path.join(self.tmpdir.name, 'out.pdf'), gs,
+                                          limits=pdfebc.core.GhostscriptLimits(None, 0.5, None))
+        self.assertEqual(pdfebc.core.ACTION_FAILED, result.action)
+        self.assertEqual(pdfebc.core.GS_CPU_LIMIT.format(0.5), result.error)
+        self.assertLess(result.wall_time, 4)
+
+    def test_async_cpu_limit_kills_ghostscript(self):
+        gs = create_fake_ghostscript(self.tmpdir.name, cpu_seconds_per_megabyte=40)
+        source, = self.create_pdfs([128 * 1024])
+        result = run_coroutine(pdfebc.core.compress_pdf_async(
+            source, os.path.join(self.tmpdir.name, 'out.pdf'), gs,
+            limits=pdfebc.core.GhostscriptLimits(None, 0.5, None)))
+        self.assertEqual(pdfebc.core.ACTION_FAILED, result.action)
+        self.assertEqual(pdfebc.core.GS_CPU_LIMIT.format(0.5), result.error)
+
+    def test_async_kill_below_cpu_limit_is_not_reported_as_cpu_limit(self):
+        gs = os.path.join(self.tmpdir.name, 'killed_gs')
+        with open(gs, 'w') as file:
+            file.write("#!/bin/sh\nkill -9 $$\n")
+        os.chmod(gs, os.stat(gs).st_mode | stat.S_IXUSR)
+        source, = self.create_pdfs([128 * 1024])
+        result = run_coroutine(pdfebc.core.compress_pdf_async(
+            source, os.path.join(self.tmpdir.name, 'out.pdf'), gs,
+            limits=pdfebc.core.GhostscriptLimits(None, 5, None)))
+        self.assertEqual(pdfebc.core.GS_EXIT_CODE.format(-signal.SIGKILL), result.error)
+
+    def test_wait_with_timeout_notices_exit_at_once(self):
+        process = subprocess.Popen(['sleep', '0.35'])
+        start = time.monotonic()
+        exit_code, _ = pdfebc.core.wait_for_process(process, timeout=10)
+        self.assertEqual(0, exit_code)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_wait_with_timeout_kills_process(self):
+        process = subprocess.Popen(['sleep', '10'])
+        with self.assertRaises(pdfebc.core.GhostscriptTimeoutError):
+            pdfebc.core.wait_for_process(process, timeout=0.2)
+        self.assertEqual(-signal.SIGKILL, process.returncode)
+
+    @unittest.skipUnless(hasattr(resource, 'prlimit'), "the limits are set with prlimit")
+    def test_limit_process_sets_limits(self):
+        memory = 1024**3
+        process = subprocess.Popen(
+            [sys.executable, '-c', 'import resource, sys; sys.stdin.readline(); '
+             'print(resource.getrlimit(resource.RLIMIT_AS), '
+             'resource.getrlimit(resource.RLIMIT_CPU))'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+        pdfebc.core.limit_process(process.pid, 1.5, memory)
+        stdout, _ = process.communicate("\n")
+        self.assertEqual("{} {}".format((memory, memory), (2, 3)), stdout.strip())
+
+class FileListTest(unittest.TestCase):
+    """Tests of compressing the files of a list instead of a source directory."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source_directory = os.path.join(self.tmpdir.name, 'src')
+        self.output_directory = os.path.join(self.tmpdir.name, 'out')
+        os.makedirs(os.path.join(self.source_directory, 'sub'))
+        os.makedirs(self.output_directory)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def read_list(self, content, chunk_size=None):
+        file = buffer = io.BytesIO(content)
+        if chunk_size is not None:
+            # hand out a few bytes at a time, like a pipe that is still being written to
+            file = Mock(read1=lambda size: buffer.read(min(size, chunk_size)))
+        return [(source.path, source.output_path)
+                for source in pdfebc.core.iter_file_list(file)]
+
+    def test_iter_file_list(self):
+        expected = [('a.pdf', None), ('dir/b c.pdf', '/out/b.pdf'), ('d.pdf', None)]
+        for content in (b"a.pdf\ndir/b c.pdf\t/out/b.pdf\n\nd.pdf",
+                        b"a.pdf\r\ndir/b c.pdf\t/out/b.pdf\r\nd.pdf\r\n",
+                        b"a.pdf\0dir/b c.pdf\t/out/b.pdf\0d.pdf\0"):
+            for chunk_size in (None, 1, 3):
+                self.assertEqual(expected, self.read_list(content, chunk_size))
+
+    def test_nul_separated_paths_with_newlines(self):
+        self.assertEqual([('a.pdf', None), ('new\nline.pdf', None)],
+                         self.read_list(b"a.pdf\0new\nline.pdf\0", chunk_size=2))
+        self.assertEqual([], self.read_list(b""))
+
+    def create_file(self, path):
+        with open(path, 'wb') as file:
+            file.write(os.urandom(1024))
+        return path
+
+    def test_batch_of_listed_files(self):
+        inside = self.create_file(os.path.join(self.source_directory, 'sub', 'a.pdf'))
+        outside = self.create_file(os.path.join(self.tmpdir.name, 'b.pdf'))
+        explicit = self.create_file(os.path.join(self.source_directory, 'c.pdf'))
+        explicit_output = os.path.join(self.tmpdir.name, 'elsewhere', 'c_small.pdf')
+        missing = os.path.join(self.source_directory, 'missing.pdf')
+        self.create_file(os.path.join(self.source_directory, 'not_listed.pdf'))
+        content = "\n".join([inside, outside, explicit + "\t" + explicit_output, missing])
+        sources = pdfebc.core.iter_file_list(io.BytesIO(content.encode()))
+        results = pdfebc.core.compress_multiple_pdfs(self.source_directory, self.output_directory,
+                                                     'gs', sources=sources)
+        self.assertEqual([inside, outside, explicit, missing],
+                         [result.source_path for result in results])
+        self.assertEqual([pdfebc.core.ACTION_COPIED] * 3 + [pdfebc.core.ACTION_FAILED],
+                         [result.action for result in results])
+        self.assertTrue(os.path.isfile(os.path.join(self.output_directory, 'sub', 'a.pdf')))
+        self.assertTrue(os.path.isfile(os.path.join(self.output_directory, 'b.pdf')))
+        self.assertTrue(os.path.isfile(explicit_output))
+        self.assertFalse(os.path.exists(os.path.join(self.output_directory, 'not_listed.pdf')))
+
+    def test_incremental_batch_of_listed_files(self):
+        source = self.create_file(os.path.join(self.source_directory, 'a.pdf'))
+        output = os.path.join(self.tmpdir.name, 'a_out.pdf')
+        for action in (pdfebc.core.ACTION_COPIED, pdfebc.core.ACTION_SKIPPED):
+            sources = [pdfebc.core.SourceFile(source, output)]
+            results = pdfebc.core.compress_multiple_pdfs(
+                self.source_directory, self.output_directory, 'gs', incremental=True,
+                sources=sources)
+            self.assertEqual([action], [result.action for result in results])
+        os.remove(source)
+        pdfebc.core.compress_multiple_pdfs(self.source_directory, self.output_directory, 'gs',
+                                           incremental=True, sources=[])
+        self.assertFalse(os.path.exists(output))
+
+    def test_listed_files_are_filtered(self):
+        paths = [self.create_file(os.path.join(self.source_directory, name))
+                 for name in ('a.pdf', 'b.pdf', os.path.join('sub', 'c.pdf'))]
+        results = pdfebc.core.compress_multiple_pdfs(
+            self.source_directory, self.output_directory, 'gs', include=['sub/*', 'a*'],
+            sources=[pdfebc.core.SourceFile(path) for path in paths])
+        self.assertEqual([paths[0], paths[2]], [result.source_path for result in results])
+
+    def test_listed_files_are_consumed_lazily(self):
+        consumed = []
+        def sources():
+            for i in range(50):
+                consumed.append(i)
+                yield pdfebc.core.SourceFile(self.create_file(
+                    os.path.join(self.source_directory, '{}.pdf'.format(i))))
+        consumed_at_results = []
+        results = pdfebc.core.compress_multiple_pdfs(
+            self.source_directory, self.output_directory, 'gs', jobs=1, sources=sources(),
+            keep_results=False,
+            result_callback=lambda result: consumed_at_results.append(len(consumed)))
+        self.assertEqual([], results)
+        self.assertEqual(50, len(consumed_at_results))
+        self.assertLessEqual(consumed_at_results[0], pdfebc.core.PENDING_FILES_PER_JOB + 1)
+
+class FakeWorker:
+    """A worker for pdfebc.core.WorkerPool that records its job instead of running it, and writes
+    a placeholder to its output file."""
+
+    def __init__(self, args, memory, fail=False):
+        self.args = args
+        self.memory = memory
+        self.fail = fail
+        self.jobs = []
+        self.closed = False
+
+    def run(self, job, limits=None):
+        self.jobs.append(job)
+        if self.fail:
+            return 1, 0.5, pdfebc.core.GS_EXIT_CODE.format(1)
+        output_path = next(arg.split("=", 1)[1] for arg in self.args
+                           if arg.startswith("-sOutputFile="))
+        with open(output_path, 'wb') as file:
+            file.write(b"%PDF")
+        return 0, 0.5, None
+
+    def close(self):
+        self.closed = True
+
+class WorkerPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.workers = []
+        self.fail = False
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.srcdir = os.path.join(self.tmpdir.name, 'src')
+        self.outdir = os.path.join(self.tmpdir.name, 'out')
+        os.makedirs(self.outdir)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def start_worker(self, args, memory):
+        self.workers.append(FakeWorker(args, memory, self.fail))
+        return self.workers[-1]
+
+    def compress(self, pool, name, limits=None, directory=None):
+        return pool.compress(os.path.join(directory or self.srcdir, name),
+                             os.path.join(self.outdir, name), ("-s",), limits)
+
+    def test_postscript_job(self):
+        self.assertEqual("(/in/a \\(1\\).pdf) (r) file runpdf\n",
+                         pdfebc.core.postscript_job("/in/a (1).pdf"))
+
+    def test_interpreter_args(self):
+        args = pdfebc.core.interpreter_args(("-sDEVICE=pdfwrite", "-dBATCH"), {"/b", "/a"},
+                                            "/tmp/out.pdf")
+        self.assertEqual(["-sDEVICE=pdfwrite", "-dSAFER",
+                          "--permit-file-read=/a/*", "--permit-file-read=/b/*",
+                          "--permit-file-write=/tmp/out.pdf", "-sOutputFile=/tmp/out.pdf"],
+                         args)
+
+    def test_covers(self):
+        self.assertTrue(pdfebc.core.covers({"/a"}, {"/a", "/a/b"}))
+        self.assertFalse(pdfebc.core.covers({"/a"}, {"/ab"}))
+        self.assertTrue(pdfebc.core.covers({"/"}, {"/ab"}))
+
+    def test_starts_spare_for_next_file(self):
+        pool = pdfebc.core.WorkerPool(self.start_worker, 2, "1.0")
+        for name in ("a.pdf", "b.pdf", "c.pdf"):
+            self.assertEqual((0, 0.5, None), self.compress(pool, name))
+            self.assertTrue(os.path.isfile(os.path.join(self.outdir, name)))
+        self.assertEqual([[pdfebc.core.postscript_job(os.path.join(self.srcdir, name))]
+                          for name in ("a.pdf", "b.pdf", "c.pdf")] + [[]],
+                         [worker.jobs for worker in self.workers])
+        self.assertEqual([True] * 3 + [False], [worker.closed for worker in self.workers])
+        pool.close()
+        self.assertTrue(self.workers[-1].closed)
+        self.assertFalse(os.path.exists(pool.scratch_directory))
+
+    def test_spares_read_the_directories_of_earlier_files(self):
+        pool = pdfebc.core.WorkerPool(self.start_worker, 1, "1.0")
+        other = os.path.join(self.tmpdir.name, 'other')
+        for directory in (self.srcdir, other, self.srcdir, other):
+            self.assertEqual((0, 0.5, None), self.compress(pool, "a.pdf", directory=directory))
+        self.assertEqual([1, 0, 1, 1, 1, 0], [len(worker.jobs) for worker in self.workers])
+        self.assertTrue(self.workers[1].closed)
+        both = ["--permit-file-read=%s" % os.path.join(directory, "*")
+                for directory in sorted((self.srcdir, other))]
+        for worker in self.workers[2:]:
+            self.assertEqual(both, [arg for arg in worker.args
+                                    if arg.startswith("--permit-file-read=")])
+        pool.close()
+
+    def test_failed_worker_is_replaced(self):
+        pool = pdfebc.core.WorkerPool(self.start_worker, 1, "1.0")
+        self.fail = True
+        _, _, error = self.compress(pool, "a.pdf")
+        self.assertIsNotNone(error)
+        self.assertTrue(self.workers[0].closed)
+        self.assertFalse(os.path.exists(os.path.join(self.outdir, "a.pdf")))
+        # only the scratch file of the spare is left
+        spare_output = self.workers[1].args[-1].split("=", 1)[1]
+        self.assertEqual([os.path.basename(spare_output)], os.listdir(pool.scratch_directory))
+        pool.close()
+
+    def test_memory_limit_selects_worker(self):
+        pool = pdfebc.core.WorkerPool(self.start_worker, 2, "1.0")
+        limits = pdfebc.core.GhostscriptLimits(None, None, 1024)
+        self.compress(pool, "a.pdf")
+        self.compress(pool, "a.pdf", limits)
+        self.compress(pool, "a.pdf", limits)
+        self.assertEqual([(None, 1), (None, 0), (1024, 1), (1024, 1), (1024, 0)],
+                         [(worker.memory, len(worker.jobs)) for worker in self.workers])
+        pool.close()
+
+    def test_worker_that_cannot_start(self):
+        def start_worker(args, memory):
+            raise pdfebc.core.CompressionError("cannot start")
+        pool = pdfebc.core.WorkerPool(start_worker, 1, "1.0")
+        self.assertEqual((None, 0.0, "cannot start"), self.compress(pool, "a.pdf"))
+        self.assertEqual((None, 0.0, "cannot start"), self.compress(pool, "a.pdf"))
+        pool.close()
+
+    def test_limits_concurrent_workers(self):
+        size = 2
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        class SlowWorker(FakeWorker):
+            def run(self, job, limits=None):
+                with lock:
+                    running.append(job)
+                    peak.append(len(running))
+                time.sleep(0.05)
+                with lock:
+                    running.remove(job)
+                return super().run(job, limits)
+        pool = pdfebc.core.WorkerPool(lambda args, memory: SlowWorker(args, memory), size, "1.0")
+        with futures.ThreadPoolExecutor(max_workers=6) as executor:
+            results = list(executor.map(
+                lambda i: self.compress(pool, "%d.pdf" % i), range(6)))
+        self.assertEqual([(0, 0.5, None)] * 6, results)
+        self.assertEqual(size, max(peak))
+        pool.close()
+
+class InterpreterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.srcdir = os.path.join(self.tmpdir.name, 'src')
+        self.outdir = os.path.join(self.tmpdir.name, 'out')
+        os.makedirs(self.srcdir)
+        os.makedirs(self.outdir)
+        self.log = os.path.join(self.tmpdir.name, 'gs.log')
+        self.pools = []
+
+    def tearDown(self):
+        for pool in self.pools:
+            pool.close()
+        self.tmpdir.cleanup()
+
+    def pool(self, size=1, **kwargs):
+        gs = create_fake_ghostscript(self.tmpdir.name, log=self.log, **kwargs)
+        self.pools.append(pdfebc.core.interpreter_pool(gs, size))
+        return self.pools[-1]
+
+    def create_pdf(self, name, content=b"%PDF-1.4\n"):
+        path = os.path.join(self.srcdir, name)
+        with open(path, 'wb') as file:
+            file.write(content + b"x" * (pdfebc.core.FILE_SIZE_LOWER_LIMIT - len(content)))
+        return path
+
+    def compress(self, pool, name, limits=None):
+        return pool.compress(os.path.join(self.srcdir, name), os.path.join(self.outdir, name),
+                             pdfebc.core.GHOSTSCRIPT_SETTINGS, limits)
+
+    def test_interpreter_per_file(self):
+        pool = self.pool(version="9.99")
+        for name in ("a.pdf", "b (1).pdf", "c.pdf"):
+            self.create_pdf(name)
+            exit_code, cpu_time, error = self.compress(pool, name)
+            self.assertEqual((0, None), (exit_code, error))
+            self.assertGreaterEqual(cpu_time, 0)
+            self.assertEqual(pdfebc.core.FILE_SIZE_LOWER_LIMIT // 2,
+                             os.path.getsize(os.path.join(self.outdir, name)))
+        log = read_log(self.log)
+        self.assertEqual(3, len({entry['pid'] for entry in log}))
+        self.assertEqual("-", log[0]['args'][-1])
+        self.assertIn("-dSAFER", log[0]['args'])
+        self.assertEqual("9.99", pool.version)
+
+    def test_failed_job(self):
+        pool = self.pool(exit_code=1)
+        self.create_pdf("a.pdf")
+        exit_code, _, error = self.compress(pool, "a.pdf")
+        self.assertEqual(1, exit_code)
+        self.assertEqual(pdfebc.core.GS_JOB_FAILED.format("/ioerror"), error)
+
+    def test_crash_is_isolated(self):
+        pool = self.pool()
+        self.create_pdf("crash.pdf", b"%crash")
+        self.create_pdf("a.pdf")
+        _, _, error = self.compress(pool, "crash.pdf")
+        self.assertEqual(pdfebc.core.GS_EXIT_CODE.format(-signal.SIGABRT), error)
+        self.assertEqual((0, None), self.compress(pool, "a.pdf")[::2])
+        self.assertTrue(os.path.isfile(os.path.join(self.outdir, "a.pdf")))
+
+    def test_timeout(self):
+        pool = self.pool(seconds=10)
+        self.create_pdf("a.pdf")
+        start = time.monotonic()
+        _, _, error = self.compress(pool, "a.pdf", pdfebc.core.GhostscriptLimits(0.3, None, None))
+        self.assertEqual(pdfebc.core.GS_TIMED_OUT.format(0.3), error)
+        self.assertLess(time.monotonic() - start, 5)
+
+    @unittest.skipUnless(hasattr(resource, 'prlimit'), "the CPU time limit is set with prlimit")
+    def test_cpu_limit(self):
+        pool = self.pool(cpu_seconds_per_megabyte=100)
+        self.create_pdf("a.pdf")
+        _, cpu_time, error = self.compress(pool, "a.pdf", pdfebc.core.GhostscriptLimits(
+            30, 0.5, None))
+        self.assertEqual(pdfebc.core.GS_CPU_LIMIT.format(0.5), error)
+        self.assertGreaterEqual(cpu_time, 0.5)
+
+    def test_interpreter_that_cannot_start(self):
+        gs = os.path.join(self.tmpdir.name, 'broken_gs')
+        with open(gs, 'w') as file:
+            file.write("#!/bin/sh\nexit 3\n")
+        os.chmod(gs, stat.S_IRWXU)
+        pool = pdfebc.core.WorkerPool(
+            lambda args, memory: pdfebc.core.InterpreterWorker(gs, args, memory), 1, "1.0")
+        self.create_pdf("a.pdf")
+        _, _, error = self.compress(pool, "a.pdf")
+        self.assertEqual(pdfebc.core.GS_EXIT_CODE.format(3), error)
+        pool.close()
+
+    def test_batch(self):
+        for i in range(6):
+            self.create_pdf("%d.pdf" % i)
+        pool = self.pool(size=2)
+        results = pdfebc.core.compress_multiple_pdfs(self.srcdir, self.outdir, "unused", jobs=2,
+                                                     min_savings=0, backend=pool)
+        self.assertEqual([pdfebc.core.ACTION_COMPRESSED] * 6,
+                         [result.action for result in results])
+        self.assertEqual(6, len({entry['pid'] for entry in read_log(self.log)}))
+
+@unittest.skipIf(shutil.which('gs') is None, "Ghostscript is not installed")
+class RealInterpreterTest(unittest.TestCase):
+    """Tests of the interpreter backend with real Ghostscript, which runs in SAFER mode."""
+
+    def test_compresses_files_to_their_own_outputs(self):
+        with tempfile.TemporaryDirectory() as tmpdir, pdfebc.core.interpreter_pool('gs', 2) as pool:
+            for name, pages in (("a.pdf", 1), ("b (1).pdf", 3)):
+                source = os.path.join(tmpdir, name)
+                output = os.path.join(tmpdir, "out " + name)
+                write_sample_pdf(source, pages)
+                self.assertEqual((0, None), pool.compress(
+                    source, output, pdfebc.core.GHOSTSCRIPT_SETTINGS)[::2])
+                self.assertEqual(pages, pdfebc.core.ghostscript_page_count('gs', output))
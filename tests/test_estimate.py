@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the estimate module.
+
+Author: Simon Larsén
+"""
+import unittest
+import tempfile
+import time
+import os
+from .context import pdfebc
+from .fake_ghostscript import create_fake_ghostscript, read_log, PAGE_MARKER
+
+PAGE_SIZE = 16 * 1024
+
+def create_pdf(directory, name, pages):
+    """Create a file that the fake Ghostscript counts ``pages`` pages in, of PAGE_SIZE bytes
+    each.
+
+    Returns:
+        str: Path to the file.
+    """
+    path = os.path.join(directory, name)
+    page = PAGE_MARKER + b"x" * (PAGE_SIZE - len(PAGE_MARKER))
+    with open(path, 'wb') as file:
+        file.write(page * pages)
+    return path
+
+class EstimateTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.srcdir = os.path.join(self.tmpdir.name, 'src')
+        self.outdir = os.path.join(self.tmpdir.name, 'out')
+        self.log = os.path.join(self.tmpdir.name, 'gs.log')
+        os.makedirs(self.srcdir)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def fake_gs(self, **kwargs):
+        return create_fake_ghostscript(self.tmpdir.name, log=self.log, **kwargs)
+
+    def estimate(self, gs, **kwargs):
+        return pdfebc.estimate.estimate_multiple_pdfs(self.srcdir, gs,
+                                                      output_directory=self.outdir, **kwargs)
+
+    def test_sample_page_numbers(self):
+        self.assertEqual([1], pdfebc.estimate.sample_page_numbers(1, 3))
+        self.assertEqual([1, 2], pdfebc.estimate.sample_page_numbers(2, 3))
+        self.assertEqual([2, 6, 9], pdfebc.estimate.sample_page_numbers(10, 3))
+
+    def test_project_without_variation(self):
+        total, error = pdfebc.estimate.project([3.0, 3.0], 10, fixed=1.0)
+        self.assertEqual(21.0, total)
+        self.assertEqual(0.0, error)
+
+    def test_project_with_variation(self):
+        total, error = pdfebc.estimate.project([1.0, 3.0], 10)
+        self.assertEqual(20.0, total)
+        self.assertGreater(error, 0)
+
+    def test_project_every_page_sampled(self):
+        total, error = pdfebc.estimate.project([1.0, 3.0], 2)
+        self.assertEqual(4.0, total)
+        self.assertEqual(0.0, error)
+
+    def test_makespan(self):
+        self.assertEqual(12, pdfebc.estimate.makespan([3, 3, 2, 2, 2], 1))
+        self.assertEqual(7, pdfebc.estimate.makespan([3, 3, 2, 2, 2], 2))
+        self.assertEqual(3, pdfebc.estimate.makespan([3, 3, 2, 2, 2], 5))
+
+    def test_sampling_projects_output_size(self):
+        gs = self.fake_gs(ratio=0.5)
+        path = create_pdf(self.srcdir, 'a.pdf', 20)
+        create_pdf(self.srcdir, 'b.pdf', 8)
+        batch = self.estimate(gs, sample_pages=3)
+        self.assertEqual({pdfebc.estimate.METHOD_SAMPLE: 2}, dict(batch.methods()))
+        self.assertEqual(28 * PAGE_SIZE, batch.input_bytes)
+        self.assertAlmostEqual(14 * PAGE_SIZE, batch.output_bytes.value, delta=28)
+        self.assertLessEqual(batch.output_bytes.low, batch.output_bytes.value)
+        self.assertGreaterEqual(batch.output_bytes.high, batch.output_bytes.value)
+        estimate = next(estimate for estimate in batch.files if estimate.source_path == path)
+        self.assertEqual(20, estimate.pages)
+
+    def test_sampling_compresses_single_pages(self):
+        gs = self.fake_gs()
+        create_pdf(self.srcdir, 'a.pdf', 20)
+        self.estimate(gs, sample_pages=3)
+        compressions = read_log(self.log)
+        self.assertEqual(3, len(compressions))
+        for compression in compressions:
+            first = [arg for arg in compression['args'] if arg.startswith("-dFirstPage=")]
+            last = [arg for arg in compression['args'] if arg.startswith("-dLastPage=")]
+            self.assertEqual(first[0].split("=")[1], last[0].split("=")[1])
+            self.assertFalse(os.path.exists(compression['output']))
+        self.assertFalse(os.path.exists(self.outdir))
+
+    def test_projects_wall_time_at_parallelism(self):
+        gs = self.fake_gs(seconds=0.05)
+        for i in range(4):
+            create_pdf(self.srcdir, '%d.pdf' % i, 5)
+        serial = self.estimate(gs, sample_pages=1, jobs=1)
+        parallel = pdfebc.estimate.wall_time_range(serial.files, 4)
+        self.assertGreater(serial.wall_time.value, 4 * 5 * 0.04)
+        self.assertEqual(max(estimate.wall_time for estimate in serial.files), parallel.value)
+        self.assertLessEqual(parallel.low, parallel.value)
+        self.assertGreaterEqual(parallel.high, parallel.value)
+
+    def test_uses_history_of_known_files(self):
+        gs = self.fake_gs()
+        path = create_pdf(self.srcdir, 'a.pdf', 20)
+        history = pdfebc.history.CompressionHistory(os.path.join(self.tmpdir.name, 'h.json'))
+        size = os.path.getsize(path)
+        history.record(history.fingerprint(path, size, pdfebc.core.GHOSTSCRIPT_SETTINGS), 0.25,
+                       2.0, 3.0)
+        batch = self.estimate(gs, history=history)
+        estimate, = batch.files
+        self.assertEqual(pdfebc.estimate.METHOD_HISTORY, estimate.method)
+        self.assertEqual(0.25 * size, estimate.output_bytes)
+        self.assertEqual((2.0, 3.0), (estimate.cpu_time, estimate.wall_time))
+        self.assertEqual([], read_log(self.log))
+
+    def test_files_that_never_shrink_are_copied(self):
+        gs = self.fake_gs()
+        path = create_pdf(self.srcdir, 'a.pdf', 20)
+        history = pdfebc.history.CompressionHistory(os.path.join(self.tmpdir.name, 'h.json'))
+        size = os.path.getsize(path)
+        history.record(history.fingerprint(path, size, pdfebc.core.GHOSTSCRIPT_SETTINGS), 1.1,
+                       2.0, 3.0)
+        estimate, = self.estimate(gs, history=history).files
+        self.assertEqual(pdfebc.estimate.METHOD_COPY, estimate.method)
+        self.assertEqual(size, estimate.output_bytes)
+
+    def test_small_files_are_copied(self):
+        gs = self.fake_gs()
+        create_pdf(self.srcdir, 'a.pdf', 1)
+        estimate, = self.estimate(gs).files
+        self.assertEqual(pdfebc.estimate.METHOD_COPY, estimate.method)
+        self.assertEqual(0.0, estimate.cpu_time)
+
+    def test_keeps_original_when_savings_are_too_small(self):
+        gs = self.fake_gs(ratio=0.99)
+        path = create_pdf(self.srcdir, 'a.pdf', 10)
+        estimate, = self.estimate(gs, min_savings=0.05).files
+        self.assertEqual(pdfebc.estimate.METHOD_SAMPLE, estimate.method)
+        self.assertEqual(os.path.getsize(path), estimate.output_bytes)
+        self.assertGreaterEqual(estimate.cpu_time, 0.0)
+
+    def test_without_sampling_does_not_run_ghostscript(self):
+        create_pdf(self.srcdir, 'a.pdf', 10)
+        gs = os.path.join(self.tmpdir.name, 'not_ghostscript')
+        estimate, = self.estimate(gs, sample_pages=0).files
+        self.assertEqual(pdfebc.estimate.METHOD_UNKNOWN, estimate.method)
+        self.assertIsNone(estimate.error)
+
+    def test_failed_sample_is_unknown(self):
+        gs = self.fake_gs(exit_code=1)
+        path = create_pdf(self.srcdir, 'a.pdf', 10)
+        batch = self.estimate(gs)
+        estimate, = batch.files
+        self.assertEqual(pdfebc.estimate.METHOD_UNKNOWN, estimate.method)
+        self.assertIsNotNone(estimate.error)
+        self.assertEqual(os.path.getsize(path), batch.output_bytes.value)
+
+    def test_files_are_found_only_a_few_jobs_ahead(self):
+        paths = [create_pdf(self.srcdir, '{:02}.pdf'.format(i), 5) for i in range(40)]
+        found, finished, ahead, file_sizes = [], [], [], []
+        estimate_pdf = pdfebc.estimate.estimate_pdf
+
+        def sources():
+            for path in paths:
+                ahead.append(len(found) - len(finished))
+                found.append(path)
+                yield pdfebc.core.SourceFile(path)
+
+        def slow_estimate_pdf(*args):
+            time.sleep(0.005)
+            file_sizes.append(args[-1])
+            estimate = estimate_pdf(*args)
+            finished.append(args[0])
+            return estimate
+        pdfebc.estimate.estimate_pdf = slow_estimate_pdf
+        try:
+            batch = self.estimate('definitely-not-gs', jobs=2, sample_pages=0,
+                                  sources=sources())
+        finally:
+            pdfebc.estimate.estimate_pdf = estimate_pdf
+        self.assertEqual(paths, [estimate.source_path for estimate in batch.files])
+        self.assertLessEqual(max(ahead), 2 * pdfebc.core.PENDING_FILES_PER_JOB)
+        self.assertEqual([5 * PAGE_SIZE] * 40, file_sizes)
+
+    def test_format_estimate(self):
+        gs = self.fake_gs()
+        create_pdf(self.srcdir, 'a.pdf', 10)
+        summary = pdfebc.estimate.format_estimate(self.estimate(gs, jobs=2))
+        self.assertIn("1 file(s)", summary)
+        self.assertIn("2 parallel job(s)", summary)
+        self.assertIn("1 sampled", summary)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the history module.
+
+Author: Simon Larsén
+"""
+import unittest
+import tempfile
+import json
+import os
+from .context import pdfebc
+
+SETTINGS = ("-sDEVICE=pdfwrite",)
+
+class HistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.history_path = os.path.join(self.tmpdir.name, 'data', 'history.json')
+        self.pdf_path = os.path.join(self.tmpdir.name, 'file.pdf')
+        self.content = os.urandom(3 * pdfebc.history.FINGERPRINT_BLOCK_SIZE)
+        with open(self.pdf_path, 'wb') as file:
+            file.write(self.content)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def fingerprint(self, settings=SETTINGS):
+        return pdfebc.history.CompressionHistory.fingerprint(self.pdf_path, len(self.content),
+                                                              settings)
+
+    def test_fingerprint_is_stable(self):
+        self.assertEqual(self.fingerprint(), self.fingerprint())
+
+    def test_fingerprint_depends_on_settings(self):
+        self.assertNotEqual(self.fingerprint(), self.fingerprint(("-sDEVICE=pdfwrite", "-r72")))
+
+    def test_fingerprint_depends_on_last_block(self):
+        before = self.fingerprint()
+        with open(self.pdf_path, 'r+b') as file:
+            file.seek(-1, os.SEEK_END)
+            file.write(bytes([self.content[-1] ^ 0xff]))
+        self.assertNotEqual(before, self.fingerprint())
+
+    def test_never_shrinks(self):
+        history = pdfebc.history.CompressionHistory(self.history_path)
+        fingerprint = self.fingerprint()
+        self.assertFalse(history.never_shrinks(fingerprint, 0.05))
+        history.record(fingerprint, 0.5, 1.0, 1.5)
+        self.assertFalse(history.never_shrinks(fingerprint, 0.05))
+        history.record(fingerprint, 1.2, 1.0, 1.5)
+        self.assertTrue(history.never_shrinks(fingerprint, 0.05))
+
+    def test_never_shrinks_depends_on_min_savings(self):
+        history = pdfebc.history.CompressionHistory(self.history_path)
+        fingerprint = self.fingerprint()
+        history.record(fingerprint, 0.9, 1.0, 1.5)
+        self.assertTrue(history.never_shrinks(fingerprint, 0.2))
+        self.assertFalse(history.never_shrinks(fingerprint, 0.05))
+
+    def test_never_shrinks_with_other_version(self):
+        history = pdfebc.history.CompressionHistory(self.history_path)
+        fingerprint = self.fingerprint()
+        history.record(fingerprint, 1.2, 1.0, 1.5, "9.50")
+        self.assertTrue(history.never_shrinks(fingerprint, 0.05, "9.50"))
+        self.assertTrue(history.never_shrinks(fingerprint, 0.05))
+        self.assertFalse(history.never_shrinks(fingerprint, 0.05, "10.02.1"))
+
+    def test_retry_after_skips(self):
+        history = pdfebc.history.CompressionHistory(self.history_path)
+        fingerprint = self.fingerprint()
+        history.record(fingerprint, 1.2, 1.0, 1.5)
+        for _ in range(pdfebc.history.RETRY_AFTER_SKIPS):
+            self.assertTrue(history.never_shrinks(fingerprint, 0.05))
+            history.skip(fingerprint)
+        self.assertFalse(history.never_shrinks(fingerprint, 0.05))
+        history.record(fingerprint, 1.2, 1.0, 1.5)
+        self.assertTrue(history.never_shrinks(fingerprint, 0.05))
+
+    def test_save_and_load(self):
+        history = pdfebc.history.CompressionHistory(self.history_path)
+        history.record(self.fingerprint(), 0.5, 1.0, 1.5, "9.50")
+        history.save()
+        loaded = pdfebc.history.CompressionHistory.load(self.history_path)
+        self.assertEqual(pdfebc.history.HistoryEntry(0.5, 1.0, 1.5, 0, "9.50"),
+                         loaded.get(self.fingerprint()))
+
+    def test_load_entries_of_older_versions(self):
+        os.makedirs(os.path.dirname(self.history_path))
+        with open(self.history_path, 'w') as file:
+            json.dump({self.fingerprint(): [1.2, 1.0, 1.5, 1]}, file)
+        loaded = pdfebc.history.CompressionHistory.load(self.history_path)
+        self.assertEqual(pdfebc.history.HistoryEntry(1.2, 1.0, 1.5, 0, None),
+                         loaded.get(self.fingerprint()))
+
+    def test_load_missing_file(self):
+        history = pdfebc.history.CompressionHistory.load(self.history_path)
+        self.assertIsNone(history.get(self.fingerprint()))
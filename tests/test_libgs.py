@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the libgs module. The workers are tested with the fake libgs of fake_libgs.c,
+which is compiled for the tests if there is a C compiler.
+
+Author: Simon Larsén
+"""
+import unittest
+import tempfile
+import shutil
+import subprocess
+import json
+import os
+from .context import pdfebc
+from .sample_pdf import write_sample_pdf
+
+FAKE_LIBGS_SOURCE = os.path.join(os.path.dirname(__file__), 'fake_libgs.c')
+COMPILER = shutil.which('cc')
+FILE_SIZE = 2 * pdfebc.core.FILE_SIZE_LOWER_LIMIT
+
+def read_events(path):
+    """
+    Returns:
+        list(dict): The events logged by the fake libgs.
+    """
+    if not os.path.isfile(path):
+        return []
+    with open(path) as file:
+        return [json.loads(line) for line in file]
+
+class RevisionTest(unittest.TestCase):
+    def test_format_revision(self):
+        self.assertEqual("9.27", pdfebc.libgs.format_revision(927))
+        self.assertEqual("9.56.1", pdfebc.libgs.format_revision(9561))
+        self.assertEqual("10.02.1", pdfebc.libgs.format_revision(10021))
+
+    def test_pool_without_library(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with self.assertRaises(OSError):
+                pdfebc.libgs.libgs_pool(1, os.path.join(tmpdir, 'libgs.so'))
+
+@unittest.skipIf(COMPILER is None, "no C compiler to build the fake libgs with")
+class LibgsWorkerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.build_directory = tempfile.TemporaryDirectory()
+        cls.library = os.path.join(cls.build_directory.name, 'libgs.so')
+        subprocess.run([COMPILER, "-shared", "-fPIC", "-o", cls.library, FAKE_LIBGS_SOURCE],
+                       check=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.build_directory.cleanup()
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.srcdir = os.path.join(self.tmpdir.name, 'src')
+        self.outdir = os.path.join(self.tmpdir.name, 'out')
+        os.makedirs(self.srcdir)
+        os.makedirs(self.outdir)
+        self.log = os.path.join(self.tmpdir.name, 'libgs.log')
+        os.environ['PDFEBC_FAKE_GS_LOG'] = self.log
+        self.pool = pdfebc.libgs.libgs_pool(1, self.library)
+
+    def tearDown(self):
+        self.pool.close()
+        del os.environ['PDFEBC_FAKE_GS_LOG']
+        self.tmpdir.cleanup()
+
+    def create_pdf(self, name, first_line=b"%PDF-1.4"):
+        path = os.path.join(self.srcdir, name)
+        with open(path, 'wb') as file:
+            file.write(first_line + b"\n" + b"x" * (FILE_SIZE - len(first_line) - 1))
+        return path
+
+    def compress(self, name, settings=pdfebc.core.GHOSTSCRIPT_SETTINGS, limits=None):
+        return self.pool.compress(os.path.join(self.srcdir, name),
+                                  os.path.join(self.outdir, name), settings, limits)
+
+    def events(self, event):
+        return [entry for entry in read_events(self.log) if entry['event'] == event]
+
+    def test_version(self):
+        self.assertEqual("10.02.1", self.pool.version)
+
+    def init_of(self, run):
+        """
+        Returns:
+            dict: The event of initializing the instance that ran a job.
+        """
+        init, = [init for init in self.events("init") if init['pid'] == run['pid']]
+        return init
+
+    def test_instance_per_file(self):
+        for name in ("a.pdf", "b.pdf", "c.pdf"):
+            self.create_pdf(name)
+            exit_code, cpu_time, error = self.compress(name)
+            self.assertEqual((0, None), (exit_code, error))
+            self.assertGreaterEqual(cpu_time, 0)
+            self.assertEqual(FILE_SIZE // 2, os.path.getsize(os.path.join(self.outdir, name)))
+        runs = self.events("run")
+        self.assertEqual(3, len({run['pid'] for run in runs}))
+        for run in runs:
+            init = self.init_of(run)
+            self.assertIn("--permit-file-read=%s" % os.path.join(self.srcdir, "*"),
+                          init['detail'])
+            self.assertIn("-sOutputFile=%s" % run['detail'], init['detail'].split())
+            self.assertEqual(self.pool.scratch_directory, os.path.dirname(run['detail']))
+            self.assertNotIn("-dBATCH", init['detail'].split())
+        self.pool.close()
+        self.assertFalse(os.path.exists(self.pool.scratch_directory))
+
+    def test_instances_have_the_settings_of_their_file(self):
+        self.create_pdf("a.pdf")
+        for settings in (pdfebc.core.GHOSTSCRIPT_SETTINGS, pdfebc.core.FALLBACK_SETTINGS,
+                         pdfebc.core.FALLBACK_SETTINGS):
+            self.assertEqual((0, None), self.compress("a.pdf", settings)[::2])
+        self.assertEqual([False, True, True],
+                         ["-dPDFSETTINGS=/screen" in self.init_of(run)['detail'].split()
+                          for run in self.events("run")])
+
+    def test_output_in_other_directory(self):
+        self.create_pdf("a.pdf")
+        other = os.path.join(self.tmpdir.name, 'other')
+        os.makedirs(other)
+        self.compress("a.pdf")
+        self.pool.compress(os.path.join(self.srcdir, "a.pdf"), os.path.join(other, "a.pdf"),
+                           pdfebc.core.GHOSTSCRIPT_SETTINGS)
+        self.assertEqual(FILE_SIZE // 2, os.path.getsize(os.path.join(other, "a.pdf")))
+
+    def test_crash_is_isolated(self):
+        self.create_pdf("crash.pdf", b"%crash")
+        self.create_pdf("a.pdf")
+        _, _, error = self.compress("crash.pdf")
+        self.assertIsNotNone(error)
+        exit_code, _, error = self.compress("a.pdf")
+        self.assertEqual((0, None), (exit_code, error))
+
+    def test_failed_job(self):
+        self.create_pdf("fail.pdf", b"%fail")
+        exit_code, _, error = self.compress("fail.pdf")
+        self.assertEqual(pdfebc.libgs.LIBGS_ERROR.format(exit_code), error)
+
+    def test_timeout(self):
+        self.create_pdf("hang.pdf", b"%hang")
+        limits = pdfebc.core.GhostscriptLimits(0.5, None, None)
+        _, _, error = self.compress("hang.pdf", limits=limits)
+        self.assertEqual(pdfebc.core.GS_TIMED_OUT.format(0.5), error)
+
+    def test_cpu_limit(self):
+        self.create_pdf("spin.pdf", b"%spin")
+        limits = pdfebc.core.GhostscriptLimits(30, 1, None)
+        _, cpu_time, error = self.compress("spin.pdf", limits=limits)
+        self.assertEqual(pdfebc.core.GS_CPU_LIMIT.format(1), error)
+        self.assertGreaterEqual(cpu_time, 0.5)
+
+    def test_batch(self):
+        for i in range(6):
+            self.create_pdf("%d.pdf" % i)
+        with pdfebc.libgs.libgs_pool(3, self.library) as pool:
+            results = pdfebc.core.compress_multiple_pdfs(self.srcdir, self.outdir, "gs", jobs=3,
+                                                         min_savings=0, backend=pool)
+        self.assertEqual([pdfebc.core.ACTION_COMPRESSED] * 6,
+                         [result.action for result in results])
+        self.assertEqual(6, len({run['pid'] for run in self.events("run")}))
+
+@unittest.skipIf(pdfebc.libgs.find_libgs() is None, "libgs is not installed")
+class RealLibgsTest(unittest.TestCase):
+    """Tests of the libgs backend with the real libgs, which runs Ghostscript in SAFER mode."""
+
+    def test_compresses_files_to_their_own_outputs(self):
+        with tempfile.TemporaryDirectory() as tmpdir, pdfebc.libgs.libgs_pool(2) as pool:
+            for name, pages in (("a.pdf", 1), ("b (1).pdf", 3)):
+                source = os.path.join(tmpdir, name)
+                output = os.path.join(tmpdir, "out " + name)
+                write_sample_pdf(source, pages)
+                self.assertEqual((0, None), pool.compress(
+                    source, output, pdfebc.core.GHOSTSCRIPT_SETTINGS)[::2])
+                with open(output, 'rb') as file:
+                    content = file.read()
+                self.assertTrue(content.startswith(b"%PDF"))
+                self.assertIn(b"%%EOF", content[-32:])
+                if shutil.which('gs') is not None:
+                    self.assertEqual(pages, pdfebc.core.ghostscript_page_count('gs', output))
+
+if __name__ == '__main__':
+    unittest.main()
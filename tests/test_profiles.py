@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the profiles module.
+
+Author: Simon Larsén
+"""
+import unittest
+import tempfile
+import os
+from collections import defaultdict
+from .context import pdfebc
+from .fake_ghostscript import create_fake_ghostscript, read_log
+
+def config_with_sections(sections):
+    """
+    Args:
+        sections (dict): Sections of a configuration file, keyed by name.
+
+    Returns:
+        defaultdict: A configuration like the one returned by pdfebc.utils.read_config.
+    """
+    config = defaultdict(defaultdict)
+    for name, section in sections.items():
+        config[name].update(section)
+    return config
+
+class ProfilesTest(unittest.TestCase):
+    def test_builtin_profiles(self):
+        profiles = pdfebc.profiles.builtin_profiles()
+        self.assertEqual(['ebook', 'screen', 'printer', 'fast'], list(profiles))
+        for profile in profiles.values():
+            self.assertIn("-dCompatibilityLevel=1.4", profile.settings)
+        self.assertIn("-dPDFSETTINGS=/ebook", profiles['ebook'].settings)
+        self.assertIn("-dEmbedAllFonts=false", profiles['fast'].settings)
+        self.assertEqual(profiles['ebook'].settings, pdfebc.core.GHOSTSCRIPT_SETTINGS)
+
+    def test_custom_profile_from_config(self):
+        config = config_with_sections({
+            'profile:scans': {'base': 'screen', 'color_image_resolution': '100',
+                              'embed_fonts': 'no', 'extra': '-dPDFSETTINGS=/printer -dFoo',
+                              'patterns': 'scans/*.pdf  *_scan.pdf'}})
+        profile = pdfebc.profiles.load_profiles(config)['scans']
+        self.assertEqual(pdfebc.profiles.BASE_SETTINGS + (
+            "-dPDFSETTINGS=/printer", "-dDownsampleColorImages=true", "-dColorImageResolution=100",
+            "-dEmbedAllFonts=false", "-dFoo"), profile.settings)
+        self.assertEqual(('scans/*.pdf', '*_scan.pdf'), profile.patterns)
+
+    def test_config_section_changes_builtin_profile(self):
+        config = config_with_sections({'profile:fast': {'gray_image_resolution': '50'},
+                                       'EMAIL': {'user': 'someone'}})
+        profiles = pdfebc.profiles.load_profiles(config)
+        fast = profiles['fast'].settings
+        self.assertIn("-dGrayImageResolution=50", fast)
+        self.assertNotIn("-dGrayImageResolution=72", fast)
+        self.assertIn("-dEmbedAllFonts=false", fast)
+        self.assertEqual(['ebook', 'screen', 'printer', 'fast'], list(profiles))
+
+    def test_invalid_profiles(self):
+        for section in ({'base': 'nonexistent'}, {'pdfsettings': 'tiny'},
+                        {'mono_image_resolution': '-3'}, {'embed_fonts': 'maybe'}):
+            with self.assertRaises(pdfebc.utils.ConfigurationError):
+                pdfebc.profiles.load_profiles(config_with_sections({'profile:bad': section}))
+
+    def test_settings_rules_order(self):
+        config = config_with_sections({'profile:scans': {'base': 'screen',
+                                                         'patterns': 'scans/*'}})
+        profiles = pdfebc.profiles.load_profiles(config)
+        rules = pdfebc.profiles.settings_rules(profiles, [('scans/big*', 'fast')])
+        select = lambda path: pdfebc.profiles.select_settings(path, profiles['ebook'].settings,
+                                                              rules)
+        self.assertEqual(profiles['fast'].settings, select('scans/big.pdf'))
+        self.assertEqual(profiles['scans'].settings, select('scans/small.pdf'))
+        self.assertEqual(profiles['ebook'].settings, select('other.pdf'))
+        with self.assertRaises(ValueError):
+            pdfebc.profiles.settings_rules(profiles, [('*', 'nonexistent')])
+
+    def test_profile_rule_argument(self):
+        self.assertEqual(('a=b/*.pdf', 'fast'), pdfebc.cli.profile_rule('a=b/*.pdf=fast'))
+        with self.assertRaises(Exception):
+            pdfebc.cli.profile_rule('*.pdf')
+
+    def test_batch_uses_profile_of_matching_rule(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source_directory = os.path.join(tmpdir, 'src')
+            output_directory = os.path.join(tmpdir, 'out')
+            log = os.path.join(tmpdir, 'gs.log')
+            os.makedirs(os.path.join(source_directory, 'scans'))
+            os.makedirs(output_directory)
+            for path in ('book.pdf', os.path.join('scans', 'page.pdf')):
+                with open(os.path.join(source_directory, path), 'wb') as file:
+                    file.write(os.urandom(128 * 1024))
+            gs = create_fake_ghostscript(tmpdir, log=log)
+            profiles = pdfebc.profiles.builtin_profiles()
+            cache = pdfebc.cache.CompressionCache(os.path.join(tmpdir, 'cache'))
+            for _ in range(2):
+                pdfebc.core.compress_multiple_pdfs(
+                    source_directory, output_directory, gs, recursive=True, cache=cache,
+                    settings=profiles['screen'].settings,
+                    settings_rules=pdfebc.profiles.settings_rules(profiles, [('scans/*', 'fast')]))
+            settings = dict((os.path.basename(entry['inputs'][0]), entry['args'])
+                            for entry in read_log(log))
+            self.assertIn("-dPDFSETTINGS=/screen", settings['book.pdf'])
+            self.assertIn("-dEmbedAllFonts=false", settings['page.pdf'])
+            self.assertEqual(2, len(read_log(log)))
+            # the same files with another profile are not cache hits
+            results = pdfebc.core.compress_multiple_pdfs(source_directory, output_directory, gs,
+                                                         recursive=True, cache=cache,
+                                                         settings=profiles['printer'].settings)
+            self.assertEqual([pdfebc.core.ACTION_COMPRESSED] * 2,
+                             [result.action for result in results])
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the scheduling module.
+
+Author: Simon Larsén
+"""
+import unittest
+import tempfile
+import os
+from unittest.mock import patch
+from .context import pdfebc
+
+SIZES = [10, 300, 20, 4000, 50]
+
+class SchedulingTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cost_model_path = os.path.join(self.tmpdir.name, 'config', 'costs.json')
+        for i, size in enumerate(SIZES):
+            with open(os.path.join(self.tmpdir.name, '{}.pdf'.format(i)), 'wb') as file:
+                file.write(b'x' * size)
+        self.indexed_entries = list(enumerate(pdfebc.core.iter_pdf_entries(self.tmpdir.name)))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_fifo_keeps_discovery_order(self):
+        ordered = pdfebc.scheduling.order_entries(self.indexed_entries,
+                                                  pdfebc.scheduling.SCHEDULE_FIFO)
+        self.assertEqual(self.indexed_entries, list(ordered))
+
+    def test_largest_first(self):
+        ordered = pdfebc.scheduling.order_entries(self.indexed_entries,
+                                                  pdfebc.scheduling.SCHEDULE_LARGEST_FIRST)
+        sizes = [entry.stat().st_size for _, entry in ordered]
+        self.assertEqual(sorted(SIZES, reverse=True), sizes)
+
+    def test_learned_prefers_recorded_costs(self):
+        cost_model = pdfebc.scheduling.CostModel(self.cost_model_path)
+        smallest = min((entry for _, entry in self.indexed_entries),
+                       key=lambda entry: entry.stat().st_size)
+        cost_model.record(smallest.path, smallest.stat().st_size, 1000.0)
+        cost_model.seconds_per_byte = 0.001
+        ordered = pdfebc.scheduling.order_entries(self.indexed_entries,
+                                                  pdfebc.scheduling.SCHEDULE_LEARNED, cost_model)
+        self.assertEqual(smallest.path, ordered[0][1].path)
+
+    def test_unknown_schedule(self):
+        with self.assertRaises(ValueError):
+            pdfebc.scheduling.order_entries(self.indexed_entries, 'random')
+
+    def test_cost_model_save_and_load(self):
+        cost_model = pdfebc.scheduling.CostModel(self.cost_model_path)
+        cost_model.record('a.pdf', 100, 2.0)
+        cost_model.record('b.pdf', 100, 4.0)
+        cost_model.save()
+        loaded = pdfebc.scheduling.CostModel.load(self.cost_model_path)
+        self.assertEqual(cost_model.seconds_per_byte, loaded.seconds_per_byte)
+        self.assertEqual(2.0, loaded.predict('a.pdf', 100))
+        self.assertAlmostEqual(1000 * cost_model.seconds_per_byte, loaded.predict('c.pdf', 1000))
+
+    def test_cost_model_load_missing_file(self):
+        cost_model = pdfebc.scheduling.CostModel.load(self.cost_model_path)
+        self.assertEqual(123, cost_model.predict('a.pdf', 123))
+
+    @patch('pdfebc.core.compress_pdf', autospec=True)
+    def test_compress_multiple_pdfs_largest_first(self, mock_compress_pdf):
+        mock_compress_pdf.side_effect = lambda filepath, output_path, *args: \
+            pdfebc.core.CompressionResult(filepath, output_path, pdfebc.core.ACTION_COMPRESSED,
+                                          0, 0, 0.0, 0.0, 0, None)
+        with tempfile.TemporaryDirectory() as tmpoutdir:
+            cost_model = pdfebc.scheduling.CostModel(self.cost_model_path)
+            results = pdfebc.core.compress_multiple_pdfs(
+                self.tmpdir.name, tmpoutdir, pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT,
+                schedule=pdfebc.scheduling.SCHEDULE_LARGEST_FIRST, cost_model=cost_model)
+            compressed_sizes = [os.stat(call[0][0]).st_size
+                                for call in mock_compress_pdf.call_args_list]
+            self.assertEqual(sorted(SIZES, reverse=True), compressed_sizes)
+            expected_out_paths = [os.path.join(tmpoutdir, entry.name)
+                                  for _, entry in self.indexed_entries]
+            self.assertEqual(expected_out_paths, [result.output_path for result in results])
+            self.assertEqual(len(SIZES), len(cost_model.files))
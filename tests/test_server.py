@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the server module.
+
+Author: Simon Larsén
+"""
+import unittest
+import tempfile
+import threading
+import http.client
+import json
+import time
+import os
+from .context import pdfebc
+from .test_core import create_sleeping_ghostscript
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.file_size_lower_limit = pdfebc.core.FILE_SIZE_LOWER_LIMIT
+        pdfebc.core.FILE_SIZE_LOWER_LIMIT = 0
+        self.gs = create_sleeping_ghostscript(self.tmpdir.name)
+        self.start_server()
+
+    def tearDown(self):
+        self.stop_server()
+        pdfebc.core.FILE_SIZE_LOWER_LIMIT = self.file_size_lower_limit
+        self.tmpdir.cleanup()
+
+    def start_server(self, workers=2, queue_size=4, max_upload_bytes=1024):
+        self.service = pdfebc.server.CompressionService(self.gs, workers=workers,
+                                                        queue_size=queue_size, min_savings=0)
+        self.httpd = pdfebc.server.ThreadingHTTPServer(('127.0.0.1', 0), self.service,
+                                                       max_upload_bytes)
+        self.service.start()
+        self.thread = threading.Thread(target=self.httpd.serve_forever, args=(0.05,))
+        self.thread.start()
+
+    def stop_server(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+        self.service.stop()
+
+    def request(self, method, path, body=None):
+        connection = http.client.HTTPConnection('127.0.0.1', self.httpd.server_address[1])
+        try:
+            connection.request(method, path, body)
+            response = connection.getresponse()
+            return response.status, dict(response.getheaders()), response.read()
+        finally:
+            connection.close()
+
+    def submit(self, sleep_time, name='scan.pdf'):
+        """Submit a file that the sleeping Ghostscript stand-in takes sleep_time seconds on."""
+        return self.request('POST', '/jobs?name=' + name, str(sleep_time).encode())
+
+    def wait_for_job(self, job_id, timeout=5):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            _, _, body = self.request('GET', '/jobs/' + job_id)
+            job = json.loads(body.decode())
+            if job['status'] in (pdfebc.server.STATUS_DONE, pdfebc.server.STATUS_FAILED):
+                return job
+            time.sleep(0.02)
+        self.fail("Job {} did not finish".format(job_id))
+
+    def test_submit_poll_and_fetch(self):
+        status, headers, body = self.submit(0)
+        self.assertEqual(202, status)
+        job = json.loads(body.decode())
+        self.assertEqual('/jobs/' + job['id'], headers['Location'])
+        self.assertEqual('scan.pdf', job['filename'])
+        job = self.wait_for_job(job['id'])
+        self.assertEqual(pdfebc.server.STATUS_DONE, job['status'])
+        self.assertEqual(pdfebc.core.ACTION_COMPRESSED, job['result']['action'])
+        status, headers, body = self.request('GET', '/jobs/{}/result'.format(job['id']))
+        self.assertEqual(200, status)
+        self.assertEqual('application/pdf', headers['Content-Type'])
+        self.assertEqual(b'0', body)
+
+    def test_result_of_unfinished_job(self):
+        _, _, body = self.submit(0.5)
+        job_id = json.loads(body.decode())['id']
+        status, _, _ = self.request('GET', '/jobs/{}/result'.format(job_id))
+        self.assertEqual(409, status)
+
+    def test_unknown_job(self):
+        status, _, _ = self.request('GET', '/jobs/' + 'f' * 32)
+        self.assertEqual(404, status)
+
+    def test_delete_job(self):
+        _, _, body = self.submit(0)
+        job_id = self.wait_for_job(json.loads(body.decode())['id'])['id']
+        job_directory = self.service.get(job_id).directory
+        status, _, _ = self.request('DELETE', '/jobs/' + job_id)
+        self.assertEqual(200, status)
+        self.assertFalse(os.path.exists(job_directory))
+        status, _, _ = self.request('GET', '/jobs/' + job_id)
+        self.assertEqual(404, status)
+
+    def test_full_queue_rejects_jobs(self):
+        self.stop_server()
+        self.start_server(workers=1, queue_size=1)
+        self.assertEqual(202, self.submit(0.5)[0])
+        deadline = time.monotonic() + 5
+        while self.service.metrics()['running'] < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        statuses = [self.submit(0.5)[0] for _ in range(3)]
+        self.assertEqual([202, 503, 503], statuses)
+        status, headers, _ = self.submit(0.5)
+        self.assertEqual(str(pdfebc.server.RETRY_AFTER_SECONDS), headers['Retry-After'])
+        _, _, body = self.request('GET', '/metrics')
+        metrics = json.loads(body.decode())
+        self.assertEqual(1, metrics['running'])
+        self.assertEqual(1, metrics['queue_depth'])
+        self.assertEqual(3, metrics['rejected'])
+
+    def test_too_large_upload(self):
+        status, _, _ = self.request('POST', '/jobs', b'0' * 2048)
+        self.assertEqual(413, status)
+
+    def test_unsafe_name_is_replaced(self):
+        _, _, body = self.submit(0, name='../../etc/passwd')
+        self.assertEqual(pdfebc.server.DEFAULT_JOB_FILENAME, json.loads(body.decode())['filename'])
+
+    def test_name_is_url_decoded(self):
+        _, _, body = self.submit(0, name='scan%20%C3%A5%2B1.pdf')
+        self.assertEqual('scan \u00e5+1.pdf', json.loads(body.decode())['filename'])
+
+    def test_stop_fails_queued_jobs(self):
+        self.stop_server()
+        self.start_server(workers=1, queue_size=2)
+        running = json.loads(self.submit(0.3)[2].decode())['id']
+        deadline = time.monotonic() + 5
+        while self.service.metrics()['running'] < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        queued = [json.loads(self.submit(0)[2].decode())['id'] for _ in range(2)]
+        self.service.stop()
+        self.assertEqual(pdfebc.server.STATUS_DONE, self.service.get(running).status)
+        for job_id in queued:
+            job = self.service.get(job_id)
+            self.assertEqual(pdfebc.server.STATUS_FAILED, job.status)
+            self.assertEqual(pdfebc.server.JOB_NOT_RUN, job.result.error)
+        metrics = self.service.metrics()
+        self.assertEqual((1, 2, 0), (metrics['completed'], metrics['failed'],
+                                     metrics['queue_depth']))
+
+    def test_metrics_count_completed_jobs(self):
+        job_ids = [json.loads(self.submit(0)[2].decode())['id'] for _ in range(3)]
+        for job_id in job_ids:
+            self.wait_for_job(job_id)
+        _, _, body = self.request('GET', '/metrics')
+        metrics = json.loads(body.decode())
+        self.assertEqual(3, metrics['completed'])
+        self.assertEqual(0, metrics['queue_depth'])
+        self.assertEqual(3, metrics['bytes_in'])
+        self.assertGreater(metrics['throughput_total'], 0)
+
+    def test_missing_ghostscript_fails_job(self):
+        self.stop_server()
+        self.gs = os.path.join(self.tmpdir.name, 'definitely-not-gs')
+        self.start_server(workers=1)
+        job = self.wait_for_job(json.loads(self.submit(0)[2].decode())['id'])
+        self.assertEqual(pdfebc.server.STATUS_FAILED, job['status'])
+        self.assertIn("FileNotFoundError", job['result']['error'])
+        # the worker is still alive
+        job = self.wait_for_job(json.loads(self.submit(0)[2].decode())['id'])
+        self.assertEqual(pdfebc.server.STATUS_FAILED, job['status'])
+        metrics = json.loads(self.request('GET', '/metrics')[2].decode())
+        self.assertEqual((0, 0, 2), (metrics['running'], metrics['completed'], metrics['failed']))
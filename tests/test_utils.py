@@ -9,8 +9,14 @@ import tempfile
 import configparser
 import os
 import email
+import email.policy
+import smtplib
+import time
+import subprocess
+import sys
 from email.mime.multipart import MIMEMultipart
 from .context import pdfebc
+from .smtp_server import SMTPStandIn
 
 class UtilsTest(unittest.TestCase):
     NUM_ATTACHMENT_FILENAMES = 10
@@ -128,6 +134,72 @@ class UtilsTest(unittest.TestCase):
         with self.assertRaises(IOError) as context:
             pdfebc.utils.read_config(config_path)
 
+    def test_load_config_uses_snapshot_until_file_changes(self):
+        self.valid_config.write(self.temp_config_file)
+        self.temp_config_file.close()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            snapshot_path = os.path.join(tmpdir, 'snapshot.json')
+            config = pdfebc.utils.load_config(self.temp_config_file.name, snapshot_path)
+            self.assertTrue(os.path.isfile(snapshot_path))
+            with patch('pdfebc.utils.read_config') as read_config:
+                snapshot = pdfebc.utils.load_config(self.temp_config_file.name, snapshot_path)
+                self.assertFalse(read_config.called)
+            self.assertEqual(config, snapshot)
+            self.assertEqual(self.user,
+                             snapshot[pdfebc.utils.EMAIL_SECTION_KEY][self.user_key])
+            self.valid_config[pdfebc.utils.EMAIL_SECTION_KEY][self.user_key] = 'other_user'
+            with open(self.temp_config_file.name, 'w', encoding='utf-8') as file:
+                self.valid_config.write(file)
+            config = pdfebc.utils.load_config(self.temp_config_file.name, snapshot_path)
+            self.assertEqual('other_user', config[pdfebc.utils.EMAIL_SECTION_KEY][self.user_key])
+
+    def test_load_config_with_broken_snapshot(self):
+        self.valid_config.write(self.temp_config_file)
+        self.temp_config_file.close()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            snapshot_path = os.path.join(tmpdir, 'snapshot.json')
+            with open(snapshot_path, 'w') as file:
+                file.write('{"fingerprint": ')
+            config = pdfebc.utils.load_config(self.temp_config_file.name, snapshot_path)
+            self.assertEqual(self.user, config[pdfebc.utils.EMAIL_SECTION_KEY][self.user_key])
+
+    def test_load_config_no_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with self.assertRaises(IOError):
+                pdfebc.utils.load_config(os.path.join(tmpdir, 'config.cnf'),
+                                         os.path.join(tmpdir, 'snapshot.json'))
+
+    def test_config_needed(self):
+        self.assertTrue(pdfebc.cli.config_needed([]))
+        self.assertTrue(pdfebc.cli.config_needed(['-s', 'docs', 'watch']))
+        for args in (['--help'], ['-o', 'out', '-h'], ['-cs'], ['watch', '--help']):
+            self.assertFalse(pdfebc.cli.config_needed(args))
+
+    def test_argparser_without_config(self):
+        args = pdfebc.cli.create_argparser().parse_args(['--configstatus'])
+        self.assertTrue(args.configstatus)
+        self.assertEqual(pdfebc.cli.OUT_DIR_DEFAULT, args.outdir)
+        self.assertEqual(pdfebc.profiles.PROFILE_DEFAULT, args.profile)
+
+    def test_argparser_defaults_match_lazy_modules(self):
+        self.assertEqual(pdfebc.estimate.SAMPLE_PAGES_DEFAULT, pdfebc.cli.ESTIMATE_PAGES_DEFAULT)
+        self.assertEqual(pdfebc.watch.SETTLE_TIME_DEFAULT, pdfebc.cli.SETTLE_TIME_DEFAULT)
+        self.assertEqual(pdfebc.watch.POLL_INTERVAL_DEFAULT, pdfebc.cli.POLL_INTERVAL_DEFAULT)
+        self.assertEqual(pdfebc.server.HOST_DEFAULT, pdfebc.cli.HOST_DEFAULT)
+        self.assertEqual(pdfebc.server.PORT_DEFAULT, pdfebc.cli.PORT_DEFAULT)
+        self.assertEqual(pdfebc.server.QUEUE_SIZE_DEFAULT, pdfebc.cli.QUEUE_SIZE_DEFAULT)
+        self.assertEqual(pdfebc.server.MAX_UPLOAD_BYTES_DEFAULT,
+                         pdfebc.cli.MAX_UPLOAD_DEFAULT * pdfebc.core.BYTES_PER_MEGABYTE)
+
+    def test_startup_does_not_import_lazy_modules(self):
+        code = ("import sys, pdfebc.main; "
+                "print(' '.join(m for m in ('smtplib', 'email', 'asyncio', 'http.server', 'ssl', "
+                "'ctypes') if m in sys.modules))")
+        output = subprocess.check_output(
+            [sys.executable, '-c', code], universal_newlines=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.assertEqual('', output.strip())
+
     def test_attach_valid_files(self):
         email_ = MIMEMultipart()
         pdfebc.utils.attach_files(self.attachment_filenames, email_)
@@ -154,18 +226,61 @@ class UtilsTest(unittest.TestCase):
         mock_smtp_instance.send_message.assert_called_once_with(email_)
         mock_smtp_instance.quit.assert_called_once()
 
-    @patch('smtplib.SMTP')
-    def test_send_valid_email_with_attachments(self, mock_smtp):
+    def start_smtp_stand_in(self):
+        """Start an SMTP stand-in and point the valid config at it. STARTTLS is patched out, as
+        the stand-in does not support it.
+
+        Returns:
+            (SMTPStandIn, Mock): The running server and the patched starttls method.
+        """
+        server = SMTPStandIn(self.user, self.password).start()
+        self.addCleanup(server.stop)
+        starttls_patcher = patch('smtplib.SMTP.starttls', return_value=(220, b''))
+        mock_starttls = starttls_patcher.start()
+        self.addCleanup(starttls_patcher.stop)
+        self.valid_config[pdfebc.utils.EMAIL_SECTION_KEY][self.smtp_server_key] = '127.0.0.1'
+        self.valid_config[pdfebc.utils.EMAIL_SECTION_KEY][self.smtp_port_key] = str(server.port)
+        return server, mock_starttls
+
+    def test_send_valid_email_with_attachments(self):
+        server, mock_starttls = self.start_smtp_stand_in()
         subject = "Test e-mail"
-        message = "Test e-mail body"
+        message = "Test e-mail body\n.leading dot"
+        with open(self.attachment_filenames[0], 'wb') as file:
+            file.write(os.urandom(3 * pdfebc.utils.ATTACHMENT_CHUNK_SIZE // 2))
         pdfebc.utils.send_with_attachments(subject, message, self.attachment_filenames,
                                            self.valid_config._sections)
-        mock_smtp.assert_called_once_with(self.smtp_server, self.smtp_port)
-        mock_smtp_instance = mock_smtp()
-        mock_smtp_instance.starttls.assert_called_once()
-        mock_smtp_instance.login.assert_called_once_with(self.user, self.password)
-        mock_smtp_instance.send_message.assert_called_once()
-        mock_smtp_instance.quit.assert_called_once()
+        mock_starttls.assert_called_once()
+        self.assertEqual(1, server.logins)
+        self.assertEqual(1, len(server.messages))
+        received = email.message_from_bytes(server.messages[0][2])
+        self.assertEqual(subject, received['Subject'])
+        self.assertEqual(self.user, received['From'])
+        self.assertEqual(self.receiver, received['To'])
+        parts = received.get_payload()
+        self.assertEqual(message.replace('\n', '\r\n'), parts[0].get_payload())
+        self.assertEqual(list(map(os.path.basename, self.attachment_filenames)),
+                         [part.get_filename() for part in parts[1:]])
+        with open(self.attachment_filenames[0], 'rb') as file:
+            self.assertEqual(file.read(), parts[1].get_payload(decode=True))
+
+    def test_send_email_with_non_ascii_subject_and_filename(self):
+        server, _ = self.start_smtp_stand_in()
+        subject = "Komprimerade filer – åäö"
+        with tempfile.TemporaryDirectory() as tmpdir:
+            attachment = os.path.join(tmpdir, "rapport_åäö.pdf")
+            with open(attachment, 'wb') as file:
+                file.write(os.urandom(1024))
+            pdfebc.utils.send_with_attachments(subject, "Hej då", [attachment],
+                                               self.valid_config._sections)
+            received = email.message_from_bytes(server.messages[0][2],
+                                                policy=email.policy.default)
+            self.assertEqual(subject, received['Subject'])
+            text, part = received.iter_parts()
+            self.assertEqual("Hej då", text.get_content())
+            self.assertEqual(os.path.basename(attachment), part.get_filename())
+            with open(attachment, 'rb') as file:
+                self.assertEqual(file.read(), part.get_content())
 
     def test_create_email_config(self):
         section_key = pdfebc.utils.EMAIL_SECTION_KEY
@@ -190,6 +305,26 @@ class UtilsTest(unittest.TestCase):
         config_path = self.temp_config_file.name
         self.assertTrue(pdfebc.utils.valid_config_exists(config_path))
 
+    def test_valid_config_exists_with_optional_jobs_option(self):
+        self.valid_config[pdfebc.utils.DEFAULT_SECTION_KEY][pdfebc.utils.JOBS_KEY] = '4'
+        self.valid_config.write(self.temp_config_file)
+        self.temp_config_file.close()
+        config_path = self.temp_config_file.name
+        self.assertTrue(pdfebc.utils.valid_config_exists(config_path))
+
+    def test_valid_config_exists_with_unknown_option(self):
+        self.valid_config[pdfebc.utils.DEFAULT_SECTION_KEY]['unknown'] = 'value'
+        self.valid_config.write(self.temp_config_file)
+        self.temp_config_file.close()
+        config_path = self.temp_config_file.name
+        self.assertFalse(pdfebc.utils.valid_config_exists(config_path))
+
+    def test_try_get_conf_or_default_missing_option(self):
+        config = pdfebc.utils.config_parser_to_defaultdict(self.valid_config)
+        jobs = pdfebc.utils.try_get_conf_or_default(config, self.default_section_key,
+                                                    pdfebc.utils.JOBS_KEY, '1')
+        self.assertEqual('1', jobs)
+
     def test_valid_config_exists_with_invalid_config(self):
         self.invalid_config.write(self.temp_config_file)
         self.temp_config_file.close()
@@ -239,25 +374,88 @@ class UtilsTest(unittest.TestCase):
             *args)
         self.assertFalse(mock_callback.called)
 
-    @patch('smtplib.SMTP')
-    def test_send_files_preconf_valid_files(self, mock_smtp):
-        mock_smtp_instance = mock_smtp()
+    def test_send_files_preconf_valid_files(self):
+        server, mock_starttls = self.start_smtp_stand_in()
         mock_status_callback = Mock(return_value=None)
         self.valid_config.write(self.temp_config_file)
         self.temp_config_file.close()
         pdfebc.utils.send_files_preconf(self.attachment_filenames, config_path=self.temp_config_file.name,
                                         status_callback=mock_status_callback)
-        mock_smtp_instance.starttls.assert_called_once()
-        mock_smtp_instance.login.assert_called_once_with(self.user, self.password)
-        mock_smtp_instance.send_message.assert_called_once()
-        mock_smtp_instance.quit.assert_called_once()
+        mock_starttls.assert_called_once()
+        self.assertEqual(1, server.logins)
+        self.assertEqual(1, len(server.messages))
         expected_send_message = pdfebc.utils.SENDING_PRECONF.format(
             self.user, self.receiver,
-            self.smtp_server, self.smtp_port, '\n'.join(self.attachment_filenames))
+            '127.0.0.1', server.port, '\n'.join(self.attachment_filenames))
         expected_sent_message = pdfebc.utils.FILES_SENT
         mock_status_callback.assert_any_call(expected_send_message)
         mock_status_callback.assert_any_call(expected_sent_message)
 
+    def create_files_with_sizes(self, directory, sizes):
+        filepaths = []
+        for i, size in enumerate(sizes):
+            filepath = os.path.join(directory, '{}.pdf'.format(i))
+            with open(filepath, 'wb') as file:
+                file.write(b'x' * size)
+            filepaths.append(filepath)
+        return filepaths
+
+    def test_encoded_attachment_size_accounts_for_base64(self):
+        size = pdfebc.utils.encoded_attachment_size(3 * 1024, 'file.pdf')
+        self.assertGreater(size, 4 * 1024)
+        self.assertLess(size, 4 * 1024 + 1024)
+
+    def test_pack_attachments_first_fit_decreasing(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filepaths = self.create_files_with_sizes(tmpdir, [3000, 6000, 3000, 9000, 6000])
+            max_message_bytes = pdfebc.utils.MESSAGE_OVERHEAD_BYTES + sum(
+                pdfebc.utils.encoded_attachment_size(size, '0.pdf') for size in [9000, 3000])
+            packed = pdfebc.utils.pack_attachments(filepaths, max_message_bytes)
+            self.assertEqual(3, len(packed))
+            self.assertEqual(sorted(filepaths),
+                             sorted(path for paths, _ in packed for path in paths))
+            for paths, size in packed:
+                self.assertLessEqual(size, max_message_bytes)
+                self.assertEqual(sorted(paths, key=filepaths.index), paths)
+
+    def test_pack_attachments_oversized_file_gets_own_message(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filepaths = self.create_files_with_sizes(tmpdir, [100, 50000, 100])
+            packed = pdfebc.utils.pack_attachments(filepaths, 10000)
+            self.assertEqual([[filepaths[1]], [filepaths[0], filepaths[2]]],
+                             [paths for paths, _ in packed])
+            self.assertGreater(packed[0][1], 10000)
+
+    def test_send_files_preconf_splits_into_several_messages(self):
+        server, _ = self.start_smtp_stand_in()
+        mock_status_callback = Mock(return_value=None)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filepaths = self.create_files_with_sizes(tmpdir, [6000] * 4)
+            max_message_bytes = pdfebc.utils.MESSAGE_OVERHEAD_BYTES + 2 * \
+                pdfebc.utils.encoded_attachment_size(6000, '0.pdf')
+            self.valid_config[pdfebc.utils.EMAIL_SECTION_KEY][
+                pdfebc.utils.MAX_MESSAGE_BYTES_KEY] = str(max_message_bytes)
+            self.valid_config.write(self.temp_config_file)
+            self.temp_config_file.close()
+            pdfebc.utils.send_files_preconf(filepaths, config_path=self.temp_config_file.name,
+                                            status_callback=mock_status_callback)
+        self.assertEqual(1, server.connections)
+        self.assertEqual(2, len(server.messages))
+        received = [email.message_from_bytes(data) for _, _, data in server.messages]
+        self.assertEqual(["PDF files from pdfebc (1 of 2)", "PDF files from pdfebc (2 of 2)"],
+                         [message['Subject'] for message in received])
+        for message in received:
+            self.assertLessEqual(len(message.as_bytes()), max_message_bytes)
+        mock_status_callback.assert_any_call(pdfebc.utils.MESSAGE_SENT.format(2, 2))
+        mock_status_callback.assert_any_call(pdfebc.utils.FILES_SENT)
+
+    def test_valid_config_exists_with_optional_max_message_bytes_option(self):
+        self.valid_config[pdfebc.utils.EMAIL_SECTION_KEY][
+            pdfebc.utils.MAX_MESSAGE_BYTES_KEY] = '1000'
+        self.valid_config.write(self.temp_config_file)
+        self.temp_config_file.close()
+        self.assertTrue(pdfebc.utils.valid_config_exists(self.temp_config_file.name))
+
     def test_run_config_diagnostics_valid_config(self):
         self.valid_config.write(self.temp_config_file)
         self.temp_config_file.close()
@@ -311,3 +509,137 @@ class UtilsTest(unittest.TestCase):
         print(expected_output)
         actual_output = pdfebc.utils.config_to_string(config)
         self.assertEqual(expected_output, actual_output)
+
+class SMTPConnectionTest(unittest.TestCase):
+    USER = 'test_user'
+    PASSWORD = 'test_password'
+
+    def setUp(self):
+        self.server = SMTPStandIn(self.USER, self.PASSWORD).start()
+        self.connection = pdfebc.utils.SMTPConnection('127.0.0.1', self.server.port, self.USER,
+                                                      self.PASSWORD, use_tls=False)
+
+    def tearDown(self):
+        self.connection.close()
+        self.server.stop()
+
+    def create_email(self, subject):
+        email_ = MIMEMultipart()
+        email_['From'] = self.USER
+        email_['To'] = 'test_receiver'
+        email_['Subject'] = subject
+        return email_
+
+    def test_send_messages_over_one_session(self):
+        emails = [self.create_email("Message {}".format(i)) for i in range(5)]
+        self.connection.send_messages(emails)
+        self.assertEqual(5, len(self.server.messages))
+        self.assertEqual(1, self.server.connections)
+        self.assertEqual(1, self.server.logins)
+        self.assertIn(b"Subject: Message 4", self.server.messages[-1][2])
+
+    def test_reconnects_when_server_drops_connection(self):
+        self.connection.send_message(self.create_email("First"))
+        self.server.drop_connections()
+        self.connection.send_message(self.create_email("Second"))
+        self.assertEqual(2, len(self.server.messages))
+        self.assertEqual(2, self.server.logins)
+
+    def test_checks_idle_connection_with_noop(self):
+        self.connection.noop_after_idle = 0
+        self.connection.send_message(self.create_email("First"))
+        self.connection.send_message(self.create_email("Second"))
+        self.assertEqual(1, self.server.noops)
+        self.assertEqual(1, self.server.connections)
+
+    def test_reconnects_when_idle_connection_is_dead(self):
+        self.connection.noop_after_idle = 0
+        self.connection.send_message(self.create_email("First"))
+        self.server.drop_connections()
+        self.assertFalse(self.connection.is_alive())
+        self.connection.send_message(self.create_email("Second"))
+        self.assertEqual(2, self.server.connections)
+        self.assertEqual(2, len(self.server.messages))
+
+    def test_send_stream_dot_stuffs_lines(self):
+        chunks = [b"Subject: Dots\r\n\r\n", b".one\r\n..two\r\nthree.\r\n"]
+        self.connection.send_stream(self.USER, ['test_receiver'], lambda: iter(chunks))
+        self.assertEqual(b"".join(chunks), self.server.messages[0][2])
+
+    def test_wrong_password(self):
+        self.connection.password = 'wrong'
+        with self.assertRaises(smtplib.SMTPAuthenticationError):
+            self.connection.send_message(self.create_email("Denied"))
+        self.assertEqual(0, len(self.server.messages))
+
+    @patch('smtplib.SMTP')
+    def test_send_email_reuses_given_connection(self, mock_smtp):
+        connection = pdfebc.utils.SMTPConnection('test_server', 999, self.USER, self.PASSWORD)
+        for subject in ("First", "Second"):
+            pdfebc.utils.send_email(self.create_email(subject), None, connection)
+        mock_smtp.assert_called_once_with('test_server', 999)
+        self.assertEqual(2, mock_smtp.return_value.send_message.call_count)
+        mock_smtp.return_value.quit.assert_not_called()
+        connection.close()
+        mock_smtp.return_value.quit.assert_called_once()
+
+class EmailPipelineTest(unittest.TestCase):
+    USER = 'test_user'
+    PASSWORD = 'test_password'
+    FILE_SIZE = 6000
+
+    def setUp(self):
+        self.server = SMTPStandIn(self.USER, self.PASSWORD).start()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filepaths = []
+        for i in range(5):
+            filepath = os.path.join(self.tmpdir.name, '{}.pdf'.format(i))
+            with open(filepath, 'wb') as file:
+                file.write(os.urandom(self.FILE_SIZE))
+            self.filepaths.append(filepath)
+        max_message_bytes = pdfebc.utils.MESSAGE_OVERHEAD_BYTES + 2 * \
+            pdfebc.utils.encoded_attachment_size(self.FILE_SIZE, '0.pdf')
+        self.config = {pdfebc.utils.EMAIL_SECTION_KEY: {
+            pdfebc.utils.USER_KEY: self.USER,
+            pdfebc.utils.PASSWORD_KEY: self.PASSWORD,
+            pdfebc.utils.RECEIVER_KEY: 'test_receiver',
+            pdfebc.utils.SMTP_SERVER_KEY: '127.0.0.1',
+            pdfebc.utils.SMTP_PORT_KEY: str(self.server.port),
+            pdfebc.utils.MAX_MESSAGE_BYTES_KEY: str(max_message_bytes)}}
+        starttls_patcher = patch('smtplib.SMTP.starttls', return_value=(220, b''))
+        starttls_patcher.start()
+        self.addCleanup(starttls_patcher.stop)
+
+    def tearDown(self):
+        self.server.stop()
+        self.tmpdir.cleanup()
+
+    def wait_for_messages(self, amount, timeout=5):
+        deadline = time.monotonic() + timeout
+        while len(self.server.messages) < amount and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return len(self.server.messages)
+
+    def test_sends_full_emails_before_close(self):
+        pipeline = pdfebc.utils.EmailPipeline(self.config).start()
+        for filepath in self.filepaths[:3]:
+            pipeline.put(filepath)
+        self.assertEqual(1, self.wait_for_messages(1))
+        for filepath in self.filepaths[3:]:
+            pipeline.put(filepath)
+        pipeline.close()
+        self.assertEqual(3, len(self.server.messages))
+        self.assertEqual(1, self.server.connections)
+        received = [email.message_from_bytes(data) for _, _, data in self.server.messages]
+        filenames = [part.get_filename() for message in received
+                     for part in message.get_payload()[1:]]
+        self.assertEqual(sorted(map(os.path.basename, self.filepaths)), sorted(filenames))
+        self.assertEqual("PDF files from pdfebc (part 3)", received[-1]['Subject'])
+
+    def test_close_raises_send_errors(self):
+        self.config[pdfebc.utils.EMAIL_SECTION_KEY][pdfebc.utils.PASSWORD_KEY] = 'wrong'
+        pipeline = pdfebc.utils.EmailPipeline(self.config).start()
+        for filepath in self.filepaths:
+            pipeline.put(filepath)
+        with self.assertRaises(smtplib.SMTPAuthenticationError):
+            pipeline.close()
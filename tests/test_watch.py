@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the watch module.
+
+Author: Simon Larsén
+"""
+import unittest
+import tempfile
+import threading
+import time
+import json
+import io
+import os
+from .context import pdfebc
+
+def wait_for(condition, timeout=5):
+    """Wait until the condition is true, or the timeout has passed.
+
+    Returns:
+        bool: The last value of the condition.
+    """
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+class WatchTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source_directory = os.path.join(self.tmpdir.name, 'src')
+        self.output_directory = os.path.join(self.tmpdir.name, 'out')
+        os.makedirs(self.source_directory)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_file(self, name, content=b'%PDF-1.4'):
+        path = os.path.join(self.source_directory, name)
+        with open(path, 'wb') as file:
+            file.write(content)
+        return path
+
+    def test_debouncer_waits_for_stable_file(self):
+        debouncer = pdfebc.watch.Debouncer(settle_time=1)
+        path = self.write_file('a.pdf')
+        debouncer.add(path, now=0)
+        self.assertEqual([], debouncer.ready(now=0))
+        self.assertEqual([], debouncer.ready(now=0.5))
+        with open(path, 'ab') as file:
+            file.write(b'more')
+        self.assertEqual([], debouncer.ready(now=1.2))
+        self.assertEqual([], debouncer.ready(now=2.0))
+        settled = debouncer.ready(now=2.3)
+        self.assertEqual([path], [settled_path for settled_path, _, _ in settled])
+        self.assertEqual(0, settled[0][2])
+        self.assertEqual(0, len(debouncer))
+
+    def test_debouncer_forgets_removed_files(self):
+        debouncer = pdfebc.watch.Debouncer(settle_time=0)
+        path = self.write_file('a.pdf')
+        debouncer.add(path)
+        os.remove(path)
+        self.assertEqual([], debouncer.ready())
+        self.assertEqual(0, len(debouncer))
+
+    def test_polling_watcher_detects_new_and_changed_files(self):
+        existing = self.write_file('existing.pdf')
+        watcher = pdfebc.watch.PollingWatcher(self.source_directory, interval=0)
+        self.assertEqual(set(), watcher.changes(0))
+        new = self.write_file('new.pdf')
+        os.utime(existing, ns=(0, 0))
+        self.assertEqual({existing, new}, watcher.changes(0))
+
+    def test_inotify_watcher_detects_new_files(self):
+        try:
+            watcher = pdfebc.watch.InotifyWatcher(self.source_directory)
+        except OSError:
+            self.skipTest("inotify is not available")
+        try:
+            path = self.write_file('new.pdf')
+            changes = set()
+            wait_for(lambda: changes.update(watcher.changes(0.1)) or path in changes)
+            self.assertIn(path, changes)
+        finally:
+            watcher.close()
+
+    def test_latency_stats(self):
+        stats = pdfebc.watch.LatencyStats()
+        self.assertIsNone(stats.summary())
+        for seconds in range(1, 101):
+            stats.record(float(seconds))
+        summary = stats.summary()
+        self.assertEqual(100, summary.count)
+        self.assertEqual(50.5, summary.mean)
+        self.assertEqual(51.0, summary.median)
+        self.assertEqual(96.0, summary.percentile_95)
+        self.assertEqual(100.0, summary.max)
+
+    def run_watch(self, use_inotify):
+        latency_log = io.StringIO()
+        existing = self.write_file('existing.pdf')
+        file_watch = pdfebc.watch.Watch(self.source_directory, self.output_directory,
+                                        pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT, jobs=2,
+                                        settle_time=0.1, poll_interval=0.05,
+                                        use_inotify=use_inotify, latency_log=latency_log)
+        thread = threading.Thread(target=file_watch.run)
+        thread.start()
+        try:
+            dropped = self.write_file('dropped.pdf')
+            self.assertTrue(wait_for(lambda: len(latency_log.getvalue().splitlines()) == 2))
+            self.write_file('ignored.txt')
+        finally:
+            file_watch.stop()
+            thread.join()
+        for path in (existing, dropped):
+            self.assertTrue(os.path.isfile(os.path.join(self.output_directory,
+                                                        os.path.basename(path))))
+        self.assertEqual(2, file_watch.latency.summary().count)
+        records = [json.loads(line) for line in latency_log.getvalue().splitlines()]
+        self.assertEqual({existing, dropped}, {record['source_path'] for record in records})
+        self.assertTrue(all(record['latency'] >= 0.1 for record in records))
+
+    def test_watch_with_polling(self):
+        self.run_watch(use_inotify=False)
+
+    def test_watch_with_inotify_if_available(self):
+        self.run_watch(use_inotify=True)
+
+    def test_missing_ghostscript_fails_files_and_keeps_watching(self):
+        messages = []
+        latency_log = io.StringIO()
+        file_watch = pdfebc.watch.Watch(self.source_directory, self.output_directory,
+                                        os.path.join(self.tmpdir.name, 'definitely-not-gs'),
+                                        status_callback=messages.append, settle_time=0.1,
+                                        poll_interval=0.05, use_inotify=False,
+                                        latency_log=latency_log)
+
+        def results():
+            return [json.loads(line) for line in latency_log.getvalue().splitlines()]
+
+        thread = threading.Thread(target=file_watch.run)
+        thread.start()
+        try:
+            path = self.write_file('dropped.pdf', b'x' * pdfebc.core.FILE_SIZE_LOWER_LIMIT)
+            self.assertTrue(wait_for(lambda: len(results()) == 1))
+            self.write_file('second.pdf', b'x' * pdfebc.core.FILE_SIZE_LOWER_LIMIT)
+            self.assertTrue(wait_for(lambda: len(results()) == 2))
+            self.assertTrue(thread.is_alive())
+        finally:
+            file_watch.stop()
+            thread.join()
+        self.assertEqual([pdfebc.core.ACTION_FAILED] * 2,
+                         [result['action'] for result in results()])
+        self.assertTrue(any(message.startswith("Failed to compress '{}'".format(path))
+                            for message in messages))
+
+    def test_watch_forgets_removed_files(self):
+        forget_interval = pdfebc.watch.FORGET_INTERVAL
+        pdfebc.watch.FORGET_INTERVAL = 0.05
+        file_watch = pdfebc.watch.Watch(self.source_directory, self.output_directory,
+                                        pdfebc.cli.GHOSTSCRIPT_BINARY_DEFAULT, settle_time=0.1,
+                                        poll_interval=0.05, use_inotify=False)
+        thread = threading.Thread(target=file_watch.run)
+        thread.start()
+        try:
+            path = self.write_file('dropped.pdf')
+            self.assertTrue(wait_for(lambda: file_watch.latency.summary() is not None))
+            kept = self.write_file('kept.pdf')
+            self.assertTrue(wait_for(lambda: file_watch.latency.summary().count == 2))
+            os.remove(path)
+            self.assertTrue(wait_for(lambda: path not in file_watch._compressed))
+            self.assertIn(kept, file_watch._compressed)
+        finally:
+            file_watch.stop()
+            thread.join()
+            pdfebc.watch.FORGET_INTERVAL = forget_interval